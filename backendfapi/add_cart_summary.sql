@@ -0,0 +1,37 @@
+-- Thêm cột snapshot tổng quan giỏ hàng vào Cart (dùng bởi app/cart_summary.py)
+-- Chạy 1 lần trong SQL Server Management Studio hoặc Azure Data Studio
+
+USE [final_project_getout]
+GO
+
+IF COL_LENGTH(N'[dbo].[Cart]', N'LineCount') IS NULL
+BEGIN
+    ALTER TABLE [dbo].[Cart] ADD
+        [LineCount] INT NOT NULL CONSTRAINT [DF_Cart_LineCount] DEFAULT 0,
+        [ItemCount] INT NOT NULL CONSTRAINT [DF_Cart_ItemCount] DEFAULT 0,
+        [BuySubtotal] NUMERIC(21, 2) NOT NULL CONSTRAINT [DF_Cart_BuySubtotal] DEFAULT 0,
+        [RentSubtotal] NUMERIC(21, 2) NOT NULL CONSTRAINT [DF_Cart_RentSubtotal] DEFAULT 0
+    PRINT 'Đã thêm cột snapshot vào Cart'
+END
+GO
+
+-- Backfill từ CartItem (chạy lại được: ghi đè toàn bộ)
+UPDATE c
+SET LineCount = ISNULL(s.LineCount, 0),
+    ItemCount = ISNULL(s.ItemCount, 0),
+    BuySubtotal = ISNULL(s.BuySubtotal, 0),
+    RentSubtotal = ISNULL(s.RentSubtotal, 0)
+FROM [dbo].[Cart] c
+LEFT JOIN (
+    SELECT CartID,
+           COUNT(*) AS LineCount,
+           SUM(Quantity) AS ItemCount,
+           SUM(CASE WHEN TransactionType = 'rent' THEN 0 ELSE Subtotal END) AS BuySubtotal,
+           SUM(CASE WHEN TransactionType = 'rent' THEN Subtotal ELSE 0 END) AS RentSubtotal
+    FROM [dbo].[CartItem]
+    GROUP BY CartID
+) s ON s.CartID = c.CartID
+GO
+
+SELECT COUNT(*) AS Carts, SUM(LineCount) AS Lines, SUM(ItemCount) AS Items FROM [dbo].[Cart]
+GO
@@ -0,0 +1,48 @@
+-- Thêm cột ExpiresAt (có index) cho PendingRegistration / PasswordResetToken (dùng bởi app/otp_store.py)
+-- và dọn các dòng đã hết hạn / đã dùng tích lũy từ trước.
+-- Chạy 1 lần trong SQL Server Management Studio hoặc Azure Data Studio
+
+USE [final_project_getout]
+GO
+
+IF COL_LENGTH(N'[dbo].[PendingRegistration]', N'ExpiresAt') IS NULL
+BEGIN
+    ALTER TABLE [dbo].[PendingRegistration] ADD [ExpiresAt] DATETIME NULL
+    PRINT 'Đã thêm cột ExpiresAt vào PendingRegistration'
+END
+GO
+
+IF COL_LENGTH(N'[dbo].[PasswordResetToken]', N'ExpiresAt') IS NULL
+BEGIN
+    ALTER TABLE [dbo].[PasswordResetToken] ADD [ExpiresAt] DATETIME NULL
+    PRINT 'Đã thêm cột ExpiresAt vào PasswordResetToken'
+END
+GO
+
+-- Backfill: hạn = CreatedAt + 5 phút (OTP_TTL mặc định)
+UPDATE [dbo].[PendingRegistration] SET ExpiresAt = DATEADD(SECOND, 300, ISNULL(CreatedAt, GETUTCDATE())) WHERE ExpiresAt IS NULL
+UPDATE [dbo].[PasswordResetToken] SET ExpiresAt = DATEADD(SECOND, 300, ISNULL(CreatedAt, GETUTCDATE())) WHERE ExpiresAt IS NULL
+GO
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = N'IX_PendingRegistration_ExpiresAt')
+    CREATE INDEX [IX_PendingRegistration_ExpiresAt] ON [dbo].[PendingRegistration] ([ExpiresAt])
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = N'IX_PasswordResetToken_ExpiresAt')
+    CREATE INDEX [IX_PasswordResetToken_ExpiresAt] ON [dbo].[PasswordResetToken] ([ExpiresAt])
+GO
+
+-- Dọn 1 lần (theo lô để không khóa bảng lâu), sau đó thread sweeper của app tự dọn
+WHILE 1 = 1
+BEGIN
+    DELETE TOP (5000) FROM [dbo].[PendingRegistration] WHERE ExpiresAt < GETUTCDATE()
+    IF @@ROWCOUNT < 5000 BREAK
+END
+WHILE 1 = 1
+BEGIN
+    DELETE TOP (5000) FROM [dbo].[PasswordResetToken] WHERE ExpiresAt < GETUTCDATE() OR IsUsed = 1
+    IF @@ROWCOUNT < 5000 BREAK
+END
+GO
+
+SELECT (SELECT COUNT(*) FROM [dbo].[PendingRegistration]) AS PendingRegistrations,
+       (SELECT COUNT(*) FROM [dbo].[PasswordResetToken]) AS PasswordResetTokens
+GO
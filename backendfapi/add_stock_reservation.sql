@@ -0,0 +1,37 @@
+-- Thêm cột StockReservedAt vào SalesOrderHeader và bảng SalesOrderStockReservation
+-- (dùng bởi app/checkout.py: reserve_stock / release_stock)
+-- Đơn đặt trước khi có cột giữ NULL -> hủy đơn không cộng lại tồn kho chưa từng bị trừ
+-- SalesOrderStockReservation: số lượng đã trừ ở từng kho của mỗi đơn Mua -> hủy đơn hoàn đúng kho đã trừ
+-- Chạy 1 lần trong SQL Server Management Studio hoặc Azure Data Studio
+
+USE [final_project_getout]
+GO
+
+IF COL_LENGTH(N'[dbo].[SalesOrderHeader]', N'StockReservedAt') IS NULL
+BEGIN
+    ALTER TABLE [dbo].[SalesOrderHeader] ADD [StockReservedAt] DATETIME NULL
+    PRINT 'Đã thêm cột StockReservedAt vào SalesOrderHeader'
+END
+GO
+
+IF OBJECT_ID(N'[dbo].[SalesOrderStockReservation]', N'U') IS NULL
+BEGIN
+    CREATE TABLE [dbo].[SalesOrderStockReservation] (
+        [SalesOrderID] INT NOT NULL,
+        [ProductID] INT NOT NULL,
+        [LocationID] SMALLINT NOT NULL,
+        [Quantity] INT NOT NULL,
+        CONSTRAINT [PK_SalesOrderStockReservation] PRIMARY KEY ([SalesOrderID], [ProductID], [LocationID]),
+        CONSTRAINT [FK_SalesOrderStockReservation_SalesOrderHeader] FOREIGN KEY ([SalesOrderID])
+            REFERENCES [dbo].[SalesOrderHeader] ([SalesOrderID]),
+        CONSTRAINT [FK_SalesOrderStockReservation_Product] FOREIGN KEY ([ProductID])
+            REFERENCES [dbo].[product] ([ProductID]),
+        CONSTRAINT [FK_SalesOrderStockReservation_Location] FOREIGN KEY ([LocationID])
+            REFERENCES [dbo].[Location] ([LocationID])
+    )
+    PRINT 'Đã tạo bảng SalesOrderStockReservation'
+END
+GO
+
+SELECT COUNT(*) AS Orders, COUNT(StockReservedAt) AS ReservedOrders FROM [dbo].[SalesOrderHeader]
+GO
@@ -0,0 +1,101 @@
+"""
+Script kiểm tra + đo tốc độ chiến lược encoding text với SQL Server.
+
+1. Round-trip tiếng Việt qua bảng tạm NVARCHAR với từng chế độ DB_TEXT_ENCODING (native / utf8):
+   ghi rồi đọc lại, so sánh từng ký tự, đo thời gian insert + select.
+2. Chi phí CPU khi chuẩn bị dữ liệu ghi: ensure_utf8_string cũ (encode/decode từng giá trị)
+   so với validate_text (chỉ chạy ở biên nhận dữ liệu). Phần này không cần DB.
+
+    python bench_encoding.py            # cả 2 phần
+    python bench_encoding.py --no-db    # chỉ phần 2
+"""
+
+import argparse
+import os
+import sys
+import time
+import timeit
+import unicodedata
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
+
+# Fix encoding cho Windows console
+if sys.platform == 'win32':
+    import io
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+
+SAMPLES = [
+    "Xe đạp địa hình Giant Talon 29 – Đỏ",
+    "Chính sách thuê xe của Bike Go như thế nào?",
+    "Cọc 80% giá trị xe. Cần CMND để xác minh thông tin.",
+    "Phụ kiện: mũ bảo hiểm, đèn LED, khóa chống trộm",
+    unicodedata.normalize("NFD", "Tiếng Việt dạng NFD (gõ từ macOS)"),
+    "ASCII only name, 42",
+    "Ký tự đặc biệt: ₫ € ✓ 🚲",
+]
+
+
+def legacy_ensure_utf8_string(text):
+    """Bản cũ của helper.ensure_utf8_string (encode + decode mỗi giá trị)"""
+    if text is None:
+        return None
+    if isinstance(text, str):
+        try:
+            text.encode('utf-8').decode('utf-8')
+            return text
+        except (UnicodeEncodeError, UnicodeDecodeError):
+            try:
+                return text.encode('latin-1').decode('utf-8')
+            except Exception:
+                return text
+    return str(text)
+
+
+def bench_db(rows: int):
+    from sqlalchemy import create_engine, event, text
+    from app.database import SQLALCHEMY_DATABASE_URL, set_utf8_encoding
+
+    for mode in ("native", "utf8"):
+        engine = create_engine(SQLALCHEMY_DATABASE_URL)
+        if mode == "utf8":
+            event.listen(engine, "connect", set_utf8_encoding)
+
+        with engine.connect() as conn:
+            conn.execute(text("CREATE TABLE #enc_test (id INT PRIMARY KEY, v NVARCHAR(400))"))
+            values = [{"id": i, "v": SAMPLES[i % len(SAMPLES)]} for i in range(rows)]
+
+            started = time.perf_counter()
+            conn.execute(text("INSERT INTO #enc_test (id, v) VALUES (:id, :v)"), values)
+            write_ms = (time.perf_counter() - started) * 1000
+
+            started = time.perf_counter()
+            stored = dict(conn.execute(text("SELECT id, v FROM #enc_test")).all())
+            read_ms = (time.perf_counter() - started) * 1000
+
+            wrong = [i for i in range(rows) if stored.get(i) != values[i]["v"]]
+            conn.rollback()
+        engine.dispose()
+
+        status = "OK" if not wrong else f"{len(wrong)} sai (vd: {stored.get(wrong[0])!r})"
+        print(f"[{mode:6}] round-trip {rows} dòng: {status} | insert {write_ms:.1f} ms, select {read_ms:.1f} ms")
+
+
+def bench_cpu(fields: int):
+    from app.helper import validate_text
+
+    batch = [SAMPLES[i % len(SAMPLES)] for i in range(fields)]
+    legacy = timeit.timeit(lambda: [legacy_ensure_utf8_string(v) for v in batch], number=20) / 20
+    current = timeit.timeit(lambda: [validate_text(v) for v in batch], number=20) / 20
+    print(f"{fields} field: ensure_utf8_string cũ {legacy * 1000:.2f} ms, validate_text (kèm chuẩn hóa NFC) {current * 1000:.2f} ms")
+    assert all(validate_text(v) == unicodedata.normalize("NFC", v) for v in SAMPLES)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--no-db", action="store_true", help="Bỏ qua phần round-trip với SQL Server")
+    parser.add_argument("--rows", type=int, default=2000)
+    args = parser.parse_args()
+
+    if not args.no_db:
+        bench_db(args.rows)
+    bench_cpu(args.rows * 10)
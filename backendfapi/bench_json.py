@@ -0,0 +1,101 @@
+"""
+Script đo tốc độ encode JSON cho trang danh sách lớn (không cần DB), kiểm tra output giống hệt nhau từng byte
+(dữ liệu bench không có float dạng mũ - 1e16 / 1e-7 - là chỗ orjson khác json stdlib, xem app/json_response.py).
+
+1. Response model (PagedResponse[OrderListItem]):
+   - stdlib: jsonable_encoder + json.dumps (response cache cũ / response_class tùy chỉnh)
+   - response_model: FastAPI validate lại theo response_model rồi dump bằng pydantic-core
+   - render_json: dump thẳng model (response cache hiện tại), không validate
+2. Dict thuần (Decimal / datetime / tiếng Việt): stdlib so với render_json (orjson)
+
+    python bench_json.py --rows 1000
+"""
+
+import argparse
+import os
+import sys
+import timeit
+from datetime import datetime
+from decimal import Decimal
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
+
+# Fix encoding cho Windows console
+if sys.platform == 'win32':
+    import io
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+
+
+def timed(label: str, fn, number: int, baseline: float = None) -> float:
+    ms = timeit.timeit(fn, number=number) / number * 1000
+    speedup = f" (x{baseline / ms:.1f})" if baseline else ""
+    print(f"  {label:16} {ms:8.3f} ms{speedup}")
+    return ms
+
+
+def bench_model(rows: int, number: int):
+    from app.helper import PagedResponse, PaginationMeta, paged_response
+    from app.json_response import render_json
+    from app.routes.admin.config import OrderListItem
+
+    items = [
+        OrderListItem(
+            id=f"ORD-{i}", db_id=i, type="sale" if i % 2 else "rental", customer_name="Nguyễn Văn An",
+            created_at=datetime(2024, 5, 1, 10, i % 60, 1, 1234), status="5", status_label="Completed",
+            total_amount=Decimal("1234.5600"),
+        )
+        for i in range(rows)
+    ]
+    model = paged_response(items, PaginationMeta(total_items=rows * 10, total_pages=10, current_page=1, limit=rows))
+    adapter = TypeAdapter(PagedResponse[OrderListItem])
+
+    def stdlib():
+        return JSONResponse(jsonable_encoder(model)).body
+
+    def response_model():
+        return adapter.dump_json(adapter.validate_python(model, from_attributes=True), by_alias=True)
+
+    def direct():
+        return render_json(model)
+
+    assert stdlib() == response_model() == direct()
+    print(f"PagedResponse[OrderListItem], {rows} dòng ({len(direct())} bytes):")
+    baseline = timed("stdlib", stdlib, number)
+    timed("response_model", response_model, number, baseline)
+    timed("render_json", direct, number, baseline)
+
+
+def bench_dict(rows: int, number: int):
+    from app.json_response import render_json
+
+    payload = {
+        "data": [
+            {"id": i, "name": "Xe đạp địa hình", "price": Decimal("1500000.50"), "created_at": datetime(2024, 5, 1, 10, 0, i % 60)}
+            for i in range(rows)
+        ]
+    }
+
+    def stdlib():
+        return JSONResponse(jsonable_encoder(payload)).body
+
+    def orjson_path():
+        return render_json(payload)
+
+    assert stdlib() == orjson_path()
+    print(f"dict, {rows} dòng:")
+    baseline = timed("stdlib", stdlib, number)
+    timed("render_json", orjson_path, number, baseline)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--number", type=int, default=50)
+    args = parser.parse_args()
+
+    bench_model(args.rows, args.number)
+    bench_dict(args.rows, args.number)
@@ -0,0 +1,123 @@
+"""
+Benchmark đăng nhập đồng thời (POST /auth/login, verify argon2 trong process pool - app/password_hasher.py)
+trên server đang chạy: bắn --attempts lần đăng nhập, --concurrency lần cùng lúc, in latency p50 / p95 / p99.
+Song song gọi --probe-path liên tục để xem event loop có bị chặn trong lúc đăng nhập dồn dập không,
+cuối cùng in số liệu pool hash của /admin/metrics (queue time, run time, số lần trả 503).
+
+    python bench_login.py --identifier admin --password admin123 --concurrency 200 --attempts 200
+    python bench_login.py --identifier a@b.com --password x --wrong-ratio 0.5 --probe-path /store/products/featured
+
+So sánh với cấu hình cũ (verify ngay trong threadpool): chạy server với PASSWORD_HASH_WORKERS=0.
+Mỗi worker uvicorn có pool riêng -> nên chạy server 1 worker khi benchmark để số liệu /admin/metrics khớp.
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+
+import httpx
+
+# Fix encoding cho Windows console
+if sys.platform == 'win32':
+    import io
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+
+
+def percentile(sorted_values, p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+def report(label: str, latencies):
+    latencies = sorted(latencies)
+    if not latencies:
+        print(f"{label}: không có request")
+        return
+    print(
+        f"{label}: {len(latencies)} request, p50 {statistics.median(latencies) * 1000:.0f} ms, "
+        f"p95 {percentile(latencies, 0.95) * 1000:.0f} ms, p99 {percentile(latencies, 0.99) * 1000:.0f} ms, "
+        f"max {latencies[-1] * 1000:.0f} ms"
+    )
+
+
+async def run_logins(client: httpx.AsyncClient, args):
+    """Trả về (latency, Counter status code)"""
+    latencies, statuses = [], {}
+    counter = iter(range(args.attempts))
+    wrong_every = round(1 / args.wrong_ratio) if args.wrong_ratio > 0 else 0
+
+    async def worker():
+        for i in counter:
+            password = args.password + "-wrong" if wrong_every and i % wrong_every == 0 else args.password
+            started = time.perf_counter()
+            try:
+                response = await client.post("/auth/login", json={"identifier": args.identifier, "password": password})
+                key = response.status_code
+            except httpx.HTTPError as e:
+                key = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[key] = statuses.get(key, 0) + 1
+
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    return latencies, statuses
+
+
+async def run_probe(client: httpx.AsyncClient, path: str, stop: asyncio.Event):
+    latencies = []
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            await client.get(path)
+        except httpx.HTTPError:
+            pass
+        latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(0.05)
+    return latencies
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark đăng nhập đồng thời")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--identifier", required=True, help="Email / SĐT của tài khoản test")
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--attempts", type=int, default=200)
+    parser.add_argument("--wrong-ratio", type=float, default=0.0, help="Tỷ lệ lần đăng nhập sai mật khẩu (0-1)")
+    parser.add_argument("--probe-path", default="/store/products/featured",
+                        help="Endpoint nhẹ gọi song song để đo độ trễ event loop ('' = tắt)")
+    args = parser.parse_args()
+
+    limits = httpx.Limits(max_connections=args.concurrency + 1)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=120) as client:
+        await client.post("/auth/login", json={"identifier": args.identifier, "password": args.password})  # warm-up
+        await client.get("/admin/metrics", params={"reset": True})
+
+        stop = asyncio.Event()
+        probe = asyncio.create_task(run_probe(client, args.probe_path, stop)) if args.probe_path else None
+        started = time.perf_counter()
+        latencies, statuses = await run_logins(client, args)
+        elapsed = time.perf_counter() - started
+        stop.set()
+        probe_latencies = await probe if probe else []
+
+        print(f"{args.attempts} lần đăng nhập, {args.concurrency} cùng lúc: {elapsed:.2f}s "
+              f"({args.attempts / elapsed:.1f} login/s), status {statuses}")
+        report("Login", latencies)
+        if probe:
+            report(f"Probe {args.probe_path}", probe_latencies)
+
+        metrics = (await client.get("/admin/metrics")).json()["data"]["password_hash"]
+        print(
+            f"Pool hash: {metrics['workers']} process, concurrency {metrics['concurrency']}, "
+            f"peak chờ {metrics['peak_waiting']}, từ chối (503) {metrics['rejected']}"
+        )
+        for name in ("queue_wait", "run"):
+            h = metrics[name]
+            print(f"  {name}: {h['count']} job, avg {h['avg_ms']} ms, max {h['max_ms']} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
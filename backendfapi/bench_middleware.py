@@ -0,0 +1,89 @@
+"""
+Script đo overhead middleware mỗi request (TestClient, không qua mạng):
+UTF8Middleware cũ (BaseHTTPMiddleware) so với UTF8Middleware ASGI thuần hiện tại.
+
+Mặc định gọi các endpoint storefront có lượng truy cập cao. Request đầu tiên của mỗi path nạp response cache
+(cần SQL Server), các request sau trả từ cache -> chênh lệch thời gian chủ yếu là chi phí middleware.
+--no-db: dùng endpoint giả trả payload cỡ danh sách sản phẩm nổi bật, không cần DB.
+
+    python bench_middleware.py --requests 2000
+    python bench_middleware.py --no-db
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
+
+# Fix encoding cho Windows console
+if sys.platform == 'win32':
+    import io
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+
+STORE_PATHS = [
+    "/store/products/featured",
+    "/store/categories",
+    "/store/products/1/detail",
+    "/store/products/1/similar",
+]
+
+
+class LegacyUTF8Middleware(BaseHTTPMiddleware):
+    """Bản cũ của app.UTF8Middleware"""
+    async def dispatch(self, request: Request, call_next):
+        response = await call_next(request)
+        if isinstance(response, JSONResponse):
+            response.headers["Content-Type"] = "application/json; charset=utf-8"
+        return response
+
+
+def build_app(middleware, no_db: bool) -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(middleware)
+    if no_db:
+        payload = [
+            {"product_id": i, "name": f"Xe đạp địa hình {i}", "price": 1500000.0 + i, "thumbnail": f"/images/{i}.jpg"}
+            for i in range(12)
+        ]
+
+        @app.get("/store/products/featured")
+        def featured():
+            return {"status": "success", "data": payload}
+    else:
+        from app.routes import store_router
+        app.include_router(store_router)
+    return app
+
+
+def run(app: FastAPI, paths, requests: int):
+    """Trả về (thời gian trung bình mỗi request (ms), Content-Type của response đầu tiên)"""
+    with TestClient(app) as client:
+        content_type = [client.get(path).headers.get("content-type") for path in paths][0]
+        started = time.perf_counter()
+        for i in range(requests):
+            client.get(paths[i % len(paths)])
+        return (time.perf_counter() - started) * 1000 / requests, content_type
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--no-db", action="store_true", help="Dùng endpoint giả thay cho storefront thật")
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    from app import UTF8Middleware
+
+    paths = ["/store/products/featured"] if args.no_db else STORE_PATHS
+    legacy, legacy_type = run(build_app(LegacyUTF8Middleware, args.no_db), paths, args.requests)
+    current, current_type = run(build_app(UTF8Middleware, args.no_db), paths, args.requests)
+    print(f"BaseHTTPMiddleware: {legacy:.3f} ms/req, Content-Type: {legacy_type}")
+    print(f"ASGI thuần:         {current:.3f} ms/req, Content-Type: {current_type}")
+    print(f"{args.requests} request, giảm {legacy - current:.3f} ms/req")
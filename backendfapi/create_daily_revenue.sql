@@ -0,0 +1,39 @@
+-- Tạo bảng rollup doanh thu theo ngày (dùng bởi app/revenue.py)
+-- Chạy 1 lần trong SQL Server Management Studio hoặc Azure Data Studio
+
+USE [final_project_getout]
+GO
+
+IF OBJECT_ID(N'[dbo].[DailyRevenue]', N'U') IS NULL
+BEGIN
+    CREATE TABLE [dbo].[DailyRevenue](
+        [RevenueDate] DATE NOT NULL PRIMARY KEY,
+        [SalesRevenue] NUMERIC(19, 4) NOT NULL DEFAULT 0,
+        [SalesCount] INT NOT NULL DEFAULT 0,
+        [RentalRevenue] NUMERIC(19, 4) NOT NULL DEFAULT 0,
+        [RentalCount] INT NOT NULL DEFAULT 0,
+        [ModifiedDate] DATETIME NULL DEFAULT GETDATE()
+    )
+    PRINT 'Đã tạo bảng DailyRevenue'
+END
+GO
+
+-- Backfill từ dữ liệu đơn hàng hiện có (chạy lại được: xóa rồi tính lại toàn bộ)
+DELETE FROM [dbo].[DailyRevenue]
+GO
+
+INSERT INTO [dbo].[DailyRevenue] (RevenueDate, SalesRevenue, SalesCount, RentalRevenue, RentalCount, ModifiedDate)
+SELECT d.RevenueDate,
+       SUM(d.SalesRevenue), SUM(d.SalesCount),
+       SUM(d.RentalRevenue), SUM(d.RentalCount),
+       GETDATE()
+FROM (
+    SELECT CAST(OrderDate AS DATE) AS RevenueDate, TotalDue AS SalesRevenue, 1 AS SalesCount,
+           0 AS RentalRevenue, 0 AS RentalCount
+    FROM [dbo].[SalesOrderHeader]
+    UNION ALL
+    SELECT CAST(RentalDate AS DATE), 0, 0, TotalDue, 1
+    FROM [dbo].[RentalHeader]
+) d
+GROUP BY d.RevenueDate
+GO
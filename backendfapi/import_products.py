@@ -0,0 +1,62 @@
+"""
+Import / cập nhật hàng loạt sản phẩm từ file CSV / JSON / NDJSON (khóa theo ProductNumber).
+Cùng pipeline với POST /admin/products/import (app/product_import.py), in tiến độ sau mỗi lô.
+
+    python import_products.py catalog.csv
+    python import_products.py catalog.ndjson --dry-run --errors errors.ndjson
+
+CSV: cột theo ProductCreateUpdate, field lồng nhau viết dạng attributes.color, stock_details.total_stock,
+rental_config.is_rentable; cột images: url1|url2 (ảnh đầu tiên là ảnh chính).
+Lưu ý: chạy ngoài server nên chỉ xóa được response cache dùng chung (redis), cache trong RAM của server
+tự hết hạn theo TTL.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
+
+# Fix encoding cho Windows console
+if sys.platform == 'win32':
+    import io
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+
+from app.database import SessionLocal
+from app.product_import import IMPORT_CHUNK_SIZE, import_products
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import sản phẩm")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=["csv", "json"], help="Mặc định đoán theo đuôi file")
+    parser.add_argument("--dry-run", action="store_true", help="Chỉ validate, không ghi DB")
+    parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE)
+    parser.add_argument("--errors", help="Ghi lỗi từng dòng ra file NDJSON")
+    args = parser.parse_args()
+
+    format = args.format or ("csv" if args.path.lower().endswith(".csv") else "json")
+    with open(args.path, "rb") as f:
+        data = f.read()
+
+    with SessionLocal() as db:
+        for event in import_products(db, data, format, dry_run=args.dry_run, chunk_size=args.chunk_size):
+            print(f"[{event['event']:8}] {event['processed']} dòng | tạo {event['created']} | cập nhật {event['updated']} "
+                  f"| lỗi {event['failed']} | {event['elapsed_s']} s")
+
+    errors = event["errors"]
+    if args.errors:
+        with open(args.errors, "w", encoding="utf-8") as f:
+            for error in errors:
+                f.write(json.dumps(error, ensure_ascii=False) + "\n")
+    else:
+        for error in errors[:20]:
+            print(f"  dòng {error['row']} ({error['product_number']}): {'; '.join(error['errors'])}")
+        if len(errors) > 20:
+            print(f"  ... còn {len(errors) - 20} lỗi, dùng --errors để ghi ra file")
+    sys.exit(1 if event["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Script load test đơn giản: bắn N request song song vào các endpoint và in throughput / latency.
+Dùng để so sánh trước / sau khi đổi cách truy cập DB (cùng số worker uvicorn).
+
+    python load_test.py --base-url http://localhost:8000 --concurrency 50 --requests 1000 \
+        /admin/dashboard /admin/products /store/products/featured
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+
+import httpx
+
+# Fix encoding cho Windows console
+if sys.platform == 'win32':
+    import io
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+
+
+async def run_load(client: httpx.AsyncClient, paths, concurrency: int, total: int):
+    """Trả về (thời gian chạy, danh sách latency, số request lỗi)"""
+    latencies = []
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            path = paths[i % len(paths)]
+            start = time.perf_counter()
+            try:
+                response = await client.get(path)
+                if response.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - started, latencies, errors
+
+
+def report(elapsed: float, latencies, errors: int):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0
+    print(f"Requests:   {len(latencies)} ({errors} errors)")
+    print(f"Throughput: {len(latencies) / elapsed:.1f} req/s")
+    print(f"Latency:    p50 {statistics.median(latencies) * 1000:.1f} ms, p95 {p95 * 1000:.1f} ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Load test các endpoint GET")
+    parser.add_argument("paths", nargs="+", help="VD: /admin/dashboard /store/products/featured")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--token", help="Bearer token (nếu endpoint cần đăng nhập)")
+    args = parser.parse_args()
+
+    headers = {"Authorization": f"Bearer {args.token}"} if args.token else {}
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, headers=headers, limits=limits, timeout=60) as client:
+        report(*await run_load(client, args.paths, args.concurrency, args.requests))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
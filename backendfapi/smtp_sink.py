@@ -0,0 +1,126 @@
+"""
+SMTP sink local để test hàng đợi gửi mail (app/mailer.py) mà không gửi mail thật:
+nhận mọi mail qua SMTP thường (không TLS / đăng nhập), in ra console và lưu file .eml vào --out.
+
+    python smtp_sink.py --port 1025 --out sink_mail
+    MAIL_SINK=localhost:1025 uvicorn main:app        # (chạy server ở terminal khác)
+
+--fail-rate 0.3: trả lỗi tạm thời 451 cho ~30% mail để thử cơ chế gửi lại.
+--max-messages-per-connection N: ngắt kết nối sau N mail (giống server SMTP thật) để thử kết nối lại.
+Cuối mỗi kết nối in số mail đã nhận -> thấy được mail được gửi theo lô trên cùng 1 kết nối.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from email import message_from_bytes, policy
+
+# Fix encoding cho Windows console
+if sys.platform == 'win32':
+    import io
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+
+
+class SinkStats:
+    def __init__(self):
+        self.connections = 0
+        self.messages = 0
+        self.rejected = 0
+
+
+async def handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, args, stats: SinkStats):
+    stats.connections += 1
+    connection_id = stats.connections
+    received = 0
+
+    async def reply(line: str):
+        writer.write(f"{line}\r\n".encode())
+        await writer.drain()
+
+    await reply("220 bikego-sink ESMTP")
+    sender, recipients = None, []
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            command = line.decode(errors="replace").strip()
+            verb = command[:4].upper()
+
+            if verb in ("EHLO", "HELO"):
+                await reply("250-bikego-sink" if verb == "EHLO" else "250 bikego-sink")
+                if verb == "EHLO":
+                    await reply("250 8BITMIME")
+            elif verb == "MAIL":
+                sender, recipients = command[10:].strip(" <>"), []
+                await reply("250 OK")
+            elif verb == "RCPT":
+                recipients.append(command[8:].strip(" <>"))
+                await reply("250 OK")
+            elif verb == "DATA":
+                await reply("354 End data with <CR><LF>.<CR><LF>")
+                lines = []
+                while True:
+                    data_line = await reader.readline()
+                    if data_line in (b".\r\n", b".\n", b""):
+                        break
+                    lines.append(data_line[1:] if data_line.startswith(b"..") else data_line)
+                if random.random() < args.fail_rate:
+                    stats.rejected += 1
+                    await reply("451 Temporary failure, try again later")
+                    continue
+                raw = b"".join(lines)
+                received += 1
+                stats.messages += 1
+                message = message_from_bytes(raw, policy=policy.default)
+                print(f"[conn {connection_id}] #{stats.messages} {sender} -> {', '.join(recipients)}: {message['Subject']}")
+                if args.out:
+                    path = os.path.join(args.out, f"{int(time.time() * 1000)}-{stats.messages}.eml")
+                    with open(path, "wb") as f:
+                        f.write(raw)
+                await reply("250 OK queued")
+                if args.max_messages_per_connection and received >= args.max_messages_per_connection:
+                    await reply("421 Too many messages on this connection, closing")
+                    break
+            elif verb == "RSET":
+                sender, recipients = None, []
+                await reply("250 OK")
+            elif verb == "NOOP":
+                await reply("250 OK")
+            elif verb == "QUIT":
+                await reply("221 Bye")
+                break
+            else:
+                await reply("502 Command not implemented")
+    finally:
+        print(f"[conn {connection_id}] đóng sau {received} mail (tổng {stats.messages} mail / {stats.connections} kết nối, "
+              f"{stats.rejected} lần trả 451)")
+        writer.close()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="SMTP sink local cho test gửi mail")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1025)
+    parser.add_argument("--out", default="", help="Thư mục lưu file .eml ('' = không lưu)")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Tỷ lệ mail bị trả lỗi tạm thời 451 (0-1)")
+    parser.add_argument("--max-messages-per-connection", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+    stats = SinkStats()
+    server = await asyncio.start_server(lambda r, w: handle_client(r, w, args, stats), args.host, args.port)
+    print(f"SMTP sink đang nghe {args.host}:{args.port}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
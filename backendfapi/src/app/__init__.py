@@ -1,33 +1,82 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.requests import Request
-import json
+from contextlib import asynccontextmanager
+import logging
+import os
+
+import anyio.to_thread
 
 from app.routes import *
 
-class UTF8Middleware(BaseHTTPMiddleware):
-    """Middleware to ensure UTF-8 encoding in requests and responses"""
-    async def dispatch(self, request: Request, call_next):
-        # Đảm bảo request body được decode đúng UTF-8
-        if request.method in ["POST", "PUT", "PATCH"]:
-            # FastAPI tự động decode JSON, nhưng đảm bảo charset header đúng
-            content_type = request.headers.get("content-type", "")
-            if "application/json" in content_type and "charset" not in content_type:
-                # Không cần làm gì, FastAPI đã xử lý đúng
-                pass
-        
-        response = await call_next(request)
-        
-        # Đảm bảo response headers có charset UTF-8
-        if isinstance(response, JSONResponse):
-            response.headers["Content-Type"] = "application/json; charset=utf-8"
-        
-        return response
+class UTF8Middleware:
+    """Middleware ASGI thuần: thêm charset=utf-8 vào Content-Type application/json của response.
+    Chỉ sửa header ở message http.response.start, body đi thẳng (không bọc stream / task như BaseHTTPMiddleware)."""
+    JSON_CONTENT_TYPE = b"application/json"
+    UTF8_CONTENT_TYPE = b"application/json; charset=utf-8"
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_charset(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [
+                    (name, self.UTF8_CONTENT_TYPE)
+                    if name == b"content-type" and value == self.JSON_CONTENT_TYPE else (name, value)
+                    for name, value in message.get("headers", ())
+                ]
+            await send(message)
+
+        await self.app(scope, receive, send_with_charset)
+
+logger = logging.getLogger(__name__)
+
+def warm_up_read_models():
+    """Nạp sẵn product_stats + catalog_index + search index để request đầu tiên không phải chờ"""
+    from app.database import SessionLocal
+    from app.product_stats import product_stats
+    from app.catalog_index import catalog_index
+    from app.search_engine import product_search, faq_search
+
+    db = SessionLocal()
+    try:
+        product_stats.reload(db)
+        catalog_index.load(db)
+        product_search.load(db)
+        faq_search.load(db)
+    except Exception as e:
+        # Không chặn khởi động, request đầu tiên sẽ tự load lại
+        logger.warning("Warm-up read models failed: %s", e)
+    finally:
+        db.close()
+
+# Handler sync (def) chạy trong threadpool của anyio -> số thread = số request sync chạy đồng thời / worker
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", "40"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    from app.mailer import mail_queue
+    from app.otp_store import otp_sweeper
+    from app.password_hasher import password_hasher
+
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    warm_up_read_models()
+    await anyio.to_thread.run_sync(password_hasher.start)
+    mail_queue.start()
+    otp_sweeper.start()
+    try:
+        yield
+    finally:
+        otp_sweeper.stop()
+        password_hasher.shutdown()
+        await anyio.to_thread.run_sync(mail_queue.stop)
 
 def create_app() -> FastAPI:
-    app = FastAPI(title="Bike Go")
+    app = FastAPI(title="Bike Go", lifespan=lifespan)
 
     # Add UTF-8 encoding middleware
     app.add_middleware(UTF8Middleware)
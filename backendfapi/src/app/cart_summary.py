@@ -0,0 +1,190 @@
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import case, func, select, update
+from sqlalchemy.orm import Session
+
+from app.models import Cart, CartItem, Voucher
+
+# ==========================================
+# CART SUMMARY SNAPSHOT
+# ==========================================
+# Badge giỏ hàng gọi GET /store/cart liên tục -> tổng quan giỏ được lưu sẵn trên dòng Cart
+# (LineCount, ItemCount, BuySubtotal, RentSubtotal, xem add_cart_summary.sql):
+# - add / update / remove item (store + chatbot) cộng chênh lệch trước / sau vào Cart trong cùng transaction
+#   bằng UPDATE ... SET X = X + :delta (không đọc - sửa - ghi, an toàn khi nhiều request cùng giỏ)
+# - GET /store/cart?include_items=false chỉ đọc dòng Cart, không join CartItem / Product / ảnh
+# - GET đầy đủ vẫn tính từ CartItem, lệch với snapshot thì ghi lại (rebuild_cart_summary)
+# Voucher áp vào giỏ đọc qua voucher_cache (TTL ngắn), checkout vẫn kiểm tra lại với DB.
+
+VOUCHER_CACHE_TTL = int(os.getenv("VOUCHER_CACHE_TTL", "30"))
+VOUCHER_CACHE_SIZE = 1024  # Code lạ gửi lên cũng được cache (None) -> giới hạn số key
+
+
+@dataclass(frozen=True)
+class CartLine:
+    transaction_type: str
+    quantity: int
+    subtotal: Decimal
+
+    @classmethod
+    def of(cls, item: CartItem) -> "CartLine":
+        """Chụp dòng giỏ hàng (giá trị đang có trong session)"""
+        return cls(item.TransactionType or 'buy', item.Quantity, item.Subtotal or Decimal(0))
+
+    @classmethod
+    def after_flush(cls, db: Session, item: CartItem) -> "CartLine":
+        """Flush INSERT / UPDATE của item rồi đọc lại Subtotal do DB tính"""
+        db.flush()
+        db.refresh(item, ["Subtotal"])
+        return cls.of(item)
+
+
+@dataclass
+class CartSnapshot:
+    cart_id: int
+    line_count: int = 0
+    item_count: int = 0
+    buy_subtotal: Decimal = Decimal(0)
+    rent_subtotal: Decimal = Decimal(0)
+
+    @classmethod
+    def of(cls, cart: Cart) -> "CartSnapshot":
+        return cls(
+            cart.CartID, cart.LineCount or 0, cart.ItemCount or 0,
+            cart.BuySubtotal or Decimal(0), cart.RentSubtotal or Decimal(0)
+        )
+
+
+def _deltas(line: Optional[CartLine], sign: int) -> Tuple[int, int, Decimal, Decimal]:
+    if line is None:
+        return 0, 0, Decimal(0), Decimal(0)
+    buy = line.subtotal if line.transaction_type != 'rent' else Decimal(0)
+    rent = line.subtotal if line.transaction_type == 'rent' else Decimal(0)
+    return sign, sign * line.quantity, sign * buy, sign * rent
+
+
+def record_cart_change(db: Session, cart_id: int, before: Optional[CartLine] = None, after: Optional[CartLine] = None):
+    """Cộng chênh lệch 1 dòng giỏ hàng vào snapshot (before=None: thêm mới, after=None: xóa). Gọi trước db.commit()"""
+    removed, added = _deltas(before, -1), _deltas(after, 1)
+    lines, items, buy, rent = (a + b for a, b in zip(removed, added))
+    db.execute(
+        update(Cart).where(Cart.CartID == cart_id).values(
+            LineCount=Cart.LineCount + lines,
+            ItemCount=Cart.ItemCount + items,
+            BuySubtotal=Cart.BuySubtotal + buy,
+            RentSubtotal=Cart.RentSubtotal + rent,
+            ModifiedDate=datetime.utcnow()
+        ).execution_options(synchronize_session=False)
+    )
+
+
+def compute_cart_summary(db: Session, cart_ids: Iterable[int]) -> Dict[int, CartSnapshot]:
+    """Tính lại snapshot từ CartItem (giỏ không có item sẽ không có trong dict)"""
+    is_rent = CartItem.TransactionType == 'rent'
+    rows = db.execute(
+        select(
+            CartItem.CartID, func.count(), func.sum(CartItem.Quantity),
+            func.sum(case((is_rent, 0), else_=CartItem.Subtotal)),
+            func.sum(case((is_rent, CartItem.Subtotal), else_=0)),
+        ).where(CartItem.CartID.in_(list(cart_ids))).group_by(CartItem.CartID)
+    ).all()
+    return {
+        cart_id: CartSnapshot(cart_id, lines, int(items or 0), Decimal(buy or 0), Decimal(rent or 0))
+        for cart_id, lines, items, buy, rent in rows
+    }
+
+
+def rebuild_cart_summary(db: Session, cart_ids: Iterable[int]):
+    """Ghi đè snapshot của các giỏ bằng số liệu tính từ CartItem (sửa sai lệch). Gọi trước db.commit()"""
+    cart_ids = list(cart_ids)
+    computed = compute_cart_summary(db, cart_ids)
+    for cart_id in cart_ids:
+        snapshot = computed.get(cart_id, CartSnapshot(cart_id))
+        db.execute(
+            update(Cart).where(Cart.CartID == cart_id).values(
+                LineCount=snapshot.line_count, ItemCount=snapshot.item_count,
+                BuySubtotal=snapshot.buy_subtotal, RentSubtotal=snapshot.rent_subtotal
+            ).execution_options(synchronize_session=False)
+        )
+
+
+# ==========================================
+# VOUCHER CACHE (voucher áp vào giỏ hàng)
+# ==========================================
+@dataclass(frozen=True)
+class VoucherRule:
+    code: str
+    scope: str
+    status: bool
+    start_date: datetime
+    end_date: datetime
+    quantity: int
+    min_order_amount: Decimal
+    discount_percent: Optional[int]
+    discount_amount: Decimal
+
+    def applies(self, scope: str, amount: Decimal, now: datetime) -> bool:
+        """Còn hiệu lực, đúng phạm vi (buy / rent) và đạt giá trị tối thiểu"""
+        return (
+            self.status and self.quantity > 0 and self.start_date <= now <= self.end_date
+            and self.scope in (scope, 'all') and amount > 0 and amount >= self.min_order_amount
+        )
+
+    def discounted(self, amount: Decimal) -> Decimal:
+        """Số tiền sau giảm giá (DiscountPercent là số phần trăm, VD 10 = 10%)"""
+        if self.discount_percent:
+            discount_amt = amount * (Decimal(self.discount_percent) / 100)
+        else:
+            discount_amt = self.discount_amount
+        return max(amount - min(discount_amt, amount), Decimal(0))
+
+
+class VoucherCache:
+    def __init__(self, ttl: int = VOUCHER_CACHE_TTL):
+        self.ttl = ttl
+        self._entries: Dict[str, Tuple[Optional[VoucherRule], float]] = {}  # code -> (rule, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, db: Session, code: str) -> Optional[VoucherRule]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(code)
+        if entry and entry[1] > now:
+            return entry[0]
+
+        voucher = db.execute(select(Voucher).where(Voucher.Code == code)).scalars().first()
+        rule = VoucherRule(
+            code=voucher.Code, scope=(voucher.Scope or 'all').lower(), status=bool(voucher.Status),
+            start_date=voucher.StartDate, end_date=voucher.EndDate, quantity=voucher.Quantity or 0,
+            min_order_amount=voucher.MinOrderAmount or Decimal(0), discount_percent=voucher.DiscountPercent,
+            discount_amount=voucher.DiscountAmount or Decimal(0)
+        ) if voucher else None
+        with self._lock:
+            if len(self._entries) >= VOUCHER_CACHE_SIZE:
+                self._entries.clear()
+            self._entries[code] = (rule, now + self.ttl)
+        return rule
+
+    def invalidate(self):
+        """Admin sửa voucher -> xóa cache của worker hiện tại (worker khác chờ hết TTL)"""
+        with self._lock:
+            self._entries.clear()
+
+
+voucher_cache = VoucherCache()
+
+
+def apply_cart_voucher(db: Session, code: Optional[str], scope: str, amount: Decimal) -> Decimal:
+    """Tổng tiền buy / rent sau voucher (voucher không hợp lệ -> giữ nguyên)"""
+    if not code or amount <= 0:
+        return amount
+    rule = voucher_cache.get(db, code)
+    if rule and rule.applies(scope, amount, datetime.now()):
+        return rule.discounted(amount)
+    return amount
@@ -0,0 +1,316 @@
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.models import Product, ProductSubcategory
+
+# ==========================================
+# FACETED CATALOG INDEX
+# ==========================================
+# Mỗi sản phẩm được gán 1 ordinal (vị trí trong CatalogSnapshot.entries).
+# Posting list của mỗi giá trị facet là 1 bitset (Python int), bit thứ i = sản phẩm có ordinal i.
+# Lọc = AND các bitset, đếm facet = popcount, không cần round-trip tới DB.
+# Mỗi worker giữ index riêng -> reload toàn bộ sau CATALOG_INDEX_TTL giây (1 request reload, các request khác
+# dùng tạm snapshot cũ): xây snapshot mới rồi gán 1 lần, sửa 1 sản phẩm cũng copy-on-write -> request đọc luôn
+# thấy 1 snapshot đầy đủ.
+
+CATALOG_INDEX_TTL = int(os.getenv("CATALOG_INDEX_TTL", "600"))
+
+FACETS = ("category", "condition", "size", "color", "rentable", "price_range")
+
+# Giữ nguyên biên của filter price_range cũ (2 khoảng giữa lấy cả 2 đầu mút)
+PRICE_BUCKETS = (
+    ("under 1000", lambda p: p < 1000),
+    ("1000-2000", lambda p: 1000 <= p <= 2000),
+    ("2000-3000", lambda p: 2000 <= p <= 3000),
+    ("above 3000", lambda p: p > 3000),
+)
+PRICE_BUCKET_NAMES = {name for name, _ in PRICE_BUCKETS}
+
+
+def normalize_facet_value(value) -> Optional[str]:
+    """SQL Server so sánh không phân biệt hoa thường & bỏ khoảng trắng cuối -> casefold + strip"""
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value.casefold() if value else None
+
+
+@dataclass
+class CatalogEntry:
+    product_id: int
+    name: str
+    list_price: Decimal
+    subcategory_id: Optional[int] = None
+    condition: Optional[str] = None
+    size: Optional[str] = None
+    color: Optional[str] = None
+    rent_price: Optional[Decimal] = None
+    is_rentable: bool = False
+
+    def facet_keys(self) -> List[Tuple[str, object]]:
+        keys = [
+            ("category", self.subcategory_id),
+            ("condition", normalize_facet_value(self.condition)),
+            ("size", normalize_facet_value(self.size)),
+            ("color", normalize_facet_value(self.color)),
+            ("rentable", bool(self.is_rentable)),
+        ]
+        price = self.list_price if self.list_price is not None else 0
+        keys += [("price_range", name) for name, match in PRICE_BUCKETS if match(price)]
+        return [(facet, key) for facet, key in keys if key is not None]
+
+
+@dataclass
+class CatalogFilter:
+    category_id: Optional[int] = None
+    condition: Optional[str] = None
+    sizes: List[str] = field(default_factory=list)
+    colors: List[str] = field(default_factory=list)
+    is_rentable: Optional[bool] = None
+    price_range: Optional[str] = None
+
+    def facet_values(self) -> Dict[str, list]:
+        """facet -> danh sách key đã normalize (OR trong cùng facet, AND giữa các facet)"""
+        values = {}
+        if self.category_id:
+            values["category"] = [self.category_id]
+        if self.condition:
+            values["condition"] = [normalize_facet_value(self.condition)]
+        if self.sizes:
+            values["size"] = [normalize_facet_value(s) for s in self.sizes]
+        if self.colors:
+            values["color"] = [normalize_facet_value(c) for c in self.colors]
+        if self.is_rentable is not None:
+            values["rentable"] = [bool(self.is_rentable)]
+        if self.price_range in PRICE_BUCKET_NAMES:
+            values["price_range"] = [self.price_range]
+        return values
+
+
+def iter_ordinals(mask: int) -> List[int]:
+    """Danh sách vị trí bit 1 của bitset (tăng dần)"""
+    bits = bin(mask)[:1:-1]
+    return [i for i, b in enumerate(bits) if b == "1"]
+
+
+class CatalogSnapshot:
+    """
+    1 phiên bản index. Chỉ được sửa (add / remove) trước khi gán vào CatalogIndex._snapshot,
+    sau đó chỉ đọc -> request đọc không cần lock và không bao giờ thấy index đang xây dở.
+    """
+
+    def __init__(self, category_names: Optional[Dict[int, str]] = None):
+        self.entries: List[Optional[CatalogEntry]] = []
+        self.ordinals: Dict[int, int] = {}
+        self.postings: Dict[str, Dict[object, int]] = {f: {} for f in FACETS}
+        self.labels: Dict[str, Dict[object, str]] = {f: {} for f in FACETS}
+        self.all = 0
+        self.category_names: Dict[int, str] = dict(category_names or {})
+
+    def copy(self) -> "CatalogSnapshot":
+        snapshot = CatalogSnapshot(self.category_names)
+        snapshot.entries = list(self.entries)
+        snapshot.ordinals = dict(self.ordinals)
+        snapshot.postings = {f: dict(p) for f, p in self.postings.items()}
+        snapshot.labels = {f: dict(l) for f, l in self.labels.items()}
+        snapshot.all = self.all
+        return snapshot
+
+    # --- Build ---
+    def add(self, entry: CatalogEntry):
+        ordinal = len(self.entries)
+        self.entries.append(entry)
+        self.ordinals[entry.product_id] = ordinal
+        bit = 1 << ordinal
+        self.all |= bit
+        labels = {
+            "category": entry.subcategory_id, "condition": entry.condition, "size": entry.size,
+            "color": entry.color, "rentable": bool(entry.is_rentable),
+        }
+        for facet, key in entry.facet_keys():
+            postings = self.postings[facet]
+            postings[key] = postings.get(key, 0) | bit
+            self.labels[facet].setdefault(key, labels.get(facet, key))
+
+    def remove(self, product_id: int):
+        # Ordinal cũ bị bỏ trống (tombstone), reload theo TTL sẽ dồn lại
+        ordinal = self.ordinals.pop(product_id, None)
+        if ordinal is None:
+            return
+        bit = 1 << ordinal
+        self.entries[ordinal] = None
+        self.all &= ~bit
+        for facet in FACETS:
+            for key, mask in self.postings[facet].items():
+                if mask & bit:
+                    self.postings[facet][key] = mask & ~bit
+
+    # --- Query ---
+    def label(self, facet: str, key):
+        if facet == "category":
+            return self.category_names.get(key, str(key))
+        return self.labels[facet].get(key)
+
+    def facet_mask(self, facet: str, keys: list) -> int:
+        postings = self.postings[facet]
+        mask = 0
+        for key in keys:
+            mask |= postings.get(key, 0)
+        return mask
+
+    def match(self, filters: CatalogFilter, exclude_facet: Optional[str] = None) -> int:
+        mask = self.all
+        for facet, keys in filters.facet_values().items():
+            if facet != exclude_facet:
+                mask &= self.facet_mask(facet, keys)
+        return mask
+
+    def entries_of(self, mask: int) -> List[CatalogEntry]:
+        entries = self.entries
+        return [entries[i] for i in iter_ordinals(mask) if entries[i] is not None]
+
+    def mask_of(self, product_ids) -> int:
+        mask = 0
+        for pid in product_ids:
+            ordinal = self.ordinals.get(pid)
+            if ordinal is not None:
+                mask |= 1 << ordinal
+        return mask
+
+
+class CatalogIndex:
+    def __init__(self, ttl: int = CATALOG_INDEX_TTL):
+        self.ttl = ttl
+        self._snapshot = CatalogSnapshot()
+        self._loaded_at: Optional[float] = None
+        self._lock = threading.RLock()  # Chỉ cho phía ghi (load / refresh), phía đọc lấy self._snapshot 1 lần
+        self._reload_lock = threading.Lock()
+
+    # --- Load / refresh ---
+    @staticmethod
+    def _fetch(db: Session, product_id: Optional[int] = None) -> List[CatalogEntry]:
+        query = select(
+            Product.ProductID, Product.Name, Product.ListPrice, Product.ProductSubcategoryID,
+            Product.Condition, Product.Size, Product.Color, Product.RentPrice, Product.IsRentable
+        ).order_by(Product.ProductID)
+        if product_id is not None:
+            query = query.where(Product.ProductID == product_id)
+        return [
+            CatalogEntry(
+                product_id=row.ProductID, name=row.Name, list_price=row.ListPrice,
+                subcategory_id=row.ProductSubcategoryID, condition=row.Condition,
+                size=row.Size, color=row.Color, rent_price=row.RentPrice,
+                is_rentable=bool(row.IsRentable)
+            )
+            for row in db.execute(query).all()
+        ]
+
+    def load(self, db: Session) -> "CatalogIndex":
+        entries = self._fetch(db)
+        categories = db.execute(
+            select(ProductSubcategory.ProductSubcategoryID, ProductSubcategory.Name)
+        ).all()
+        snapshot = CatalogSnapshot({cat_id: name for cat_id, name in categories})
+        for entry in entries:
+            snapshot.add(entry)
+        with self._lock:
+            self._snapshot = snapshot
+            self._loaded_at = time.monotonic()
+        return self
+
+    def _stale(self) -> bool:
+        loaded_at = self._loaded_at
+        return loaded_at is None or time.monotonic() - loaded_at > self.ttl
+
+    def ensure_loaded(self, db: Session) -> "CatalogIndex":
+        if not self._stale():
+            return self
+        # Đã có snapshot (chỉ hết hạn) -> request khác đang reload thì dùng tạm snapshot cũ, không chờ
+        blocking = self._loaded_at is None
+        if not self._reload_lock.acquire(blocking=blocking):
+            return self
+        try:
+            if self._stale():
+                self.load(db)
+        finally:
+            self._reload_lock.release()
+        return self
+
+    def _update(self, change):
+        """Copy-on-write: sửa bản sao rồi gán lại, request đang đọc vẫn dùng snapshot cũ nguyên vẹn"""
+        with self._lock:
+            snapshot = self._snapshot.copy()
+            change(snapshot)
+            self._snapshot = snapshot
+
+    def refresh_product(self, db: Session, product_id: int):
+        """Gọi sau khi commit create/update/delete sản phẩm"""
+        if self._loaded_at is None:
+            return  # Chưa load -> lần đọc đầu sẽ lấy dữ liệu mới
+        entries = self._fetch(db, product_id)
+
+        def change(snapshot: CatalogSnapshot):
+            snapshot.remove(product_id)
+            for entry in entries:
+                snapshot.add(entry)
+        self._update(change)
+
+    def remove_product(self, product_id: int):
+        self._update(lambda snapshot: snapshot.remove(product_id))
+
+    def set_category_name(self, category_id: int, name: Optional[str]):
+        """Gọi sau khi tạo/đổi tên (name) hoặc xóa (None) danh mục"""
+        def change(snapshot: CatalogSnapshot):
+            if name is None:
+                snapshot.category_names.pop(category_id, None)
+            else:
+                snapshot.category_names[category_id] = name
+        self._update(change)
+
+    # --- Query (mỗi hàm chỉ đọc 1 snapshot) ---
+    def match(self, filters: CatalogFilter, exclude_facet: Optional[str] = None) -> int:
+        return self._snapshot.match(filters, exclude_facet)
+
+    def search(self, filters: CatalogFilter) -> List[CatalogEntry]:
+        snapshot = self._snapshot
+        return snapshot.entries_of(snapshot.match(filters))
+
+    def get(self, product_id: int) -> Optional[CatalogEntry]:
+        snapshot = self._snapshot
+        ordinal = snapshot.ordinals.get(product_id)
+        return snapshot.entries[ordinal] if ordinal is not None else None
+
+    def facet_counts(self, filters: CatalogFilter, within_ids=None) -> Dict[str, List[dict]]:
+        """
+        Đếm số sản phẩm cho từng giá trị facet.
+        Facet đang được lọc không tự giới hạn chính nó (chọn thêm size khác vẫn thấy số lượng).
+        within_ids: ProductID giới hạn thêm (vd: kết quả full-text / min_rating), đổi sang bitset trên cùng
+        snapshot (bitset của snapshot khác có ordinal khác)
+        """
+        snapshot = self._snapshot
+        within = snapshot.mask_of(within_ids) if within_ids is not None else None
+        result = {}
+        for facet in FACETS:
+            base = snapshot.match(filters, exclude_facet=facet)
+            if within is not None:
+                base &= within
+            items = []
+            for key, mask in snapshot.postings[facet].items():
+                count = (mask & base).bit_count()
+                if count:
+                    items.append({"value": key, "label": snapshot.label(facet, key), "count": count})
+            result[facet] = items
+        return result
+
+    def category_counts(self) -> Dict[int, int]:
+        return {key: mask.bit_count() for key, mask in self._snapshot.postings["category"].items()}
+
+
+catalog_index = CatalogIndex()
@@ -0,0 +1,200 @@
+import hashlib
+import math
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, List, Optional, Set
+
+from app.response_cache import response_cache, CATALOG_TAG, FAQS_TAG
+from app.search_engine import tokenize
+
+# ==========================================
+# CHATBOT ANSWER CACHE
+# ==========================================
+# Lời chào, câu hỏi chính sách, FAQ gợi ý (/chatbot/faqs) lặp lại rất nhiều -> lưu kết quả AI theo câu hỏi đã chuẩn hóa
+# (bỏ dấu, chữ thường, chỉ giữ từ, bỏ tiểu từ ạ / vậy / nhé...), cache hit trả về ngay không gọi Gemini:
+# - Khớp gần đúng chỉ cho greeting / policy: TF-IDF trên trigram ký tự, cosine >= CHAT_CACHE_SIMILARITY (gõ sai /
+#   thêm bớt dấu câu vẫn trúng), các con số trong câu phải giống hệt ("thuê 3 ngày" khác "thuê 5 ngày")
+# - Intent khác (product_search, consultation_only...) phải trùng câu đã chuẩn hóa: "mua xe X" / "đặt xe X" gần
+#   giống "tìm xe X", "màu đen" gần giống "màu đỏ" -> khớp gần đúng sẽ trả nhầm SQL hoặc nuốt mất order_intent
+# - TTL theo intent (INTENT_TTLS), intent không có trong bảng (order_intent, lỗi parse JSON, ...) không bao giờ cache
+# - product_search chỉ cache câu SQL, mỗi lần hit vẫn chạy lại SQL -> giá / tồn kho luôn mới
+# - Câu trả lời phụ thuộc ngữ cảnh: chỉ greeting / policy dùng được khi có lịch sử chat, intent khác chỉ cache
+#   và trả từ cache cho tin nhắn đầu tiên (không có history)
+# - Hết hiệu lực khi system prompt đổi (tên danh mục, chính sách, tư vấn, model: so fingerprint) hoặc theo tag
+#   version của response_cache: admin sửa FAQ (mọi intent), đổi danh mục / sản phẩm (product_search)
+# Cache nằm trong process, mỗi worker uvicorn có cache riêng.
+
+CHAT_CACHE_SIZE = int(os.getenv("CHAT_CACHE_SIZE", "1000"))
+CHAT_CACHE_SIMILARITY = float(os.getenv("CHAT_CACHE_SIMILARITY", "0.85"))
+
+INTENT_TTLS = {
+    "greeting": 24 * 3600,
+    "policy": 3600,
+    "irrelevant": 3600,
+    "consultation_only": 1800,
+    "product_search": 600,
+}
+CONTEXT_FREE_INTENTS = {"greeting", "policy"}
+INTENT_TAGS = {"product_search": (FAQS_TAG, CATALOG_TAG)}
+DEFAULT_TAGS = (FAQS_TAG,)
+MAX_CANDIDATES = 20  # Số entry chung nhiều trigram nhất đem tính cosine
+FILLER_WORDS = {"a", "ah", "ak", "vay", "nhe", "nha", "oi", "nhi", "ha"}  # Tiểu từ cuối câu (ạ, vậy, nhé, ơi...)
+
+
+def normalize_message(message: str) -> str:
+    """'Chào shop ạ!!' -> 'chao shop'"""
+    return " ".join(t for t in tokenize(message) if t not in FILLER_WORDS)
+
+
+def trigrams(text: str) -> Counter:
+    padded = f" {text} "
+    return Counter(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def prompt_fingerprint(system_prompt: str, model_id: str) -> str:
+    return hashlib.blake2b(f"{model_id}\n{system_prompt}".encode("utf-8"), digest_size=16).hexdigest()
+
+
+@dataclass
+class ChatCacheEntry:
+    key: str
+    intent: str
+    answer: Dict[str, str]  # reply_message hoặc sql_query
+    fingerprint: str
+    tags: Dict[str, int]
+    expires_at: float
+    grams: Counter
+    numbers: FrozenSet[str] = field(default_factory=frozenset)
+
+    @property
+    def context_free(self) -> bool:
+        return self.intent in CONTEXT_FREE_INTENTS
+
+
+class ChatAnswerCache:
+    def __init__(self, max_size: int = CHAT_CACHE_SIZE, similarity: float = CHAT_CACHE_SIMILARITY):
+        self.max_size = max_size
+        self.similarity = similarity
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, ChatCacheEntry]" = OrderedDict()
+        self._postings: Dict[str, Set[str]] = {}  # trigram -> key các entry greeting / policy chứa trigram
+        self._fuzzy_count = 0  # Số entry có trong _postings (N của IDF)
+        self._lock = threading.Lock()
+
+    # --- Index ---
+    def _add(self, entry: ChatCacheEntry):
+        self._remove(entry.key)
+        self._entries[entry.key] = entry
+        if entry.context_free:
+            self._fuzzy_count += 1
+            for gram in entry.grams:
+                self._postings.setdefault(gram, set()).add(entry.key)
+        while len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None or not entry.context_free:
+            return
+        self._fuzzy_count -= 1
+        for gram in entry.grams:
+            keys = self._postings.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._postings[gram]
+
+    def _idf(self, gram: str) -> float:
+        return math.log((self._fuzzy_count + 1) / (len(self._postings.get(gram, ())) + 1)) + 1
+
+    def _cosine(self, a: Counter, b: Counter) -> float:
+        weights_a = {g: tf * self._idf(g) for g, tf in a.items()}
+        weights_b = {g: tf * self._idf(g) for g, tf in b.items()}
+        dot = sum(w * weights_b.get(g, 0.0) for g, w in weights_a.items())
+        norm = math.sqrt(sum(w * w for w in weights_a.values())) * math.sqrt(sum(w * w for w in weights_b.values()))
+        return dot / norm if norm else 0.0
+
+    def _candidates(self, key: str, grams: Counter) -> List[ChatCacheEntry]:
+        """Entry trùng key, nếu không có thì các entry greeting / policy đủ giống"""
+        exact = self._entries.get(key)
+        if exact is not None:
+            return [exact]
+        overlap = Counter()
+        for gram in grams:
+            for candidate in self._postings.get(gram, ()):
+                overlap[candidate] += 1
+        scored = [
+            (self._cosine(grams, self._entries[candidate].grams), candidate)
+            for candidate, _ in overlap.most_common(MAX_CANDIDATES)
+        ]
+        return [self._entries[k] for score, k in sorted(scored, reverse=True) if score >= self.similarity]
+
+    # --- API ---
+    def lookup(self, message: str, fingerprint: str, has_history: bool) -> Optional[ChatCacheEntry]:
+        key = normalize_message(message)
+        if not key:
+            return None
+        grams = trigrams(key)
+        numbers = frozenset(t for t in key.split() if t.isdigit())
+        now = time.monotonic()
+        with self._lock:
+            candidates = self._candidates(key, grams)
+            for entry in candidates:
+                if entry.expires_at <= now or entry.fingerprint != fingerprint:
+                    self._remove(entry.key)
+                    continue
+                if entry.numbers != numbers or (has_history and not entry.context_free):
+                    continue
+                self._entries.move_to_end(entry.key)
+                break
+            else:
+                entry = None
+        # Tag version đọc ngoài lock (có thể là backend dùng chung qua mạng)
+        if entry is not None and response_cache.tag_versions(entry.tags) != entry.tags:
+            with self._lock:
+                self._remove(entry.key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def store(self, message: str, fingerprint: str, has_history: bool, ai_data: dict):
+        intent = ai_data.get("intent")
+        ttl = INTENT_TTLS.get(intent)
+        if not ttl or ai_data.get("cacheable") is False:
+            return
+        if has_history and intent not in CONTEXT_FREE_INTENTS:
+            return
+        if intent == "product_search":
+            answer = {"sql_query": ai_data.get("sql_query") or ""}
+            if not answer["sql_query"]:
+                return
+        else:
+            answer = {"reply_message": ai_data.get("reply_message") or ""}
+            if not answer["reply_message"]:
+                return
+        key = normalize_message(message)
+        if not key:
+            return
+        entry = ChatCacheEntry(
+            key=key, intent=intent, answer=answer, fingerprint=fingerprint,
+            tags=response_cache.tag_versions(INTENT_TAGS.get(intent, DEFAULT_TAGS)), expires_at=time.monotonic() + ttl,
+            grams=trigrams(key), numbers=frozenset(t for t in key.split() if t.isdigit()),
+        )
+        with self._lock:
+            self._add(entry)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._postings.clear()
+            self._fuzzy_count = 0
+
+
+chat_cache = ChatAnswerCache()
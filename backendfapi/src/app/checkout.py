@@ -0,0 +1,381 @@
+import os
+import random
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+from app.models import (
+    Cart, CartItem, CustomerAdress, Product, ProductInventory, RentalDetail, RentalHeader,
+    SalesOrderDetail, SalesOrderHeader, SalesOrderStockReservation, Voucher, VoucherUsage,
+)
+from app.stock import MAINTENANCE_LOCATION_ID
+from app.revenue import record_order_revenue
+from app.product_stats import product_stats
+
+# ==========================================
+# CHECKOUT SERVICE
+# ==========================================
+# Tạo đơn Mua (SalesOrder) / Thuê (RentalOrder) từ giỏ hàng trong 1 transaction:
+# 1. Đọc giỏ + địa chỉ + voucher, lấy toàn bộ sản phẩm của giỏ trong 1 query
+# 2. Giữ chỗ bằng UPDATE có điều kiện (không đọc - sửa - ghi):
+#    - Cart: Status 'Active' -> 'Converted' (2 request checkout cùng 1 giỏ chỉ 1 request thành công)
+#    - Voucher: Quantity - 1 WHERE Quantity > 0
+#    - Tồn kho dòng Mua: rải qua các kho (ngoài kho bảo trì) theo LocationID tăng dần, mỗi kho
+#      Quantity - take WHERE Quantity >= take -> đủ hàng theo tổng các kho là mua được. Dòng Thuê không trừ kho
+#      (xe được trả lại), admin gán AssetID khi giao xe.
+#    Không giữ được chỗ -> rollback, trả 409. Đơn Mua ghi StockReservedAt + số đã trừ ở từng kho
+#    (SalesOrderStockReservation), hủy đơn thì release_stock hoàn đúng các kho đó, đúng 1 lần.
+# 3. Chi tiết đơn INSERT 1 lần (executemany), DailyRevenue cộng dồn cuối cùng (dòng nóng, giữ lock ngắn nhất)
+# Lock lấy theo thứ tự cố định (Voucher -> Cart -> ProductInventory theo ProductID, LocationID -> đơn hàng ->
+# DailyRevenue)
+# để hạn chế deadlock; SQL Server vẫn chọn victim (lỗi 1205) thì chạy lại cả transaction tối đa
+# CHECKOUT_MAX_RETRIES lần.
+
+CHECKOUT_MAX_RETRIES = int(os.getenv("CHECKOUT_MAX_RETRIES", "3"))
+CHECKOUT_RETRY_BACKOFF = float(os.getenv("CHECKOUT_RETRY_BACKOFF", "0.05"))  # Giây, nhân đôi mỗi lần thử lại
+STOCK_DEBIT_ATTEMPTS = 3  # Số lần đọc lại 1 kho khi request khác vừa trừ chen vào
+
+DEADLOCK_CODES = ("1205", "40001")  # SQL Server deadlock victim / SQLSTATE serialization failure
+
+
+@dataclass
+class CheckoutResult:
+    buy_order_id: Optional[int] = None
+    buy_order_number: Optional[str] = None
+    rent_order_id: Optional[int] = None
+    rent_order_number: Optional[str] = None
+    total_amount: Decimal = Decimal(0)
+
+
+def generate_order_number(prefix: str):
+    # Tạo mã đơn hàng dạng SO-20231010-XXXX
+    return f"{prefix}-{datetime.now().strftime('%Y%m%d')}-{uuid.uuid4().hex[:4].upper()}"
+
+
+def is_deadlock(error: DBAPIError) -> bool:
+    text = str(error.orig)
+    return any(code in text for code in DEADLOCK_CODES)
+
+
+def apply_voucher(voucher: Voucher, subtotal_buy: Decimal, subtotal_rent: Decimal) -> Tuple[Decimal, Decimal]:
+    """(discount_buy, discount_rent) theo Scope của voucher"""
+    scope = voucher.Scope.lower() if voucher.Scope else 'all'
+    if scope == 'buy':
+        applicable_amount = subtotal_buy
+    elif scope == 'rent':
+        applicable_amount = subtotal_rent
+    else:
+        applicable_amount = subtotal_buy + subtotal_rent
+    if applicable_amount <= 0:
+        return Decimal(0), Decimal(0)
+
+    if voucher.DiscountPercent:
+        discount_amt = applicable_amount * (Decimal(voucher.DiscountPercent) / 100)
+    else:
+        discount_amt = voucher.DiscountAmount or Decimal(0)
+
+    # Scope = all: trừ ưu tiên vào đơn Mua, còn dư trừ đơn Thuê
+    if scope == 'buy':
+        return min(discount_amt, subtotal_buy), Decimal(0)
+    if scope == 'rent':
+        return Decimal(0), min(discount_amt, subtotal_rent)
+    if subtotal_buy >= discount_amt:
+        return discount_amt, Decimal(0)
+    return subtotal_buy, discount_amt - subtotal_buy
+
+
+# --- Stock ---
+@dataclass(frozen=True)
+class StockDebit:
+    product_id: int
+    location_id: int
+    quantity: int
+
+
+def merge_quantities(lines: Iterable[Tuple[int, int]]) -> Dict[int, int]:
+    """[(ProductID, qty)] -> {ProductID: tổng qty}, sắp theo ProductID (thứ tự lấy lock cố định)"""
+    totals: Dict[int, int] = {}
+    for product_id, quantity in lines:
+        totals[product_id] = totals.get(product_id, 0) + quantity
+    return dict(sorted(totals.items()))
+
+
+def _debit_location(db: Session, product_id: int, location_id: int, wanted: int, available: int, now: datetime) -> int:
+    """Trừ tối đa wanted ở 1 kho bằng UPDATE có điều kiện, trả về số đã trừ (request khác trừ chen vào -> đọc lại)"""
+    for _ in range(STOCK_DEBIT_ATTEMPTS):
+        take = min(wanted, available)
+        if take <= 0:
+            return 0
+        debited = db.execute(
+            update(ProductInventory).where(
+                ProductInventory.ProductID == product_id,
+                ProductInventory.LocationID == location_id,
+                ProductInventory.Quantity >= take,
+            ).values(Quantity=ProductInventory.Quantity - take, ModifiedDate=now)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if debited:
+            return take
+        available = db.execute(
+            select(ProductInventory.Quantity).where(
+                ProductInventory.ProductID == product_id, ProductInventory.LocationID == location_id,
+            )
+        ).scalar() or 0
+    return 0
+
+
+def reserve_stock(db: Session, lines: Iterable[Tuple[int, int]]) -> Tuple[List[StockDebit], List[int]]:
+    """
+    Trừ tồn kho cho các dòng Mua, rải qua các kho (ngoài kho bảo trì) theo LocationID tăng dần.
+    Trả về (số đã trừ ở từng kho, ProductID không đủ hàng). Có ProductID thiếu hàng thì caller phải rollback
+    (các kho đã trừ một phần được hoàn theo transaction).
+    """
+    debits: List[StockDebit] = []
+    short = []
+    now = datetime.now()
+    for product_id, quantity in merge_quantities(lines).items():
+        stock = db.execute(
+            select(ProductInventory.LocationID, ProductInventory.Quantity).where(
+                ProductInventory.ProductID == product_id,
+                ProductInventory.LocationID != MAINTENANCE_LOCATION_ID,
+                ProductInventory.Quantity > 0,
+            ).order_by(ProductInventory.LocationID)
+        ).all()
+        remaining = quantity
+        if sum(row.Quantity for row in stock) >= quantity:
+            for location_id, available in stock:
+                taken = _debit_location(db, product_id, location_id, remaining, available, now)
+                if taken:
+                    debits.append(StockDebit(product_id, location_id, taken))
+                    remaining -= taken
+                if remaining <= 0:
+                    break
+        if remaining > 0:
+            short.append(product_id)
+    return debits, short
+
+
+def release_stock(db: Session, sales_order_id: int) -> bool:
+    """
+    Hoàn tồn kho khi đơn Mua bị hủy (gọi trước db.commit() của thao tác hủy).
+    Chỉ hoàn khi đơn còn StockReservedAt (đơn đặt trước khi có giữ chỗ không trừ kho) và xóa cờ trong cùng
+    UPDATE có điều kiện -> hủy lại lần 2 (Cancelled -> Pending -> Cancelled) không cộng kho lần nữa.
+    Cộng lại đúng kho đã trừ theo SalesOrderStockReservation.
+    """
+    released = db.execute(
+        update(SalesOrderHeader).where(
+            SalesOrderHeader.SalesOrderID == sales_order_id,
+            SalesOrderHeader.StockReservedAt.isnot(None),
+        ).values(StockReservedAt=None).execution_options(synchronize_session=False)
+    ).rowcount
+    if not released:
+        return False
+    rows = db.execute(
+        select(
+            SalesOrderStockReservation.ProductID, SalesOrderStockReservation.LocationID,
+            SalesOrderStockReservation.Quantity,
+        ).where(SalesOrderStockReservation.SalesOrderID == sales_order_id)
+        .order_by(SalesOrderStockReservation.ProductID, SalesOrderStockReservation.LocationID)
+    ).all()
+    now = datetime.now()
+    for row in rows:
+        db.execute(
+            update(ProductInventory).where(
+                ProductInventory.ProductID == row.ProductID,
+                ProductInventory.LocationID == row.LocationID,
+            ).values(Quantity=ProductInventory.Quantity + row.Quantity, ModifiedDate=now)
+            .execution_options(synchronize_session=False)
+        )
+    db.execute(
+        delete(SalesOrderStockReservation).where(SalesOrderStockReservation.SalesOrderID == sales_order_id)
+        .execution_options(synchronize_session=False)
+    )
+    return True
+
+
+# --- Checkout ---
+def _place_order(db: Session, user_id: int, address_id: int, voucher_code: Optional[str], note: Optional[str]) -> CheckoutResult:
+    cart = db.execute(
+        select(Cart.CartID).where(Cart.CustomerID == user_id, Cart.Status == "Active")
+    ).first()
+    items = db.execute(
+        select(CartItem.ProductID, CartItem.Quantity, CartItem.UnitPrice, CartItem.Subtotal, CartItem.TransactionType)
+        .where(CartItem.CartID == cart.CartID).order_by(CartItem.CartItemID)
+    ).all() if cart else []
+    if not items:
+        raise HTTPException(status_code=400, detail="Cart is empty")
+
+    address = db.execute(select(CustomerAdress.AddressID).where(
+        CustomerAdress.AddressID == address_id,
+        CustomerAdress.CustomerID == user_id
+    )).first()
+    if not address:
+        raise HTTPException(status_code=400, detail="Invalid address")
+
+    # Toàn bộ sản phẩm của giỏ trong 1 query
+    product_ids = {item.ProductID for item in items}
+    products = {
+        row.ProductID: row for row in db.execute(
+            select(Product.ProductID, Product.IsRentable).where(Product.ProductID.in_(product_ids))
+        )
+    }
+    missing = sorted(product_ids - products.keys())
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Products no longer available: {missing}")
+
+    buy_items = [item for item in items if (item.TransactionType or 'buy') == 'buy']
+    rent_items = [item for item in items if (item.TransactionType or 'buy') != 'buy']
+    not_rentable = sorted({item.ProductID for item in rent_items if not products[item.ProductID].IsRentable})
+    if not_rentable:
+        raise HTTPException(status_code=400, detail=f"Products not available for rent: {not_rentable}")
+
+    subtotal_buy = sum((item.Subtotal for item in buy_items), Decimal(0))
+    subtotal_rent = sum((item.Subtotal for item in rent_items), Decimal(0))
+
+    # Voucher
+    discount_buy = discount_rent = Decimal(0)
+    voucher = None
+    now = datetime.now()
+    if voucher_code:
+        voucher = db.execute(select(Voucher).where(
+            Voucher.Code == voucher_code,
+            Voucher.Status == True,
+            Voucher.StartDate <= now,
+            Voucher.EndDate >= now,
+            Voucher.Quantity > 0
+        )).scalars().first()
+        if not voucher:
+            raise HTTPException(status_code=400, detail="Invalid or expired voucher")
+        if subtotal_buy + subtotal_rent < (voucher.MinOrderAmount or 0):
+            raise HTTPException(status_code=400, detail=f"Order needs minimum {voucher.MinOrderAmount}")
+        used = db.execute(select(VoucherUsage.VoucherID).where(
+            VoucherUsage.VoucherID == voucher.VoucherID, VoucherUsage.CustomerID == user_id
+        )).first()
+        if used:
+            raise HTTPException(status_code=400, detail="Voucher already used")
+        discount_buy, discount_rent = apply_voucher(voucher, subtotal_buy, subtotal_rent)
+
+        reserved = db.execute(
+            update(Voucher).where(Voucher.VoucherID == voucher.VoucherID, Voucher.Quantity > 0)
+            .values(Quantity=Voucher.Quantity - 1).execution_options(synchronize_session=False)
+        ).rowcount
+        if not reserved:
+            raise HTTPException(status_code=409, detail="Voucher is out of stock")
+
+    # Giỏ hàng: chỉ 1 request checkout được chuyển giỏ sang Converted
+    converted = db.execute(
+        update(Cart).where(Cart.CartID == cart.CartID, Cart.Status == "Active")
+        .values(Status="Converted", IsCheckedOut=True, ModifiedDate=now)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not converted:
+        raise HTTPException(status_code=409, detail="Cart is already being checked out")
+
+    debits, short = reserve_stock(db, ((item.ProductID, item.Quantity) for item in buy_items))
+    if short:
+        raise HTTPException(status_code=409, detail=f"Insufficient stock for products: {short}")
+
+    result = CheckoutResult()
+    buy_header = rent_header = None
+
+    # --- A. Đơn Mua (SalesOrder) ---
+    if buy_items:
+        buy_header = SalesOrderHeader(
+            CustomerID=user_id,
+            OrderDate=now,
+            DueDate=now,
+            SalesOrderNumber=generate_order_number("SO"),
+            TotalDue=max(subtotal_buy - discount_buy, Decimal(0)),
+            Freight=0,
+            OrderStatus="Pending",
+            ModifiedDate=now,
+            StockReservedAt=now,
+            CancellationReason=note  # Lưu tạm note vào đây
+        )
+        db.add(buy_header)
+        db.flush()  # Để lấy SalesOrderID
+        db.execute(insert(SalesOrderDetail), [
+            {
+                "SalesOrderID": buy_header.SalesOrderID, "OrderQty": item.Quantity,
+                "ProductID": item.ProductID, "UnitPrice": item.UnitPrice, "ModifiedDate": now,
+            }
+            for item in buy_items
+        ])
+        db.execute(insert(SalesOrderStockReservation), [
+            {
+                "SalesOrderID": buy_header.SalesOrderID, "ProductID": debit.product_id,
+                "LocationID": debit.location_id, "Quantity": debit.quantity,
+            }
+            for debit in debits
+        ])
+
+    # --- B. Đơn Thuê (RentalOrder), AssetID do admin gán khi giao xe ---
+    if rent_items:
+        rent_header = RentalHeader(
+            CustomerID=user_id,
+            RentalDate=now,
+            DueDate=now,
+            RentalNumber=generate_order_number("RN"),
+            TotalDue=max(subtotal_rent - discount_rent, Decimal(0)),
+            Status=1,  # 1: Pending/Active
+            ModifiedDate=now
+        )
+        db.add(rent_header)
+        db.flush()
+        db.execute(insert(RentalDetail), [
+            {
+                "RentalID": rent_header.RentalID, "ProductID": item.ProductID, "OrderQty": item.Quantity,
+                "UnitPrice": item.UnitPrice, "ConditionDescription": "Initial Order",
+            }
+            for item in rent_items
+        ])
+
+    # --- C. Voucher usage (ưu tiên lưu ID đơn Mua) ---
+    if voucher:
+        db.add(VoucherUsage(
+            VoucherID=voucher.VoucherID,
+            CustomerID=user_id,
+            OrderID=buy_header.SalesOrderID if buy_header else rent_header.RentalID,
+            UsedDate=now
+        ))
+        db.flush()
+
+    # --- D. Rollup DailyRevenue (cuối transaction) ---
+    if buy_header:
+        record_order_revenue(db, buy_header.OrderDate, sales_revenue=buy_header.TotalDue, sales_count=1)
+        result.buy_order_id, result.buy_order_number = buy_header.SalesOrderID, buy_header.SalesOrderNumber
+        result.total_amount += buy_header.TotalDue
+    if rent_header:
+        record_order_revenue(db, rent_header.RentalDate, rental_revenue=rent_header.TotalDue, rental_count=1)
+        result.rent_order_id, result.rent_order_number = rent_header.RentalID, rent_header.RentalNumber
+        result.total_amount += rent_header.TotalDue
+
+    db.commit()
+
+    # Cập nhật read model total_sold (chỉ đơn Mua)
+    product_stats.record_sale((item.ProductID, item.Quantity) for item in buy_items)
+    return result
+
+
+def place_order(db: Session, user_id: int, address_id: int, voucher_code: Optional[str] = None,
+                note: Optional[str] = None) -> CheckoutResult:
+    """Checkout giỏ Active của user, chạy lại cả transaction khi bị chọn làm deadlock victim"""
+    for attempt in range(CHECKOUT_MAX_RETRIES + 1):
+        try:
+            return _place_order(db, user_id, address_id, voucher_code, note)
+        except HTTPException:
+            db.rollback()
+            raise
+        except DBAPIError as e:
+            db.rollback()
+            if not is_deadlock(e) or attempt == CHECKOUT_MAX_RETRIES:
+                raise
+            time.sleep(CHECKOUT_RETRY_BACKOFF * (2 ** attempt) * (1 + random.random()))
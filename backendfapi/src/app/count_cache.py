@@ -0,0 +1,165 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Optional, Tuple
+
+from sqlalchemy import Table, event, inspect, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+from sqlalchemy.orm import Query as SQLQuery
+from sqlalchemy.sql.util import find_tables
+
+# ==========================================
+# COUNT CACHE (tổng số dòng cho list endpoint phân trang)
+# ==========================================
+# Chuyển trang 3 -> 4 không cần COUNT(*) lại: cache theo câu COUNT đã compile (SQL + tham số = bộ filter).
+# - Hết hạn sau COUNT_CACHE_TTL giây
+# - Commit có ghi vào bảng nằm trong query (ORM flush / update() / delete() / insert()) -> tăng version bảng,
+#   các count của bảng đó bị bỏ qua ngay trong worker hiện tại (worker khác chờ hết TTL)
+# - estimate(): list không filter đọc row count từ metadata của SQL Server (sys.dm_db_partition_stats)
+#   thay vì scan, kết quả là ước lượng -> PaginationMeta.total_is_exact = False
+
+logger = logging.getLogger(__name__)
+
+COUNT_CACHE_TTL = int(os.getenv("COUNT_CACHE_TTL", "30"))
+COUNT_CACHE_SIZE = int(os.getenv("COUNT_CACHE_SIZE", "1024"))
+
+DIRTY_TABLES_KEY = "count_cache_dirty_tables"
+
+PARTITION_ROW_COUNT_SQL = text(
+    "SELECT SUM(row_count) FROM sys.dm_db_partition_stats "
+    "WHERE object_id = OBJECT_ID(:table_name) AND index_id IN (0, 1)"
+)
+
+
+def query_tables(query: SQLQuery) -> FrozenSet[str]:
+    """Tên các bảng mà query đọc (kể cả trong subquery / UNION)"""
+    elements = find_tables(query.statement, include_selects=True, include_joins=True, include_aliases=True)
+    return frozenset(t.fullname for t in elements if isinstance(t, Table))
+
+
+class CountCache:
+    def __init__(self, ttl: int = COUNT_CACHE_TTL, max_size: int = COUNT_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        # key -> (count, {table: version lúc đếm}, expires_at)
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[int, Dict[str, int], float]]" = OrderedDict()
+        self._versions: Dict[str, int] = {}
+        self._estimate_supported = True
+        self._lock = threading.Lock()
+
+    # --- Invalidation ---
+    def invalidate(self, tables=None):
+        """Bỏ các count đọc từ tables (None = toàn bộ)"""
+        with self._lock:
+            if tables is None:
+                self._entries.clear()
+                return
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+
+    def _snapshot(self, tables: FrozenSet[str]) -> Dict[str, int]:
+        return {table: self._versions.get(table, 0) for table in tables}
+
+    # --- Read ---
+    @staticmethod
+    def _key(query: SQLQuery) -> Tuple[str, str]:
+        compiled = query.statement.compile(dialect=query.session.get_bind().dialect)
+        return str(compiled), repr(sorted(compiled.params.items()))
+
+    def count(self, query: SQLQuery) -> int:
+        """query.count() có cache (bỏ ORDER BY để không ảnh hưởng key / subquery COUNT)"""
+        query = query.order_by(None)
+        if self.ttl <= 0:
+            return query.count()
+
+        key = self._key(query)
+        tables = query_tables(query)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                total, versions, expires_at = entry
+                if expires_at > now and versions == self._snapshot(tables):
+                    self._entries.move_to_end(key)
+                    return total
+            versions = self._snapshot(tables)
+
+        total = query.count()
+        with self._lock:
+            # Có commit chen vào trong lúc đếm -> không lưu kết quả có thể đã cũ
+            if versions == self._snapshot(tables):
+                self._entries[key] = (total, versions, now + self.ttl)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return total
+
+    def estimate(self, query: SQLQuery) -> Optional[int]:
+        """
+        Row count từ metadata khi query là 1 bảng không filter / group / distinct.
+        None nếu không ước lượng được (query có filter, DB không phải SQL Server, thiếu quyền VIEW DATABASE STATE)
+        """
+        if not self._estimate_supported:
+            return None
+        db = query.session
+        if db.get_bind().dialect.name != "mssql":
+            return None
+        statement = query.statement
+        if statement.whereclause is not None or statement._group_by_clauses or statement._distinct or statement._having_criteria:
+            return None
+        tables = query_tables(query)
+        if len(tables) != 1:
+            return None
+
+        table_name = next(iter(tables))
+        try:
+            total = db.execute(PARTITION_ROW_COUNT_SQL, {"table_name": table_name}).scalar()
+        except DBAPIError as e:
+            logger.warning("Row count estimate unavailable, falling back to COUNT(*): %s", e)
+            self._estimate_supported = False
+            return None
+        return int(total) if total is not None else None
+
+
+count_cache = CountCache()
+
+
+# --- Session hooks: ghi nhận bảng bị ghi trong transaction, invalidate khi commit ---
+# Rollback cả transaction thì bỏ danh sách (dữ liệu không đổi). Rollback savepoint vẫn giữ: invalidate thừa
+# chỉ tốn thêm 1 lần COUNT.
+def _mark_dirty(session: Session, tables):
+    session.info.setdefault(DIRTY_TABLES_KEY, set()).update(tables)
+
+
+@event.listens_for(Session, "after_flush")
+def _track_flush(session, flush_context):
+    tables = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        mapper = inspect(obj).mapper
+        tables.update(t.fullname for t in mapper.tables)
+    if tables:
+        _mark_dirty(session, tables)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_bulk_write(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, "table", None)
+        if isinstance(table, Table):
+            _mark_dirty(orm_execute_state.session, [table.fullname])
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_on_commit(session):
+    tables = session.info.pop(DIRTY_TABLES_KEY, None)
+    if tables:
+        count_cache.invalidate(tables)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_on_rollback(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop(DIRTY_TABLES_KEY, None)
@@ -1,8 +1,15 @@
 from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+import logging
+import os
 import urllib.parse
+import time
 import pyodbc
+from fastapi import Request
+
+from app.db_metrics import pool_options, install_pool_hooks, pool_metrics, route_label
 
 server = 'localhost\\SQLEXPRESS'
 database = 'final_project_getout'
@@ -20,40 +27,86 @@ params = urllib.parse.quote_plus(
 )
 
 SQLALCHEMY_DATABASE_URL = f"mssql+pyodbc:///?odbc_connect={params}"
+ASYNC_SQLALCHEMY_DATABASE_URL = f"mssql+aioodbc:///?odbc_connect={params}"
 
-# Configure engine with Unicode support for SQL Server
-# SQLAlchemy's String type maps to NVARCHAR for SQL Server, which supports Unicode
+# Pool size / overflow / recycle / timeout lấy từ env (xem app/db_metrics.py)
+# fast_executemany: pyodbc gửi cả mảng tham số trong 1 round-trip cho executemany (bulk import sản phẩm)
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, 
-    pool_pre_ping=True,
-    echo=False
+    echo=False,
+    fast_executemany=True,
+    **pool_options()
 )
+install_pool_hooks(engine)
+
+# ==========================================
+# TEXT ENCODING
+# ==========================================
+# Chọn 1 lần khi tạo engine (DB_TEXT_ENCODING):
+# - native (mặc định): giữ mặc định của pyodbc, str bind thành SQL_WCHAR (UTF-16LE) -> cột NVARCHAR lưu đúng
+#   tiếng Việt, đọc NVARCHAR decode UTF-16LE. Không tốn lệnh nào khi mở connection.
+# - utf8: cách cũ (setencoding UTF-8 ở mỗi connection mới), chỉ dùng khi DB dùng collation *_UTF8 cho VARCHAR.
+# Kiểm tra round-trip + đo tốc độ: python bench_encoding.py
+DB_TEXT_ENCODING = os.getenv("DB_TEXT_ENCODING", "native")
 
-# Event listener để set encoding UTF-8 cho mỗi connection
-@event.listens_for(engine, "connect")
 def set_utf8_encoding(dbapi_conn, connection_record):
-    """
-    Set UTF-8 encoding cho pyodbc connection.
-    PyODBC mặc định dùng UTF-16LE, nhưng SQL Server NVARCHAR hoạt động tốt với UTF-8.
-    Đã xóa hết dữ liệu cũ bị lỗi, bây giờ bật lại để dữ liệu mới được lưu đúng UTF-8.
-    """
+    """Chế độ utf8: PyODBC gửi / đọc text dạng UTF-8 thay vì UTF-16LE (engine sync và aioodbc)"""
     try:
-        # PyODBC: setencoding('utf-8') để dùng UTF-8 thay vì UTF-16LE mặc định
-        # Điều này đảm bảo string được encode/decode đúng với SQL Server NVARCHAR
-        dbapi_conn.setencoding('utf-8')
-        dbapi_conn.setdecoding(pyodbc.SQL_CHAR, encoding='utf-8')
-        dbapi_conn.setdecoding(pyodbc.SQL_WCHAR, encoding='utf-8')
+        # driver_connection: pyodbc.Connection (sync) hoặc aioodbc.Connection bọc pyodbc.Connection trong _conn
+        raw_conn = connection_record.driver_connection
+        raw_conn = getattr(raw_conn, "_conn", raw_conn)
+        raw_conn.setencoding('utf-8')
+        raw_conn.setdecoding(pyodbc.SQL_CHAR, encoding='utf-8')
+        raw_conn.setdecoding(pyodbc.SQL_WCHAR, encoding='utf-8')
     except Exception as e:
-        import logging
         logging.warning(f"Could not set UTF-8 encoding for database connection: {e}")
 
+if DB_TEXT_ENCODING == "utf8":
+    event.listen(engine, "connect", set_utf8_encoding)
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
-def get_db():
+def get_db(request: Request = None):
     db = SessionLocal()
+    started = time.perf_counter()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+        if request is not None:
+            pool_metrics.observe_session(route_label(request), (time.perf_counter() - started) * 1000)
+
+# ==========================================
+# ASYNC SESSION (aioodbc)
+# ==========================================
+# Handler async dùng AsyncSession để không block event loop khi chờ SQL Server.
+# Code truy vấn dùng chung (revenue, stock, ...) vẫn viết cho Session sync -> gọi qua await db.run_sync(fn, ...)
+# Engine tạo lazy ở request đầu tiên: app vẫn khởi động được khi môi trường chưa cài aioodbc.
+# Dùng cùng DB_TEXT_ENCODING với engine sync -> 2 engine đọc cùng 1 dòng text ra giống nhau.
+_async_engine = None
+_AsyncSessionLocal = None
+
+def get_async_engine():
+    global _async_engine, _AsyncSessionLocal
+    if _async_engine is None:
+        _async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, echo=False, **pool_options(async_engine=True))
+        install_pool_hooks(_async_engine.sync_engine)
+        if DB_TEXT_ENCODING == "utf8":
+            event.listen(_async_engine.sync_engine, "connect", set_utf8_encoding)
+        _AsyncSessionLocal = async_sessionmaker(_async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+    return _async_engine
+
+def AsyncSessionLocal() -> AsyncSession:
+    get_async_engine()
+    return _AsyncSessionLocal()
+
+async def get_async_db(request: Request = None):
+    started = time.perf_counter()
+    try:
+        async with AsyncSessionLocal() as db:
+            yield db
+    finally:
+        if request is not None:
+            pool_metrics.observe_session(route_label(request), (time.perf_counter() - started) * 1000)
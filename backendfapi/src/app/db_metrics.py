@@ -0,0 +1,184 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Optional
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+# ==========================================
+# CONNECTION POOL CONFIG + METRICS
+# ==========================================
+# Mỗi worker uvicorn có pool riêng: số connection tối đa / worker = DB_POOL_SIZE + DB_MAX_OVERFLOW,
+# tổng connection tới SQL Server = số worker x con số đó.
+# Thay pool_pre_ping (SELECT 1 ở mọi lần checkout) bằng ping chỉ khi connection đã rảnh > DB_POOL_PING_IDLE giây.
+# PoolMetrics: số connection đang checkout, histogram thời gian chờ lấy connection, số lần phải dùng overflow /
+# timeout và thời gian giữ session theo route -> /admin/metrics.
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # < timeout idle của SQL Server / firewall
+DB_POOL_PING_IDLE = int(os.getenv("DB_POOL_PING_IDLE", "60"))
+
+# Biên trên (ms) của các bucket histogram, bucket cuối = +Inf
+LATENCY_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class Histogram:
+    def __init__(self, bounds=LATENCY_BUCKETS_MS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, ms: float):
+        self.counts[bisect_left(self.bounds, ms)] += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def snapshot(self) -> dict:
+        count = sum(self.counts)
+        labels = [f"<={b}" for b in self.bounds] + [f">{self.bounds[-1]}"]
+        return {
+            "count": count,
+            "avg_ms": round(self.total / count, 2) if count else 0.0,
+            "max_ms": round(self.max, 2),
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+class PoolMetrics:
+    def __init__(self):
+        self.wait = Histogram()
+        self.overflow_checkouts = 0
+        self.timeouts = 0
+        self.invalidated = 0
+        self.peak_checked_out = 0
+        self._routes: Dict[str, Histogram] = {}
+        self._pools: List = []
+        self._lock = threading.Lock()
+
+    def track(self, pool):
+        self._pools.append(pool)
+
+    def observe_checkout(self, pool, wait_ms: float):
+        with self._lock:
+            self.wait.observe(wait_ms)
+            checked_out = pool.checkedout()
+            self.peak_checked_out = max(self.peak_checked_out, checked_out)
+            if checked_out > pool.size():
+                self.overflow_checkouts += 1
+
+    def observe_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def observe_invalidated(self):
+        with self._lock:
+            self.invalidated += 1
+
+    def observe_session(self, route: str, hold_ms: float):
+        with self._lock:
+            self._routes.setdefault(route, Histogram()).observe(hold_ms)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            pools = [
+                {
+                    "pool": type(pool).__name__,
+                    "size": pool.size(),
+                    "max_overflow": pool._max_overflow,
+                    "checked_out": pool.checkedout(),
+                    "idle": pool.checkedin(),
+                    "overflow": max(0, pool.overflow()),
+                }
+                for pool in self._pools
+            ]
+            routes = {route: h.snapshot() for route, h in sorted(self._routes.items())}
+            return {
+                "pools": pools,
+                "peak_checked_out": self.peak_checked_out,
+                "overflow_checkouts": self.overflow_checkouts,
+                "timeouts": self.timeouts,
+                "invalidated_connections": self.invalidated,
+                "checkout_wait": self.wait.snapshot(),
+                "session_hold_by_route": routes,
+            }
+
+    def reset(self):
+        with self._lock:
+            self.wait = Histogram()
+            self.overflow_checkouts = self.timeouts = self.invalidated = 0
+            self.peak_checked_out = 0
+            self._routes = {}
+
+
+pool_metrics = PoolMetrics()
+
+
+class MeteredPoolMixin:
+    """Đo thời gian chờ lấy connection ở _do_get (chờ queue khi pool đã hết connection rảnh)"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            pool_metrics.observe_timeout()
+            raise
+        pool_metrics.observe_checkout(self, (time.perf_counter() - started) * 1000)
+        return connection
+
+
+class MeteredQueuePool(MeteredPoolMixin, QueuePool):
+    pass
+
+
+class MeteredAsyncPool(MeteredPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def pool_options(async_engine: bool = False) -> dict:
+    """Tham số create_engine / create_async_engine dùng chung"""
+    return {
+        "poolclass": MeteredAsyncPool if async_engine else MeteredQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+    }
+
+
+def install_pool_hooks(engine):
+    """Ping connection rảnh lâu khi checkout + đăng ký pool vào metrics (engine sync hoặc async.sync_engine)"""
+    pool_metrics.track(engine.pool)
+
+    @event.listens_for(engine, "checkin")
+    def mark_idle(dbapi_conn, connection_record):
+        connection_record.info["idle_since"] = time.monotonic()
+
+    @event.listens_for(engine, "checkout")
+    def ping_if_idle(dbapi_conn, connection_record, connection_proxy):
+        idle_since: Optional[float] = connection_record.info.get("idle_since")
+        if idle_since is None or time.monotonic() - idle_since < DB_POOL_PING_IDLE:
+            return
+        cursor = dbapi_conn.cursor()
+        try:
+            cursor.execute("SELECT 1")
+        except Exception:
+            # Pool bỏ connection này và thử lấy connection khác
+            pool_metrics.observe_invalidated()
+            raise exc.DisconnectionError()
+        finally:
+            try:
+                cursor.close()
+            except Exception:
+                pass
+
+
+def route_label(request) -> str:
+    """Path template của route (/admin/products/{product_id}) thay vì URL thật để không nổ số nhãn"""
+    route = request.scope.get("route")
+    return f"{request.method} {getattr(route, 'path', request.url.path)}"
@@ -0,0 +1,116 @@
+import csv
+import io
+import os
+import zlib
+from datetime import date
+from typing import Iterable, Iterator, Literal, Optional, Type, Union, get_args, get_origin
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from app.json_response import render_json
+
+# ==========================================
+# STREAMING EXPORT (CSV / NDJSON)
+# ==========================================
+# Endpoint export truyền vào generator trả từng schema item (cùng schema với API danh sách), đọc DB theo lô
+# EXPORT_BATCH_SIZE dòng (yield_per) -> bộ nhớ không phụ thuộc số dòng.
+# - ndjson: mỗi dòng 1 object JSON giống hệt item của API danh sách
+# - csv: object lồng nhau được làm phẳng thành cột "prices.list_price", có BOM để Excel đọc đúng tiếng Việt.
+#   Header lấy theo schema item (không theo dòng đầu) -> export rỗng vẫn có dòng tên cột, object con None để trống
+# Client gửi Accept-Encoding: gzip -> nén trong lúc stream (Content-Encoding: gzip).
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+EXPORT_CHUNK_BYTES = 64 * 1024  # Gom dòng thành chunk ~64KB trước khi gửi
+
+ExportFormat = Literal["csv", "ndjson"]
+
+MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def flatten(data: dict, prefix: str = "") -> dict:
+    """{"prices": {"list_price": 1}} -> {"prices.list_price": 1}"""
+    flat = {}
+    for key, value in data.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{name}."))
+        else:
+            flat[name] = value
+    return flat
+
+
+def nested_model(annotation) -> Optional[Type[BaseModel]]:
+    """ProductPrices / Optional[CustomerStats] -> class schema con, kiểu khác -> None"""
+    if get_origin(annotation) is Union:
+        models = [nested_model(arg) for arg in get_args(annotation) if arg is not type(None)]
+        return models[0] if len(models) == 1 else None
+    return annotation if isinstance(annotation, type) and issubclass(annotation, BaseModel) else None
+
+
+def schema_columns(schema: Type[BaseModel], prefix: str = "") -> list:
+    """Tên cột CSV theo schema (alias, cùng thứ tự khai báo), schema con làm phẳng như flatten()"""
+    columns = []
+    for name, field in schema.model_fields.items():
+        column = f"{prefix}{field.serialization_alias or field.alias or name}"
+        child = nested_model(field.annotation)
+        if child is None:
+            columns.append(column)
+        else:
+            columns.extend(schema_columns(child, f"{column}."))
+    return columns
+
+
+def encode_csv(items: Iterable[BaseModel], schema: Type[BaseModel]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    buffer.write("\ufeff")
+    writer = csv.DictWriter(buffer, fieldnames=schema_columns(schema), extrasaction="ignore", restval="")
+    writer.writeheader()
+    for item in items:
+        writer.writerow(flatten(item.model_dump(mode="json", by_alias=True)))
+        if buffer.tell() >= EXPORT_CHUNK_BYTES:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+
+def encode_ndjson(items: Iterable[BaseModel]) -> Iterator[bytes]:
+    lines, size = [], 0
+    for item in items:
+        line = render_json(item)
+        lines.append(line)
+        size += len(line) + 1
+        if size >= EXPORT_CHUNK_BYTES:
+            yield b"\n".join(lines) + b"\n"
+            lines, size = [], 0
+    if lines:
+        yield b"\n".join(lines) + b"\n"
+
+
+def gzip_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 = định dạng gzip
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_response(
+    items: Iterator[BaseModel], schema: Type[BaseModel], format: ExportFormat, name: str, request: Request
+) -> StreamingResponse:
+    """StreamingResponse cho generator items kiểu schema (generator tự mở / đóng session DB của nó)"""
+    chunks = encode_csv(items, schema) if format == "csv" else encode_ndjson(items)
+    headers = {
+        "Content-Disposition": f'attachment; filename="{name}-{date.today():%Y%m%d}.{format}"',
+        "Vary": "Accept-Encoding",
+    }
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        chunks = gzip_chunks(chunks)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(chunks, media_type=MEDIA_TYPES[format], headers=headers)
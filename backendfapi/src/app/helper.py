@@ -1,51 +1,53 @@
-from math import ceil
-from typing import Type, TypeVar, List, Any, Optional, Generic, TypeVar
+from math import ceil, isfinite
+from typing import Type, TypeVar, List, Any, Optional, Generic, TypeVar, Callable, Literal, Tuple, Annotated
 from sqlalchemy.orm import Query as SQLQuery
-from pydantic import BaseModel
+from sqlalchemy import and_, or_
+from pydantic import BaseModel, AfterValidator
+from fastapi import HTTPException, Query
+from dataclasses import dataclass
+from datetime import datetime, date
+import base64
 import hashlib
+import json
+import unicodedata
 import uuid
 from decimal import Decimal
 
+from app.count_cache import count_cache
+
 T = TypeVar('T')
 
 # ==========================================
 # UTF-8 Encoding Helper
 # ==========================================
+# str của Python đã là Unicode, pyodbc bind thẳng thành NVARCHAR (UTF-16) -> không encode/decode lại từng giá trị.
+# Chỉ kiểm tra 1 lần ở biên nhận dữ liệu (request body, file import) qua kiểu CleanStr.
+
+def validate_text(value: Optional[str]) -> Optional[str]:
+    """
+    Kiểm tra text đầu vào: loại surrogate lẻ (không lưu được vào NVARCHAR) và chuẩn hóa NFC
+    (tiếng Việt gõ từ macOS/iOS có thể ở dạng NFD -> so sánh / tìm kiếm không khớp).
+    Chuỗi ASCII đi thẳng, không tốn thêm bản sao nào.
+    """
+    if value is None or value.isascii():
+        return value
+    try:
+        value.encode("utf-8")
+    except UnicodeEncodeError:
+        raise ValueError("Text contains invalid Unicode characters")
+    return value if unicodedata.is_normalized("NFC", value) else unicodedata.normalize("NFC", value)
+
+CleanStr = Annotated[str, AfterValidator(validate_text)]
 
 def ensure_utf8_string(text: Optional[str]) -> Optional[str]:
     """
-    Đảm bảo string được encode đúng UTF-8 trước khi lưu vào database.
-    Nếu string đã là unicode string, giữ nguyên.
-    Nếu string là bytes, decode về UTF-8.
+    Giữ cho code cũ: str trả về nguyên vẹn (đã là Unicode), bytes decode UTF-8.
+    Dữ liệu mới nên đi qua CleanStr / validate_text ở biên nhận dữ liệu thay vì gọi hàm này trước mỗi lần ghi.
     """
-    if text is None:
-        return None
-    
-    # Nếu đã là string, đảm bảo nó là unicode string
-    if isinstance(text, str):
-        # Đảm bảo string là unicode (không phải bytes đã được decode sai)
-        try:
-            # Nếu string có thể encode/decode lại UTF-8, nó đã đúng
-            text.encode('utf-8').decode('utf-8')
-            return text
-        except (UnicodeEncodeError, UnicodeDecodeError):
-            # Nếu có lỗi, thử decode lại từ latin-1 (thường là encoding mặc định khi lỗi)
-            try:
-                return text.encode('latin-1').decode('utf-8')
-            except:
-                return text
-    
-    # Nếu là bytes, decode về UTF-8
+    if text is None or isinstance(text, str):
+        return text
     if isinstance(text, bytes):
-        try:
-            return text.decode('utf-8')
-        except UnicodeDecodeError:
-            # Thử decode từ latin-1 rồi encode lại UTF-8
-            try:
-                return text.decode('latin-1').encode('utf-8').decode('utf-8')
-            except:
-                return text.decode('utf-8', errors='replace')
-    
+        return text.decode('utf-8', errors='replace')
     return str(text)
 
 # ==========================================
@@ -57,10 +59,15 @@ class SortOrder(str):
     DESC = "desc"
 
 class PaginationMeta(BaseModel):
-    total_items: int
-    total_pages: int
-    current_page: int
+    # Chế độ page: luôn có đủ total_items / total_pages / current_page.
+    # Chế độ cursor: current_page = None, total = None nếu client không yêu cầu (total=deferred)
+    total_items: Optional[int] = None
+    total_pages: Optional[int] = None
+    total_is_exact: Optional[bool] = None  # False: total_items lấy từ row count metadata (total=estimate)
+    current_page: Optional[int] = None
     limit: int
+    next_cursor: Optional[str] = None  # Keyset pagination: truyền lại qua query ?cursor=... để lấy trang kế
+    prev_cursor: Optional[str] = None
 
 class PagedResponse(BaseModel, Generic[T]):
     """Wrapper chuẩn cho danh sách có phân trang"""
@@ -90,7 +97,7 @@ def paginate(
     """
     Hàm chuẩn hóa phân trang cho SQLAlchemy Query
     """
-    total_items = query.count()
+    total_items = count_cache.count(query)
     total_pages = ceil(total_items / limit) if limit > 0 else 0
     
     # Get items
@@ -102,6 +109,7 @@ def paginate(
     meta = PaginationMeta(
         total_items=total_items,
         total_pages=total_pages,
+        total_is_exact=True,
         current_page=page,
         limit=limit
     )
@@ -117,7 +125,8 @@ def manual_paginate(
     items: List[Any],
     total_items: int,
     page: int,
-    limit: int
+    limit: int,
+    next_cursor: Optional[str] = None
 ) -> PagedResponse:
     """
     Hàm phân trang cho các query phức tạp (như Union) hoặc List có sẵn
@@ -127,8 +136,10 @@ def manual_paginate(
     meta = PaginationMeta(
         total_items=total_items,
         total_pages=total_pages,
+        total_is_exact=True,
         current_page=page,
-        limit=limit
+        limit=limit,
+        next_cursor=next_cursor
     )
     
     return PagedResponse(
@@ -138,6 +149,178 @@ def manual_paginate(
         pagination=meta
     )
 
+# ==========================================
+# 2. KEYSET (CURSOR) PAGINATION
+# ==========================================
+# Cursor = base64(JSON) của giá trị sort key của dòng cuối trang -> client coi là chuỗi opaque.
+# Trang kế lọc bằng WHERE (key) < (cursor) thay vì OFFSET, nên trang sâu không chậm hơn trang đầu.
+
+def _cursor_default(value):
+    if isinstance(value, datetime):
+        return {"$dt": value.isoformat()}
+    if isinstance(value, date):
+        return {"$d": value.isoformat()}
+    if isinstance(value, Decimal):
+        return {"$dec": str(value)}
+    raise TypeError(f"Cannot encode {type(value)} in cursor")
+
+def _cursor_hook(obj: dict):
+    if "$dt" in obj:
+        return datetime.fromisoformat(obj["$dt"])
+    if "$d" in obj:
+        return date.fromisoformat(obj["$d"])
+    if "$dec" in obj:
+        return Decimal(obj["$dec"])
+    return obj
+
+def encode_cursor(values: List[Any]) -> str:
+    raw = json.dumps(values, default=_cursor_default, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+CURSOR_DIRECTIONS = ("next", "prev")
+
+def _cursor_value(column: Any, value: Any) -> Any:
+    """Giá trị cursor phải cùng kiểu với cột sort (int / datetime / Decimal / str...), sai kiểu -> None"""
+    try:
+        expected = column.type.python_type
+    except (AttributeError, NotImplementedError):
+        expected = None
+    if value is None or isinstance(value, (bool, list, dict)):
+        return None
+    if isinstance(value, (float, Decimal)) and not isfinite(value):  # NaN / Infinity
+        return None
+    if expected is Decimal or expected is float:
+        return value if isinstance(value, (int, float, Decimal)) else None
+    if expected is date:
+        return value if isinstance(value, date) and not isinstance(value, datetime) else None
+    if expected is not None:
+        return value if isinstance(value, expected) else None
+    return value if isinstance(value, (int, float, str, Decimal, date)) else None
+
+def decode_cursor(cursor: str, columns: List[Any]) -> Tuple[str, List[Any]]:
+    """Giải mã cursor -> (hướng 'next' / 'prev', giá trị sort key). Sai định dạng / sai kiểu so với columns -> 400"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        decoded = json.loads(raw, object_hook=_cursor_hook)
+    except (ValueError, TypeError, ArithmeticError):  # ArithmeticError: {"$dec": "abc"}
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+    if not isinstance(decoded, list) or len(decoded) != len(columns) + 1 or decoded[0] not in CURSOR_DIRECTIONS:
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+    direction, *raw_values = decoded
+    values = [_cursor_value(column, value) for column, value in zip(columns, raw_values)]
+    if any(value is None for value in values):
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+    return direction, values
+
+def keyset_condition(columns: List[Any], values: List[Any], descending: bool = True):
+    """
+    (c1, c2, ..., cn) < (v1, v2, ..., vn) theo thứ tự từ điển (> nếu ascending).
+    SQL Server không hỗ trợ so sánh row-value nên phải mở rộng thành OR của các AND.
+    """
+    clauses = []
+    for i, column in enumerate(columns):
+        prefix = [columns[j] == values[j] for j in range(i)]
+        compare = column < values[i] if descending else column > values[i]
+        clauses.append(and_(*prefix, compare))
+    return or_(*clauses)
+
+@dataclass
+class CursorParams:
+    """Query params chung để các list endpoint opt-in cursor pagination"""
+    paging: str = "page"
+    cursor: Optional[str] = None
+    total: str = "exact"
+
+    @property
+    def cursor_mode(self) -> bool:
+        return self.paging == "cursor" or self.cursor is not None
+
+    @property
+    def wants_total(self) -> bool:
+        # Chế độ page giữ nguyên contract cũ -> luôn có total
+        return not self.cursor_mode or self.total != "deferred"
+
+def count_total(query: SQLQuery, mode: str = "exact") -> Tuple[int, bool]:
+    """
+    Tổng số dòng của query -> (total, is_exact).
+    exact: COUNT có cache (count_cache). estimate: row count metadata nếu query không filter, ngược lại như exact.
+    """
+    if mode == "estimate":
+        estimated = count_cache.estimate(query)
+        if estimated is not None:
+            return estimated, False
+    return count_cache.count(query), True
+
+def cursor_params(
+    paging: Literal["page", "cursor"] = Query("page", description="cursor: phân trang keyset theo next_cursor/prev_cursor"),
+    cursor: Optional[str] = Query(None, description="next_cursor / prev_cursor của trang trước (bật chế độ cursor)"),
+    total: Literal["exact", "deferred", "estimate"] = Query(
+        "deferred",
+        description="exact = đếm tổng (COUNT có cache), estimate = ước lượng từ metadata khi không filter, deferred = bỏ qua (chỉ chế độ cursor)"
+    ),
+) -> CursorParams:
+    return CursorParams(paging=paging, cursor=cursor, total=total)
+
+def keyset_paginate(
+    query: SQLQuery,
+    sort_columns: List[Any],
+    page: int,
+    limit: int,
+    params: Optional[CursorParams] = None,
+    descending: bool = True,
+    key_of: Optional[Callable[[Any], List[Any]]] = None,
+) -> Tuple[List[Any], PaginationMeta]:
+    """
+    Phân trang theo sort key ổn định (cột cuối nên là PK).
+    - Chế độ page: COUNT + OFFSET như paginate() cũ, kèm next_cursor/prev_cursor để chuyển sang cursor bất kỳ lúc nào
+    - Chế độ cursor: WHERE key < cursor (hoặc > khi đi lùi), không OFFSET, COUNT chỉ khi total=exact/estimate
+    key_of(row) -> giá trị sort key của 1 dòng (mặc định getattr theo tên cột)
+    Trả về (rows, PaginationMeta)
+    """
+    params = params or CursorParams()
+    key_of = key_of or (lambda row: [getattr(row, column.key) for column in sort_columns])
+
+    forward, values = True, None
+    if params.cursor:
+        direction, values = decode_cursor(params.cursor, sort_columns)
+        forward = direction != "prev"
+
+    # Đi lùi: đảo chiều sort để lấy các dòng ngay trước cursor, sau đó đảo lại kết quả
+    order_desc = descending if forward else not descending
+    paged = query.order_by(*(column.desc() if order_desc else column.asc() for column in sort_columns))
+    if values is not None:
+        paged = paged.filter(keyset_condition(sort_columns, values, descending=order_desc))
+    elif not params.cursor_mode:
+        paged = paged.offset((page - 1) * limit)
+
+    # Lấy dư 1 dòng để biết còn trang tiếp theo (theo chiều đang đi) không
+    rows = paged.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if not forward:
+        rows.reverse()
+
+    has_next = has_more if forward else True
+    has_prev = (values is not None or (not params.cursor_mode and page > 1)) if forward else has_more
+    next_cursor = encode_cursor(["next", *key_of(rows[-1])]) if rows and has_next else None
+    prev_cursor = encode_cursor(["prev", *key_of(rows[0])]) if rows and has_prev else None
+
+    total_items, total_is_exact = count_total(query, params.total) if params.wants_total else (None, None)
+    meta = PaginationMeta(
+        total_items=total_items,
+        total_pages=(ceil(total_items / limit) if limit > 0 else 0) if total_items is not None else None,
+        total_is_exact=total_is_exact,
+        current_page=None if params.cursor_mode else page,
+        limit=limit,
+        next_cursor=next_cursor,
+        prev_cursor=prev_cursor
+    )
+    return rows, meta
+
+def paged_response(items: List[Any], meta: PaginationMeta) -> PagedResponse:
+    """Đóng gói kết quả keyset_paginate() (sau khi map sang schema)"""
+    return PagedResponse(status="success", code=200, data=items, pagination=meta)
+
 def success_response(data: Any = None, message: str = None) -> APIResponse:
     """Wrapper cho response đơn lẻ"""
     return APIResponse(
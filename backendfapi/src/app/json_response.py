@@ -0,0 +1,31 @@
+from typing import Any
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+
+# ==========================================
+# FAST JSON ENCODE (orjson / pydantic-core)
+# ==========================================
+# Route có response_model: FastAPI (>= 0.12x) đã tự validate rồi dump thẳng ra bytes bằng pydantic-core,
+# nên KHÔNG đặt default_response_class của app (response_class tùy chỉnh làm FastAPI quay về đường chậm
+# dump_python + render).
+# render_json dùng cho các chỗ tự encode body (response cache, export, stream NDJSON) thay cho
+# jsonable_encoder + json.dumps:
+# - Model pydantic: dump bằng serializer của chính model (by_alias, giống output response_model).
+# - Dict / list: orjson, kiểu orjson không tự xử lý được (Decimal, model lồng bên trong, ...) đi qua
+#   jsonable_encoder -> Decimal ra số như cũ, datetime / date / UUID / Enum orjson tự encode giống isoformat / str.
+# Output không giống hệt từng byte với json stdlib ở float dạng mũ: 1e16 / 1e-7 thay vì 1e+16 / 1e-07
+# (parse ra cùng giá trị), inf / nan ra null thay vì lỗi ValueError.
+# Không thêm đường bỏ qua validate response_model: model handler trả về đã là instance nên validate gần như
+# không tốn gì (~0.03 ms / 1000 dòng), còn dump model chưa parametrize (PagedResponse thay vì
+# PagedResponse[OrderListItem]) phải suy kiểu lúc chạy, chậm hơn dump theo response_model (python bench_json.py).
+
+
+def render_json(content: Any) -> bytes:
+    """Encode content ra JSON bytes (UTF-8, không escape ký tự non-ASCII, không khoảng trắng)"""
+    if isinstance(content, BaseModel):
+        return content.__pydantic_serializer__.to_json(content, by_alias=True)
+    return orjson.dumps(content, default=jsonable_encoder, option=orjson.OPT_NON_STR_KEYS)
+
+
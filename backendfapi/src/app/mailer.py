@@ -0,0 +1,246 @@
+import heapq
+import itertools
+import logging
+import os
+import queue
+import smtplib
+import ssl
+import threading
+import time
+from dataclasses import dataclass
+from email.message import EmailMessage
+from email.utils import formataddr
+from typing import List, Optional, Tuple
+
+from app.routes.auth.config import conf
+
+# ==========================================
+# OUTBOUND MAIL QUEUE
+# ==========================================
+# Trước đây mỗi email OTP là 1 BackgroundTask trong worker web, tạo FastMail mới -> mở 1 phiên SMTP mới
+# (kết nối + STARTTLS + LOGIN) cho từng mail. Giờ handler chỉ đưa mail vào hàng đợi (O(1)), 1 thread gửi mail
+# / worker uvicorn:
+# - Giữ kết nối SMTP mở giữa các mail, đóng khi rảnh quá MAIL_SMTP_IDLE giây (server tự ngắt thì kết nối lại)
+# - Lấy tối đa MAIL_BATCH_SIZE mail mỗi lượt, gửi liên tiếp trên cùng kết nối
+# - Lỗi tạm thời (mất kết nối, 4xx) -> gửi lại sau MAIL_RETRY_BACKOFF * 2^n giây, tối đa MAIL_MAX_RETRIES lần;
+#   lỗi 5xx / sai địa chỉ người nhận -> bỏ, ghi log
+# Hàng đợi nằm trong bộ nhớ: restart worker thì mất mail chưa gửi (OTP người dùng có thể yêu cầu gửi lại).
+# Test local: chạy smtp_sink.py rồi đặt MAIL_SINK=localhost:1025 (SMTP thường, không TLS / đăng nhập).
+
+MAIL_QUEUE_SIZE = int(os.getenv("MAIL_QUEUE_SIZE", "10000"))
+MAIL_BATCH_SIZE = int(os.getenv("MAIL_BATCH_SIZE", "20"))
+MAIL_MAX_RETRIES = int(os.getenv("MAIL_MAX_RETRIES", "5"))
+MAIL_RETRY_BACKOFF = float(os.getenv("MAIL_RETRY_BACKOFF", "2"))
+MAIL_SMTP_IDLE = float(os.getenv("MAIL_SMTP_IDLE", "30"))
+MAIL_SINK = os.getenv("MAIL_SINK")  # "host:port" -> gửi vào SMTP sink local thay vì conf
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class SmtpSettings:
+    host: str
+    port: int
+    starttls: bool
+    ssl_tls: bool
+    username: Optional[str]
+    password: Optional[str]
+    sender: str
+    timeout: float
+    validate_certs: bool = True
+
+    @classmethod
+    def from_env(cls) -> "SmtpSettings":
+        sender = formataddr((conf.MAIL_FROM_NAME or "", str(conf.MAIL_FROM)))
+        if MAIL_SINK:
+            host, _, port = MAIL_SINK.partition(":")
+            return cls(host or "localhost", int(port or 1025), False, False, None, None, sender, 10)
+        return cls(
+            host=conf.MAIL_SERVER, port=conf.MAIL_PORT, starttls=conf.MAIL_STARTTLS, ssl_tls=conf.MAIL_SSL_TLS,
+            username=conf.MAIL_USERNAME if conf.USE_CREDENTIALS else None,
+            password=conf.MAIL_PASSWORD.get_secret_value() if conf.USE_CREDENTIALS else None,
+            sender=sender, timeout=conf.TIMEOUT, validate_certs=conf.VALIDATE_CERTS,
+        )
+
+
+@dataclass
+class OutgoingMail:
+    to: str
+    subject: str
+    html: str
+    attempts: int = 0
+
+
+class SmtpConnection:
+    """1 kết nối SMTP dùng lại cho nhiều mail"""
+
+    def __init__(self, settings: SmtpSettings):
+        self.settings = settings
+        self._smtp: Optional[smtplib.SMTP] = None
+        self.last_used = 0.0
+        self.opened = 0  # Số lần mở kết nối (handshake TLS + LOGIN)
+
+    def _context(self):
+        context = ssl.create_default_context()
+        if not self.settings.validate_certs:
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        return context
+
+    def _open(self) -> smtplib.SMTP:
+        s = self.settings
+        if s.ssl_tls:
+            smtp = smtplib.SMTP_SSL(s.host, s.port, timeout=s.timeout, context=self._context())
+        else:
+            smtp = smtplib.SMTP(s.host, s.port, timeout=s.timeout)
+            if s.starttls:
+                smtp.starttls(context=self._context())
+        if s.username:
+            smtp.login(s.username, s.password)
+        self.opened += 1
+        return smtp
+
+    def send(self, message: EmailMessage):
+        if self._smtp is None:
+            self._smtp = self._open()
+        try:
+            self._smtp.send_message(message)
+        except (smtplib.SMTPServerDisconnected, smtplib.SMTPResponseException) as e:
+            # Server đã đóng kết nối đang giữ (idle timeout / 421 giới hạn số mail mỗi kết nối) -> mở lại, gửi lại 1 lần
+            if isinstance(e, smtplib.SMTPResponseException) and e.smtp_code != 421:
+                raise
+            self.close()
+            self._smtp = self._open()
+            self._smtp.send_message(message)
+        self.last_used = time.monotonic()
+
+    def close(self):
+        smtp, self._smtp = self._smtp, None
+        if smtp is not None:
+            try:
+                smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                smtp.close()
+
+    def close_if_idle(self, idle: float):
+        if self._smtp is not None and time.monotonic() - self.last_used > idle:
+            self.close()
+
+
+def is_permanent(error: Exception) -> bool:
+    """Lỗi không nên gửi lại: người nhận bị từ chối, lỗi 5xx, sai đăng nhập"""
+    if isinstance(error, (smtplib.SMTPRecipientsRefused, smtplib.SMTPAuthenticationError)):
+        return True
+    return isinstance(error, smtplib.SMTPResponseException) and 500 <= error.smtp_code < 600
+
+
+class MailQueue:
+    def __init__(self, max_size: int = MAIL_QUEUE_SIZE, batch_size: int = MAIL_BATCH_SIZE,
+                 max_retries: int = MAIL_MAX_RETRIES, backoff: float = MAIL_RETRY_BACKOFF):
+        self.batch_size = max(batch_size, 1)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self._queue: "queue.Queue[Optional[OutgoingMail]]" = queue.Queue(maxsize=max_size)
+        self._delayed: List[Tuple[float, int, OutgoingMail]] = []  # heap (gửi lại lúc, thứ tự, mail), chỉ thread gửi dùng
+        self._order = itertools.count()
+        self._settings: Optional[SmtpSettings] = None
+        self._connection: Optional[SmtpConnection] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    # --- Phía web (mọi thread) ---
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._settings = self._settings or SmtpSettings.from_env()
+            self._connection = SmtpConnection(self._settings)
+            self._thread = threading.Thread(target=self._run, name="mail-queue", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10):
+        """Gửi nốt mail đang chờ (tối đa timeout giây) rồi dừng thread (gọi khi tắt app)"""
+        thread = self._thread
+        if thread is None:
+            return
+        self._queue.put(None)
+        thread.join(timeout)
+        self._thread = None
+        logger.info("Mail queue stopped: %d sent, %d failed, %d retried", self.sent, self.failed, self.retried)
+
+    def enqueue(self, to: str, subject: str, html: str) -> bool:
+        """Đưa mail vào hàng đợi, False nếu hàng đợi đầy"""
+        self.start()
+        try:
+            self._queue.put_nowait(OutgoingMail(to, subject, html))
+            return True
+        except queue.Full:
+            logger.warning("Mail queue full (%d), dropping mail to %s", self._queue.maxsize, to)
+            return False
+
+    # --- Thread gửi mail ---
+    def _build(self, mail: OutgoingMail) -> EmailMessage:
+        message = EmailMessage()
+        message["Subject"] = mail.subject
+        message["From"] = self._settings.sender
+        message["To"] = mail.to
+        message.set_content(mail.html, subtype="html")
+        return message
+
+    def _next_batch(self, stopping: bool) -> Tuple[List[OutgoingMail], bool]:
+        """Mail tới hạn gửi lại + mail mới (chờ tối đa tới lần gửi lại gần nhất / MAIL_SMTP_IDLE)"""
+        batch = []
+        now = time.monotonic()
+        while self._delayed and self._delayed[0][0] <= now and len(batch) < self.batch_size:
+            batch.append(heapq.heappop(self._delayed)[2])
+
+        wait = min(self._delayed[0][0] - now, MAIL_SMTP_IDLE) if self._delayed else MAIL_SMTP_IDLE
+        block = not batch and not stopping
+        while len(batch) < self.batch_size:
+            try:
+                mail = self._queue.get(block=block, timeout=max(wait, 0) if block else None)
+            except queue.Empty:
+                break
+            block = False
+            if mail is None:
+                stopping = True
+                continue
+            batch.append(mail)
+        return batch, stopping
+
+    def _deliver(self, mail: OutgoingMail):
+        try:
+            self._connection.send(self._build(mail))
+            self.sent += 1
+        except Exception as e:
+            if not isinstance(e, (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused)):
+                self._connection.close()  # Lỗi kết nối -> lần sau mở kết nối mới
+            mail.attempts += 1
+            if is_permanent(e) or mail.attempts > self.max_retries:
+                self.failed += 1
+                logger.error("Mail to %s failed after %d attempt(s): %s", mail.to, mail.attempts, e)
+                return
+            self.retried += 1
+            retry_at = time.monotonic() + self.backoff * 2 ** (mail.attempts - 1)
+            heapq.heappush(self._delayed, (retry_at, next(self._order), mail))
+            logger.warning("Mail to %s failed (attempt %d), retrying: %s", mail.to, mail.attempts, e)
+
+    def _run(self):
+        stopping = False
+        while True:
+            batch, stopping = self._next_batch(stopping)
+            for mail in batch:
+                self._deliver(mail)
+            if stopping and not batch and self._queue.empty():
+                # Mail chờ gửi lại lúc tắt app bị bỏ
+                for _, _, mail in self._delayed:
+                    logger.error("Mail to %s dropped at shutdown after %d attempt(s)", mail.to, mail.attempts)
+                self._connection.close()
+                return
+            self._connection.close_if_idle(MAIL_SMTP_IDLE)
+
+
+mail_queue = MailQueue()
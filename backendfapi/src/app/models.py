@@ -242,6 +242,12 @@ class Cart(Base):
     Status = Column(String(20))
     IsCheckedOut = Column(Boolean, nullable=False)
 
+    # --- Snapshot tổng quan giỏ (app/cart_summary.py, add_cart_summary.sql) ---
+    LineCount = Column(Integer, nullable=False, default=0)     # Số dòng CartItem
+    ItemCount = Column(Integer, nullable=False, default=0)     # Tổng Quantity
+    BuySubtotal = Column(Numeric(21, 2), nullable=False, default=0)
+    RentSubtotal = Column(Numeric(21, 2), nullable=False, default=0)
+
     customer = relationship("Customer", back_populates="cart")
     items = relationship("CartItem", back_populates="cart")
 
@@ -284,6 +290,7 @@ class SalesOrderHeader(Base):
     OrderStatus = Column(String(20), nullable=False)
     CancellationRequestDate = Column(DateTime, nullable=True)
     CancellationReason = Column(String(500), nullable=True)
+    StockReservedAt = Column(DateTime, nullable=True)  # Đã trừ tồn kho lúc checkout (NULL: chưa giữ / đã hoàn)
 
     customer = relationship("Customer", back_populates="orders")
     details = relationship("SalesOrderDetail", back_populates="header")
@@ -293,7 +300,7 @@ class SalesOrderDetail(Base):
     __tablename__ = "SalesOrderDetail"
 
     SalesOrderID = Column(Integer, ForeignKey("SalesOrderHeader.SalesOrderID"), primary_key=True)
-    SalesOrderDetailID = Column(Integer, primary_key=True)
+    SalesOrderDetailID = Column(Integer, primary_key=True, autoincrement=True)  # IDENTITY
     OrderQty = Column(SmallInteger)
     ProductID = Column(Integer, ForeignKey("product.ProductID"), nullable=False)
     UnitPrice = Column(Numeric) # Money
@@ -303,6 +310,16 @@ class SalesOrderDetail(Base):
     product = relationship("Product", back_populates="sales_order_details")
 
 
+class SalesOrderStockReservation(Base):
+    """Tồn kho đã trừ lúc checkout theo từng kho -> hủy đơn hoàn đúng kho đã trừ"""
+    __tablename__ = "SalesOrderStockReservation"
+
+    SalesOrderID = Column(Integer, ForeignKey("SalesOrderHeader.SalesOrderID"), primary_key=True)
+    ProductID = Column(Integer, ForeignKey("product.ProductID"), primary_key=True)
+    LocationID = Column(SmallInteger, ForeignKey("Location.LocationID"), primary_key=True)
+    Quantity = Column(Integer, nullable=False)
+
+
 # --- KHUYẾN MÃI & NHÂN VIÊN ---
 
 class Voucher(Base):
@@ -364,6 +381,7 @@ class PendingRegistration(Base):
     LastName = Column(String(50))
     OTP = Column(String(6), nullable=False)
     CreatedAt = Column(DateTime, default=datetime.utcnow)
+    ExpiresAt = Column(DateTime, index=True)  # UTC, xem app/otp_store.py
 
 class PasswordResetToken(Base):
     __tablename__ = "PasswordResetToken"
@@ -372,6 +390,7 @@ class PasswordResetToken(Base):
     Email = Column(String(100), unique=True, index=True, nullable=False)
     OTP = Column(String(6), nullable=False)
     CreatedAt = Column(DateTime, default=datetime.utcnow)
+    ExpiresAt = Column(DateTime, index=True)  # UTC, xem app/otp_store.py
     IsUsed = Column(Boolean, default=False, nullable=False)
 
 class RentalHeader(Base):
@@ -427,4 +446,15 @@ class FAQ(Base):
     Answer = Column(String, nullable=False)
     Keywords = Column(String, nullable=True) # Lưu chuỗi "a,b,c"
     IsActive = Column(Boolean, default=True)
-    ModifiedDate = Column(DateTime, default=datetime.now)
\ No newline at end of file
+    ModifiedDate = Column(DateTime, default=datetime.now)
+
+class DailyRevenue(Base):
+    """Rollup doanh thu theo ngày (cập nhật tăng dần khi checkout, xem app/revenue.py)"""
+    __tablename__ = "DailyRevenue"
+
+    RevenueDate = Column(Date, primary_key=True)
+    SalesRevenue = Column(Numeric(19, 4), nullable=False, default=0)
+    SalesCount = Column(Integer, nullable=False, default=0)
+    RentalRevenue = Column(Numeric(19, 4), nullable=False, default=0)
+    RentalCount = Column(Integer, nullable=False, default=0)
+    ModifiedDate = Column(DateTime, default=datetime.now)
@@ -0,0 +1,290 @@
+import heapq
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from app.models import PasswordResetToken, PendingRegistration
+
+# ==========================================
+# OTP / PENDING STATE STORE (TTL)
+# ==========================================
+# Đăng ký chờ xác thực (register -> verify_registration) và OTP quên mật khẩu (forgot_password -> reset_password)
+# là bản ghi có hạn OTP_TTL giây, tra theo (loại, email):
+# - Bản ghi mang sẵn ExpiresAt (có index), hết hạn thì coi như không còn hiệu lực dù chưa bị xóa
+# - Thread dọn dẹp mỗi OTP_SWEEP_INTERVAL giây xóa bản ghi hết hạn theo lô OTP_SWEEP_BATCH dòng
+#   (mỗi lô 1 transaction ngắn) -> bảng không phình theo số lần đăng ký / quên mật khẩu bỏ dở
+# - OTP đã dùng bị xóa luôn (trước đây PasswordResetToken chỉ đánh dấu IsUsed và giữ lại mãi)
+# OTP_STORE chọn backend:
+#   db     (mặc định) bảng PendingRegistration / PasswordResetToken trên SQL Server (xem add_otp_expiry.sql)
+#   memory dict trong process, chỉ đúng khi chạy 1 worker uvicorn (dev)
+#   sqlite file SQLite dùng chung cho các worker trên cùng máy (OTP_STORE_PATH), thay cho store chia sẻ kiểu Redis
+# Với backend db, thao tác đi chung transaction của request (handler commit). Backend khác ghi ngay.
+
+OTP_TTL = int(os.getenv("OTP_TTL", "300"))  # 5 phút, khớp nội dung email OTP
+OTP_STORE = os.getenv("OTP_STORE", "db").lower()
+OTP_STORE_PATH = os.getenv("OTP_STORE_PATH", os.path.join(tempfile.gettempdir(), "bikego_otp.sqlite3"))
+OTP_SWEEP_INTERVAL = int(os.getenv("OTP_SWEEP_INTERVAL", "60"))
+OTP_SWEEP_BATCH = int(os.getenv("OTP_SWEEP_BATCH", "500"))
+
+REGISTRATION = "registration"
+PASSWORD_RESET = "password_reset"
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class OtpRecord:
+    kind: str
+    email: str
+    otp: str
+    expires_at: datetime  # UTC
+    data: Dict[str, Optional[str]] = field(default_factory=dict)
+
+    def expired(self, now: Optional[datetime] = None) -> bool:
+        return self.expires_at <= (now or datetime.utcnow())
+
+
+def _expiry(ttl: int) -> Tuple[datetime, datetime]:
+    now = datetime.utcnow()
+    return now, now + timedelta(seconds=ttl)
+
+
+# ==========================================
+# BACKEND: SQL SERVER (mặc định)
+# ==========================================
+@dataclass(frozen=True)
+class _DbKind:
+    model: type
+    columns: Dict[str, str]  # key trong OtpRecord.data -> tên cột
+
+
+DB_KINDS = {
+    REGISTRATION: _DbKind(PendingRegistration, {
+        "phone": "Phone", "first_name": "FirstName", "last_name": "LastName", "password_hash": "PasswordHash",
+    }),
+    PASSWORD_RESET: _DbKind(PasswordResetToken, {}),
+}
+
+
+class DbOtpStore:
+    def __init__(self, ttl: int = OTP_TTL):
+        self.ttl = ttl
+
+    def _row(self, db: Session, kind: str, email: str):
+        model = DB_KINDS[kind].model
+        return db.execute(select(model).where(model.Email == email)).scalars().first()
+
+    def put(self, db: Session, kind: str, email: str, otp: str, data: Optional[dict] = None):
+        spec = DB_KINDS[kind]
+        created_at, expires_at = _expiry(self.ttl)
+        row = self._row(db, kind, email)
+        if row is None:
+            row = spec.model(Email=email)
+            db.add(row)
+        row.OTP = otp
+        row.CreatedAt = created_at
+        row.ExpiresAt = expires_at
+        if kind == PASSWORD_RESET:
+            row.IsUsed = False
+        for key, column in spec.columns.items():
+            setattr(row, column, (data or {}).get(key))
+
+    def get(self, db: Session, kind: str, email: str) -> Optional[OtpRecord]:
+        row = self._row(db, kind, email)
+        if row is None or getattr(row, "IsUsed", False):
+            return None
+        # Dòng tạo trước khi có cột ExpiresAt -> tính từ CreatedAt
+        expires_at = row.ExpiresAt or (row.CreatedAt + timedelta(seconds=self.ttl))
+        data = {key: getattr(row, column) for key, column in DB_KINDS[kind].columns.items()}
+        return OtpRecord(kind, row.Email, row.OTP, expires_at, data)
+
+    def delete(self, db: Session, kind: str, email: str):
+        model = DB_KINDS[kind].model
+        db.execute(delete(model).where(model.Email == email).execution_options(synchronize_session=False))
+
+    def sweep(self, db: Session, batch_size: int = OTP_SWEEP_BATCH) -> int:
+        now = datetime.utcnow()
+        removed = 0
+        for spec in DB_KINDS.values():
+            model = spec.model
+            stale = model.ExpiresAt < now
+            if model is PasswordResetToken:
+                stale = stale | (model.IsUsed == True)  # Dòng đã dùng từ trước khi có store
+            while True:
+                ids = select(model.Id).where(stale).limit(batch_size)
+                deleted = db.execute(
+                    delete(model).where(model.Id.in_(ids)).execution_options(synchronize_session=False)
+                ).rowcount
+                db.commit()
+                removed += deleted
+                if deleted < batch_size:
+                    break
+        return removed
+
+
+# ==========================================
+# BACKEND: MEMORY (1 process)
+# ==========================================
+class MemoryOtpStore:
+    def __init__(self, ttl: int = OTP_TTL):
+        self.ttl = ttl
+        self._records: Dict[Tuple[str, str], OtpRecord] = {}
+        self._expiry_heap: List[Tuple[datetime, str, str]] = []  # (hết hạn lúc, kind, email) -> sweep không quét cả dict
+        self._lock = threading.Lock()
+
+    def put(self, db, kind: str, email: str, otp: str, data: Optional[dict] = None):
+        _, expires_at = _expiry(self.ttl)
+        with self._lock:
+            self._records[(kind, email)] = OtpRecord(kind, email, otp, expires_at, dict(data or {}))
+            heapq.heappush(self._expiry_heap, (expires_at, kind, email))
+
+    def get(self, db, kind: str, email: str) -> Optional[OtpRecord]:
+        with self._lock:
+            return self._records.get((kind, email))
+
+    def delete(self, db, kind: str, email: str):
+        with self._lock:
+            self._records.pop((kind, email), None)
+
+    def sweep(self, db=None, batch_size: int = OTP_SWEEP_BATCH) -> int:
+        now = datetime.utcnow()
+        removed = 0
+        with self._lock:
+            while self._expiry_heap and self._expiry_heap[0][0] <= now:
+                expires_at, kind, email = heapq.heappop(self._expiry_heap)
+                record = self._records.get((kind, email))
+                # Bản ghi đã được put lại (hạn mới) thì entry heap này đã cũ
+                if record is not None and record.expires_at == expires_at:
+                    del self._records[(kind, email)]
+                    removed += 1
+        return removed
+
+
+# ==========================================
+# BACKEND: SQLITE FILE (nhiều worker / 1 máy)
+# ==========================================
+class SqliteOtpStore:
+    def __init__(self, path: str = OTP_STORE_PATH, ttl: int = OTP_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._run("PRAGMA journal_mode=WAL")
+        self._run(
+            "CREATE TABLE IF NOT EXISTS otp_record ("
+            " kind TEXT NOT NULL, email TEXT NOT NULL, otp TEXT NOT NULL, data TEXT NOT NULL,"
+            " expires_at TEXT NOT NULL, PRIMARY KEY (kind, email))"
+        )
+        self._run("CREATE INDEX IF NOT EXISTS ix_otp_record_expires_at ON otp_record (expires_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=5)
+
+    def _run(self, sql: str, params: tuple = ()):
+        conn = self._connect()
+        try:
+            with conn:
+                return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    def put(self, db, kind: str, email: str, otp: str, data: Optional[dict] = None):
+        _, expires_at = _expiry(self.ttl)
+        self._run(
+            "INSERT INTO otp_record (kind, email, otp, data, expires_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (kind, email) DO UPDATE SET otp = excluded.otp, data = excluded.data, "
+            "expires_at = excluded.expires_at",
+            (kind, email, otp, json.dumps(data or {}), expires_at.isoformat()),
+        )
+
+    def get(self, db, kind: str, email: str) -> Optional[OtpRecord]:
+        rows = self._run(
+            "SELECT otp, data, expires_at FROM otp_record WHERE kind = ? AND email = ?", (kind, email)
+        )
+        if not rows:
+            return None
+        otp, data, expires_at = rows[0]
+        return OtpRecord(kind, email, otp, datetime.fromisoformat(expires_at), json.loads(data))
+
+    def delete(self, db, kind: str, email: str):
+        self._run("DELETE FROM otp_record WHERE kind = ? AND email = ?", (kind, email))
+
+    def sweep(self, db=None, batch_size: int = OTP_SWEEP_BATCH) -> int:
+        now = datetime.utcnow().isoformat()
+        removed = 0
+        while True:
+            conn = self._connect()
+            try:
+                with conn:
+                    deleted = conn.execute(
+                        "DELETE FROM otp_record WHERE rowid IN "
+                        "(SELECT rowid FROM otp_record WHERE expires_at <= ? LIMIT ?)", (now, batch_size)
+                    ).rowcount
+            finally:
+                conn.close()
+            removed += deleted
+            if deleted < batch_size:
+                return removed
+
+
+def create_otp_store():
+    if OTP_STORE == "memory":
+        return MemoryOtpStore()
+    if OTP_STORE == "sqlite":
+        return SqliteOtpStore()
+    return DbOtpStore()
+
+
+otp_store = create_otp_store()
+
+
+# ==========================================
+# SWEEPER
+# ==========================================
+class OtpSweeper:
+    """Thread nền gọi otp_store.sweep định kỳ (gọi start / stop trong lifespan)"""
+
+    def __init__(self, interval: int = OTP_SWEEP_INTERVAL):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def sweep_once(self) -> int:
+        from app.database import SessionLocal
+
+        db = SessionLocal() if isinstance(otp_store, DbOtpStore) else None
+        try:
+            return otp_store.sweep(db)
+        finally:
+            if db is not None:
+                db.close()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                removed = self.sweep_once()
+                if removed:
+                    logger.info("OTP sweeper removed %d expired record(s)", removed)
+            except Exception as e:
+                logger.warning("OTP sweep failed: %s", e)
+
+    def start(self):
+        if self.interval <= 0 or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="otp-sweeper", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+
+otp_sweeper = OtpSweeper()
@@ -0,0 +1,181 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import anyio.from_thread
+import anyio.to_thread
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+from passlib.hash import argon2
+
+from app.db_metrics import Histogram
+
+# ==========================================
+# PASSWORD HASHING POOL (argon2)
+# ==========================================
+# argon2 tốn ~0.1-0.3s CPU + 64MB RAM mỗi lần hash / verify, đăng nhập dồn dập (nhân viên đầu giờ, khuyến mãi)
+# trước đây chiếm hết threadpool / làm đứng cả worker -> chuyển sang process pool riêng:
+# - PASSWORD_HASH_WORKERS process / worker uvicorn (0 = chạy trong threadpool như cũ, VD máy 1 CPU)
+# - Tối đa PASSWORD_HASH_CONCURRENCY job chạy cùng lúc, request khác chờ ở semaphore (đo thời gian chờ = queue time)
+# - Quá PASSWORD_HASH_MAX_QUEUE request đang chờ -> 503 ngay thay vì để hàng đợi dài vô hạn
+# Process con dùng "spawn" trên mọi OS (như Windows, không fork process đang có thread / connection DB),
+# job gửi sang là hàm của passlib.hash.argon2 (pickle được), process sống suốt vòng đời worker.
+# Số liệu (queue time, run time, số job đang chạy / chờ, số lần từ chối) -> /admin/metrics.
+
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_CONCURRENCY = int(os.getenv("PASSWORD_HASH_CONCURRENCY", str(max(PASSWORD_HASH_WORKERS, 1))))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "512"))
+
+# Chỉ dùng scheme argon2 mặc định (không tùy chỉnh tham số) -> hash / verify của handler argon2 gốc tương đương
+# pwd_context, và handler gốc pickle được để gửi sang process con (handler của CryptContext thì không)
+pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
+
+
+class HashMetrics:
+    def __init__(self):
+        self.queue_wait = Histogram()
+        self.run = Histogram()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.waiting = 0
+        self.peak_waiting = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def enter_queue(self):
+        with self._lock:
+            self.waiting += 1
+            self.peak_waiting = max(self.peak_waiting, self.waiting)
+
+    def start(self, wait_ms: float):
+        with self._lock:
+            self.waiting -= 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            self.queue_wait.observe(wait_ms)
+
+    def finish(self, run_ms: float):
+        with self._lock:
+            self.in_flight -= 1
+            self.run.observe(run_ms)
+
+    def leave_queue(self):
+        """Request bị hủy khi đang chờ semaphore"""
+        with self._lock:
+            self.waiting -= 1
+
+    def observe_rejected(self):
+        with self._lock:
+            self.rejected += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "peak_in_flight": self.peak_in_flight,
+                "peak_waiting": self.peak_waiting,
+                "rejected": self.rejected,
+                "queue_wait": self.queue_wait.snapshot(),
+                "run": self.run.snapshot(),
+            }
+
+    def reset(self):
+        with self._lock:
+            self.queue_wait = Histogram()
+            self.run = Histogram()
+            self.peak_in_flight = self.in_flight
+            self.peak_waiting = self.waiting
+            self.rejected = 0
+
+
+class PasswordHasher:
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, concurrency: int = PASSWORD_HASH_CONCURRENCY,
+                 max_queue: int = PASSWORD_HASH_MAX_QUEUE):
+        self.workers = workers
+        self.concurrency = max(concurrency, 1)
+        self.max_queue = max_queue
+        self.metrics = HashMetrics()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Tạo process pool và khởi động sẵn các process con (gọi trong lifespan)"""
+        if self.workers <= 0:
+            return
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+                executor = self._executor
+            else:
+                return
+        # spawn process con theo nhu cầu -> gửi job rỗng để login đầu tiên không phải chờ khởi động process
+        for future in [executor.submit(argon2.identify, "") for _ in range(self.workers)]:
+            future.result()
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _run(self, fn, *args):
+        if self.metrics.waiting >= self.max_queue:
+            self.metrics.observe_rejected()
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Hệ thống đang bận, vui lòng thử lại sau",
+            )
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        if self.workers > 0 and self._executor is None:
+            await anyio.to_thread.run_sync(self.start)  # Chưa chạy lifespan (script / test)
+
+        queued = time.perf_counter()
+        self.metrics.enter_queue()
+        try:
+            await self._semaphore.acquire()
+        except BaseException:
+            self.metrics.leave_queue()
+            raise
+        started = time.perf_counter()
+        self.metrics.start((started - queued) * 1000)
+        try:
+            if self.workers > 0:
+                return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+            return await anyio.to_thread.run_sync(fn, *args)
+        finally:
+            self._semaphore.release()
+            self.metrics.finish((time.perf_counter() - started) * 1000)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(argon2.hash, password)
+
+    async def verify(self, password: str, hashed: str) -> Optional[bool]:
+        """True / False, None nếu hash không phải định dạng argon2 (VD hash SHA256 cũ)"""
+        if not hashed or pwd_context.identify(hashed, required=False) is None:
+            return None
+        return await self._run(argon2.verify, password, hashed)
+
+    def snapshot(self) -> dict:
+        return {
+            "workers": self.workers, "concurrency": self.concurrency, "max_queue": self.max_queue,
+            **self.metrics.snapshot(),
+        }
+
+    def hash_blocking(self, password: str) -> str:
+        """Cho code sync: handler def (worker thread của anyio) đi qua pool, ngoài event loop (script, startup) hash trực tiếp"""
+        try:
+            return anyio.from_thread.run(self.hash, password)
+        except RuntimeError:  # Không ở trong worker thread của anyio (NoEventLoopError)
+            return pwd_context.hash(password)
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,47 @@
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import select, desc
+from sqlalchemy.orm import Session
+
+from app.models import ProductImage
+
+# ==========================================
+# PRODUCT THUMBNAIL RESOLVER
+# ==========================================
+# Quy tắc chung cho store + admin: ảnh IsPrimary (ImageID nhỏ nhất) -> không có thì ảnh bất kỳ (ImageID nhỏ nhất).
+
+# SQL Server giới hạn 2100 tham số / câu lệnh
+ID_CHUNK_SIZE = 2000
+
+
+def pick_thumbnail(images: Iterable[ProductImage]) -> Optional[str]:
+    """Áp dụng quy tắc trên cho danh sách ảnh đã load sẵn (vd: p.images)"""
+    best = None
+    for img in images:
+        key = (not img.IsPrimary, img.ImageID)
+        if best is None or key < best[0]:
+            best = (key, img.ImageURL)
+    return best[1] if best else None
+
+
+def get_thumbnails(db: Session, product_ids: Optional[Iterable[int]] = None) -> Dict[int, str]:
+    """ProductID -> thumbnail URL, 1 query cho cả danh sách (None = mọi sản phẩm)"""
+    def fetch(ids=None):
+        query = select(ProductImage.ProductID, ProductImage.ImageURL).order_by(
+            ProductImage.ProductID, desc(ProductImage.IsPrimary), ProductImage.ImageID
+        )
+        if ids is not None:
+            query = query.where(ProductImage.ProductID.in_(ids))
+        for product_id, url in db.execute(query):
+            # Dòng đầu tiên của mỗi sản phẩm là ảnh ưu tiên nhất
+            thumbnails.setdefault(product_id, url)
+
+    thumbnails: Dict[int, str] = {}
+    if product_ids is None:
+        fetch()
+        return thumbnails
+
+    ids = list(dict.fromkeys(product_ids))
+    for start in range(0, len(ids), ID_CHUNK_SIZE):
+        fetch(ids[start:start + ID_CHUNK_SIZE])
+    return thumbnails
@@ -0,0 +1,332 @@
+import csv
+import io
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Literal, Optional, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from app.models import Product, ProductImage, ProductInventory, ProductSubcategory
+from app.stock import MAINTENANCE_LOCATION_ID
+from app.product_stats import product_stats
+from app.catalog_index import catalog_index
+from app.search_engine import product_search
+from app.response_cache import response_cache, product_tag, CATALOG_TAG, FEATURED_TAG
+from app.routes.admin.config import ProductCreateUpdate
+
+# ==========================================
+# BULK PRODUCT IMPORT
+# ==========================================
+# Nạp catalog nhà cung cấp (CSV / JSON / NDJSON) theo lô IMPORT_CHUNK_SIZE dòng, khóa theo ProductNumber:
+# 1. Validate từng dòng bằng ProductCreateUpdate (cùng schema POST /admin/products) + độ dài cột + subcategory
+#    tồn tại + ProductNumber trùng trong file -> lỗi theo từng dòng, dòng hỏng không chặn cả lô.
+# 2. Mỗi lô: 1 SELECT tìm ProductID theo ProductNumber, INSERT / UPDATE Product, ProductInventory (kho chính +
+#    kho bảo trì) và ProductImage bằng executemany (engine bật fast_executemany), commit theo lô.
+#    Lỗi DB -> rollback riêng lô đó, các dòng của lô được báo lỗi.
+# Dữ liệu ghi giống create_product / update_product: sản phẩm mới chỉ tạo kho bảo trì khi có hàng,
+# sản phẩm đã có thì ghi đè tồn kho 2 kho và thay toàn bộ ảnh (ảnh đầu tiên là ảnh chính).
+# IMPORT_CHUNK_SIZE giữ < 2000: SQL Server giới hạn 2100 tham số / câu lệnh (IN (...) theo lô).
+
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "1000"))
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))  # Số lỗi tối đa giữ trong báo cáo
+
+MAIN_LOCATION_ID = 1
+IMAGE_SEPARATOR = "|"  # Cột images trong CSV: url1|url2|...
+
+ImportFormat = Literal["csv", "json"]
+
+# Field của schema -> cột String có giới hạn độ dài trong DB
+LENGTH_LIMITS = {
+    "name": Product.Name,
+    "product_number": Product.ProductNumber,
+    "attributes.color": Product.Color,
+    "attributes.size": Product.Size,
+    "attributes.condition": Product.Condition,
+    "attributes.frame_material": Product.FrameMaterial,
+    "attributes.wheel_size": Product.WheelSize,
+}
+
+
+@dataclass
+class ImportReport:
+    total: int = 0
+    created: int = 0
+    updated: int = 0
+    failed: int = 0
+    errors: List[dict] = field(default_factory=list)
+    started: float = field(default_factory=time.perf_counter)
+
+    def add_error(self, row: int, product_number: Optional[str], errors: List[str]):
+        self.failed += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append({"row": row, "product_number": product_number, "errors": errors})
+
+    def progress(self) -> dict:
+        return {
+            "processed": self.total,
+            "created": self.created,
+            "updated": self.updated,
+            "failed": self.failed,
+            "elapsed_s": round(time.perf_counter() - self.started, 2),
+        }
+
+
+# --- Đọc file ---
+def unflatten(row: Dict[str, Any], groups: Iterable[str] = ()) -> dict:
+    """
+    {"attributes.color": "Red"} -> {"attributes": {"color": "Red"}}, ô trống bị bỏ để dùng giá trị mặc định.
+    groups: object lồng nhau luôn có mặt (kể cả khi mọi ô đều trống) để lỗi báo đúng field con
+    """
+    nested: dict = {group: {} for group in groups}
+    for key, value in row.items():
+        if key is None or value is None or value == "":
+            continue
+        target = nested
+        *parents, leaf = key.strip().split(".")
+        for parent in parents:
+            target = target.setdefault(parent, {})
+        target[leaf] = value
+    if isinstance(nested.get("images"), str):
+        nested["images"] = [url.strip() for url in nested["images"].split(IMAGE_SEPARATOR) if url.strip()]
+    nested.setdefault("images", [])
+    return nested
+
+
+def read_rows(data: bytes, format: ImportFormat) -> Iterator[Tuple[int, dict]]:
+    """(số dòng, dict) — CSV: số dòng trong file (header = 1), JSON / NDJSON: thứ tự object bắt đầu từ 1"""
+    text = data.decode("utf-8-sig")
+    if format == "csv":
+        reader = csv.DictReader(io.StringIO(text))
+        groups = {name.split(".")[0].strip() for name in reader.fieldnames or () if "." in name}
+        for row in reader:
+            yield reader.line_num, unflatten(row, groups)
+    elif text.lstrip().startswith("["):
+        for index, item in enumerate(json.loads(text), start=1):
+            yield index, item
+    else:
+        index = 0
+        for line in text.splitlines():
+            if line.strip():
+                index += 1
+                yield index, json.loads(line)
+
+
+def chunked(rows: Iterable, size: int) -> Iterator[list]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# --- Import ---
+class ProductImporter:
+    def __init__(self, db: Session, dry_run: bool = False, chunk_size: int = IMPORT_CHUNK_SIZE):
+        self.db = db
+        self.dry_run = dry_run
+        self.chunk_size = chunk_size
+        self.report = ImportReport()
+        self.subcategory_ids = set(db.scalars(select(ProductSubcategory.ProductSubcategoryID)))
+        self.seen_numbers = set()
+        self.touched_ids: List[int] = []
+
+    def run(self, rows: Iterable[Tuple[int, Any]]) -> Iterator[dict]:
+        """Chạy từng lô, yield progress sau mỗi lô"""
+        for chunk in chunked(rows, self.chunk_size):
+            valid = self.validate(chunk)
+            if valid and not self.dry_run:
+                self.write(valid)
+            yield self.report.progress()
+
+    def validate(self, chunk) -> List[Tuple[int, ProductCreateUpdate]]:
+        valid = []
+        for row_no, raw in chunk:
+            self.report.total += 1
+            number = raw.get("product_number") if isinstance(raw, dict) else None
+            try:
+                payload = ProductCreateUpdate.model_validate(raw)
+            except ValidationError as e:
+                self.report.add_error(row_no, number, [
+                    f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" for err in e.errors(include_url=False)
+                ])
+                continue
+
+            errors = []
+            for path, column in LENGTH_LIMITS.items():
+                value = payload
+                for part in path.split("."):
+                    value = getattr(value, part)
+                if value is not None and len(value) > column.type.length:
+                    errors.append(f"{path}: at most {column.type.length} characters")
+            if payload.subcategory_id not in self.subcategory_ids:
+                errors.append(f"subcategory_id: {payload.subcategory_id} does not exist")
+            if payload.product_number in self.seen_numbers:
+                errors.append("product_number: duplicated in file")
+            if errors:
+                self.report.add_error(row_no, payload.product_number, errors)
+                continue
+
+            self.seen_numbers.add(payload.product_number)
+            valid.append((row_no, payload))
+        return valid
+
+    def write(self, valid: List[Tuple[int, ProductCreateUpdate]]):
+        db = self.db
+        try:
+            numbers = [payload.product_number for _, payload in valid]
+            existing = dict(db.execute(
+                select(Product.ProductNumber, Product.ProductID).where(Product.ProductNumber.in_(numbers))
+            ).all())
+            now = datetime.now()
+
+            new_rows = [payload for _, payload in valid if payload.product_number not in existing]
+            old_rows = [payload for _, payload in valid if payload.product_number in existing]
+            if new_rows:
+                db.execute(insert(Product), [
+                    {
+                        **product_columns(payload),
+                        "Description": payload.description,
+                        "RentalPeriodUnit": "day",
+                        "SellStartDate": now,
+                        "ModifiedDate": now,
+                        "FinishedGoodsFlag": True,
+                        "DaysToManufacture": 0,
+                    }
+                    for payload in new_rows
+                ])
+                created = dict(db.execute(
+                    select(Product.ProductNumber, Product.ProductID)
+                    .where(Product.ProductNumber.in_([payload.product_number for payload in new_rows]))
+                ).all())
+            else:
+                created = {}
+            if old_rows:
+                db.execute(update(Product), [
+                    {
+                        "ProductID": existing[payload.product_number],
+                        **product_columns(payload),
+                        # Không có mô tả mới thì giữ mô tả cũ (như update_product)
+                        **({"Description": payload.description} if payload.description else {}),
+                        "ModifiedDate": now,
+                    }
+                    for payload in old_rows
+                ])
+
+            self.write_inventory(created, existing, valid, now)
+            self.write_images({**created, **existing}, valid)
+            db.commit()
+        except SQLAlchemyError as e:
+            db.rollback()
+            message = str(getattr(e, "orig", None) or e).splitlines()[0]
+            for row_no, payload in valid:
+                self.report.add_error(row_no, payload.product_number, [f"database: {message}"])
+            return
+
+        self.report.created += len(created)
+        self.report.updated += len(old_rows)
+        self.touched_ids.extend(created.values())
+        self.touched_ids.extend(existing.values())
+
+    def write_inventory(self, created: Dict[str, int], existing: Dict[str, int], valid, now: datetime):
+        """Kho chính = tổng - bảo trì, kho bảo trì = số bảo trì. 1 SELECT + UPDATE / INSERT executemany"""
+        wanted = {}
+        for _, payload in valid:
+            stock = payload.stock_details
+            maint_qty = stock.maintenance_stock
+            if payload.product_number in created:
+                product_id = created[payload.product_number]
+                wanted[(product_id, MAIN_LOCATION_ID)] = max(0, stock.total_stock - maint_qty)
+                if maint_qty > 0:
+                    wanted[(product_id, MAINTENANCE_LOCATION_ID)] = maint_qty
+            else:
+                product_id = existing[payload.product_number]
+                wanted[(product_id, MAIN_LOCATION_ID)] = max(0, stock.total_stock - maint_qty)
+                wanted[(product_id, MAINTENANCE_LOCATION_ID)] = maint_qty
+
+        present = set()
+        if existing:
+            present = set(self.db.execute(
+                select(ProductInventory.ProductID, ProductInventory.LocationID).where(
+                    ProductInventory.ProductID.in_(list(existing.values())),
+                    ProductInventory.LocationID.in_([MAIN_LOCATION_ID, MAINTENANCE_LOCATION_ID]),
+                )
+            ).all())
+
+        updates = [
+            {"ProductID": pid, "LocationID": loc, "Quantity": qty, "ModifiedDate": now}
+            for (pid, loc), qty in wanted.items() if (pid, loc) in present
+        ]
+        inserts = [
+            {
+                "ProductID": pid, "LocationID": loc, "Quantity": qty, "ModifiedDate": now,
+                "Shelf": "M" if loc == MAINTENANCE_LOCATION_ID else "A", "Bin": "1",
+            }
+            for (pid, loc), qty in wanted.items() if (pid, loc) not in present
+        ]
+        if updates:
+            self.db.execute(update(ProductInventory), updates)
+        if inserts:
+            self.db.execute(insert(ProductInventory), inserts)
+
+    def write_images(self, product_ids: Dict[str, int], valid):
+        """Thay toàn bộ ảnh của các sản phẩm trong lô (ảnh đầu tiên là ảnh chính)"""
+        self.db.execute(delete(ProductImage).where(ProductImage.ProductID.in_(list(product_ids.values()))))
+        images = [
+            {"ProductID": product_ids[payload.product_number], "ImageURL": url, "IsPrimary": idx == 0}
+            for _, payload in valid
+            for idx, url in enumerate(payload.images)
+        ]
+        if images:
+            self.db.execute(insert(ProductImage), images)
+
+    def refresh_read_models(self):
+        """Nạp lại snapshot / index 1 lần thay vì refresh từng sản phẩm như create / update lẻ"""
+        product_stats.reload(self.db)
+        catalog_index.load(self.db)
+        product_search.load(self.db)
+        response_cache.invalidate(FEATURED_TAG, CATALOG_TAG, *(product_tag(pid) for pid in self.touched_ids))
+
+
+def product_columns(payload: ProductCreateUpdate) -> dict:
+    """Các cột Product lấy từ payload (giống create_product / update_product)"""
+    return {
+        "Name": payload.name,
+        "ProductNumber": payload.product_number,
+        "ProductSubcategoryID": payload.subcategory_id,
+        "ListPrice": payload.list_price,
+        "StandardCost": payload.standard_cost,
+        "SafetyStockLevel": payload.safety_stock_level,
+        "ReorderPoint": payload.reorder_point,
+        "Color": payload.attributes.color,
+        "Size": payload.attributes.size,
+        "Condition": payload.attributes.condition,
+        "FrameMaterial": payload.attributes.frame_material,
+        "WheelSize": payload.attributes.wheel_size,
+        "IsRentable": payload.rental_config.is_rentable,
+        "SecurityDeposit": payload.rental_config.security_deposit,
+        "RentPrice": payload.rent_price,
+    }
+
+
+def import_products(db: Session, data: bytes, format: ImportFormat, dry_run: bool = False,
+                    chunk_size: int = IMPORT_CHUNK_SIZE) -> Iterator[dict]:
+    """Yield {"event": "progress", ...} sau mỗi lô, cuối cùng {"event": "done", ..., "errors": [...]}"""
+    importer = ProductImporter(db, dry_run=dry_run, chunk_size=chunk_size)
+    try:
+        for progress in importer.run(read_rows(data, format)):
+            yield {"event": "progress", **progress}
+    except (ValueError, csv.Error) as e:
+        # File hỏng (JSON sai cú pháp, CSV lỗi) giữa chừng: các lô trước đã commit vẫn giữ
+        importer.report.add_error(importer.report.total + 1, None, [f"file: {e}"])
+    if importer.touched_ids:
+        importer.refresh_read_models()
+    yield {"event": "done", "dry_run": dry_run, **importer.report.progress(), "errors": importer.report.errors}
@@ -0,0 +1,158 @@
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+
+from app.models import SalesOrderDetail, ProductReview
+from app.product_images import get_thumbnails
+
+# ==========================================
+# PRODUCT STATS READ MODEL
+# ==========================================
+# Snapshot trong process: ProductID -> (total_sold, avg_rating, review_count, primary_image_url).
+# - Nạp 1 lần bằng 3 query GROUP BY, sau đó cập nhật tăng dần khi checkout / ghi review / đổi ảnh.
+# - Mỗi worker uvicorn giữ snapshot riêng, nên reload toàn bộ sau PRODUCT_STATS_TTL giây
+#   để sửa sai lệch do ghi từ worker khác.
+
+PRODUCT_STATS_TTL = int(os.getenv("PRODUCT_STATS_TTL", "600"))
+
+
+@dataclass
+class ProductStats:
+    total_sold: int = 0
+    review_count: int = 0
+    rating_sum: int = 0
+    rating_count: int = 0  # AVG() của SQL bỏ qua Rating NULL
+    primary_image_url: Optional[str] = None
+
+    @property
+    def avg_rating(self) -> float:
+        return self.rating_sum / self.rating_count if self.rating_count else 0.0
+
+
+EMPTY_STATS = ProductStats()
+
+
+class ProductStatsStore:
+    def __init__(self, ttl: int = PRODUCT_STATS_TTL):
+        self.ttl = ttl
+        self._stats: Dict[int, ProductStats] = {}
+        self._loaded_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()  # Chỉ 1 request reload khi hết TTL
+
+    # --- Load ---
+    def reload(self, db: Session) -> Dict[int, ProductStats]:
+        """Tính lại toàn bộ snapshot (chỉ chạy lúc khởi tạo hoặc hết TTL)"""
+        stats: Dict[int, ProductStats] = {}
+
+        def entry(product_id: int) -> ProductStats:
+            if product_id not in stats:
+                stats[product_id] = ProductStats()
+            return stats[product_id]
+
+        sales = db.execute(
+            select(SalesOrderDetail.ProductID, func.sum(SalesOrderDetail.OrderQty))
+            .group_by(SalesOrderDetail.ProductID)
+        ).all()
+        for product_id, total_sold in sales:
+            entry(product_id).total_sold = int(total_sold or 0)
+
+        ratings = db.execute(
+            select(
+                ProductReview.ProductID,
+                func.count(ProductReview.ProductReviewID),
+                func.sum(ProductReview.Rating),
+                func.count(ProductReview.Rating),
+            ).group_by(ProductReview.ProductID)
+        ).all()
+        for product_id, review_count, rating_sum, rating_count in ratings:
+            s = entry(product_id)
+            s.review_count = int(review_count or 0)
+            s.rating_sum = int(rating_sum or 0)
+            s.rating_count = int(rating_count or 0)
+
+        # Ảnh đại diện theo quy tắc chung (primary -> fallback ảnh bất kỳ)
+        for product_id, url in get_thumbnails(db).items():
+            entry(product_id).primary_image_url = url
+
+        with self._lock:
+            self._stats = stats
+            self._loaded_at = time.monotonic()
+        return stats
+
+    def _stale(self) -> bool:
+        loaded_at = self._loaded_at
+        return loaded_at is None or time.monotonic() - loaded_at > self.ttl
+
+    def ensure_loaded(self, db: Session) -> "ProductStatsStore":
+        if not self._stale():
+            return self
+        # Đã có snapshot (chỉ hết hạn) -> request khác đang reload thì dùng tạm snapshot cũ, không chờ
+        blocking = self._loaded_at is None
+        if not self._reload_lock.acquire(blocking=blocking):
+            return self
+        try:
+            if self._stale():  # Request trước có thể vừa reload xong
+                self.reload(db)
+        finally:
+            self._reload_lock.release()
+        return self
+
+    def invalidate(self):
+        """Buộc reload ở lần đọc kế tiếp"""
+        self._loaded_at = None
+
+    # --- Read ---
+    def get(self, product_id: int) -> ProductStats:
+        return self._stats.get(product_id, EMPTY_STATS)
+
+    def top_selling(self, limit: int) -> List[int]:
+        """ProductID có total_sold > 0, giảm dần theo total_sold"""
+        with self._lock:
+            items = list(self._stats.items())  # record_sale / _entry thêm key từ thread khác
+        ranked = sorted(
+            ((pid, s.total_sold) for pid, s in items if s.total_sold > 0),
+            key=lambda x: x[1], reverse=True
+        )
+        return [pid for pid, _ in ranked[:limit]]
+
+    def sort_by_total_sold(self, product_ids: Iterable[int]) -> List[int]:
+        return sorted(product_ids, key=lambda pid: self.get(pid).total_sold, reverse=True)
+
+    # --- Incremental updates (gọi sau khi commit thành công) ---
+    def _entry(self, product_id: int) -> ProductStats:
+        s = self._stats.get(product_id)
+        if s is None:
+            s = ProductStats()
+            self._stats[product_id] = s
+        return s
+
+    def record_sale(self, items: Iterable[Tuple[int, int]]):
+        """items: (ProductID, OrderQty) của các dòng SalesOrderDetail vừa tạo"""
+        with self._lock:
+            for product_id, qty in items:
+                self._entry(product_id).total_sold += int(qty or 0)
+
+    def record_review(self, product_id: int, rating: Optional[int]):
+        with self._lock:
+            s = self._entry(product_id)
+            s.review_count += 1
+            if rating is not None:
+                s.rating_sum += int(rating)
+                s.rating_count += 1
+
+    def set_primary_image(self, product_id: int, url: Optional[str]):
+        with self._lock:
+            self._entry(product_id).primary_image_url = url
+
+    def remove_product(self, product_id: int):
+        with self._lock:
+            self._stats.pop(product_id, None)
+
+
+product_stats = ProductStatsStore()
@@ -0,0 +1,273 @@
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from fastapi import Request, Response
+from fastapi.concurrency import run_in_threadpool
+
+from app.json_response import render_json
+
+# ==========================================
+# RESPONSE CACHE (GET công khai của storefront / chatbot)
+# ==========================================
+# - Key = path + query string đã sắp xếp, value = body JSON đã encode + ETag
+# - ETag / If-None-Match -> 304 không body (client luôn revalidate: Cache-Control no-cache)
+# - Invalidate theo tag: mỗi tag có 1 version, entry lưu version của các tag lúc ghi,
+#   admin ghi -> tăng version tag -> mọi entry mang tag đó hết hiệu lực ngay (không cần quét key)
+# - Backend: LRU trong process (mặc định) hoặc backend dùng chung giữa các worker (RESPONSE_CACHE_REDIS_URL),
+#   bất kỳ client nào có get / set(ex=) / incr / mget đều dùng được (redis-py, fakeredis, ...)
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "60"))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "512"))
+RESPONSE_CACHE_REDIS_URL = os.getenv("RESPONSE_CACHE_REDIS_URL")
+# Invalidate lỗi (backend dùng chung mất kết nối) -> trong RESPONSE_CACHE_TTL giây sau đó entry mới chỉ sống chừng này
+RESPONSE_CACHE_FALLBACK_TTL = int(os.getenv("RESPONSE_CACHE_FALLBACK_TTL", "5"))
+
+# --- Tags ---
+CATALOG_TAG = "catalog"    # Danh sách phụ thuộc tập sản phẩm / danh mục (categories, similar)
+FEATURED_TAG = "featured"
+FAQS_TAG = "faqs"
+
+
+def product_tag(product_id: int) -> str:
+    return f"product:{product_id}"
+
+
+def reviews_tag(product_id: int) -> str:
+    return f"reviews:{product_id}"
+
+
+@dataclass
+class CachedResponse:
+    body: bytes
+    etag: str
+    tags: Dict[str, int] = field(default_factory=dict)  # tag -> version lúc ghi
+
+    def dumps(self) -> bytes:
+        return json.dumps({"body": self.body.decode("utf-8"), "etag": self.etag, "tags": self.tags}).encode("utf-8")
+
+    @classmethod
+    def loads(cls, raw: bytes) -> "CachedResponse":
+        data = json.loads(raw)
+        return cls(body=data["body"].encode("utf-8"), etag=data["etag"], tags=data["tags"])
+
+
+# --- Backends ---
+class MemoryBackend:
+    """LRU + TTL trong process"""
+
+    def __init__(self, max_size: int = RESPONSE_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (value, expires_at)
+        self._counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value, ttl: int):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def get_counters(self, keys: List[str]) -> List[int]:
+        with self._lock:
+            return [self._counters.get(key, 0) for key in keys]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SharedBackend:
+    """Backend dùng chung giữa các worker qua client kiểu Redis (value được serialize thành bytes)"""
+
+    prefix = "response_cache:"
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, key: str):
+        raw = self.client.get(self.prefix + key)
+        return CachedResponse.loads(raw) if raw is not None else None
+
+    def set(self, key: str, value: CachedResponse, ttl: int):
+        self.client.set(self.prefix + key, value.dumps(), ex=ttl)
+
+    def incr(self, key: str) -> int:
+        return int(self.client.incr(self.prefix + key))
+
+    def get_counters(self, keys: List[str]) -> List[int]:
+        if not keys:
+            return []
+        return [int(v or 0) for v in self.client.mget([self.prefix + key for key in keys])]
+
+    def clear(self):
+        # Entry tự hết hạn theo TTL, không quét keyspace dùng chung
+        pass
+
+
+def build_backend():
+    if RESPONSE_CACHE_REDIS_URL:
+        try:
+            import redis
+            return SharedBackend(redis.Redis.from_url(RESPONSE_CACHE_REDIS_URL))
+        except ImportError:
+            logger.warning("RESPONSE_CACHE_REDIS_URL is set but the redis package is not installed, using in-process cache")
+    return MemoryBackend()
+
+
+# --- Cache ---
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # So sánh weak: bỏ tiền tố W/
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in candidates
+
+
+class ResponseCache:
+    def __init__(self, backend=None, ttl: int = RESPONSE_CACHE_TTL, fallback_ttl: int = RESPONSE_CACHE_FALLBACK_TTL):
+        self.backend = backend if backend is not None else build_backend()
+        self.ttl = ttl
+        self.fallback_ttl = fallback_ttl
+        self._short_ttl_until = 0.0
+
+    @staticmethod
+    def key_for(request: Request) -> str:
+        query = "&".join(f"{k}={v}" for k, v in sorted(request.query_params.multi_items()))
+        return f"{request.url.path}?{query}"
+
+    def tag_versions(self, tags: Iterable[str]) -> Dict[str, int]:
+        tags = list(dict.fromkeys(tags))
+        try:
+            return dict(zip(tags, self.backend.get_counters([f"tag:{tag}" for tag in tags])))
+        except Exception as e:
+            logger.warning("Response cache tag lookup failed: %s", e)
+            return {}
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        try:
+            entry = self.backend.get(key)
+            # Tag nào đã bị invalidate sau khi ghi -> coi như miss
+            if entry is None or self.tag_versions(entry.tags) != entry.tags:
+                return None
+            return entry
+        except Exception as e:
+            # Backend dùng chung lỗi -> đọc thẳng DB, không làm hỏng request
+            logger.warning("Response cache read failed: %s", e)
+            return None
+
+    def set(self, key: str, body: bytes, tags: Dict[str, int], ttl: Optional[int] = None) -> CachedResponse:
+        entry = CachedResponse(body=body, etag=make_etag(body), tags=tags)
+        ttl = ttl or self.ttl
+        if time.monotonic() < self._short_ttl_until:
+            ttl = min(ttl, self.fallback_ttl)
+        try:
+            self.backend.set(key, entry, ttl)
+        except Exception as e:
+            logger.warning("Response cache write failed: %s", e)
+        return entry
+
+    def invalidate(self, *tags: str):
+        """
+        Gọi sau db.commit() của thao tác admin: lỗi backend chỉ ghi log (không biến write đã commit thành 500).
+        Version tag không tăng được -> entry cũ còn sống tối đa TTL của nó, entry ghi mới dùng fallback_ttl.
+        """
+        for tag in tags:
+            try:
+                self.backend.incr(f"tag:{tag}")
+            except Exception as e:
+                logger.warning("Response cache invalidate of tag %s failed: %s", tag, e)
+                self._short_ttl_until = time.monotonic() + self.ttl
+
+    def clear(self):
+        self.backend.clear()
+
+
+response_cache = ResponseCache()
+
+
+def invalidate_product(product_id: int):
+    """Gọi sau khi commit create/update/delete sản phẩm: detail, similar, featured, categories"""
+    response_cache.invalidate(product_tag(product_id), FEATURED_TAG, CATALOG_TAG)
+
+
+def to_response(entry: CachedResponse, request: Request) -> Response:
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json; charset=utf-8", headers=headers)
+
+
+def cached_response(
+    tags: Callable[[Dict[str, Any], Any], Iterable[str]] = lambda params, result: (),
+    ttl: Optional[int] = None,
+):
+    """
+    Decorator cho GET endpoint (đặt dưới @router.get):
+        tags(params, result) -> các tag của response (params = tham số của endpoint)
+    Tag được đọc version trước khi chạy endpoint, admin ghi chen vào giữa -> entry vừa ghi đã cũ ngay.
+    Response trả về dạng JSON đã encode sẵn nên bỏ qua bước validate response_model.
+    """
+    def decorator(endpoint):
+        signature = inspect.signature(endpoint)
+        is_async = inspect.iscoroutinefunction(endpoint)
+
+        @functools.wraps(endpoint)
+        async def wrapper(*args, cache_request: Request, **kwargs):
+            key = response_cache.key_for(cache_request)
+            entry = response_cache.get(key)
+            if entry is None:
+                # Snapshot version của các tag cố định theo tham số trước khi đọc DB
+                before = response_cache.tag_versions(tags(kwargs, None))
+                if is_async:
+                    result = await endpoint(*args, **kwargs)
+                else:
+                    result = await run_in_threadpool(endpoint, *args, **kwargs)
+                if isinstance(result, Response):
+                    return result
+                body = render_json(result)
+                versions = response_cache.tag_versions(tags(kwargs, result))
+                versions.update(before)
+                entry = response_cache.set(key, body, versions, ttl)
+            return to_response(entry, cache_request)
+
+        wrapper.__signature__ = signature.replace(parameters=[
+            *signature.parameters.values(),
+            inspect.Parameter("cache_request", inspect.Parameter.KEYWORD_ONLY, annotation=Request),
+        ])
+        return wrapper
+    return decorator
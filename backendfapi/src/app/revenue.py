@@ -0,0 +1,188 @@
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+from sqlalchemy import select, update, delete, func, cast, Date
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.models import DailyRevenue, SalesOrderHeader, RentalHeader
+
+# ==========================================
+# DAILY REVENUE ROLLUP
+# ==========================================
+# Bảng DailyRevenue: 1 dòng / ngày (doanh thu + số đơn Mua và Thuê).
+# - Cộng dồn trong cùng transaction với checkout (record_order_revenue)
+# - Dashboard / Reports / biểu đồ chỉ đọc rollup: 1 query cho mọi khoảng thời gian
+# - rebuild_daily_revenue() tính lại từ SalesOrderHeader / RentalHeader (backfill / sửa sai lệch)
+# Doanh thu giữ nguyên định nghĩa cũ: SUM(TotalDue) theo OrderDate / RentalDate, không phụ thuộc trạng thái đơn.
+
+GRANULARITIES = ("day", "week", "month")
+
+
+@dataclass
+class RevenueBucket:
+    start: date
+    sales_revenue: Decimal = Decimal(0)
+    sales_count: int = 0
+    rental_revenue: Decimal = Decimal(0)
+    rental_count: int = 0
+
+    @property
+    def total_revenue(self) -> Decimal:
+        return self.sales_revenue + self.rental_revenue
+
+    @property
+    def total_orders(self) -> int:
+        return self.sales_count + self.rental_count
+
+
+# --- Write ---
+def record_order_revenue(
+    db: Session, order_date: datetime,
+    sales_revenue: Decimal = Decimal(0), sales_count: int = 0,
+    rental_revenue: Decimal = Decimal(0), rental_count: int = 0
+):
+    """Cộng đơn vừa tạo vào rollup của ngày order_date (gọi trước db.commit() của checkout)"""
+    day = order_date.date() if isinstance(order_date, datetime) else order_date
+    increment = update(DailyRevenue).where(DailyRevenue.RevenueDate == day).values(
+        SalesRevenue=DailyRevenue.SalesRevenue + sales_revenue,
+        SalesCount=DailyRevenue.SalesCount + sales_count,
+        RentalRevenue=DailyRevenue.RentalRevenue + rental_revenue,
+        RentalCount=DailyRevenue.RentalCount + rental_count,
+        ModifiedDate=datetime.now()
+    )
+    if db.execute(increment).rowcount:
+        return
+    try:
+        with db.begin_nested():
+            db.add(DailyRevenue(
+                RevenueDate=day, SalesRevenue=sales_revenue, SalesCount=sales_count,
+                RentalRevenue=rental_revenue, RentalCount=rental_count, ModifiedDate=datetime.now()
+            ))
+    except IntegrityError:
+        # Request khác vừa tạo dòng của ngày này -> cộng dồn vào dòng đó
+        db.execute(increment)
+
+
+def rebuild_daily_revenue(db: Session, start: Optional[date] = None, end: Optional[date] = None) -> int:
+    """Tính lại rollup cho [start, end] (None = toàn bộ) từ bảng đơn hàng. Trả về số ngày được ghi."""
+    def in_range(column, query):
+        if start:
+            query = query.where(column >= datetime.combine(start, datetime.min.time()))
+        if end:
+            query = query.where(column < datetime.combine(end + timedelta(days=1), datetime.min.time()))
+        return query
+
+    sales_day = cast(SalesOrderHeader.OrderDate, Date)
+    rental_day = cast(RentalHeader.RentalDate, Date)
+    sales = db.execute(in_range(SalesOrderHeader.OrderDate, select(
+        sales_day, func.sum(SalesOrderHeader.TotalDue), func.count(SalesOrderHeader.SalesOrderID)
+    )).group_by(sales_day)).all()
+    rentals = db.execute(in_range(RentalHeader.RentalDate, select(
+        rental_day, func.sum(RentalHeader.TotalDue), func.count(RentalHeader.RentalID)
+    )).group_by(rental_day)).all()
+
+    rows: Dict[date, DailyRevenue] = {}
+
+    def row(day) -> DailyRevenue:
+        day = _as_date(day)
+        if day not in rows:
+            rows[day] = DailyRevenue(
+                RevenueDate=day, SalesRevenue=Decimal(0), SalesCount=0,
+                RentalRevenue=Decimal(0), RentalCount=0, ModifiedDate=datetime.now()
+            )
+        return rows[day]
+
+    for day, revenue, count in sales:
+        r = row(day)
+        r.SalesRevenue, r.SalesCount = revenue or Decimal(0), count or 0
+    for day, revenue, count in rentals:
+        r = row(day)
+        r.RentalRevenue, r.RentalCount = revenue or Decimal(0), count or 0
+
+    purge = delete(DailyRevenue)
+    if start:
+        purge = purge.where(DailyRevenue.RevenueDate >= start)
+    if end:
+        purge = purge.where(DailyRevenue.RevenueDate <= end)
+    db.execute(purge)
+    db.add_all(rows.values())
+    db.commit()
+    return len(rows)
+
+
+# --- Read ---
+def _as_date(value) -> date:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    return value
+
+
+def bucket_start(day: date, granularity: str) -> date:
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    return day
+
+
+def next_bucket(start: date, granularity: str) -> date:
+    if granularity == "week":
+        return start + timedelta(days=7)
+    if granularity == "month":
+        return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return start + timedelta(days=1)
+
+
+def bucket_label(start: date, granularity: str) -> str:
+    return start.strftime("%m/%Y") if granularity == "month" else start.strftime("%d/%m")
+
+
+def revenue_totals(db: Session, start: Optional[date] = None, end: Optional[date] = None) -> RevenueBucket:
+    """Tổng doanh thu / số đơn trong [start, end] (None = toàn bộ), 1 query"""
+    query = select(
+        func.sum(DailyRevenue.SalesRevenue), func.sum(DailyRevenue.SalesCount),
+        func.sum(DailyRevenue.RentalRevenue), func.sum(DailyRevenue.RentalCount)
+    )
+    if start:
+        query = query.where(DailyRevenue.RevenueDate >= start)
+    if end:
+        query = query.where(DailyRevenue.RevenueDate <= end)
+    sales_revenue, sales_count, rental_revenue, rental_count = db.execute(query).one()
+    return RevenueBucket(
+        start=start, sales_revenue=Decimal(sales_revenue or 0), sales_count=int(sales_count or 0),
+        rental_revenue=Decimal(rental_revenue or 0), rental_count=int(rental_count or 0)
+    )
+
+
+def revenue_series(db: Session, start: date, end: date, granularity: str = "day") -> List[RevenueBucket]:
+    """
+    Doanh thu theo bucket day/week/month trong [start, end], bucket trống = 0.
+    1 query lấy các dòng ngày trong khoảng (tối đa 366 dòng / năm), gộp bucket trong Python.
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity must be one of {GRANULARITIES}")
+
+    buckets: Dict[date, RevenueBucket] = {}
+    cursor = bucket_start(start, granularity)
+    while cursor <= end:
+        buckets[cursor] = RevenueBucket(start=cursor)
+        cursor = next_bucket(cursor, granularity)
+
+    rows = db.execute(
+        select(
+            DailyRevenue.RevenueDate, DailyRevenue.SalesRevenue, DailyRevenue.SalesCount,
+            DailyRevenue.RentalRevenue, DailyRevenue.RentalCount
+        ).where(DailyRevenue.RevenueDate >= start, DailyRevenue.RevenueDate <= end)
+    ).all()
+    for day, sales_revenue, sales_count, rental_revenue, rental_count in rows:
+        bucket = buckets[bucket_start(_as_date(day), granularity)]
+        bucket.sales_revenue += Decimal(sales_revenue or 0)
+        bucket.sales_count += sales_count or 0
+        bucket.rental_revenue += Decimal(rental_revenue or 0)
+        bucket.rental_count += rental_count or 0
+    return list(buckets.values())
@@ -1,16 +1,34 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, status
-from sqlalchemy.orm import Session
-from sqlalchemy import func, or_, and_, desc, union_all, literal
+from fastapi import APIRouter, Depends, File, HTTPException, Query, Request, UploadFile, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session, joinedload, selectinload
+from sqlalchemy import select, func, or_, and_, desc, union_all, literal
 from datetime import datetime, date, timedelta
 from decimal import Decimal
 from typing import Optional, List
 
-from app.database import get_db
+from app.database import SessionLocal, get_db, get_async_db, AsyncSessionLocal
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.models import *
+from app.product_stats import product_stats
+from app.catalog_index import catalog_index
+from app.search_engine import product_search, faq_search
+from app.stock import get_stock_summary, get_stock_totals, EMPTY_STOCK
+from app.revenue import revenue_totals, revenue_series, bucket_label
+from app.checkout import release_stock
+from app.cart_summary import voucher_cache
+from app.product_images import get_thumbnails, pick_thumbnail
+from app.count_cache import count_cache
+from app.db_metrics import pool_metrics
+from app.password_hasher import password_hasher
+from app.export import EXPORT_BATCH_SIZE, ExportFormat, export_response
+from app.json_response import render_json
+from app.product_import import ImportFormat, import_products
+from app.response_cache import response_cache, invalidate_product, reviews_tag, CATALOG_TAG, FAQS_TAG
 from .config import * 
 from ...helper import *
 from app.routes.auth.apis import get_password_hash
 import re
+import asyncio
 
 admin_router = APIRouter(prefix="/admin", tags=["Admin"])
 
@@ -50,54 +68,37 @@ def parse_faq_id(faq_id: str | int) -> int:
 # 1. DASHBOARD & REPORTS
 # ==========================================
 
-@admin_router.get("/dashboard", response_model=APIResponse[DashboardData])
-async def get_dashboard_stats(db: Session = Depends(get_db)):
+def build_dashboard(db: Session) -> DashboardData:
     today = datetime.now()
-    start_of_week = today - timedelta(days=today.weekday())
+    start_of_week = today.date() - timedelta(days=today.weekday())
 
-    # 1. Summary Metrics
-    total_sales = db.query(func.sum(SalesOrderHeader.TotalDue)).scalar() or Decimal(0)
-    total_rentals = db.query(func.sum(RentalHeader.TotalDue)).scalar() or Decimal(0)
-    total_revenue = total_sales + total_rentals
+    # 1. Summary Metrics (gộp các COUNT vào 1 round-trip bằng scalar subquery)
+    total_revenue = revenue_totals(db).total_revenue
 
     # Growth Logic (Mockup for Demo)
     prev_revenue = total_revenue * Decimal(0.85)
     growth = float((total_revenue - prev_revenue) / prev_revenue * 100) if prev_revenue else 0
 
-    active_rentals = db.query(func.count(RentalHeader.RentalID)).filter(RentalHeader.Status == 1).scalar() or 0
-    total_customers = db.query(func.count(Customer.CustomerID)).scalar() or 0
-    overdue_count = db.query(func.count(RentalHeader.RentalID)).filter(
-        and_(RentalHeader.DueDate < today, RentalHeader.ReturnDate == None)
-    ).scalar() or 0
+    active_rentals, total_customers, overdue_count = db.execute(select(
+        select(func.count(RentalHeader.RentalID)).where(RentalHeader.Status == 1).scalar_subquery(),
+        select(func.count(Customer.CustomerID)).scalar_subquery(),
+        select(func.count(RentalHeader.RentalID)).where(
+            and_(RentalHeader.DueDate < today, RentalHeader.ReturnDate == None)
+        ).scalar_subquery(),
+    )).one()
 
-    # 2. Revenue Chart (7 Days)
-    labels = []
-    sales_data = []
-    rent_data = []
-    
-    for i in range(7):
-        curr_day = start_of_week + timedelta(days=i)
-        next_day = curr_day + timedelta(days=1)
-        labels.append(curr_day.strftime("%a"))
-        
-        d_sales = db.query(func.sum(SalesOrderHeader.TotalDue)).filter(
-            and_(SalesOrderHeader.OrderDate >= curr_day, SalesOrderHeader.OrderDate < next_day)
-        ).scalar() or Decimal(0)
-        
-        d_rent = db.query(func.sum(RentalHeader.TotalDue)).filter(
-            and_(RentalHeader.RentalDate >= curr_day, RentalHeader.RentalDate < next_day)
-        ).scalar() or Decimal(0)
-        
-        sales_data.append(d_sales)
-        rent_data.append(d_rent)
+    # 2. Revenue Chart (7 Days, đọc từ rollup DailyRevenue)
+    week = revenue_series(db, start_of_week, start_of_week + timedelta(days=6), "day")
+    labels = [b.start.strftime("%a") for b in week]
+    sales_data = [b.sales_revenue for b in week]
+    rent_data = [b.rental_revenue for b in week]
 
     # 3. Inventory Status
-    # Location 60: Maintenance, Others: Available
-    maintenance_qty = db.query(func.sum(ProductInventory.Quantity)).filter(ProductInventory.LocationID == 60).scalar() or 0
-    available_qty = db.query(func.sum(ProductInventory.Quantity)).filter(ProductInventory.LocationID != 60).scalar() or 0
-    
-    # Renting Qty (Items currently out)
-    renting_qty = db.query(func.sum(RentalDetail.OrderQty)).join(RentalHeader).filter(RentalHeader.Status == 1).scalar() or 0
+    # Location 60: Maintenance, Others: Available, Renting: Items currently out
+    stock = get_stock_totals(db)
+    maintenance_qty = stock.maintenance
+    available_qty = stock.in_house
+    renting_qty = stock.renting
     
     # Adjust available (Physical count in warehouse includes rented items logic depending on DB design, 
     # assuming Inventory table decrements only on sale, but for rental it stays but marked? 
@@ -113,9 +114,9 @@ async def get_dashboard_stats(db: Session = Depends(get_db)):
     dashboard_data = DashboardData(
         summary=DashboardSummary(
             total_revenue=RevenueItem(value=total_revenue, growth_percentage=growth, growth_direction="up"),
-            active_rental=CountItem(value=active_rentals, unit="vehicles"),
-            total_customers=CountItem(value=total_customers, unit="people"),
-            overdue_return=OverdueItem(value=overdue_count, has_warning=overdue_count > 0, warning_message="Late returns detected" if overdue_count else None)
+            active_rental=CountItem(value=active_rentals or 0, unit="vehicles"),
+            total_customers=CountItem(value=total_customers or 0, unit="people"),
+            overdue_return=OverdueItem(value=overdue_count or 0, has_warning=bool(overdue_count), warning_message="Late returns detected" if overdue_count else None)
         ),
         revenue_chart=DashboardChart(
             labels=labels,
@@ -133,56 +134,39 @@ async def get_dashboard_stats(db: Session = Depends(get_db)):
             ]
         )
     )
-    return success_response(dashboard_data)
+    return dashboard_data
 
-@admin_router.get("/reports", response_model=APIResponse[ReportData])
-async def get_reports(
-    start_date: date = Query(..., description="Ngày bắt đầu (YYYY-MM-DD)"),
-    end_date: date = Query(..., description="Ngày kết thúc (YYYY-MM-DD)"),
-    page: int = Query(1, ge=1, description="Trang hiện tại cho danh sách top"),
-    limit: int = Query(5, ge=1, description="Số lượng top sản phẩm (VD: Top 5)"),
-    db: Session = Depends(get_db)
+# Các handler báo cáo dùng AsyncSession: phần truy vấn viết sync, chạy qua db.run_sync()
+@admin_router.get("/dashboard", response_model=APIResponse[DashboardData])
+async def get_dashboard_stats(db: AsyncSession = Depends(get_async_db)):
+    return success_response(await db.run_sync(build_dashboard))
+
+@admin_router.get("/revenue-chart", response_model=APIResponse[DashboardChart])
+async def get_revenue_chart(
+    days: int = Query(30, ge=1, le=1095, description="Số ngày tính ngược từ end_date (VD: 30/90/365)"),
+    granularity: str = Query("day", enum=["day", "week", "month"]),
+    end_date: Optional[date] = Query(None, description="Mặc định: hôm nay"),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    # Chuyển đổi date -> datetime để so sánh chính xác trong DB
-    start_dt = datetime.combine(start_date, datetime.min.time())
-    end_dt = datetime.combine(end_date, datetime.max.time())
-    
-    # Tính số ngày (tránh chia cho 0)
-    delta_days = (end_date - start_date).days + 1
-    if delta_days < 1: delta_days = 1
-
-    # --- 1. TÍNH TỔNG QUAN (REVENUE REPORT) ---
-    
-    # Tổng Bán hàng (Sales)
-    sales_stats = db.query(
-        func.sum(SalesOrderHeader.TotalDue).label("revenue"),
-        func.count(SalesOrderHeader.SalesOrderID).label("count")
-    ).filter(
-        and_(SalesOrderHeader.OrderDate >= start_dt, SalesOrderHeader.OrderDate <= end_dt)
-    ).first()
-
-    # Tổng Cho thuê (Rentals)
-    rental_stats = db.query(
-        func.sum(RentalHeader.TotalDue).label("revenue"),
-        func.count(RentalHeader.RentalID).label("count")
-    ).filter(
-        and_(RentalHeader.RentalDate >= start_dt, RentalHeader.RentalDate <= end_dt)
-    ).first()
+    end = end_date or date.today()
+    start = end - timedelta(days=days - 1)
+    buckets = await db.run_sync(revenue_series, start, end, granularity)
+    chart = DashboardChart(
+        labels=[bucket_label(b.start, granularity) for b in buckets],
+        series=[
+            ChartSeriesItem(name="Sales", data=[b.sales_revenue for b in buckets]),
+            ChartSeriesItem(name="Rentals", data=[b.rental_revenue for b in buckets])
+        ]
+    )
+    return success_response(chart)
 
-    # Xử lý kết quả (None -> 0)
-    total_sales_rev = sales_stats.revenue or Decimal(0)
-    total_rent_rev = rental_stats.revenue or Decimal(0)
-    
-    total_revenue = total_sales_rev + total_rent_rev
-    total_orders = (sales_stats.count or 0) + (rental_stats.count or 0)
-    avg_daily = total_revenue / Decimal(delta_days)
+async def run_in_new_session(fn, *args):
+    """Chạy fn(session, *args) với AsyncSession riêng (để các query chạy song song bằng asyncio.gather)"""
+    async with AsyncSessionLocal() as session:
+        return await session.run_sync(fn, *args)
 
-    # --- 2. TÍNH TOP SELLING (BÁN HÀNG) ---
+def top_selling_rows(db: Session, start_dt: datetime, end_dt: datetime, offset: int, limit: int):
     # Join: Product -> SalesOrderDetail -> SalesOrderHeader (để lọc ngày) -> SubCategory -> Category
-    
-    offset = (page - 1) * limit
-    
-    # Query Aggregate
     selling_query = db.query(
         Product.ProductID,
         Product.ProductNumber,
@@ -198,35 +182,11 @@ async def get_reports(
          and_(SalesOrderHeader.OrderDate >= start_dt, SalesOrderHeader.OrderDate <= end_dt)
      )\
      .group_by(Product.ProductID, Product.ProductNumber, Product.Name, ProductCategory.Name)
-     
-    # MSSQL Fix: Order By trước khi Limit
-    selling_results = selling_query.order_by(desc("TotalRevenue"))\
-                                   .offset(offset).limit(limit).all()
-
-    top_selling = []
-    for idx, row in enumerate(selling_results):
-        # Lấy ảnh đại diện (Query riêng để tránh phức tạp hóa group by)
-        img_obj = db.query(ProductImage).filter(
-            ProductImage.ProductID == row.ProductID, 
-            ProductImage.IsPrimary == True
-        ).first()
-        # Fallback ảnh
-        if not img_obj:
-            img_obj = db.query(ProductImage).filter(ProductImage.ProductID == row.ProductID).first()
 
-        top_selling.append(TopProductItem(
-            rank=offset + idx + 1,
-            product_id=row.ProductID,
-            product_number=row.ProductNumber,
-            product_name=row.Name,
-            category_name=row.CategoryName,
-            image_url=img_obj.ImageURL if img_obj else None,
-            quantity_sold=row.TotalQty,
-            revenue=row.TotalRevenue or Decimal(0)
-        ))
+    # MSSQL Fix: Order By trước khi Limit
+    return selling_query.order_by(desc("TotalRevenue")).offset(offset).limit(limit).all()
 
-    # --- 3. TÍNH TOP RENTING (CHO THUÊ) ---
-    
+def top_renting_rows(db: Session, start_dt: datetime, end_dt: datetime, offset: int, limit: int):
     renting_query = db.query(
         Product.ProductID,
         Product.ProductNumber,
@@ -242,30 +202,69 @@ async def get_reports(
          and_(RentalHeader.RentalDate >= start_dt, RentalHeader.RentalDate <= end_dt)
      )\
      .group_by(Product.ProductID, Product.ProductNumber, Product.Name, ProductCategory.Name)
-     
+
     # MSSQL Fix
-    renting_results = renting_query.order_by(desc("TotalRevenue"))\
-                                   .offset(offset).limit(limit).all()
-
-    top_renting = []
-    for idx, row in enumerate(renting_results):
-        img_obj = db.query(ProductImage).filter(
-            ProductImage.ProductID == row.ProductID, 
-            ProductImage.IsPrimary == True
-        ).first()
-        if not img_obj:
-            img_obj = db.query(ProductImage).filter(ProductImage.ProductID == row.ProductID).first()
+    return renting_query.order_by(desc("TotalRevenue")).offset(offset).limit(limit).all()
 
-        top_renting.append(TopProductItem(
+@admin_router.get("/reports", response_model=APIResponse[ReportData])
+async def get_reports(
+    start_date: date = Query(..., description="Ngày bắt đầu (YYYY-MM-DD)"),
+    end_date: date = Query(..., description="Ngày kết thúc (YYYY-MM-DD)"),
+    page: int = Query(1, ge=1, description="Trang hiện tại cho danh sách top"),
+    limit: int = Query(5, ge=1, description="Số lượng top sản phẩm (VD: Top 5)"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    # Chuyển đổi date -> datetime để so sánh chính xác trong DB
+    start_dt = datetime.combine(start_date, datetime.min.time())
+    end_dt = datetime.combine(end_date, datetime.max.time())
+    
+    # Tính số ngày (tránh chia cho 0)
+    delta_days = (end_date - start_date).days + 1
+    if delta_days < 1: delta_days = 1
+
+    # --- 1. TÍNH TỔNG QUAN (REVENUE REPORT, đọc từ rollup DailyRevenue) ---
+    totals = await db.run_sync(revenue_totals, start_date, end_date)
+    total_revenue = totals.total_revenue
+    total_orders = totals.total_orders
+    avg_daily = total_revenue / Decimal(delta_days)
+
+    # --- 2 & 3. TOP SELLING / TOP RENTING (chạy song song, mỗi query 1 session riêng) ---
+    offset = (page - 1) * limit
+    selling_results, renting_results = await asyncio.gather(
+        run_in_new_session(top_selling_rows, start_dt, end_dt, offset, limit),
+        run_in_new_session(top_renting_rows, start_dt, end_dt, offset, limit),
+    )
+
+    # Ảnh đại diện cho cả 2 danh sách trong 1 query
+    thumbnails = await db.run_sync(get_thumbnails, [row.ProductID for row in (*selling_results, *renting_results)])
+
+    top_selling = [
+        TopProductItem(
             rank=offset + idx + 1,
             product_id=row.ProductID,
             product_number=row.ProductNumber,
             product_name=row.Name,
             category_name=row.CategoryName,
-            image_url=img_obj.ImageURL if img_obj else None,
+            image_url=thumbnails.get(row.ProductID),
+            quantity_sold=row.TotalQty,
+            revenue=row.TotalRevenue or Decimal(0)
+        )
+        for idx, row in enumerate(selling_results)
+    ]
+
+    top_renting = [
+        TopProductItem(
+            rank=offset + idx + 1,
+            product_id=row.ProductID,
+            product_number=row.ProductNumber,
+            product_name=row.Name,
+            category_name=row.CategoryName,
+            image_url=thumbnails.get(row.ProductID),
             times_rented=row.TimesRented,
             revenue=row.TotalRevenue or Decimal(0)
-        ))
+        )
+        for idx, row in enumerate(renting_results)
+    ]
 
     # --- 4. TRẢ VỀ ---
     
@@ -281,70 +280,136 @@ async def get_reports(
 
     return success_response(data)
 
+@admin_router.get("/metrics", response_model=APIResponse[PoolMetricsData])
+def get_pool_metrics(reset: bool = Query(False, description="Xóa số liệu đã cộng dồn sau khi đọc")):
+    """Số liệu connection pool + pool hash mật khẩu của worker hiện tại (mỗi worker uvicorn có pool + metrics riêng)"""
+    data = PoolMetricsData(**pool_metrics.snapshot(), password_hash=password_hasher.snapshot())
+    if reset:
+        pool_metrics.reset()
+        password_hasher.metrics.reset()
+    return success_response(data)
+
 # ==========================================
 # 2. PRODUCTS
 # ==========================================
 
+def map_product_response(p: Product, stock, img_url: Optional[str]) -> ProductResponse:
+    """Product (đã load subcategory.category) + tồn kho + thumbnail -> ProductResponse (dùng cho list + export)"""
+    avail_qty = stock.available
+
+    # Map Category Name
+    cat_name = p.subcategory.category.Name if (p.subcategory and p.subcategory.category) else "Unknown"
+
+    return ProductResponse(
+        id=p.ProductID,
+        name=p.Name,
+        product_number=p.ProductNumber,
+        category_name=cat_name,
+        image_url=img_url,
+        prices=ProductPrices(
+            list_price=p.ListPrice,
+            rent_price=p.RentPrice,
+            rent_unit=p.RentalPeriodUnit or 'day'
+        ),
+        stock=StockDetails(
+            total_stock=stock.total,
+            maintenance_stock=stock.maintenance,
+            available_stock=avail_qty,
+            renting_stock=stock.renting
+        ),
+        status_label="In Stock" if avail_qty > 0 else "Out of Stock"
+    )
+
 @admin_router.get("/products", response_model=PagedResponse[ProductResponse])
-async def get_products(
+def get_products(
     page: int = Query(1, ge=1),
     limit: int = Query(10, ge=1),
     search: Optional[str] = None,
+    sort_by: str = Query("newest", enum=["newest", "relevance"]),
+    paging: CursorParams = Depends(cursor_params),
     db: Session = Depends(get_db)
 ):
-    query = db.query(Product)
+    # Eager load ảnh + danh mục để không lazy-load từng dòng
+    query = db.query(Product).options(
+        selectinload(Product.images),
+        joinedload(Product.subcategory).joinedload(ProductSubcategory.category)
+    )
     if search:
-        term = f"%{search}%"
-        query = query.filter(or_(Product.Name.ilike(term), Product.ProductNumber.ilike(term)))
+        # Full-text index thay cho ILIKE, chỉ query DB cho các ID thuộc trang hiện tại
+        # (kết quả search đã nằm trong memory nên luôn phân trang theo page)
+        hits = product_search.ensure_loaded(db).search(search)
+        if sort_by != "relevance":
+            hits.sort(key=lambda hit: hit[0], reverse=True)
+        total_items = len(hits)
+        page_ids = [pid for pid, _ in hits[(page - 1) * limit:page * limit]]
+        by_id = {p.ProductID: p for p in query.filter(Product.ProductID.in_(page_ids)).all()} if page_ids else {}
+        products = [by_id[pid] for pid in page_ids if pid in by_id]
+        meta = manual_paginate([], total_items, page, limit).pagination
+    else:
+        # MSSQL bắt buộc phải sort thì mới phân trang được
+        products, meta = keyset_paginate(query, [Product.ProductID], page, limit, paging)
     
-    total_items = query.count()
+    # Tồn kho của cả trang trong 1 query
+    stock_by_id = get_stock_summary(db, [p.ProductID for p in products])
 
-    # --- FIX: Thêm order_by trước khi offset/limit ---
-    # MSSQL bắt buộc phải sort thì mới phân trang được
-    products = query.order_by(desc(Product.ProductID))\
-                    .offset((page - 1) * limit).limit(limit).all()
-    
-    results = []
-    for p in products:
-        # Calculate Stock
-        total_phy = db.query(func.sum(ProductInventory.Quantity)).filter(ProductInventory.ProductID == p.ProductID).scalar() or 0
-        maint_qty = db.query(func.sum(ProductInventory.Quantity)).filter(ProductInventory.ProductID == p.ProductID, ProductInventory.LocationID == 60).scalar() or 0
-        renting_qty = db.query(func.sum(RentalDetail.OrderQty)).join(RentalHeader).filter(RentalDetail.ProductID == p.ProductID, RentalHeader.Status == 1).scalar() or 0
-        
-        avail_qty = max(0, total_phy - maint_qty - renting_qty)
-        
-        # Get Image
-        img_url = next((img.ImageURL for img in p.images if img.IsPrimary), None) 
-        if not img_url and p.images:
-            img_url = p.images[0].ImageURL
-        
-        # Map Category Name
-        cat_name = p.subcategory.category.Name if (p.subcategory and p.subcategory.category) else "Unknown"
-
-        results.append(ProductResponse(
-            id=p.ProductID,
-            name=p.Name,
-            product_number=p.ProductNumber,
-            category_name=cat_name,
-            image_url=img_url,
-            prices=ProductPrices(
-                list_price=p.ListPrice,
-                rent_price=p.RentPrice,
-                rent_unit=p.RentalPeriodUnit or 'day'
-            ),
-            stock=StockDetails(
-                total_stock=total_phy,
-                maintenance_stock=maint_qty,
-                available_stock=avail_qty,
-                renting_stock=renting_qty
-            ),
-            status_label="In Stock" if avail_qty > 0 else "Out of Stock"
-        ))
-        
-    return manual_paginate(results, total_items, page, limit)
+    results = [
+        map_product_response(p, stock_by_id.get(p.ProductID, EMPTY_STOCK), pick_thumbnail(p.images))
+        for p in products
+    ]
+
+    return paged_response(results, meta)
+
+def iter_product_export(search: Optional[str]):
+    """Sinh ProductResponse cho toàn bộ sản phẩm (lọc search như /admin/products), đọc theo lô EXPORT_BATCH_SIZE"""
+    # SQL Server không bật MARS: connection đang stream kết quả không chạy được query khác
+    # -> tồn kho / thumbnail của từng lô đọc bằng session thứ 2
+    with SessionLocal() as stream_db, SessionLocal() as lookup_db:
+        query = select(Product).options(
+            joinedload(Product.subcategory).joinedload(ProductSubcategory.category)
+        ).order_by(Product.ProductID.desc())
+        if search:
+            hit_ids = sorted((pid for pid, _ in product_search.ensure_loaded(lookup_db).search(search)), reverse=True)
+            batches = (
+                stream_db.scalars(query.where(Product.ProductID.in_(hit_ids[start:start + EXPORT_BATCH_SIZE]))).all()
+                for start in range(0, len(hit_ids), EXPORT_BATCH_SIZE)
+            )
+        else:
+            batches = stream_db.scalars(query.execution_options(yield_per=EXPORT_BATCH_SIZE)).partitions()
+
+        for batch in batches:
+            ids = [p.ProductID for p in batch]
+            stock_by_id = get_stock_summary(lookup_db, ids)
+            thumbnails = get_thumbnails(lookup_db, ids)
+            for p in batch:
+                yield map_product_response(p, stock_by_id.get(p.ProductID, EMPTY_STOCK), thumbnails.get(p.ProductID))
+
+@admin_router.get("/products/export")
+def export_products(request: Request, search: Optional[str] = None, format: ExportFormat = "csv"):
+    """Xuất toàn bộ sản phẩm ra CSV / NDJSON trong 1 request (stream, gzip nếu client hỗ trợ)"""
+    return export_response(iter_product_export(search), ProductResponse, format, "products", request)
+
+def iter_product_import(data: bytes, format: ImportFormat, dry_run: bool):
+    with SessionLocal() as db:
+        for event in import_products(db, data, format, dry_run=dry_run):
+            yield render_json(event) + b"\n"
+
+@admin_router.post("/products/import")
+def import_products_file(
+    file: UploadFile = File(..., description="CSV (cột lồng nhau dạng attributes.color, images: url1|url2) hoặc JSON / NDJSON theo ProductCreateUpdate"),
+    format: Optional[ImportFormat] = Query(None, description="Mặc định đoán theo đuôi file"),
+    dry_run: bool = Query(False, description="Chỉ validate, không ghi DB"),
+):
+    """
+    Import / cập nhật hàng loạt sản phẩm theo ProductNumber.
+    Trả NDJSON stream: 1 dòng {"event": "progress"} sau mỗi lô, dòng cuối {"event": "done"} kèm lỗi từng dòng.
+    """
+    if format is None:
+        format = "csv" if (file.filename or "").lower().endswith(".csv") else "json"
+    data = file.file.read()
+    return StreamingResponse(iter_product_import(data, format, dry_run), media_type="application/x-ndjson")
 
 @admin_router.post("/products", response_model=APIResponse)
-async def create_product(payload: ProductCreateUpdate, db: Session = Depends(get_db)):
+def create_product(payload: ProductCreateUpdate, db: Session = Depends(get_db)):
     # 1. Create Product
     new_p = Product(
         Name=payload.name,
@@ -389,17 +454,25 @@ async def create_product(payload: ProductCreateUpdate, db: Session = Depends(get
         db.add(ProductInventory(ProductID=new_p.ProductID, LocationID=60, Quantity=payload.stock_details.maintenance_stock, ModifiedDate=datetime.now()))
 
     db.commit()
+    product_stats.set_primary_image(new_p.ProductID, payload.images[0] if payload.images else None)
+    catalog_index.refresh_product(db, new_p.ProductID)
+    product_search.refresh(db, new_p.ProductID)
+    invalidate_product(new_p.ProductID)
     return success_response(message="Product created successfully")
 
 @admin_router.get("/products/{product_id}", response_model=APIResponse[ProductDetailResponse])
-async def get_product_detail(product_id: int, db: Session = Depends(get_db)):
-    p = db.query(Product).filter(Product.ProductID == product_id).first()
+def get_product_detail(product_id: int, db: Session = Depends(get_db)):
+    p = db.query(Product).options(
+        selectinload(Product.images),
+        joinedload(Product.subcategory).joinedload(ProductSubcategory.category)
+    ).filter(Product.ProductID == product_id).first()
     if not p: raise HTTPException(404, "Product not found")
 
-    # Reuse calculation logic (simplified here)
-    total_phy = db.query(func.sum(ProductInventory.Quantity)).filter(ProductInventory.ProductID == p.ProductID).scalar() or 0
-    maint_qty = db.query(func.sum(ProductInventory.Quantity)).filter(ProductInventory.ProductID == p.ProductID, ProductInventory.LocationID == 60).scalar() or 0
-    renting_qty = db.query(func.sum(RentalDetail.OrderQty)).join(RentalHeader).filter(RentalDetail.ProductID == p.ProductID, RentalHeader.Status == 1).scalar() or 0
+    # Reuse calculation logic (stock service dùng chung với danh sách)
+    stock = get_stock_summary(db, [p.ProductID]).get(p.ProductID, EMPTY_STOCK)
+    total_phy = stock.total
+    maint_qty = stock.maintenance
+    renting_qty = stock.renting
     
     # --- FIX: Xử lý None cho các trường có thể Null trong DB ---
     detail = ProductDetailResponse(
@@ -415,7 +488,7 @@ async def get_product_detail(product_id: int, db: Session = Depends(get_db)):
         stock=StockDetails(
             total_stock=total_phy, 
             maintenance_stock=maint_qty, 
-            available_stock=max(0, total_phy-maint_qty-renting_qty), 
+            available_stock=stock.available, 
             renting_stock=renting_qty
         ),
         attributes=ProductAttributes(
@@ -434,7 +507,7 @@ async def get_product_detail(product_id: int, db: Session = Depends(get_db)):
     return success_response(detail)
 
 @admin_router.patch("/products/{product_id}", response_model=APIResponse)
-async def update_product(
+def update_product(
     product_id: int, 
     payload: ProductCreateUpdate, 
     db: Session = Depends(get_db)
@@ -517,11 +590,15 @@ async def update_product(
         ))
 
     db.commit()
+    product_stats.set_primary_image(product_id, payload.images[0] if payload.images else None)
+    catalog_index.refresh_product(db, product_id)
+    product_search.refresh(db, product_id)
+    invalidate_product(product_id)
     return success_response(message="Product updated successfully")
 
 # 5. DELETE - DELETE PRODUCT
 @admin_router.delete("/products/{product_id}", response_model=APIResponse)
-async def delete_product(product_id: int, db: Session = Depends(get_db)):
+def delete_product(product_id: int, db: Session = Depends(get_db)):
     product = db.query(Product).filter(Product.ProductID == product_id).first()
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
@@ -538,6 +615,7 @@ async def delete_product(product_id: int, db: Session = Depends(get_db)):
         product.ModifiedDate = datetime.now()
         
         db.commit()
+        invalidate_product(product_id)
         return success_response(
             message="Product has transaction history. It has been deactivated (Soft Deleted) instead of removed."
         )
@@ -554,15 +632,23 @@ async def delete_product(product_id: int, db: Session = Depends(get_db)):
         db.delete(product)
         
         db.commit()
+        product_stats.remove_product(product_id)
+        catalog_index.remove_product(product_id)
+        product_search.remove(product_id)
+        invalidate_product(product_id)
+        response_cache.invalidate(reviews_tag(product_id))
         return success_response(message="Product permanently deleted")
 
 # 6. GET PRODUCT REVIEWS
+REVIEW_DATE_FLOOR = datetime(1900, 1, 1)
+
 @admin_router.get("/reviews/{product_id}", response_model=APIResponse[ReviewsResponseData])
-async def get_product_reviews(
+def get_product_reviews(
     product_id: int,
     page: int = Query(1, ge=1),
     limit: int = Query(5, ge=1),
     filter_type: str = Query("all", enum=["all", "highest", "lowest", "unanswered"]),
+    paging: CursorParams = Depends(cursor_params),
     db: Session = Depends(get_db)
 ):
     # 1. Check Product Exist
@@ -589,16 +675,22 @@ async def get_product_reviews(
     # 3. Query Reviews for List (Apply Filter & Pagination)
     query = db.query(ProductReview).filter(ProductReview.ProductID == product_id)
     
-    if filter_type == "highest":
-        query = query.order_by(desc(ProductReview.Rating))
-    elif filter_type == "lowest":
-        query = query.order_by(ProductReview.Rating.asc())
+    # Sort key luôn kết thúc bằng PK để thứ tự ổn định (cần cho cursor).
+    # Rating / ReviewDate có thể NULL -> COALESCE để so sánh keyset được (NULL xếp cuối như cũ)
+    descending = True
+    if filter_type in ("highest", "lowest"):
+        sort_key = [func.coalesce(ProductReview.Rating, 0), ProductReview.ProductReviewID]
+        key_of = lambda r: [r.Rating or 0, r.ProductReviewID]
+        descending = filter_type == "highest"
     elif filter_type == "unanswered":
         query = query.filter(ProductReview.ReplyContent == None)
+        sort_key = [ProductReview.ProductReviewID]
+        key_of = None
     else: # all -> Newest first
-        query = query.order_by(desc(ProductReview.ReviewDate))
-        
-    reviews_db = query.offset((page - 1) * limit).limit(limit).all()
+        sort_key = [func.coalesce(ProductReview.ReviewDate, REVIEW_DATE_FLOOR), ProductReview.ProductReviewID]
+        key_of = lambda r: [r.ReviewDate or REVIEW_DATE_FLOOR, r.ProductReviewID]
+
+    reviews_db, meta = keyset_paginate(query, sort_key, page, limit, paging, descending=descending, key_of=key_of)
 
     # 4. Map to Schema
     review_items = []
@@ -647,7 +739,8 @@ async def get_product_reviews(
                 **{f"star_{k}": v for k, v in dist.items()} # Map dict keys to pydantic alias
             )
         ),
-        reviews=review_items
+        reviews=review_items,
+        pagination=meta
     )
     
     return success_response(data)
@@ -658,16 +751,15 @@ async def get_product_reviews(
 # ==========================================
 
 @admin_router.get("/promotions", response_model=PagedResponse[PromotionResponse])
-async def get_promotions(
+def get_promotions(
     page: int = Query(1, ge=1), 
     limit: int = Query(10, ge=1), 
+    paging: CursorParams = Depends(cursor_params),
     db: Session = Depends(get_db)
 ):
-    # 1. Query DB
-    query = db.query(Voucher).order_by(Voucher.VoucherID.desc())
-    
-    total_items = query.count()
-    items_db = query.offset((page - 1) * limit).limit(limit).all()
+    # 1. Query DB (sort VoucherID desc)
+    query = db.query(Voucher)
+    items_db, meta = keyset_paginate(query, [Voucher.VoucherID], page, limit, paging)
 
     # 2. Map dữ liệu
     results = []
@@ -708,10 +800,10 @@ async def get_promotions(
         ))
 
     # 3. Trả về
-    return manual_paginate(results, total_items, page, limit)
+    return paged_response(results, meta)
 
 @admin_router.post("/promotions", response_model=APIResponse)
-async def create_promotion(payload: PromotionCreate, db: Session = Depends(get_db)):
+def create_promotion(payload: PromotionCreate, db: Session = Depends(get_db)):
     v = Voucher(
         Name=payload.name, Code=payload.code, Scope=payload.scope,
         StartDate=payload.start_date, EndDate=payload.end_date,
@@ -728,10 +820,11 @@ async def create_promotion(payload: PromotionCreate, db: Session = Depends(get_d
         
     db.add(v)
     db.commit()
+    voucher_cache.invalidate()
     return success_response(message="Promotion Created")
 
 @admin_router.get("/promotions/{promotion_id}", response_model=APIResponse[PromotionResponse])
-async def get_promotion_detail(promotion_id: int, db: Session = Depends(get_db)):
+def get_promotion_detail(promotion_id: int, db: Session = Depends(get_db)):
     # Query trực tiếp theo ID int
     v = db.query(Voucher).filter(Voucher.VoucherID == promotion_id).first()
     if not v: raise HTTPException(404, "Promotion not found")
@@ -766,7 +859,7 @@ async def get_promotion_detail(promotion_id: int, db: Session = Depends(get_db))
 
 # 4. PATCH - UPDATE PROMOTION
 @admin_router.patch("/promotions/{promotion_id}", response_model=APIResponse)
-async def update_promotion(
+def update_promotion(
     promotion_id: int, 
     payload: PromotionUpdate, 
     db: Session = Depends(get_db)
@@ -800,11 +893,12 @@ async def update_promotion(
             v.DiscountPercent = None # Reset percent
 
     db.commit()
+    voucher_cache.invalidate()
     return success_response(message="Promotion updated successfully")
 
 # 5. DELETE PROMOTION
 @admin_router.delete("/promotions/{promotion_id}", response_model=APIResponse)
-async def delete_promotion(promotion_id: int, db: Session = Depends(get_db)):
+def delete_promotion(promotion_id: int, db: Session = Depends(get_db)):
     v = db.query(Voucher).filter(Voucher.VoucherID == promotion_id).first()
     if not v: raise HTTPException(404, "Promotion not found")
 
@@ -818,6 +912,7 @@ async def delete_promotion(promotion_id: int, db: Session = Depends(get_db)):
         v.EndDate = datetime.now() - timedelta(days=1)
         
         db.commit()
+        voucher_cache.invalidate()
         return success_response(
             message="Promotion has usage history. It has been deactivated/expired instead of deleted."
         )
@@ -825,6 +920,7 @@ async def delete_promotion(promotion_id: int, db: Session = Depends(get_db)):
         # --- HARD DELETE ---
         db.delete(v)
         db.commit()
+        voucher_cache.invalidate()
         return success_response(message="Promotion permanently deleted")
 
 
@@ -834,7 +930,7 @@ async def delete_promotion(promotion_id: int, db: Session = Depends(get_db)):
 
 # 1. GET LIST CATEGORIES
 @admin_router.get("/categories", response_model=PagedResponse[CategoryResponse])
-async def get_categories(
+def get_categories(
     page: int = Query(1, ge=1),
     limit: int = Query(10, ge=1),
     search: Optional[str] = None,
@@ -847,7 +943,7 @@ async def get_categories(
         query = query.filter(ProductSubcategory.Name.ilike(f"%{search}%"))
 
     # 2. Pagination (Fix MSSQL order by)
-    total_items = query.count()
+    total_items = count_cache.count(query)
     items_db = query.order_by(ProductSubcategory.ProductSubcategoryID.desc())\
                     .offset((page - 1) * limit).limit(limit).all()
 
@@ -868,7 +964,7 @@ async def get_categories(
 
 # 2. GET CATEGORY DETAIL
 @admin_router.get("/categories/{category_id}", response_model=APIResponse[CategoryResponse])
-async def get_category_detail(category_id: int, db: Session = Depends(get_db)):
+def get_category_detail(category_id: int, db: Session = Depends(get_db)):
     cat = db.query(ProductSubcategory).filter(ProductSubcategory.ProductSubcategoryID == category_id).first()
     if not cat: 
         raise HTTPException(404, "Category not found")
@@ -885,7 +981,7 @@ async def get_category_detail(category_id: int, db: Session = Depends(get_db)):
 
 # 3. CREATE CATEGORY
 @admin_router.post("/categories", response_model=APIResponse)
-async def create_category(payload: CategoryCreate, db: Session = Depends(get_db)):
+def create_category(payload: CategoryCreate, db: Session = Depends(get_db)):
     # Check trùng tên
     if db.query(ProductSubcategory).filter(ProductSubcategory.Name == payload.name).first():
         raise HTTPException(400, "Category name already exists")
@@ -907,6 +1003,8 @@ async def create_category(payload: CategoryCreate, db: Session = Depends(get_db)
     
     db.add(new_cat)
     db.commit()
+    catalog_index.set_category_name(new_cat.ProductSubcategoryID, new_cat.Name)
+    response_cache.invalidate(CATALOG_TAG)
 
     return success_response(
         data={"id": new_cat.ProductSubcategoryID},
@@ -915,7 +1013,7 @@ async def create_category(payload: CategoryCreate, db: Session = Depends(get_db)
 
 # 4. UPDATE CATEGORY
 @admin_router.patch("/categories/{category_id}", response_model=APIResponse)
-async def update_category(
+def update_category(
     category_id: int, 
     payload: CategoryUpdate, 
     db: Session = Depends(get_db)
@@ -933,11 +1031,14 @@ async def update_category(
         cat.ModifiedDate = datetime.now()
 
     db.commit()
+    catalog_index.set_category_name(category_id, cat.Name)
+    product_search.invalidate()  # Tên danh mục nằm trong document của mọi sản phẩm thuộc danh mục
+    response_cache.invalidate(CATALOG_TAG)
     return success_response(message="Category updated successfully")
 
 # 5. DELETE CATEGORY
 @admin_router.delete("/categories/{category_id}", response_model=APIResponse)
-async def delete_category(category_id: int, db: Session = Depends(get_db)):
+def delete_category(category_id: int, db: Session = Depends(get_db)):
     cat = db.query(ProductSubcategory).filter(ProductSubcategory.ProductSubcategoryID == category_id).first()
     if not cat: 
         raise HTTPException(404, "Category not found")
@@ -954,6 +1055,8 @@ async def delete_category(category_id: int, db: Session = Depends(get_db)):
 
     db.delete(cat)
     db.commit()
+    catalog_index.set_category_name(category_id, None)
+    response_cache.invalidate(CATALOG_TAG)
 
     return success_response(message="Category deleted successfully")
 
@@ -962,38 +1065,73 @@ async def delete_category(category_id: int, db: Session = Depends(get_db)):
 # 5. CUSTOMERS
 # ==========================================
 
+def map_customer_item(c: Customer, email: Optional[str], phone: Optional[str]) -> CustomerItem:
+    return CustomerItem(
+        id=c.CustomerID,
+        full_name=f"{c.FirstName} {c.LastName}",
+        email=email,
+        phone=phone,
+        status=c.Status,
+        avatar_url=c.AvatarURL,
+        stats=None
+    )
+
 @admin_router.get("/customers", response_model=PagedResponse[CustomerItem])
-async def get_customers(
+def get_customers(
     page: int = Query(1, ge=1), limit: int = Query(10, ge=1),
-    search: Optional[str] = None, db: Session = Depends(get_db)
+    search: Optional[str] = None,
+    paging: CursorParams = Depends(cursor_params),
+    db: Session = Depends(get_db)
 ):
     q = db.query(Customer)
     if search:
         q = q.filter(or_(Customer.FirstName.ilike(f"%{search}%"), Customer.LastName.ilike(f"%{search}%")))
     
-    total = q.count()
-    
     # --- FIX: Thêm order_by trước khi offset/limit ---
-    items = q.order_by(Customer.CustomerID.desc())\
-             .offset((page-1)*limit).limit(limit).all()
+    items, meta = keyset_paginate(q, [Customer.CustomerID], page, limit, paging)
     
     res = []
     for c in items:
-        res.append(CustomerItem(
-            id=c.CustomerID,
-            full_name=f"{c.FirstName} {c.LastName}",
+        res.append(map_customer_item(
+            c,
             # Kiểm tra kỹ để tránh lỗi index nếu list rỗng
-            email=c.emails[0].EmailAddress if c.emails else None,
-            phone=c.phones[0].PhoneNumber if c.phones else None,
-            status=c.Status,
-            avatar_url=c.AvatarURL,
-            stats=None 
+            c.emails[0].EmailAddress if c.emails else None,
+            c.phones[0].PhoneNumber if c.phones else None,
         ))
         
-    return manual_paginate(res, total, page, limit)
+    return paged_response(res, meta)
+
+def first_contacts(db: Session, column, customer_ids: List[int]) -> dict:
+    """CustomerID -> giá trị đầu tiên của column (email / phone) theo thứ tự khóa chính, như c.emails[0]"""
+    table = column.class_
+    key = table.CustomerID
+    query = select(key, column).where(key.in_(customer_ids)).order_by(key, *table.__table__.primary_key.columns)
+    result = {}
+    for customer_id, value in db.execute(query):
+        result.setdefault(customer_id, value)
+    return result
+
+def iter_customer_export(search: Optional[str]):
+    """Sinh CustomerItem cho toàn bộ khách hàng (lọc search như /admin/customers), đọc theo lô EXPORT_BATCH_SIZE"""
+    with SessionLocal() as stream_db, SessionLocal() as lookup_db:
+        query = select(Customer).order_by(Customer.CustomerID.desc())
+        if search:
+            query = query.where(or_(Customer.FirstName.ilike(f"%{search}%"), Customer.LastName.ilike(f"%{search}%")))
+
+        for batch in stream_db.scalars(query.execution_options(yield_per=EXPORT_BATCH_SIZE)).partitions():
+            ids = [c.CustomerID for c in batch]
+            emails = first_contacts(lookup_db, CustomerEmailAddress.EmailAddress, ids)
+            phones = first_contacts(lookup_db, CustomerPhone.PhoneNumber, ids)
+            for c in batch:
+                yield map_customer_item(c, emails.get(c.CustomerID), phones.get(c.CustomerID))
+
+@admin_router.get("/customers/export")
+def export_customers(request: Request, search: Optional[str] = None, format: ExportFormat = "csv"):
+    """Xuất toàn bộ khách hàng ra CSV / NDJSON trong 1 request"""
+    return export_response(iter_customer_export(search), CustomerItem, format, "customers", request)
 
 @admin_router.get("/customers/{customer_id}", response_model=APIResponse[CustomerDetail])
-async def get_customer_detail(customer_id: int, db: Session = Depends(get_db)):
+def get_customer_detail(customer_id: int, db: Session = Depends(get_db)):
     c = db.query(Customer).filter(Customer.CustomerID == customer_id).first()
     if not c: raise HTTPException(404, "Customer not found")
     
@@ -1018,91 +1156,99 @@ async def get_customer_detail(customer_id: int, db: Session = Depends(get_db)):
         recent_activity=[] # Placeholder
     ))
 
+# ==========================================
+# ORDER LIST HELPERS (dùng chung cho /customers/{id}/orders và /orders)
+# ==========================================
+
+def order_union(type: str = "all", customer_id: Optional[int] = None):
+    """
+    UNION ALL SalesOrderHeader + RentalHeader (lọc theo type / khách hàng).
+    Cột: type, db_id, id_str, customer_name, created_at, status, total_amount
+    """
+    q_sales = select(
+        literal("sale").label("type"),
+        SalesOrderHeader.SalesOrderID.label("db_id"),
+        func.concat("ORD-", SalesOrderHeader.SalesOrderID).label("id_str"),
+        func.concat(Customer.FirstName, " ", Customer.LastName).label("customer_name"),
+        SalesOrderHeader.OrderDate.label("created_at"),
+        SalesOrderHeader.OrderStatus.label("status"),
+        SalesOrderHeader.TotalDue.label("total_amount")
+    ).join(Customer, Customer.CustomerID == SalesOrderHeader.CustomerID)
+
+    q_rent = select(
+        literal("rental").label("type"),
+        RentalHeader.RentalID.label("db_id"),
+        func.concat("RENT-", RentalHeader.RentalID).label("id_str"),
+        func.concat(Customer.FirstName, " ", Customer.LastName).label("customer_name"),
+        RentalHeader.RentalDate.label("created_at"),
+        func.cast(RentalHeader.Status, String).label("status"), # Cast int status to string for union compat
+        RentalHeader.TotalDue.label("total_amount")
+    ).join(Customer, Customer.CustomerID == RentalHeader.CustomerID)
+
+    if customer_id is not None:
+        q_sales = q_sales.where(SalesOrderHeader.CustomerID == customer_id)
+        q_rent = q_rent.where(RentalHeader.CustomerID == customer_id)
+
+    branches = [q for t, q in (("sale", q_sales), ("rental", q_rent)) if type in ("all", t)]
+    return (union_all(*branches) if len(branches) > 1 else branches[0]).subquery("orders_union")
+
+def paginate_orders(db: Session, orders, page: int, limit: int, paging: CursorParams):
+    """
+    Phân trang danh sách đơn hợp nhất, mới nhất trước; hòa ngày thì theo (type, db_id) để thứ tự ổn định.
+    Trả về (rows, PaginationMeta)
+    """
+    sort_key = [orders.c.created_at, orders.c.type, orders.c.db_id]
+    return keyset_paginate(db.query(orders), sort_key, page, limit, paging)
+
+def parse_rental_status(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
 @admin_router.get("/customers/{customer_id}/orders", response_model=PagedResponse[OrderListItem])
-async def get_customer_orders(
+def get_customer_orders(
     customer_id: int,
     page: int = Query(1, ge=1),
     limit: int = Query(10, ge=1),
     type: Literal['all', 'sale', 'rental'] = 'all',
+    paging: CursorParams = Depends(cursor_params),
     db: Session = Depends(get_db)
 ):
     # Check Customer exist
     cus = db.query(Customer).filter(Customer.CustomerID == customer_id).first()
     if not cus: raise HTTPException(404, "Customer not found")
 
-    orders_list = []
-
-    # 1. Query Sales Orders
-    if type in ['all', 'sale']:
-        sales = db.query(SalesOrderHeader).filter(SalesOrderHeader.CustomerID == customer_id).all()
-        for s in sales:
-            orders_list.append({
-                "obj": s,
-                "date": s.OrderDate,
-                "type": "sale"
-            })
-
-    # 2. Query Rental Orders
-    if type in ['all', 'rental']:
-        rentals = db.query(RentalHeader).filter(RentalHeader.CustomerID == customer_id).all()
-        for r in rentals:
-            orders_list.append({
-                "obj": r,
-                "date": r.RentalDate,
-                "type": "rental"
-            })
-
-    # 3. Sort & Paginate in Python
-    # Vì hợp nhất 2 nguồn dữ liệu khác nhau nên sort python sẽ dễ xử lý hơn query Union phức tạp
-    # Với lịch sử đơn hàng của 1 khách (thường < 1000 đơn), hiệu năng Python sort vẫn rất nhanh.
-    
-    # Sắp xếp mới nhất trước
-    orders_list.sort(key=lambda x: x["date"], reverse=True)
-    
-    total_items = len(orders_list)
-    
-    # Slice cho phân trang
-    start = (page - 1) * limit
-    end = start + limit
-    paged_items = orders_list[start:end]
+    # UNION ALL Sales + Rentals của khách, sort & phân trang ngay trong SQL Server (keyset theo cursor)
+    orders = order_union(type, customer_id=customer_id)
+    rows, meta = paginate_orders(db, orders, page, limit, paging)
 
-    # 4. Map to Schema
+    # Map to Schema
+    stt_map = {1: "Active", 2: "Completed", 3: "Overdue", 4: "Cancelled"}
     results = []
-    for item in paged_items:
-        obj = item["obj"]
-        o_type = item["type"]
-        
-        if o_type == "sale":
-            # Sales Mapping
-            stt_label = str(obj.OrderStatus) # VD: Shipped, Cancelled
-            total = obj.TotalDue
-            o_id_str = f"ORD-{obj.SalesOrderID}"
-            db_id = obj.SalesOrderID
+    for row in rows:
+        if row.type == "sale":
+            stt_label = str(row.status) # VD: Shipped, Cancelled
         else:
-            # Rental Mapping
             # Map status int -> label
-            stt_map = {1: "Active", 2: "Completed", 3: "Overdue", 4: "Cancelled"}
-            stt_label = stt_map.get(obj.Status, "Unknown")
-            total = obj.TotalDue
-            o_id_str = f"RENT-{obj.RentalID}"
-            db_id = obj.RentalID
+            stt_label = stt_map.get(parse_rental_status(row.status), "Unknown")
 
         results.append(OrderListItem(
-            id=o_id_str,
-            db_id=db_id,
-            type=o_type,
+            id=row.id_str,
+            db_id=row.db_id,
+            type=row.type,
             customer_name=f"{cus.FirstName} {cus.LastName}",
-            created_at=item["date"],
+            created_at=row.created_at,
             status=stt_label, # Raw status or Label
             status_label=stt_label,
-            total_amount=total
+            total_amount=row.total_amount
         ))
 
-    return manual_paginate(results, total_items, page, limit)
+    return paged_response(results, meta)
 
 # 4. PATCH - UPDATE CUSTOMER STATUS
 @admin_router.patch("/customers/{customer_id}", response_model=APIResponse)
-async def update_customer(
+def update_customer(
     customer_id: int, 
     payload: CustomerUpdate, 
     db: Session = Depends(get_db)
@@ -1130,84 +1276,62 @@ async def update_customer(
 # 6. ORDERS (Unified Sales & Rental)
 # ==========================================
 
+def map_order_item(row) -> OrderListItem:
+    """Dòng của order_union() -> OrderListItem (dùng cho list + export)"""
+    # Map Status Label
+    stt = row.status
+    if row.type == "rental":
+        # DB stores int: 1=Active, 2=Completed
+        stt = "Active" if str(row.status) == "1" else "Completed"
+
+    return OrderListItem(
+        id=row.id_str,
+        db_id=row.db_id,
+        type=row.type,
+        customer_name=row.customer_name,
+        created_at=row.created_at,
+        status=str(row.status),
+        status_label=stt,
+        total_amount=row.total_amount
+    )
+
 @admin_router.get("/orders", response_model=PagedResponse[OrderListItem])
-async def get_orders(
+def get_orders(
     type: str = Query("all", enum=["all", "sale", "rental"]),
     page: int = Query(1, ge=1),
     limit: int = Query(10, ge=1),
     search: Optional[str] = None,
+    paging: CursorParams = Depends(cursor_params),
     db: Session = Depends(get_db)
 ):
-    # Strategy: Build 2 subqueries then Union
-    # Select cols: id_str, db_id, type, customer, date, status, total
-    
-    q_sales = db.query(
-        literal("sale").label("type"),
-        SalesOrderHeader.SalesOrderID.label("db_id"),
-        func.concat("ORD-", SalesOrderHeader.SalesOrderID).label("id_str"),
-        func.concat(Customer.FirstName, " ", Customer.LastName).label("customer_name"),
-        SalesOrderHeader.OrderDate.label("created_at"),
-        SalesOrderHeader.OrderStatus.label("status"),
-        SalesOrderHeader.TotalDue.label("total_amount")
-    ).join(Customer, Customer.CustomerID == SalesOrderHeader.CustomerID)
+    # UNION ALL Sales + Rentals, sort & phân trang trong SQL Server (keyset theo cursor)
+    orders = order_union(type)
+    items, meta = paginate_orders(db, orders, page, limit, paging)
 
-    q_rent = db.query(
-        literal("rental").label("type"),
-        RentalHeader.RentalID.label("db_id"),
-        func.concat("RENT-", RentalHeader.RentalID).label("id_str"),
-        func.concat(Customer.FirstName, " ", Customer.LastName).label("customer_name"),
-        RentalHeader.RentalDate.label("created_at"),
-        func.cast(RentalHeader.Status, String).label("status"), # Cast int status to string for union compat
-        RentalHeader.TotalDue.label("total_amount")
-    ).join(Customer, Customer.CustomerID == RentalHeader.CustomerID)
+    # Map to Schema
+    res_data = [map_order_item(row) for row in items]
 
-    # Filter Type
-    final_query = None
-    if type == "sale":
-        final_query = q_sales
-    elif type == "rental":
-        final_query = q_rent
-    else:
-        final_query = union_all(q_sales, q_rent).alias("orders_union")
-        # Need to select from alias to apply limit/offset on result
-        final_query = db.query(final_query)
+    return paged_response(res_data, meta)
 
-    # Note: Search on Union is tricky, applied best on subqueries or wrapped query.
-    # For brevity, implementing basic pagination on the union result.
-    
-    total = final_query.count()
-    # Sort by created_at desc
-    if type == "all":
-        final_query = final_query.order_by(desc("created_at"))
-    else:
-        final_query = final_query.order_by(desc("created_at" if type=="sale" else "created_at")) # Name clash in simple queries resolved by ORM usually
-        
-    items = final_query.offset((page-1)*limit).limit(limit).all()
-    
-    # Map to Schema
-    res_data = []
-    for row in items:
-        # Map Status Label
-        stt = row.status
-        if row.type == "rental":
-            # DB stores int: 1=Active, 2=Completed
-            stt = "Active" if str(row.status) == "1" else "Completed"
-        
-        res_data.append(OrderListItem(
-            id=row.id_str,
-            db_id=row.db_id,
-            type=row.type,
-            customer_name=row.customer_name,
-            created_at=row.created_at,
-            status=str(row.status),
-            status_label=stt,
-            total_amount=row.total_amount
-        ))
+def iter_order_export(type: str):
+    """Sinh OrderListItem cho toàn bộ đơn (cùng thứ tự với /admin/orders), 1 cursor đọc theo lô EXPORT_BATCH_SIZE"""
+    orders = order_union(type)
+    query = select(orders).order_by(orders.c.created_at.desc(), orders.c.type.desc(), orders.c.db_id.desc())
+    with SessionLocal() as db:
+        for row in db.execute(query.execution_options(yield_per=EXPORT_BATCH_SIZE)):
+            yield map_order_item(row)
 
-    return manual_paginate(res_data, total, page, limit)
+@admin_router.get("/orders/export")
+def export_orders(
+    request: Request,
+    type: str = Query("all", enum=["all", "sale", "rental"]),
+    format: ExportFormat = "csv",
+):
+    """Xuất toàn bộ lịch sử đơn (bán + thuê) ra CSV / NDJSON trong 1 request"""
+    return export_response(iter_order_export(type), OrderListItem, format, "orders", request)
 
 @admin_router.get("/orders/{order_id}", response_model=APIResponse[OrderDetailData])
-async def get_order_detail(
+def get_order_detail(
     order_id: int, 
     type: str = Query(..., enum=["sale", "rental"], description="Loại đơn hàng: 'sale' hoặc 'rental'"),
     db: Session = Depends(get_db)
@@ -1222,11 +1346,8 @@ async def get_order_detail(
         for d in order.details:
             # Lấy ảnh sản phẩm (chọn ảnh đầu tiên hoặc None)
             # Lưu ý: d.product.images là list, cần check tồn tại
-            img_url = None
-            if d.product.images:
-                # Ưu tiên ảnh chính, nếu không có lấy ảnh đầu
-                img_obj = next((img for img in d.product.images if img.IsPrimary), d.product.images[0])
-                img_url = img_obj.ImageURL
+            # Ưu tiên ảnh chính, nếu không có lấy ảnh đầu
+            img_url = pick_thumbnail(d.product.images)
 
             items.append(OrderItemDetail(
                 product_id=d.ProductID,
@@ -1267,10 +1388,7 @@ async def get_order_detail(
         items = []
         for d in rent.details:
             # Lấy ảnh
-            img_url = None
-            if d.product.images:
-                img_obj = next((img for img in d.product.images if img.IsPrimary), d.product.images[0])
-                img_url = img_obj.ImageURL
+            img_url = pick_thumbnail(d.product.images)
 
             items.append(OrderItemDetail(
                 product_id=d.ProductID,
@@ -1309,7 +1427,7 @@ async def get_order_detail(
     return success_response(data)
 
 @admin_router.patch("/orders/{order_id}/status", response_model=APIResponse)
-async def update_order_status(
+def update_order_status(
     order_id: int, 
     payload: OrderStatusUpdate,
     type: str = Query(..., enum=["sale", "rental"]),
@@ -1336,6 +1454,8 @@ async def update_order_status(
     if type == "sale":
         order = db.query(SalesOrderHeader).filter(SalesOrderHeader.SalesOrderID == order_id).first()
         if not order: raise HTTPException(404, "Order not found")
+        if new_status == "Cancelled":
+            release_stock(db, order.SalesOrderID)  # Chỉ hoàn nếu đơn còn giữ kho
         order.OrderStatus = new_status
         order.ModifiedDate = datetime.now()
     else:
@@ -1353,7 +1473,7 @@ async def update_order_status(
 
 # 4. POST - REVIEW CANCELLATION (Sales Only)
 @admin_router.post("/orders/{order_id}/request-review", response_model=APIResponse)
-async def review_order_request(
+def review_order_request(
     order_id: int, 
     payload: CancellationReview, 
     type: str = Query(..., enum=["sale", "rental"]),
@@ -1377,7 +1497,8 @@ async def review_order_request(
             raise HTTPException(400, "This order has no pending request")
 
         if payload.decision == "accept":
-            # Chấp thuận -> Hủy đơn
+            # Chấp thuận -> Hủy đơn, hoàn tồn kho đã giữ lúc checkout
+            release_stock(db, order.SalesOrderID)
             order.OrderStatus = "Cancelled"
             # TODO: Trigger logic hoàn tiền ở đây
         else:
@@ -1429,7 +1550,7 @@ async def review_order_request(
 
 # 5. POST - RENTAL PREPARATION (Rental Only)
 @admin_router.post("/orders/{order_id}/rental-preparation", response_model=APIResponse)
-async def prepare_rental_item(
+def prepare_rental_item(
     order_id: int, 
     payload: RentalPreparation, 
     db: Session = Depends(get_db)
@@ -1480,16 +1601,15 @@ async def prepare_rental_item(
 # ==========================================
 
 @admin_router.get("/staffs", response_model=PagedResponse[StaffResponse])
-async def get_staffs(
+def get_staffs(
     page: int = Query(1, ge=1), 
     limit: int = Query(10, ge=1), 
+    paging: CursorParams = Depends(cursor_params),
     db: Session = Depends(get_db)
 ):
     # 1. Query DB (Có sort để fix lỗi MSSQL)
-    query = db.query(Employee).order_by(Employee.BusinessEntityID.desc())
-    
-    total_items = query.count()
-    items_db = query.offset((page - 1) * limit).limit(limit).all()
+    query = db.query(Employee)
+    items_db, meta = keyset_paginate(query, [Employee.BusinessEntityID], page, limit, paging)
 
     # 2. Map dữ liệu
     results = []
@@ -1525,10 +1645,10 @@ async def get_staffs(
             avatar_url=None
         ))
 
-    return manual_paginate(results, total_items, page, limit)
+    return paged_response(results, meta)
 
 @admin_router.post("/staffs", response_model=APIResponse)
-async def create_staff(payload: StaffCreateRequest, db: Session = Depends(get_db)):
+def create_staff(payload: StaffCreateRequest, db: Session = Depends(get_db)):
     # 1. Check Email trùng
     if db.query(Employee).filter(Employee.EmailAddress == payload.email).first():
         raise HTTPException(status_code=400, detail="Email already exists")
@@ -1582,7 +1702,7 @@ async def create_staff(payload: StaffCreateRequest, db: Session = Depends(get_db
     )
 
 @admin_router.get("/staffs/{staff_id}", response_model=APIResponse[StaffResponse])
-async def get_staff_detail(staff_id: str, db: Session = Depends(get_db)):
+def get_staff_detail(staff_id: str, db: Session = Depends(get_db)):
     # Parse staff_id from either integer or 'STF-XXX' format
     parsed_id = parse_staff_id(staff_id)
     emp = db.query(Employee).filter(Employee.BusinessEntityID == parsed_id).first()
@@ -1621,7 +1741,7 @@ async def get_staff_detail(staff_id: str, db: Session = Depends(get_db)):
 
 # 4. PATCH - UPDATE STAFF
 @admin_router.patch("/staffs/{staff_id}", response_model=APIResponse)
-async def update_staff(
+def update_staff(
     staff_id: str, 
     payload: StaffUpdateRequest, 
     db: Session = Depends(get_db)
@@ -1662,7 +1782,7 @@ async def update_staff(
 
 # 5. DELETE STAFF
 @admin_router.delete("/staffs/{staff_id}", response_model=APIResponse)
-async def delete_staff(staff_id: str, db: Session = Depends(get_db)):
+def delete_staff(staff_id: str, db: Session = Depends(get_db)):
     # Parse staff_id from either integer or 'STF-XXX' format
     parsed_id = parse_staff_id(staff_id)
     emp = db.query(Employee).filter(Employee.BusinessEntityID == parsed_id).first()
@@ -1690,7 +1810,7 @@ async def delete_staff(staff_id: str, db: Session = Depends(get_db)):
 
 # 1. GET SETTINGS
 @admin_router.get("/settings/rental", response_model=APIResponse[RentalSettingsData])
-async def get_rental_settings(db: Session = Depends(get_db)):
+def get_rental_settings(db: Session = Depends(get_db)):
     # Luôn lấy config ID = 1
     config = db.query(RentalConfiguration).filter(RentalConfiguration.ConfigID == 1).first()
     
@@ -1717,7 +1837,7 @@ async def get_rental_settings(db: Session = Depends(get_db)):
 
 # 2. UPDATE SETTINGS
 @admin_router.patch("/settings/rental", response_model=APIResponse)
-async def update_rental_settings(
+def update_rental_settings(
     payload: RentalSettingsUpdate, 
     db: Session = Depends(get_db)
 ):
@@ -1756,23 +1876,22 @@ async def update_rental_settings(
 
 # 1. GET LIST FAQS
 @admin_router.get("/faqs", response_model=PagedResponse[FAQResponse])
-async def get_faqs(
+def get_faqs(
     page: int = Query(1, ge=1),
     limit: int = Query(10, ge=1),
     search: Optional[str] = None,
     status: Optional[str] = Query(None, enum=["active", "inactive"]),
+    paging: CursorParams = Depends(cursor_params),
     db: Session = Depends(get_db)
 ):
     query = db.query(FAQ)
 
-    # Filter Search
+    # Filter Search (full-text index trên Question/Keywords/Answer)
     if search:
-        search_term = f"%{search}%"
-        query = query.filter(or_(
-            FAQ.Question.ilike(search_term),
-            FAQ.Answer.ilike(search_term),
-            FAQ.Keywords.ilike(search_term)
-        ))
+        faq_ids = [faq_id for faq_id, _ in faq_search.ensure_loaded(db).search(search)]
+        if not faq_ids:
+            return manual_paginate([], 0, page, limit)
+        query = query.filter(FAQ.FAQID.in_(faq_ids))
 
     # Filter Status
     if status:
@@ -1780,9 +1899,7 @@ async def get_faqs(
         query = query.filter(FAQ.IsActive == is_active)
 
     # Pagination (Sort by ID desc)
-    total_items = query.count()
-    items_db = query.order_by(FAQ.FAQID.desc())\
-                    .offset((page - 1) * limit).limit(limit).all()
+    items_db, meta = keyset_paginate(query, [FAQ.FAQID], page, limit, paging)
 
     # Map Data
     results = []
@@ -1807,18 +1924,17 @@ async def get_faqs(
             status_label=stt_lbl
         ))
 
-    return manual_paginate(results, total_items, page, limit)
+    return paged_response(results, meta)
 
 # 2. CREATE FAQ
 @admin_router.post("/faqs", response_model=APIResponse)
-async def create_faq(payload: FAQCreate, db: Session = Depends(get_db)):
-    # FastAPI đã decode JSON đúng UTF-8, chỉ cần đảm bảo là string
-    question = payload.question if isinstance(payload.question, str) else str(payload.question)
-    answer = payload.answer if isinstance(payload.answer, str) else str(payload.answer)
+def create_faq(payload: FAQCreate, db: Session = Depends(get_db)):
+    # Text đã được kiểm tra / chuẩn hóa NFC ở schema (CleanStr)
+    question = payload.question
+    answer = payload.answer
     
     # Convert List -> String (key1,key2)
-    keywords_list = [k if isinstance(k, str) else str(k) for k in payload.keywords] if payload.keywords else []
-    kw_str = ",".join(keywords_list)
+    kw_str = ",".join(payload.keywords) if payload.keywords else ""
     
     is_active = True if payload.status == "active" else False
 
@@ -1832,12 +1948,14 @@ async def create_faq(payload: FAQCreate, db: Session = Depends(get_db)):
     
     db.add(new_faq)
     db.commit()
+    faq_search.refresh(db, new_faq.FAQID)
+    response_cache.invalidate(FAQS_TAG)
 
     return success_response(message="FAQ created successfully")
 
 # 3. GET FAQ DETAIL
 @admin_router.get("/faqs/{faq_id}", response_model=APIResponse[FAQResponse])
-async def get_faq_detail(faq_id: str, db: Session = Depends(get_db)):
+def get_faq_detail(faq_id: str, db: Session = Depends(get_db)):
     # Parse faq_id from either integer or 'FAQ-XXX' format
     parsed_id = parse_faq_id(faq_id)
     f = db.query(FAQ).filter(FAQ.FAQID == parsed_id).first()
@@ -1860,29 +1978,25 @@ async def get_faq_detail(faq_id: str, db: Session = Depends(get_db)):
 
 # 4. UPDATE FAQ
 @admin_router.patch("/faqs/{faq_id}", response_model=APIResponse)
-async def update_faq(
+def update_faq(
     faq_id: str, 
     payload: FAQUpdate, 
     db: Session = Depends(get_db)
 ):
-    # Đảm bảo tất cả string được encode đúng UTF-8
-    from ...helper import ensure_utf8_string
-    
     # Parse faq_id from either integer or 'FAQ-XXX' format
     parsed_id = parse_faq_id(faq_id)
     f = db.query(FAQ).filter(FAQ.FAQID == parsed_id).first()
     if not f: raise HTTPException(404, "FAQ not found")
 
-    # Normalize strings trước khi lưu
+    # Text đã được kiểm tra / chuẩn hóa NFC ở schema (CleanStr)
     if payload.question is not None: 
-        f.Question = ensure_utf8_string(payload.question)
+        f.Question = payload.question
     if payload.answer is not None: 
-        f.Answer = ensure_utf8_string(payload.answer)
+        f.Answer = payload.answer
     
     # Update Keywords
     if payload.keywords is not None:
-        keywords_list = [ensure_utf8_string(k) for k in payload.keywords]
-        f.Keywords = ",".join(keywords_list)
+        f.Keywords = ",".join(payload.keywords)
         
     # Update Status
     if payload.status is not None:
@@ -1890,12 +2004,14 @@ async def update_faq(
 
     f.ModifiedDate = datetime.now()
     db.commit()
+    faq_search.refresh(db, parsed_id)
+    response_cache.invalidate(FAQS_TAG)
 
     return success_response(message="FAQ updated successfully")
 
 # 5. DELETE FAQ
 @admin_router.delete("/faqs/{faq_id}", response_model=APIResponse)
-async def delete_faq(faq_id: str, db: Session = Depends(get_db)):
+def delete_faq(faq_id: str, db: Session = Depends(get_db)):
     # Parse faq_id from either integer or 'FAQ-XXX' format
     parsed_id = parse_faq_id(faq_id)
     f = db.query(FAQ).filter(FAQ.FAQID == parsed_id).first()
@@ -1903,5 +2019,7 @@ async def delete_faq(faq_id: str, db: Session = Depends(get_db)):
 
     db.delete(f)
     db.commit()
+    faq_search.remove(parsed_id)
+    response_cache.invalidate(FAQS_TAG)
 
     return success_response(message="FAQ deleted successfully")
\ No newline at end of file
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, EmailStr, validator, ConfigDict
-from typing import List, Optional, Union, Literal
+from typing import Dict, List, Optional, Union, Literal
 from datetime import date, datetime
 from decimal import Decimal
 from app.helper import *
@@ -69,19 +69,56 @@ class ReportData(BaseModel):
     top_selling_products: List[TopProductItem]
     top_rented_products: List[TopProductItem]
 
+# --- Connection pool metrics ---
+class LatencyHistogram(BaseModel):
+    count: int
+    avg_ms: float
+    max_ms: float
+    buckets: Dict[str, int]  # "<=10": số lần <= 10ms, ...
+
+class PoolStatus(BaseModel):
+    pool: str
+    size: int
+    max_overflow: int
+    checked_out: int
+    idle: int
+    overflow: int
+
+class PasswordHashMetrics(BaseModel):
+    workers: int            # Số process argon2 (0 = chạy trong threadpool)
+    concurrency: int        # Số job hash / verify chạy cùng lúc tối đa
+    max_queue: int          # Số request chờ tối đa trước khi trả 503
+    in_flight: int
+    waiting: int
+    peak_in_flight: int
+    peak_waiting: int
+    rejected: int
+    queue_wait: LatencyHistogram
+    run: LatencyHistogram
+
+class PoolMetricsData(BaseModel):
+    pools: List[PoolStatus]
+    peak_checked_out: int
+    overflow_checkouts: int
+    timeouts: int
+    invalidated_connections: int
+    checkout_wait: LatencyHistogram
+    session_hold_by_route: Dict[str, LatencyHistogram]
+    password_hash: PasswordHashMetrics
+
 
 # ==========================================
 # 3. CATEGORIES
 # ==========================================
 
 class CategoryBase(BaseModel):
-    name: str
+    name: CleanStr
 
 class CategoryCreate(CategoryBase):
     pass
 
 class CategoryUpdate(BaseModel):
-    name: str
+    name: CleanStr
 
 class CategoryResponse(CategoryBase):
     id: int 
@@ -108,11 +145,11 @@ class ProductPrices(BaseModel):
     rent_unit: str = "day"
 
 class ProductAttributes(BaseModel):
-    size: Optional[str] = None
-    color: Optional[str] = None
-    frame_material: Optional[str] = None
-    wheel_size: Optional[str] = None
-    condition: str = "New"
+    size: Optional[CleanStr] = None
+    color: Optional[CleanStr] = None
+    frame_material: Optional[CleanStr] = None
+    wheel_size: Optional[CleanStr] = None
+    condition: CleanStr = "New"
 
 class RentalConfigInfo(BaseModel):
     is_rentable: bool
@@ -120,8 +157,8 @@ class RentalConfigInfo(BaseModel):
 
 # --- Main Product Schemas ---
 class ProductCreateUpdate(BaseModel):
-    name: str
-    product_number: str
+    name: CleanStr
+    product_number: CleanStr
     subcategory_id: int
     
     # Pricing
@@ -140,7 +177,7 @@ class ProductCreateUpdate(BaseModel):
     rental_config: RentalConfigInfo
     rent_price: Optional[Decimal] = None
     
-    description: Optional[str] = None
+    description: Optional[CleanStr] = None
     images: List[str] 
 
 class ProductResponse(BaseModel):
@@ -202,6 +239,7 @@ class ReviewItem(BaseModel):
 class ReviewsResponseData(BaseModel):
     summary: ReviewSummary
     reviews: List[ReviewItem]
+    pagination: Optional[PaginationMeta] = None
 
 
 # ==========================================
@@ -441,15 +479,15 @@ class RentalSettingsUpdate(BaseModel):
 # ==========================================
 
 class FAQCreate(BaseModel):
-    question: str
-    answer: str
-    keywords: List[str]
+    question: CleanStr
+    answer: CleanStr
+    keywords: List[CleanStr]
     status: Literal['active', 'inactive']
 
 class FAQUpdate(BaseModel):
-    question: Optional[str] = None
-    answer: Optional[str] = None
-    keywords: Optional[List[str]] = None
+    question: Optional[CleanStr] = None
+    answer: Optional[CleanStr] = None
+    keywords: Optional[List[CleanStr]] = None
     status: Optional[Literal['active', 'inactive']] = None
 
 class FAQResponse(BaseModel):
@@ -1,31 +1,31 @@
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordRequestForm
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig, MessageType
 from sqlalchemy.orm import Session
-from sqlalchemy import or_
-from passlib.context import CryptContext
-from passlib.exc import UnknownHashError
+from sqlalchemy import String, cast, literal_column, null, or_, select, union_all
 from jose import jwt
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
+from string import Template
+from typing import Optional
 import random
 
 from app.database import get_db
 from app import models
+from app.mailer import mail_queue
+from app.otp_store import OtpRecord, PASSWORD_RESET, REGISTRATION, otp_store
+from app.password_hasher import password_hasher
 from .config import (
     LoginRequest, RegisterRequest, TokenResponse, VerifyOTPRequest, ForgotPasswordRequest, ResetPasswordRequest,
-    ACCESS_TOKEN_EXPIRE_MINUTES, SECRET_KEY, ALGORITHM, conf
+    ACCESS_TOKEN_EXPIRE_MINUTES, SECRET_KEY, ALGORITHM
 )
 load_dotenv()
 
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
 auth_router = APIRouter(tags=["Authentication"])
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    """Hash argon2 qua process pool (gọi từ handler sync / script, xem app/password_hasher.py)"""
+    return password_hasher.hash_blocking(password)
 
 def create_access_token(data: dict):
     to_encode = data.copy()
@@ -37,148 +37,163 @@ def create_access_token(data: dict):
 def generate_otp():
     return str(random.randint(100000, 999999))
 
-async def send_otp_email(email: str, otp: str, type):
-    if type == "register":
-        subject = "đăng ký tài khoản"  
-    elif type == "forgot_password":
-        subject = "thay đổi mật khẩu"
-
-    html = f"""
-    <h3>Mã xác thực {subject} Bike Go</h3>
-    <p>Mã OTP của bạn là: <strong>{otp}</strong></p>
+# Template email OTP dựng sẵn 1 lần, mỗi lần gửi chỉ thay mã OTP
+OTP_EMAILS = {
+    otp_type: (
+        f"Xác thực {purpose}",
+        Template(f"""
+    <h3>Mã xác thực {purpose} Bike Go</h3>
+    <p>Mã OTP của bạn là: <strong>$otp</strong></p>
     <p>Mã này sẽ hết hạn trong 5 phút.</p>
-    """
-    message = MessageSchema(
-        subject="Xác thực đăng ký tài khoản",
-        recipients=[email],
-        body=html,
-        subtype=MessageType.html
+    """),
     )
-    fm = FastMail(conf)
-    try:
-        await fm.send_message(message)
-    except Exception as e:
-        print(f"Lỗi gửi mail: {e}")
+    for otp_type, purpose in (("register", "đăng ký tài khoản"), ("forgot_password", "thay đổi mật khẩu"))
+}
+
+def send_otp_email(email: str, otp: str, type):
+    """Đưa email OTP vào hàng đợi gửi mail (app/mailer.py), không chờ SMTP"""
+    subject, template = OTP_EMAILS[type]
+    if not mail_queue.enqueue(email, subject, template.substitute(otp=otp)):
+        raise HTTPException(status_code=503, detail="Hệ thống gửi email đang quá tải, vui lòng thử lại sau")
 
-def verify_otp(pending_user: models.PendingRegistration, verify_data: VerifyOTPRequest, db: Session = Depends(get_db)):
+def verify_otp(pending_user: Optional[OtpRecord], verify_data: VerifyOTPRequest, db: Session = Depends(get_db)):
     if not pending_user:
         raise HTTPException(status_code=400, detail="Yêu cầu đăng ký không tồn tại hoặc đã hết hạn")
 
-    if pending_user.OTP != verify_data.otp:
+    if pending_user.otp != verify_data.otp:
         raise HTTPException(status_code=400, detail="Mã xác thực không chính xác")
 
-    time_diff = datetime.utcnow() - pending_user.CreatedAt
-    if time_diff.total_seconds() > 300:
-        db.delete(pending_user)
+    if pending_user.expired():
+        otp_store.delete(db, REGISTRATION, pending_user.email)
         db.commit()
         raise HTTPException(status_code=400, detail="Mã xác thực đã hết hạn, vui lòng đăng ký lại")
 
     return True
 
-def _authenticate_user(identifier: str, password: str, db: Session):
-    """Helper function to authenticate user and return token response"""
-    employee = db.query(models.Employee).filter(
-        or_(
-            models.Employee.EmailAddress == identifier,
-            models.Employee.PhoneNumber == identifier
-        )
-    ).first()
+def _find_login_candidates(identifier: str, db: Session):
+    """1 query: nhân viên (email / SĐT) + khách hàng (email, rồi SĐT) khớp identifier kèm hash mật khẩu,
+    sắp theo thứ tự ưu tiên như trước: nhân viên -> khách theo email -> khách theo SĐT"""
+    no_text = cast(null(), String)
+    employee_q = select(
+        literal_column("0").label("priority"),
+        literal_column("'employee'").label("kind"),
+        models.Employee.BusinessEntityID.label("id"),
+        models.Employee.PasswordSalt.label("password_hash"),
+        models.Employee.FullName.label("last_name"),
+        no_text.label("first_name"),
+        models.Employee.GroupName.label("group_name"),
+        models.Employee.EmailAddress.label("email"),
+        models.Employee.PhoneNumber.label("phone"),
+    ).where(or_(models.Employee.EmailAddress == identifier, models.Employee.PhoneNumber == identifier))
+
+    primary_email = (
+        select(models.CustomerEmailAddress.EmailAddress)
+        .where(models.CustomerEmailAddress.CustomerID == models.Customer.CustomerID)
+        .order_by(models.CustomerEmailAddress.EmailAddressID)
+        .limit(1)
+        .correlate(models.Customer)
+        .scalar_subquery()
+    )
+
+    def customer_q(priority: int, matched_ids):
+        return select(
+            literal_column(str(priority)).label("priority"),
+            literal_column("'customer'").label("kind"),
+            models.Customer.CustomerID.label("id"),
+            models.CustomerPassWord.PasswordSalt.label("password_hash"),
+            models.Customer.LastName.label("last_name"),
+            models.Customer.FirstName.label("first_name"),
+            no_text.label("group_name"),
+            primary_email.label("email"),
+            no_text.label("phone"),
+        ).outerjoin(
+            models.CustomerPassWord, models.CustomerPassWord.CustomerID == models.Customer.CustomerID
+        ).where(models.Customer.CustomerID.in_(matched_ids))
+
+    by_email = select(models.CustomerEmailAddress.CustomerID).where(models.CustomerEmailAddress.EmailAddress == identifier)
+    by_phone = select(models.CustomerPhone.CustomerID).where(models.CustomerPhone.PhoneNumber == identifier)
+
+    query = union_all(employee_q, customer_q(1, by_email), customer_q(2, by_phone)).order_by("priority", "id")
+    return db.execute(query).all()
+
+def _employee_role(group_name: str) -> str:
+    # Map GroupName to role for frontend
+    # GroupName: "Product Staff" -> role: "product_staff"
+    # GroupName: "Order Staff" -> role: "order_staff"
+    # Otherwise (Admin) -> role: "admin"
+    if group_name == "Product Staff":
+        return "product_staff"
+    if group_name == "Order Staff":
+        return "order_staff"
+    return "admin"
+
+async def _authenticate_user(identifier: str, password: str, db: Session):
+    """Helper function to authenticate user and return token response.
+    Tra cứu DB chạy trong threadpool, verify argon2 chạy trong process pool -> event loop không bị chặn."""
+    invalid_credentials = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Thông tin đăng nhập hoặc mật khẩu không chính xác",
+    )
+
+    def lookup():
+        try:
+            return _find_login_candidates(identifier, db)
+        finally:
+            db.rollback()  # Trả connection về pool trước khi verify (có thể phải chờ trong hàng đợi hash)
+
+    candidates = await run_in_threadpool(lookup)
+    employee = next((c for c in candidates if c.kind == "employee"), None)
+    customer = next((c for c in candidates if c.kind == "customer"), None)
 
     if employee:
         # Check if password hash exists and is valid
-        if not employee.PasswordSalt:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Thông tin đăng nhập hoặc mật khẩu không chính xác",
-            )
-        
-        try:
-            if verify_password(password, employee.PasswordSalt):
-                # Map GroupName to role for frontend
-                # GroupName: "Product Staff" -> role: "product_staff"
-                # GroupName: "Order Staff" -> role: "order_staff"
-                # Otherwise (Admin) -> role: "admin" or keep DepartmentName
-                if employee.GroupName == "Product Staff":
-                    role_value = "product_staff"
-                elif employee.GroupName == "Order Staff":
-                    role_value = "order_staff"
-                else:
-                    # For admin or other roles, use "admin" or DepartmentName
-                    role_value = "admin"
-                
-                token = create_access_token(data={
-                    "sub": employee.EmailAddress or employee.PhoneNumber,
-                    "role": role_value,
-                    "type": "employee",
-                    "id": employee.BusinessEntityID
-                })
-                return {
-                    "access_token": token,
-                    "token_type": "bearer",
-                    "role": role_value,
-                    "name": employee.FullName,
-                    "id": employee.BusinessEntityID
-                }
-        except UnknownHashError:
+        if not employee.password_hash:
+            raise invalid_credentials
+
+        matched = await password_hasher.verify(password, employee.password_hash)
+        if matched is None:
             # Handle cases where password hash format is invalid (e.g., old SHA256 format)
             # This can happen if staff was created with the old generate_hash function
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Định dạng mật khẩu không hợp lệ. Vui lòng liên hệ quản trị viên để đặt lại mật khẩu.",
             )
-
-    customer_id = None
-    
-    cust_email_record = db.query(models.CustomerEmailAddress).filter(
-        models.CustomerEmailAddress.EmailAddress == identifier
-    ).first()
-
-    if cust_email_record:
-        customer_id = cust_email_record.CustomerID
-    else:
-        cust_phone_record = db.query(models.CustomerPhone).filter(
-            models.CustomerPhone.PhoneNumber == identifier
-        ).first()
-        if cust_phone_record:
-            customer_id = cust_phone_record.CustomerID
-
-    if customer_id:
-        cust_pass_record = db.query(models.CustomerPassWord).filter(
-            models.CustomerPassWord.CustomerID == customer_id
-        ).first()
-
-        customer_info = db.query(models.Customer).filter(
-            models.Customer.CustomerID == customer_id
-        ).first()
-
-        if cust_pass_record and customer_info:
-            if verify_password(password, cust_pass_record.PasswordSalt):
-                primary_email_record = db.query(models.CustomerEmailAddress).filter(
-                    models.CustomerEmailAddress.CustomerID == customer_id
-                ).first()
-                sub_value = primary_email_record.EmailAddress if primary_email_record else identifier
-
-                token = create_access_token(data={
-                    "sub": sub_value,
-                    "role": "customer",
-                    "type": "customer",
-                    "id": customer_info.CustomerID
-                })
-                
-                full_name = f"{customer_info.LastName or ''} {customer_info.FirstName or ''}".strip()
-                
-                return {
-                    "access_token": token,
-                    "token_type": "bearer",
-                    "role": "customer",
-                    "name": full_name,
-                    "id": customer_info.CustomerID
-                }
-
-    raise HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Thông tin đăng nhập hoặc mật khẩu không chính xác",
-    )
+        if matched:
+            role_value = _employee_role(employee.group_name)
+            token = create_access_token(data={
+                "sub": employee.email or employee.phone,
+                "role": role_value,
+                "type": "employee",
+                "id": employee.id
+            })
+            return {
+                "access_token": token,
+                "token_type": "bearer",
+                "role": role_value,
+                "name": employee.last_name,
+                "id": employee.id
+            }
+
+    if customer and customer.password_hash:
+        if await password_hasher.verify(password, customer.password_hash):
+            token = create_access_token(data={
+                "sub": customer.email or identifier,
+                "role": "customer",
+                "type": "customer",
+                "id": customer.id
+            })
+
+            full_name = f"{customer.last_name or ''} {customer.first_name or ''}".strip()
+
+            return {
+                "access_token": token,
+                "token_type": "bearer",
+                "role": "customer",
+                "name": full_name,
+                "id": customer.id
+            }
+
+    raise invalid_credentials
 
 @auth_router.post("/auth/token", response_model=TokenResponse)
 async def login_for_access_token(
@@ -189,7 +204,7 @@ async def login_for_access_token(
     OAuth2 compatible token endpoint for Swagger UI.
     Uses form data with 'username' and 'password' fields.
     """
-    return _authenticate_user(form_data.username, form_data.password, db)
+    return await _authenticate_user(form_data.username, form_data.password, db)
 
 @auth_router.post("/auth/login", response_model=TokenResponse)
 async def login(login_data: LoginRequest, db: Session = Depends(get_db)):
@@ -197,12 +212,11 @@ async def login(login_data: LoginRequest, db: Session = Depends(get_db)):
     JSON-based login endpoint for API clients.
     Uses JSON body with 'identifier' and 'password' fields.
     """
-    return _authenticate_user(login_data.identifier, login_data.password, db)
+    return await _authenticate_user(login_data.identifier, login_data.password, db)
 
 @auth_router.post("/auth/register")
-async def register(
+def register(
     reg_data: RegisterRequest, 
-    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db)
 ):
     existing_email = db.query(models.CustomerEmailAddress).filter(
@@ -217,34 +231,18 @@ async def register(
     if existing_phone:
         raise HTTPException(status_code=400, detail="Số điện thoại này đã được sử dụng")
 
-    pending_user = db.query(models.PendingRegistration).filter(
-        models.PendingRegistration.Email == reg_data.email
-    ).first()
-
     otp_code = generate_otp()
     hashed_pwd = get_password_hash(reg_data.password)
 
-    if pending_user:
-        pending_user.Phone = reg_data.phone
-        pending_user.FirstName = reg_data.first_name
-        pending_user.LastName = reg_data.last_name
-        pending_user.PasswordHash = hashed_pwd
-        pending_user.OTP = otp_code
-        pending_user.CreatedAt = datetime.utcnow()
-    else:
-        new_pending = models.PendingRegistration(
-            Email=reg_data.email,
-            Phone=reg_data.phone,
-            FirstName=reg_data.first_name,
-            LastName=reg_data.last_name,
-            PasswordHash=hashed_pwd,
-            OTP=otp_code
-        )
-        db.add(new_pending)
-
+    otp_store.put(db, REGISTRATION, reg_data.email, otp_code, {
+        "phone": reg_data.phone,
+        "first_name": reg_data.first_name,
+        "last_name": reg_data.last_name,
+        "password_hash": hashed_pwd,
+    })
     db.commit()
 
-    background_tasks.add_task(send_otp_email, reg_data.email, otp_code, type="register")
+    send_otp_email(reg_data.email, otp_code, type="register")
 
     return {
         "message": "Mã xác thực đã được gửi đến email. Vui lòng kiểm tra và nhập mã để hoàn tất.", 
@@ -252,44 +250,42 @@ async def register(
     }
 
 @auth_router.post("/auth/verify_registration")
-async def verify_registration(verify_data: VerifyOTPRequest, db: Session = Depends(get_db)):
-    pending_user = db.query(models.PendingRegistration).filter(
-        models.PendingRegistration.Email == verify_data.email
-    ).first()
+def verify_registration(verify_data: VerifyOTPRequest, db: Session = Depends(get_db)):
+    pending_user = otp_store.get(db, REGISTRATION, verify_data.email)
 
     is_verified_otp = verify_otp(pending_user, verify_data, db)
 
     try:
         new_customer = models.Customer(
-            FirstName=pending_user.FirstName,
-            LastName=pending_user.LastName,
+            FirstName=pending_user.data["first_name"],
+            LastName=pending_user.data["last_name"],
         )
         db.add(new_customer)
         db.flush()
 
         new_email = models.CustomerEmailAddress(
             CustomerID=new_customer.CustomerID,
-            EmailAddress=pending_user.Email,
+            EmailAddress=pending_user.email,
             ModifiedDate=datetime.now()
         )
         db.add(new_email)
 
         new_pass = models.CustomerPassWord(
             CustomerID=new_customer.CustomerID,
-            PasswordSalt=pending_user.PasswordHash,
+            PasswordSalt=pending_user.data["password_hash"],
             ModifiedDate=datetime.now()
         )
         db.add(new_pass)
 
         new_phone = models.CustomerPhone(
             CustomerID=new_customer.CustomerID,
-            PhoneNumber=pending_user.Phone,
+            PhoneNumber=pending_user.data["phone"],
             PhoneNumberTypeID=1,
             ModifiedDate=datetime.now()
         )
         db.add(new_phone)
 
-        db.delete(pending_user)
+        otp_store.delete(db, REGISTRATION, pending_user.email)
 
         db.commit()
 
@@ -301,9 +297,8 @@ async def verify_registration(verify_data: VerifyOTPRequest, db: Session = Depen
         raise HTTPException(status_code=500, detail="Lỗi hệ thống khi tạo tài khoản")
 
 @auth_router.post("/auth/forgot_password")
-async def forgot_password(
+def forgot_password(
     request: ForgotPasswordRequest, 
-    background_tasks: BackgroundTasks, 
     db: Session = Depends(get_db)
 ):
 
@@ -316,46 +311,25 @@ async def forgot_password(
 
     otp_code = generate_otp()
 
-    existing_token = db.query(models.PasswordResetToken).filter(
-        models.PasswordResetToken.Email == request.email,
-        models.PasswordResetToken.IsUsed == False
-    ).first()
-
-    if existing_token:
-        existing_token.OTP = otp_code
-        existing_token.CreatedAt = datetime.utcnow()
-    else:
-        new_token = models.PasswordResetToken(
-            Email=request.email,
-            OTP=otp_code,
-            CreatedAt=datetime.utcnow(),
-            IsUsed=False
-        )
-        db.add(new_token)
-    
+    otp_store.put(db, PASSWORD_RESET, request.email, otp_code)
     db.commit()
 
-    background_tasks.add_task(send_otp_email, request.email, otp_code, type="forgot_password")
+    send_otp_email(request.email, otp_code, type="forgot_password")
 
     return {"message": "Mã xác thực đã được gửi đến email của bạn."}
 
 @auth_router.post("/auth/reset_password")
-async def reset_password(
+def reset_password(
     request: ResetPasswordRequest, 
     db: Session = Depends(get_db)
 ):
 
-    reset_token = db.query(models.PasswordResetToken).filter(
-        models.PasswordResetToken.Email == request.email,
-        models.PasswordResetToken.OTP == request.otp,
-        models.PasswordResetToken.IsUsed == False
-    ).first()
+    reset_token = otp_store.get(db, PASSWORD_RESET, request.email)
 
-    if not reset_token:
+    if not reset_token or reset_token.otp != request.otp:
         raise HTTPException(status_code=400, detail="Mã xác thực không chính xác hoặc đã được sử dụng")
 
-    time_diff = datetime.utcnow() - reset_token.CreatedAt
-    if time_diff.total_seconds() > 300:
+    if reset_token.expired():
         raise HTTPException(status_code=400, detail="Mã xác thực đã hết hạn, vui lòng yêu cầu lại")
 
     cust_email_record = db.query(models.CustomerEmailAddress).filter(
@@ -382,7 +356,7 @@ async def reset_password(
         )
         db.add(new_pass_entry)
 
-    reset_token.IsUsed = True
+    otp_store.delete(db, PASSWORD_RESET, request.email)  # OTP chỉ dùng 1 lần
     
     db.commit()
 
@@ -1,5 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.security import OAuth2PasswordBearer
+from fastapi import APIRouter, Depends
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 import google.generativeai as genai
@@ -7,34 +6,15 @@ import json
 import re
 from datetime import datetime
 from typing import List, Optional
-from jose import JWTError, jwt
 
 from app.database import get_db
 from app.models import Product, Cart, CartItem, FAQ, ProductCategory
+from app.cart_summary import CartLine, record_cart_change
+from app.search_engine import product_search
+from app.response_cache import cached_response, FAQS_TAG
+from app.chat_cache import chat_cache, prompt_fingerprint
 from .config import *
-from app.routes.auth.config import SECRET_KEY, ALGORITHM
-
-# Khai báo Scheme (đường dẫn này chỉ để Swagger UI biết nơi lấy token)
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
-
-# --- HÀM LẤY USER ID TỪ TOKEN ---
-def get_current_user_id(token: str = Depends(oauth2_scheme)) -> int:
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    try:
-        # Giải mã Token
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: int = payload.get("id") # Lấy field 'id' trong payload
-        
-        if user_id is None:
-            raise credentials_exception
-        
-        return user_id
-    except JWTError:
-        raise credentials_exception
+from app.token_cache import get_current_user_id
 
 # Configure the Generative AI client
 genai.configure(api_key=GENAI_API_KEY)
@@ -65,7 +45,8 @@ def extract_json_from_text(text_response: str) -> dict:
         print(f"JSON Parse Error: {e}")
         return {
             "intent": "irrelevant",
-            "reply_message": "Xin lỗi, hệ thống đang gặp sự cố xử lý dữ liệu."
+            "reply_message": "Xin lỗi, hệ thống đang gặp sự cố xử lý dữ liệu.",
+            "cacheable": False,  # Không lưu câu trả lời lỗi vào chat_cache
         }
 
 def execute_sql(db: Session, query: str) -> list[dict]:
@@ -111,8 +92,10 @@ def handle_auto_order(db: Session, user_id: int, order_data: dict) -> str:
     if p_id:
         product = db.query(Product).filter(Product.ProductID == p_id).first()
     if not product and p_name:
-        clean = p_name.strip().replace("–", "-").replace("—", "-")
-        product = db.query(Product).filter(Product.Name.ilike(f"%{clean}%")).first()
+        # product_search đã gộp dash "–"/"—" và bỏ dấu tiếng Việt khi chuẩn hóa
+        hits = product_search.ensure_loaded(db).search(p_name, limit=1)
+        if hits:
+            product = db.query(Product).filter(Product.ProductID == hits[0][0]).first()
 
     if not product:
         return "Xin lỗi, không tìm thấy sản phẩm nào."
@@ -140,10 +123,12 @@ def handle_auto_order(db: Session, user_id: int, order_data: dict) -> str:
     ).first()
 
     if existing_item:
+        before = CartLine.of(existing_item)
         existing_item.Quantity += quantity
         if action == "rent":
             existing_item.RentalDays = rental_days  # Update số ngày mới nhất khách nói
         # Subtotal is computed by DB, no need to set manually
+        record_cart_change(db, cart.CartID, before, CartLine.after_flush(db, existing_item))
         msg = f"Đã cập nhật số lượng **{product.Name}**."
     else:
         new_item = CartItem(
@@ -157,6 +142,7 @@ def handle_auto_order(db: Session, user_id: int, order_data: dict) -> str:
             RentalDays=rental_days if action == "rent" else None
         )
         db.add(new_item)
+        record_cart_change(db, cart.CartID, after=CartLine.after_flush(db, new_item))
         
         days_info = f" ({rental_days} ngày)" if action == "rent" else ""
         msg = f"Đã thêm **{product.Name}**{days_info} vào giỏ hàng."
@@ -178,7 +164,8 @@ def format_chat_history(history: List[ChatMessage]) -> str:
 
 # Get active FAQs for suggested questions (public endpoint)
 @chatbot_router.get("/faqs")
-async def get_active_faqs(
+@cached_response(tags=lambda params, result: [FAQS_TAG])
+def get_active_faqs(
     limit: Optional[int] = 10,
     db: Session = Depends(get_db)
 ):
@@ -205,7 +192,7 @@ async def get_active_faqs(
         return {"success": False, "data": []}
 
 @chatbot_router.post("/message", response_model=ChatResponse)
-async def chat_with_bot(
+def chat_with_bot(
     payload: ChatRequest, 
     db: Session = Depends(get_db),
     user_id: int = Depends(get_current_user_id) 
@@ -221,7 +208,14 @@ async def chat_with_bot(
     # BƯỚC B: Format System Prompt với category list
     final_system_prompt = build_system_prompt(category_list_str)
 
-    # BƯỚC C: Tạo Prompt gửi AI
+    # BƯỚC C: Câu hỏi lặp lại (chào, chính sách, FAQ gợi ý...) -> trả từ cache, không gọi AI
+    fingerprint = prompt_fingerprint(final_system_prompt, MODEL_ID)
+    has_history = bool(payload.history)
+    cached = chat_cache.lookup(user_msg, fingerprint, has_history)
+    if cached is not None:
+        return build_chat_response(db, user_id, {"intent": cached.intent, **cached.answer})
+
+    # BƯỚC D: Tạo Prompt gửi AI
     full_prompt = f"""
 {final_system_prompt}
 
@@ -236,25 +230,30 @@ USER: {user_msg}
         response = model.generate_content(full_prompt)
         
         ai_data = extract_json_from_text(response.text)
-        
-        intent = ai_data.get("intent", "chat")
+        # order_intent (thay đổi giỏ hàng) không bao giờ được cache - xem INTENT_TTLS
+        chat_cache.store(user_msg, fingerprint, has_history, ai_data)
+        return build_chat_response(db, user_id, ai_data)
+
+    except Exception as e:
+        print(f"Chatbot Error: {e}")
+        return ChatResponse(response="Hệ thống đang bận, vui lòng thử lại.", action_type="error")
 
-        # XỬ LÝ KẾT QUẢ
-        if intent == "product_search":
-            sql = ai_data.get("sql_query", "")
-            data = execute_sql(db, sql) 
-            if not data:
-                return ChatResponse(response="Không tìm thấy sản phẩm nào phù hợp.", action_type="search_empty")
-            return ChatResponse(response="Kết quả tìm kiếm:", action_type="product_list", data=data)
+def build_chat_response(db: Session, user_id: int, ai_data: dict) -> ChatResponse:
+    """Xử lý kết quả AI (hoặc kết quả lấy từ chat_cache) theo intent"""
+    intent = ai_data.get("intent", "chat")
 
-        if intent == "order_intent":
-            details = ai_data.get("order_details", {})
-            msg = handle_auto_order(db, user_id, details)
-            return ChatResponse(response=msg, action_type="order_result")
+    if intent == "product_search":
+        # Cache chỉ giữ câu SQL -> luôn chạy lại để lấy giá / tồn kho mới
+        sql = ai_data.get("sql_query", "")
+        data = execute_sql(db, sql) 
+        if not data:
+            return ChatResponse(response="Không tìm thấy sản phẩm nào phù hợp.", action_type="search_empty")
+        return ChatResponse(response="Kết quả tìm kiếm:", action_type="product_list", data=data)
 
-        # Các trường hợp khác (policy, consulting, greeting...)
-        return ChatResponse(response=ai_data.get("reply_message", "Xin lỗi, tôi chưa hiểu."), action_type="chat")
+    if intent == "order_intent":
+        details = ai_data.get("order_details", {})
+        msg = handle_auto_order(db, user_id, details)
+        return ChatResponse(response=msg, action_type="order_result")
 
-    except Exception as e:
-        print(f"Chatbot Error: {e}")
-        return ChatResponse(response="Hệ thống đang bận, vui lòng thử lại.", action_type="error")
\ No newline at end of file
+    # Các trường hợp khác (policy, consulting, greeting...)
+    return ChatResponse(response=ai_data.get("reply_message", "Xin lỗi, tôi chưa hiểu."), action_type="chat")
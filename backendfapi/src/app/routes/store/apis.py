@@ -1,50 +1,59 @@
-from fastapi import APIRouter, Depends, Query, HTTPException, status
-from fastapi.security import OAuth2PasswordBearer
+from fastapi import APIRouter, Depends, Query, HTTPException
 from sqlalchemy.orm import Session, joinedload
 from sqlalchemy import select, func, desc, and_, or_
-from typing import List, Optional
+from typing import Dict, List, Literal, Optional
 from datetime import datetime
-import uuid
 from decimal import Decimal
 
 from app.database import get_db
 from app.models import *
+from app.product_stats import product_stats, ProductStats
+from app.catalog_index import catalog_index, CatalogEntry, CatalogFilter
+from app.search_engine import product_search
+from app.checkout import place_order
+from app.cart_summary import CartLine, CartSnapshot, apply_cart_voucher, record_cart_change, rebuild_cart_summary
+from app.product_images import get_thumbnails
+from app.response_cache import cached_response, product_tag, reviews_tag, CATALOG_TAG, FEATURED_TAG
 from .config import * 
 from ...helper import *
-from app.routes.auth.config import SECRET_KEY, ALGORITHM
-from jose import JWTError, jwt
+from app.token_cache import get_current_user_id
 
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 store_router = APIRouter(prefix="/store", tags=["Store"])
 
 # ===================================================================
-# 1. HELPER QUERIES (Reused Subqueries)
+# 1. HELPERS (Product cards từ read model product_stats)
 # ===================================================================
-def get_product_aggregates():
-    """Tạo các subquery dùng chung cho Rating, Sales, Image"""
-    stmt_sales = (
-        select(SalesOrderDetail.ProductID, func.sum(SalesOrderDetail.OrderQty).label("total_sold"))
-        .group_by(SalesOrderDetail.ProductID).subquery()
-    )
-    stmt_rating = (
-        select(ProductReview.ProductID, func.avg(ProductReview.Rating).label("avg_rating"))
-        .group_by(ProductReview.ProductID).subquery()
-    )
-    stmt_image = (
-        select(ProductImage.ProductID, ProductImage.ImageURL)
-        .where(ProductImage.IsPrimary == True).subquery()
-    )
-    return stmt_sales, stmt_rating, stmt_image
-
-def map_row_to_product_card(row):
-    """Helper map DB Row -> Pydantic Schema"""
+PLACEHOLDER_THUMBNAIL = "https://via.placeholder.com/300?text=No+Image"
+
+CARD_COLUMNS = (
+    Product.ProductID, Product.Name, Product.ListPrice,
+    Product.Condition, Product.Size, Product.Color,
+    Product.RentPrice, Product.IsRentable
+)
+
+def map_row_to_product_card(row, stats: ProductStats, placeholder: str = PLACEHOLDER_THUMBNAIL):
+    """Helper map DB Row (hoặc CatalogEntry) + ProductStats -> Pydantic Schema"""
+    if isinstance(row, CatalogEntry):
+        return ProductCard(
+            product_id=row.product_id,
+            name=row.name,
+            price=row.list_price,
+            thumbnail=stats.primary_image_url or placeholder,
+            average_rating=round(stats.avg_rating, 1),
+            total_sold=stats.total_sold,
+            condition=row.condition,
+            size=row.size,
+            color=row.color,
+            rent_price=row.rent_price,
+            is_rentable=row.is_rentable
+        )
     return ProductCard(
         product_id=row.ProductID,
         name=row.Name,
         price=row.ListPrice,
-        thumbnail=row.thumbnail if row.thumbnail else "https://via.placeholder.com/300?text=No+Image",
-        average_rating=round(float(row.average_rating), 1) if getattr(row, 'average_rating', None) else 0.0,
-        total_sold=int(row.total_sold) if getattr(row, 'total_sold', None) else 0,
+        thumbnail=stats.primary_image_url or placeholder,
+        average_rating=round(stats.avg_rating, 1),
+        total_sold=stats.total_sold,
         condition=getattr(row, 'Condition', None),
         size=getattr(row, 'Size', None),
         color=getattr(row, 'Color', None),
@@ -52,132 +61,154 @@ def map_row_to_product_card(row):
         is_rentable=getattr(row, 'IsRentable', False) if getattr(row, 'IsRentable', None) is not None else False
     )
 
+def load_product_cards(db: Session, product_ids: List[int], placeholder: str = PLACEHOLDER_THUMBNAIL) -> List[ProductCard]:
+    """Lấy cột sản phẩm theo danh sách ID (giữ nguyên thứ tự) rồi ghép số liệu từ product_stats"""
+    if not product_ids:
+        return []
+    rows = db.execute(select(*CARD_COLUMNS).where(Product.ProductID.in_(product_ids))).all()
+    by_id = {row.ProductID: row for row in rows}
+    return [
+        map_row_to_product_card(by_id[pid], product_stats.get(pid), placeholder)
+        for pid in product_ids if pid in by_id
+    ]
+
 # ===================================================================
 # 2. PRODUCT ENDPOINTS
 # ===================================================================
 
+def card_tags(result) -> List[str]:
+    """Tag product:{id} cho từng card trong response (đổi giá / tên sản phẩm -> evict)"""
+    return [product_tag(card.id) for card in result.data] if result is not None else []
+
 @store_router.get("/products/featured", response_model=APIResponse[List[ProductCard]])
+@cached_response(tags=lambda params, result: [FEATURED_TAG, *card_tags(result)])
 def get_featured_products(db: Session = Depends(get_db)):
-    stmt_sales, stmt_rating, stmt_image = get_product_aggregates()
+    product_stats.ensure_loaded(db)
 
-    query = (
-        select(
-            Product.ProductID, Product.Name, Product.ListPrice,
-            Product.RentPrice, Product.IsRentable,
-            stmt_image.c.ImageURL.label("thumbnail"),
-            func.coalesce(stmt_rating.c.avg_rating, 0).label("average_rating"),
-            func.coalesce(stmt_sales.c.total_sold, 0).label("total_sold")
-        )
-        .outerjoin(stmt_sales, Product.ProductID == stmt_sales.c.ProductID)
-        .outerjoin(stmt_rating, Product.ProductID == stmt_rating.c.ProductID)
-        .outerjoin(stmt_image, Product.ProductID == stmt_image.c.ProductID)
-        .order_by(desc("total_sold"))
-        .limit(4)
-    )
+    product_ids = product_stats.top_selling(4)
+    if len(product_ids) < 4:
+        # Chưa đủ 4 sản phẩm có lượt bán -> bổ sung sản phẩm khác (total_sold = 0)
+        filler = select(Product.ProductID).order_by(Product.ProductID).limit(4 - len(product_ids))
+        if product_ids:
+            filler = filler.where(Product.ProductID.notin_(product_ids))
+        product_ids += db.execute(filler).scalars().all()
 
-    results = db.execute(query).all()
-    data = [map_row_to_product_card(row) for row in results]
+    data = load_product_cards(db, product_ids)
     
     return success_response(data=data)
 
 
 @store_router.get("/categories", response_model=APIResponse[List[StoreCategoryItem]])
+@cached_response(tags=lambda params, result: [CATALOG_TAG])
 def get_store_categories(db: Session = Depends(get_db)):
-    """Public API: list all product subcategories (id, name) for filter drawer."""
+    """Public API: list all product subcategories (id, name, product_count) for filter drawer."""
+    catalog_index.ensure_loaded(db)
+    counts = catalog_index.category_counts()
     items = (
         db.query(ProductSubcategory)
         .order_by(ProductSubcategory.Name)
         .all()
     )
-    data = [StoreCategoryItem(id=c.ProductSubcategoryID, name=c.Name) for c in items]
+    data = [
+        StoreCategoryItem(id=c.ProductSubcategoryID, name=c.Name, product_count=counts.get(c.ProductSubcategoryID, 0))
+        for c in items
+    ]
     return success_response(data=data)
 
 
-@store_router.get("/products/search", response_model=PagedResponse[ProductCard])
-def search_products(
+def get_catalog_filter(
     category_id: Optional[int] = Query(None),
     condition: Optional[str] = Query(None),
     price_range: Optional[str] = Query(None),
     sizes: Optional[List[str]] = Query(None, alias="size"),
     colors: Optional[List[str]] = Query(None, alias="color"),
+    is_rentable: Optional[bool] = Query(None, description="Filter by rentable products"),
+) -> CatalogFilter:
+    """Dependency dùng chung cho /products/search và /products/facets"""
+    return CatalogFilter(
+        category_id=category_id, condition=condition, sizes=sizes or [], colors=colors or [],
+        is_rentable=is_rentable, price_range=price_range
+    )
+
+
+def match_catalog(
+    filters: CatalogFilter, min_rating: Optional[float], search: Optional[str],
+    relevance: Optional[Dict[int, float]] = None
+) -> List[CatalogEntry]:
+    """Lọc trên catalog_index (bitset) + product_search + product_stats, không query DB"""
+    entries = catalog_index.search(filters)
+    if search:
+        if relevance is None:
+            relevance = product_search.scores(search)
+        entries = [e for e in entries if e.product_id in relevance]
+    if min_rating:
+        entries = [e for e in entries if product_stats.get(e.product_id).avg_rating >= min_rating]
+    return entries
+
+
+@store_router.get("/products/search", response_model=PagedResponse[ProductCard])
+def search_products(
+    filters: CatalogFilter = Depends(get_catalog_filter),
     min_rating: Optional[float] = Query(None, ge=0, le=5),
     search: Optional[str] = Query(None),
-    is_rentable: Optional[bool] = Query(None, description="Filter by rentable products"),
+    sort_by: Literal["best_selling", "relevance"] = Query("best_selling", description="relevance chỉ có tác dụng khi có search"),
     page: int = Query(1, ge=1),
     limit: int = Query(12, ge=1),
     db: Session = Depends(get_db)
 ):
-    stmt_sales, stmt_rating, stmt_image = get_product_aggregates()
+    product_stats.ensure_loaded(db)
+    catalog_index.ensure_loaded(db)
+    product_search.ensure_loaded(db)
 
-    # Base Query
-    query = (
-        select(
-            Product.ProductID, Product.Name, Product.ListPrice, 
-            Product.Condition, Product.Size, Product.Color,
-            Product.RentPrice, Product.IsRentable,
-            stmt_image.c.ImageURL.label("thumbnail"),
-            func.coalesce(stmt_rating.c.avg_rating, 0).label("average_rating"),
-            func.coalesce(stmt_sales.c.total_sold, 0).label("total_sold")
-        )
-        .outerjoin(stmt_rating, Product.ProductID == stmt_rating.c.ProductID)
-        .outerjoin(stmt_sales, Product.ProductID == stmt_sales.c.ProductID)
-        .outerjoin(stmt_image, Product.ProductID == stmt_image.c.ProductID)
-    )
+    relevance = product_search.scores(search) if search else {}
+    entries = match_catalog(filters, min_rating, search, relevance)
 
-    # --- Filters ---
-    filters = []
-    if category_id: filters.append(Product.ProductSubcategoryID == category_id)
-    if condition: filters.append(Product.Condition == condition)
-    if sizes: filters.append(Product.Size.in_(sizes))
-    if colors:
-        # Case-insensitive color filter for SQL Server
-        # Create case variations to handle different case formats in database
-        color_conditions = []
-        for color in colors:
-            # Create case variations: "Blue", "blue", "BLUE", "Blue"
-            color_variations = [color, color.lower(), color.upper(), color.capitalize()]
-            for color_var in color_variations:
-                color_conditions.append(Product.Color == color_var)
-        if color_conditions:
-            filters.append(or_(*color_conditions))
-    if search: filters.append(Product.Name.ilike(f"%{search}%"))
-    if is_rentable is not None:
-        if is_rentable:
-            # Rentable Only: IsRentable == True
-            filters.append(Product.IsRentable == True)
-        else:
-            # Buy Only: IsRentable == False OR IsRentable IS NULL (default is False)
-            filters.append(or_(Product.IsRentable == False, Product.IsRentable.is_(None)))
-    
-    if price_range:
-        if price_range == "under 1000": filters.append(Product.ListPrice < 1000)
-        elif price_range == "1000-2000": filters.append(and_(Product.ListPrice >= 1000, Product.ListPrice <= 2000))
-        elif price_range == "2000-3000": filters.append(and_(Product.ListPrice >= 2000, Product.ListPrice <= 3000))
-        elif price_range == "above 3000": filters.append(Product.ListPrice > 3000)
+    # --- Pagination Logic (Sort theo total_sold trên snapshot, hòa thì theo ProductID) ---
+    if sort_by == "relevance" and search:
+        entries.sort(key=lambda e: (-relevance[e.product_id], -product_stats.get(e.product_id).total_sold, e.product_id))
+    else:
+        entries.sort(key=lambda e: (-product_stats.get(e.product_id).total_sold, e.product_id))
+    total_items = len(entries)
 
-    if min_rating:
-        filters.append(func.coalesce(stmt_rating.c.avg_rating, 0) >= min_rating)
+    offset = (page - 1) * limit
+    items = [
+        map_row_to_product_card(entry, product_stats.get(entry.product_id))
+        for entry in entries[offset:offset + limit]
+    ]
 
-    if filters:
-        query = query.where(and_(*filters))
+    return manual_paginate(items, total_items, page, limit)
 
-    # --- Pagination Logic (Manual for Complex Query) ---
-    # 1. Count Total
-    count_query = select(func.count()).select_from(query.subquery())
-    total_items = db.execute(count_query).scalar()
 
-    # 2. Get Data
-    query = query.order_by(desc("total_sold"))
-    query = query.offset((page - 1) * limit).limit(limit)
-    results = db.execute(query).all()
+@store_router.get("/products/facets", response_model=APIResponse[CatalogFacets])
+def get_product_facets(
+    filters: CatalogFilter = Depends(get_catalog_filter),
+    min_rating: Optional[float] = Query(None, ge=0, le=5),
+    search: Optional[str] = Query(None),
+    db: Session = Depends(get_db)
+):
+    """Số sản phẩm theo từng giá trị filter (cùng tham số với /products/search)"""
+    product_stats.ensure_loaded(db)
+    catalog_index.ensure_loaded(db)
+    product_search.ensure_loaded(db)
 
-    # 3. Map Data
-    items = [map_row_to_product_card(row) for row in results]
+    relevance = product_search.scores(search) if search else {}
+    within_ids = None
+    if search or min_rating:
+        # Giới hạn theo search/min_rating nhưng bỏ qua các facet để facet không tự loại chính nó
+        candidates = match_catalog(CatalogFilter(), min_rating, search, relevance)
+        within_ids = [e.product_id for e in candidates]
 
-    return manual_paginate(items, total_items, page, limit)
+    counts = catalog_index.facet_counts(filters, within_ids=within_ids)
+    total_items = len(match_catalog(filters, min_rating, search, relevance))
+    return success_response(data=CatalogFacets(total_items=total_items, **counts))
 
 
 @store_router.get("/products/{product_id}/detail", response_model=APIResponse[ProductDetail])
+@cached_response(tags=lambda params, result: [
+    product_tag(params["product_id"]),
+    # Variants lấy từ các sản phẩm cùng model -> sửa 1 variant cũng evict detail này
+    *([product_tag(v.product_id) for v in result.data.variants] if result is not None else [])
+])
 def get_product_detail(product_id: int, db: Session = Depends(get_db)):
     # 1. Query Product
     product = db.query(Product).options(
@@ -253,6 +284,7 @@ def get_product_detail(product_id: int, db: Session = Depends(get_db)):
 
 
 @store_router.get("/products/{product_id}/reviews", response_model=ProductReviewsResponse)
+@cached_response(tags=lambda params, result: [reviews_tag(params["product_id"])])
 def get_product_reviews(
     product_id: int,
     page: int = Query(1, ge=1, description="Trang hiện tại"),
@@ -316,38 +348,27 @@ def get_product_reviews(
     )
 
 @store_router.get("/products/{product_id}/similar", response_model=APIResponse[List[ProductCard]])
+@cached_response(tags=lambda params, result: [product_tag(params["product_id"]), CATALOG_TAG, *card_tags(result)])
 def get_similar_products(product_id: int, db: Session = Depends(get_db)):
     current_product = db.query(Product.ProductSubcategoryID).filter(Product.ProductID == product_id).first()
     if not current_product or not current_product.ProductSubcategoryID:
         return success_response(data=[])
 
-    stmt_image = select(ProductImage.ProductID, ProductImage.ImageURL).where(ProductImage.IsPrimary == True).subquery()
+    product_stats.ensure_loaded(db)
 
     query = (
-        select(
-            Product.ProductID, Product.Name, Product.ListPrice, 
-            Product.RentPrice, Product.IsRentable,
-            stmt_image.c.ImageURL.label("thumbnail")
-        )
-        .outerjoin(stmt_image, Product.ProductID == stmt_image.c.ProductID)
+        select(Product.ProductID)
         .where(
             Product.ProductSubcategoryID == current_product.ProductSubcategoryID,
             Product.ProductID != product_id
         )
+        .order_by(Product.ProductID)
         .limit(10)
     )
 
-    results = db.execute(query).all()
-    # Map bằng helper (chỉ cần các trường cơ bản)
-    data = [
-        ProductCard(
-            product_id=row.ProductID, name=row.Name, price=row.ListPrice,
-            thumbnail=row.thumbnail or "https://via.placeholder.com/150",
-            average_rating=0, total_sold=0, # Similar không cần tính nặng
-            rent_price=getattr(row, 'RentPrice', None),
-            is_rentable=getattr(row, 'IsRentable', False) if getattr(row, 'IsRentable', None) is not None else False
-        ) for row in results
-    ]
+    product_ids = db.execute(query).scalars().all()
+    # Rating/total_sold lấy từ snapshot nên không còn tốn thêm query
+    data = load_product_cards(db, product_ids, placeholder="https://via.placeholder.com/150")
     return success_response(data=data)
 
 
@@ -364,24 +385,6 @@ def get_or_create_cart(db: Session, customer_id: int) -> Cart:
         db.refresh(cart)
     return cart
 
-def get_current_user_id(token: str = Depends(oauth2_scheme)) -> int:
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    try:
-        # Giải mã Token
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: int = payload.get("id") # Lấy field 'id' trong payload
-        
-        if user_id is None:
-            raise credentials_exception
-        
-        return user_id
-    except JWTError:
-        raise credentials_exception
-
 # ===================================================================
 # 1. GET: Lấy giỏ hàng
 # ===================================================================
@@ -390,115 +393,83 @@ def get_current_user_id(token: str = Depends(oauth2_scheme)) -> int:
 def get_my_cart(
     buy_voucher_code: Optional[str] = Query(None, description="Voucher code for buy items"),
     rent_voucher_code: Optional[str] = Query(None, description="Voucher code for rent items"),
+    include_items: bool = Query(True, description="false: chỉ trả tổng quan (badge), không join chi tiết"),
     db: Session = Depends(get_db), 
     user_id: int = Depends(get_current_user_id)
 ):
     cart = get_or_create_cart(db, user_id)
+    snapshot = CartSnapshot.of(cart)
 
-    # Subquery lấy ảnh thumbnail
-    stmt_image = select(ProductImage.ProductID, ProductImage.ImageURL)\
-                 .where(ProductImage.IsPrimary == True).subquery()
-
-    # Query join các bảng
-    query = (
-        select(
-            CartItem,
-            Product.Name,
-            Product.ProductNumber,
-            Product.Color,
-            Product.Size,
-            Product.Condition,
-            stmt_image.c.ImageURL.label("thumbnail")
+    items_res = []
+    if include_items:
+        # Query join các bảng
+        query = (
+            select(
+                CartItem,
+                Product.Name,
+                Product.ProductNumber,
+                Product.Color,
+                Product.Size,
+                Product.Condition
+            )
+            .join(Product, CartItem.ProductID == Product.ProductID)
+            .where(CartItem.CartID == cart.CartID)
         )
-        .join(Product, CartItem.ProductID == Product.ProductID)
-        .outerjoin(stmt_image, Product.ProductID == stmt_image.c.ProductID)
-        .where(CartItem.CartID == cart.CartID)
-    )
-    results = db.execute(query).all()
+        results = db.execute(query).all()
 
-    items_res = []
-    total_buy = Decimal(0)
-    total_rent = Decimal(0)
+        # Ảnh thumbnail của cả giỏ trong 1 query
+        thumbnails = get_thumbnails(db, [row.CartItem.ProductID for row in results])
 
-    for row in results:
-        item = row.CartItem
-        
-        # Cộng dồn tổng tiền
-        if item.TransactionType == 'rent':
-            total_rent += item.Subtotal
-        else:
-            total_buy += item.Subtotal
-
-        items_res.append(CartItemResponse(
-            cart_item_id=item.CartItemID,
-            product_id=item.ProductID,
-            product_name=row.Name,
-            thumbnail=row.thumbnail or "https://via.placeholder.com/150",
-            transaction_type=item.TransactionType,
-            rental_days=item.RentalDays,
-            quantity=item.Quantity,
-            unit_price=item.UnitPrice,
-            subtotal=item.Subtotal,
-            variant=CartVariantInfo(
-                color=row.Color, size=row.Size, 
-                condition=row.Condition, model_number=row.ProductNumber
-            )
-        ))
+        total_buy = Decimal(0)
+        total_rent = Decimal(0)
 
-    # Tính discounted amounts dựa trên voucher codes
-    discounted_buy = total_buy
-    discounted_rent = total_rent
-    
-    now = datetime.now()
-    
-    # Xử lý voucher cho buy items
-    if buy_voucher_code and total_buy > 0:
-        buy_voucher = db.query(Voucher).filter(
-            Voucher.Code == buy_voucher_code,
-            Voucher.Status == True,
-            Voucher.StartDate <= now,
-            Voucher.EndDate >= now,
-            Voucher.Quantity > 0,
-            or_(Voucher.Scope == 'buy', Voucher.Scope == 'all')
-        ).first()
-        
-        if buy_voucher and total_buy >= (buy_voucher.MinOrderAmount or 0):
-            # DiscountPercent là số phần trăm (ví dụ: 10 = 10%), cần chia 100 khi tính toán
-            if buy_voucher.DiscountPercent:
-                discount_amt = total_buy * (Decimal(buy_voucher.DiscountPercent) / 100)
-            else:
-                # DiscountAmount là số tiền cố định
-                discount_amt = buy_voucher.DiscountAmount or Decimal(0)
-            discounted_buy = max(total_buy - min(discount_amt, total_buy), Decimal(0))
-    
-    # Xử lý voucher cho rent items
-    if rent_voucher_code and total_rent > 0:
-        rent_voucher = db.query(Voucher).filter(
-            Voucher.Code == rent_voucher_code,
-            Voucher.Status == True,
-            Voucher.StartDate <= now,
-            Voucher.EndDate >= now,
-            Voucher.Quantity > 0,
-            or_(Voucher.Scope == 'rent', Voucher.Scope == 'all')
-        ).first()
-        
-        if rent_voucher and total_rent >= (rent_voucher.MinOrderAmount or 0):
-            # DiscountPercent là số phần trăm (ví dụ: 10 = 10%), cần chia 100 khi tính toán
-            if rent_voucher.DiscountPercent:
-                discount_amt = total_rent * (Decimal(rent_voucher.DiscountPercent) / 100)
+        for row in results:
+            item = row.CartItem
+            
+            # Cộng dồn tổng tiền
+            if item.TransactionType == 'rent':
+                total_rent += item.Subtotal
             else:
-                # DiscountAmount là số tiền cố định
-                discount_amt = rent_voucher.DiscountAmount or Decimal(0)
-            discounted_rent = max(total_rent - min(discount_amt, total_rent), Decimal(0))
+                total_buy += item.Subtotal
+
+            items_res.append(CartItemResponse(
+                cart_item_id=item.CartItemID,
+                product_id=item.ProductID,
+                product_name=row.Name,
+                thumbnail=thumbnails.get(item.ProductID) or "https://via.placeholder.com/150",
+                transaction_type=item.TransactionType,
+                rental_days=item.RentalDays,
+                quantity=item.Quantity,
+                unit_price=item.UnitPrice,
+                subtotal=item.Subtotal,
+                variant=CartVariantInfo(
+                    color=row.Color, size=row.Size, 
+                    condition=row.Condition, model_number=row.ProductNumber
+                )
+            ))
+
+        # Snapshot lệch với chi tiết (ghi ngoài store / chatbot) -> ghi lại
+        computed = CartSnapshot(
+            cart.CartID, len(items_res), sum(i.quantity for i in items_res), total_buy, total_rent
+        )
+        if computed != snapshot:
+            rebuild_cart_summary(db, [cart.CartID])
+            db.commit()
+            snapshot = computed
+
+    # Voucher đọc qua cache, không hợp lệ -> giữ nguyên giá
+    discounted_buy = apply_cart_voucher(db, buy_voucher_code, 'buy', snapshot.buy_subtotal)
+    discounted_rent = apply_cart_voucher(db, rent_voucher_code, 'rent', snapshot.rent_subtotal)
 
     return success_response(data=CartSummaryResponse(
         cart_id=cart.CartID,
-        total_items=sum(i.quantity for i in items_res),
-        total_buy_amount=total_buy,
-        total_rent_amount=total_rent,
+        total_items=snapshot.item_count,
+        total_lines=snapshot.line_count,
+        total_buy_amount=snapshot.buy_subtotal,
+        total_rent_amount=snapshot.rent_subtotal,
         discounted_buy_amount=discounted_buy,
         discounted_rent_amount=discounted_rent,
-        grand_total=total_buy + total_rent,
+        grand_total=snapshot.buy_subtotal + snapshot.rent_subtotal,
         items=items_res
     ))
 
@@ -550,9 +521,11 @@ def add_to_cart(
     existing_item = db.query(CartItem).filter(*query_filter).first()
 
     if existing_item:
+        before = CartLine.of(existing_item)
         existing_item.Quantity += payload.quantity
         # Subtotal is computed by the database, no need to set it manually
         existing_item.DateUpdated = datetime.utcnow()
+        record_cart_change(db, cart.CartID, before, CartLine.after_flush(db, existing_item))
     else:
         new_item = CartItem(
             CartID=cart.CartID,
@@ -565,8 +538,8 @@ def add_to_cart(
             RentalDays=payload.rental_days
         )
         db.add(new_item)
+        record_cart_change(db, cart.CartID, after=CartLine.after_flush(db, new_item))
 
-    cart.ModifiedDate = datetime.utcnow()
     db.commit()
 
     return success_response(message="Added to cart successfully")
@@ -599,6 +572,8 @@ def update_cart_item(
             raise HTTPException(status_code=400, detail="Cannot set rental days for buy items")
         new_days = payload.rental_days
 
+    before = CartLine.of(item)
+
     # Subtotal is computed by the database, no need to set it manually
     if item.TransactionType == 'rent':
         item.RentalDays = new_days
@@ -606,8 +581,8 @@ def update_cart_item(
     item.Quantity = new_qty
     item.DateUpdated = datetime.utcnow()
     
-    # Update Cart timestamp
-    db.query(Cart).filter(Cart.CartID == item.CartID).update({"ModifiedDate": datetime.utcnow()})
+    # Cập nhật snapshot + timestamp của Cart
+    record_cart_change(db, item.CartID, before, CartLine.after_flush(db, item))
     
     db.commit()
     return success_response(message="Cart item updated")
@@ -630,7 +605,7 @@ def remove_cart_item(
         raise HTTPException(status_code=404, detail="Cart item not found")
 
     db.delete(item)
-    db.query(Cart).filter(Cart.CartID == item.CartID).update({"ModifiedDate": datetime.utcnow()})
+    record_cart_change(db, item.CartID, before=CartLine.of(item))
     
     db.commit()
     return success_response(message="Item removed from cart")
@@ -698,221 +673,28 @@ def get_available_vouchers(
     return success_response(data=data)
 
 
-def generate_order_number(prefix: str):
-    # Tạo mã đơn hàng dạng SO-20231010-XXXX
-    return f"{prefix}-{datetime.now().strftime('%Y%m%d')}-{uuid.uuid4().hex[:4].upper()}"
-
 @store_router.post("/order/checkout", response_model=APIResponse[CheckoutResponse])
 def create_order(
     payload: CheckoutRequest,
     db: Session = Depends(get_db),
     user_id: int = Depends(get_current_user_id)
 ):
-    # 1. Lấy Giỏ hàng
-    cart = db.query(Cart).options(joinedload(Cart.items)).filter(Cart.CustomerID == user_id, Cart.Status == "Active").first()
-    if not cart or not cart.items:
-        raise HTTPException(status_code=400, detail="Cart is empty")
-
-    # 2. Validate Địa chỉ
-    address = db.query(CustomerAdress).filter(
-        CustomerAdress.AddressID == payload.address_id,
-        CustomerAdress.CustomerID == user_id
-    ).first()
-    if not address:
-        raise HTTPException(status_code=400, detail="Invalid address")
-
-    # 3. Phân loại Item (Mua vs Thuê)
-    buy_items = []
-    rent_items = []
-    
-    # Tính tạm tính (Subtotal)
-    subtotal_buy = Decimal(0)
-    subtotal_rent = Decimal(0)
-
-    for item in cart.items:
-        # Giả sử đã có cột TransactionType trong Model CartItem (như bài trước)
-        t_type = getattr(item, 'TransactionType', 'buy') 
-        
-        if t_type == 'buy':
-            buy_items.append(item)
-            subtotal_buy += item.Subtotal
-        else:
-            rent_items.append(item)
-            subtotal_rent += item.Subtotal
-
-    # 4. Xử lý Voucher (Nếu có)
-    discount_buy = Decimal(0)
-    discount_rent = Decimal(0)
-    voucher = None
-
-    if payload.voucher_code:
-        now = datetime.now()
-        voucher = db.query(Voucher).filter(
-            Voucher.Code == payload.voucher_code,
-            Voucher.Status == True,
-            Voucher.StartDate <= now,
-            Voucher.EndDate >= now,
-            Voucher.Quantity > 0
-        ).first()
-
-        if not voucher:
-            raise HTTPException(status_code=400, detail="Invalid or expired voucher")
-
-        # Kiểm tra điều kiện Min Order (So với tổng cả giỏ)
-        total_cart_value = subtotal_buy + subtotal_rent
-        if total_cart_value < (voucher.MinOrderAmount or 0):
-            raise HTTPException(status_code=400, detail=f"Order needs minimum {voucher.MinOrderAmount}")
-
-        # Tính toán giảm giá
-        # Logic: Tính tổng giảm, sau đó chia bổ cho Buy và Rent theo tỷ lệ (hoặc ưu tiên)
-        # Đơn giản hóa: Nếu Scope=All -> Giảm trên tổng. Scope=Buy -> Giảm trên Buy.
-        
-        scope = voucher.Scope.lower() if voucher.Scope else 'all'
-        applicable_amount = Decimal(0)
-        
-        if scope == 'buy':
-            applicable_amount = subtotal_buy
-        elif scope == 'rent':
-            applicable_amount = subtotal_rent
-        else: # all
-            applicable_amount = subtotal_buy + subtotal_rent
-        
-        if applicable_amount > 0:
-            # Tính tiền giảm
-            discount_amt = Decimal(0)
-            if voucher.DiscountPercent:
-                discount_amt = applicable_amount * (Decimal(voucher.DiscountPercent) / 100)
-            else:
-                discount_amt = voucher.DiscountAmount or 0
-            
-            # Phân bổ discount lại cho 2 đơn (nếu tách đơn)
-            # Ở đây làm đơn giản: Trừ ưu tiên vào đơn Mua trước, còn dư trừ đơn Thuê
-            if scope == 'buy':
-                discount_buy = min(discount_amt, subtotal_buy)
-            elif scope == 'rent':
-                discount_rent = min(discount_amt, subtotal_rent)
-            else:
-                # Nếu ALL, trừ hết vào Buy, nếu Buy ko đủ thì trừ tiếp Rent
-                if subtotal_buy >= discount_amt:
-                    discount_buy = discount_amt
-                else:
-                    discount_buy = subtotal_buy
-                    discount_rent = discount_amt - subtotal_buy
-
-    # 5. TẠO ĐƠN HÀNG (Transaction)
-    created_buy_header = None
-    created_rent_header = None
-
+    """
+    Checkout giỏ hàng -> tách đơn Mua / Thuê (app/checkout.py).
+    Voucher, giỏ hàng và tồn kho được giữ chỗ bằng UPDATE có điều kiện -> hết hàng / hết voucher trả 409.
+    """
     try:
-        # --- A. Xử lý Đơn Mua (SalesOrder) ---
-        if buy_items:
-            final_buy_total = max(subtotal_buy - discount_buy, Decimal(0))
-            
-            buy_header = SalesOrderHeader(
-                CustomerID=user_id,
-                OrderDate=datetime.now(),
-                DueDate=datetime.now(), # Logic hạn thanh toán
-                SalesOrderNumber=generate_order_number("SO"),
-                TotalDue=final_buy_total,
-                Freight=0, # Phí ship (có thể tính thêm logic)
-                OrderStatus="Pending", # 1: InProcess
-                ModifiedDate=datetime.now(),
-                CancellationReason=payload.note # Lưu tạm note vào đây
-            )
-            db.add(buy_header)
-            db.flush() # Để lấy SalesOrderID
-            created_buy_header = buy_header
-
-            for item in buy_items:
-                detail = SalesOrderDetail(
-                    SalesOrderID=buy_header.SalesOrderID,
-                    OrderQty=item.Quantity,
-                    ProductID=item.ProductID,
-                    UnitPrice=item.UnitPrice,
-                    ModifiedDate=datetime.now()
-                )
-                db.add(detail)
-
-        # --- B. Xử lý Đơn Thuê (RentalOrder) ---
-        if rent_items:
-            final_rent_total = max(subtotal_rent - discount_rent, Decimal(0))
-            
-            rent_header = RentalHeader(
-                CustomerID=user_id,
-                RentalDate=datetime.now(),
-                # DueDate tạm tính bằng ngày hiện tại + max rental days của các item
-                # Thực tế cần logic phức tạp hơn, ở đây lấy tạm +3 ngày
-                DueDate=datetime.now(), 
-                RentalNumber=generate_order_number("RN"),
-                TotalDue=final_rent_total,
-                Status=1, # 1: Pending/Active
-                ModifiedDate=datetime.now()
-            )
-            db.add(rent_header)
-            db.flush()
-            created_rent_header = rent_header
-
-            for item in rent_items:
-                # Lấy AssetID từ đâu? Lúc đặt hàng CHƯA có AssetID.
-                # Admin sẽ gán AssetID khi giao xe.
-                # Cần thêm logic lấy Deposit
-                prod = db.query(Product).filter(Product.ProductID == item.ProductID).first()
-                
-                # Lưu ý: Cần lấy RentalDays từ CartItem
-                r_days = getattr(item, 'RentalDays', 1)
-
-                detail = RentalDetail(
-                    RentalID=rent_header.RentalID,
-                    ProductID=item.ProductID,
-                    OrderQty=item.Quantity,
-                    UnitPrice=item.UnitPrice, # Giá thuê 1 ngày
-                    # AssignedAssetID=NULL, (Chờ Admin gán)
-                    ConditionDescription="Initial Order",
-                    # Lưu số ngày thuê vào đâu? 
-                    # Bảng RentalDetail hiện tại chưa có cột RentalDays?
-                    # Tạm thời ta chỉ lưu giá, logic ngày cần update bảng Detail sau.
-                )
-                db.add(detail)
-
-        # --- C. Cập nhật Voucher & Cart ---
-        if voucher:
-            voucher.Quantity -= 1
-            # Lưu ID đơn hàng nào? Nếu tách 2 đơn thì lưu cả 2?
-            # DB VoucherUsage chỉ có 1 cột OrderID. 
-            # Ta ưu tiên lưu ID đơn Buy, nếu ko có thì lưu ID đơn Rent.
-            order_id = None
-            if created_buy_header:
-                order_id = created_buy_header.SalesOrderID
-            elif created_rent_header:
-                order_id = created_rent_header.RentalID
-            
-            usage = VoucherUsage(
-                VoucherID=voucher.VoucherID,
-                CustomerID=user_id,
-                OrderID=order_id,
-                UsedDate=datetime.now()
-            )
-            db.add(usage)
-
-        # Clear giỏ hàng (Chuyển trạng thái hoặc xóa)
-        cart.IsCheckedOut = True
-        cart.Status = "Converted"
-        # Xóa items để lần sau tạo giỏ mới sạch sẽ (Hoặc giữ lại để history)
-        # Ở đây ta set flag IsCheckedOut là đủ.
-
-        db.commit()
-
-        # --- D. Return Response ---
-        return success_response(data=CheckoutResponse(
-            message="Order placed successfully",
-            buy_order_id=created_buy_header.SalesOrderID if created_buy_header else None,
-            buy_order_number=created_buy_header.SalesOrderNumber if created_buy_header else None,
-            rent_order_id=created_rent_header.RentalID if created_rent_header else None,
-            rent_order_number=created_rent_header.RentalNumber if created_rent_header else None,
-            total_amount=(created_buy_header.TotalDue if created_buy_header else 0) + 
-                         (created_rent_header.TotalDue if created_rent_header else 0)
-        ))
-
+        result = place_order(db, user_id, payload.address_id, payload.voucher_code, payload.note)
+    except HTTPException:
+        raise
     except Exception as e:
-        db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
+
+    return success_response(data=CheckoutResponse(
+        message="Order placed successfully",
+        buy_order_id=result.buy_order_id,
+        buy_order_number=result.buy_order_number,
+        rent_order_id=result.rent_order_id,
+        rent_order_number=result.rent_order_number,
+        total_amount=result.total_amount
+    ))
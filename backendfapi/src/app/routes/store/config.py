@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, ConfigDict, validator
-from typing import List, Optional, Literal
+from typing import List, Optional, Literal, Union
 from decimal import Decimal
 from datetime import datetime
 from app.helper import *
@@ -8,6 +8,22 @@ from app.helper import *
 class StoreCategoryItem(BaseModel):
     id: int
     name: str
+    product_count: int = 0
+
+class FacetOption(BaseModel):
+    value: Union[bool, int, str]
+    label: Optional[Union[bool, int, str]] = None
+    count: int
+
+class CatalogFacets(BaseModel):
+    """Số sản phẩm theo từng giá trị filter của /store/products/search"""
+    total_items: int
+    category: List[FacetOption] = []
+    condition: List[FacetOption] = []
+    size: List[FacetOption] = []
+    color: List[FacetOption] = []
+    rentable: List[FacetOption] = []
+    price_range: List[FacetOption] = []
 
 # --- SHARED ---
 class ProductImageItem(BaseModel):
@@ -136,13 +152,14 @@ class CartItemResponse(BaseModel):
 # Tổng quan giỏ hàng
 class CartSummaryResponse(BaseModel):
     cart_id: int
-    total_items: int
+    total_items: int  # Tổng số lượng
+    total_lines: int = 0  # Số dòng sản phẩm (badge giỏ hàng)
     total_buy_amount: Decimal = 0
     total_rent_amount: Decimal = 0
     discounted_buy_amount: Decimal = 0  # Tổng tiền mua sau khi giảm giá
     discounted_rent_amount: Decimal = 0  # Tổng tiền thuê sau khi giảm giá
     grand_total: Decimal = 0
-    items: List[CartItemResponse]
+    items: List[CartItemResponse]  # Rỗng khi include_items=false
 
 # --- REQUEST ---
 
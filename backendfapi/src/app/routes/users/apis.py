@@ -1,92 +1,56 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.security import OAuth2PasswordBearer
+from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from sqlalchemy import desc, select
-from jose import JWTError, jwt
 from datetime import datetime
 from typing import List
 
-from app.routes.auth.config import SECRET_KEY, ALGORITHM
 from app.database import get_db
+from app.token_cache import CurrentCustomer, get_current_customer
 from app.models import *
 from .config import * 
 from ...helper import *
 
 users_router = APIRouter(prefix="/user", tags=["User"])
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token")
-
-# ==========================================
-# 0. AUTH DEPENDENCY
-# ==========================================
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> Customer:
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: int = payload.get("id")
-        role: str = payload.get("role")
-        if user_id is None or role != "customer":
-             raise HTTPException(
-                 status_code=status.HTTP_401_UNAUTHORIZED,
-                 detail=f"Invalid token: missing user_id or invalid role (got role: {role})",
-                 headers={"WWW-Authenticate": "Bearer"},
-             )
-    except JWTError as e:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail=f"Invalid or expired token: {str(e)}",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    
-    user = db.query(Customer).filter(Customer.CustomerID == user_id).first()
-    if user is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail=f"User not found for ID: {user_id}",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    return user
 
 # ==========================================
 # 1. PROFILE PROFILE
 # ==========================================
 @users_router.get("/profile", response_model=APIResponse[UserProfileResponse])
-def get_profile(current_user: Customer = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_profile(current_user: CurrentCustomer = Depends(get_current_customer), db: Session = Depends(get_db)):
+    customer = current_user.load()
     # Lấy thông tin email và phone (Do tách bảng)
-    email_record = db.query(CustomerEmailAddress).filter(CustomerEmailAddress.CustomerID == current_user.CustomerID).first()
-    phone_record = db.query(CustomerPhone).filter(CustomerPhone.CustomerID == current_user.CustomerID).first()
+    email_record = db.query(CustomerEmailAddress).filter(CustomerEmailAddress.CustomerID == current_user.id).first()
+    phone_record = db.query(CustomerPhone).filter(CustomerPhone.CustomerID == current_user.id).first()
     
     data = UserProfileResponse(
-        first_name=current_user.FirstName,
-        last_name=current_user.LastName,
+        first_name=customer.FirstName,
+        last_name=customer.LastName,
         email=email_record.EmailAddress if email_record else None,
         phone=phone_record.PhoneNumber if phone_record else None,
-        avatar_url=current_user.AvatarURL
+        avatar_url=customer.AvatarURL
     )
     return success_response(data=data)
 
 @users_router.patch("/profile", response_model=APIResponse)
 def update_profile(
     profile_data: ProfileUpdate, 
-    current_user: Customer = Depends(get_current_user), 
+    current_user: CurrentCustomer = Depends(get_current_customer), 
     db: Session = Depends(get_db)
 ):
-    if profile_data.first_name: current_user.FirstName = profile_data.first_name
-    if profile_data.last_name: current_user.LastName = profile_data.last_name
-    if profile_data.avatar_url: current_user.AvatarURL = profile_data.avatar_url
+    customer = current_user.load()
+    if profile_data.first_name: customer.FirstName = profile_data.first_name
+    if profile_data.last_name: customer.LastName = profile_data.last_name
+    if profile_data.avatar_url: customer.AvatarURL = profile_data.avatar_url
     
     if profile_data.phone:
-        phone_record = db.query(CustomerPhone).filter(CustomerPhone.CustomerID == current_user.CustomerID).first()
+        phone_record = db.query(CustomerPhone).filter(CustomerPhone.CustomerID == current_user.id).first()
         if phone_record:
             phone_record.PhoneNumber = profile_data.phone
             phone_record.ModifiedDate = datetime.utcnow()
         else:
             # Tạo mới nếu chưa có
             new_phone = CustomerPhone(
-                CustomerID=current_user.CustomerID,
+                CustomerID=current_user.id,
                 PhoneNumber=profile_data.phone,
                 PhoneNumberTypeID=1, # Giả định 1 là Mobile
                 ModifiedDate=datetime.utcnow()
@@ -110,14 +74,20 @@ def _reset_default_address(db: Session, customer_id: int):
 
 @users_router.get("/addresses", response_model=APIResponse[List[AddressResponse]])
 def get_addresses(
-    current_user: Customer = Depends(get_current_user),
+    current_user: CurrentCustomer = Depends(get_current_customer),
     db: Session = Depends(get_db)
 ):
     """Lấy danh sách địa chỉ, sắp xếp Default lên đầu"""
     addresses = db.query(CustomerAdress).filter(
-        CustomerAdress.CustomerID == current_user.CustomerID
+        CustomerAdress.CustomerID == current_user.id
     ).order_by(desc(CustomerAdress.IsDefault), desc(CustomerAdress.ModifiedDate)).all()
 
+    # Fallback sđt chính của khách (chỉ query khi có địa chỉ chưa có sđt)
+    fallback_phone = ""
+    if any(not addr.PhoneNumber for addr in addresses):
+        phone_record = db.query(CustomerPhone).filter(CustomerPhone.CustomerID == current_user.id).first()
+        fallback_phone = phone_record.PhoneNumber if phone_record else ""
+
     # Mapping thủ công hoặc dùng from_attributes của Pydantic
     data = [
         AddressResponse(
@@ -125,7 +95,7 @@ def get_addresses(
             address_line1=addr.AddressLine1,
             city=addr.City,
             postal_code=addr.PostalCode,
-            phone_number=addr.PhoneNumber or current_user.phones[0].PhoneNumber if current_user.phones else "", # Fallback sđt chính
+            phone_number=addr.PhoneNumber or fallback_phone,
             is_default=addr.IsDefault
         ) for addr in addresses
     ]
@@ -134,21 +104,21 @@ def get_addresses(
 @users_router.post("/addresses", response_model=APIResponse[AddressResponse])
 def create_address(
     payload: AddressCreate,
-    current_user: Customer = Depends(get_current_user),
+    current_user: CurrentCustomer = Depends(get_current_customer),
     db: Session = Depends(get_db)
 ):
     # 1. Nếu user set địa chỉ này là default, bỏ default các cái cũ
     if payload.is_default:
-        _reset_default_address(db, current_user.CustomerID)
+        _reset_default_address(db, current_user.id)
     else:
         # Nếu đây là địa chỉ đầu tiên, bắt buộc set default
-        count = db.query(CustomerAdress).filter(CustomerAdress.CustomerID == current_user.CustomerID).count()
+        count = db.query(CustomerAdress).filter(CustomerAdress.CustomerID == current_user.id).count()
         if count == 0:
             payload.is_default = True
 
     # 2. Tạo mới
     new_addr = CustomerAdress(
-        CustomerID=current_user.CustomerID,
+        CustomerID=current_user.id,
         AddressLine1=payload.address_line1,
         City=payload.city,
         PostalCode=payload.postal_code,
@@ -175,13 +145,13 @@ def create_address(
 def update_address(
     address_id: int,
     payload: AddressUpdate,
-    current_user: Customer = Depends(get_current_user),
+    current_user: CurrentCustomer = Depends(get_current_customer),
     db: Session = Depends(get_db)
 ):
     # 1. Tìm địa chỉ & Check quyền sở hữu
     address = db.query(CustomerAdress).filter(
         CustomerAdress.AddressID == address_id,
-        CustomerAdress.CustomerID == current_user.CustomerID
+        CustomerAdress.CustomerID == current_user.id
     ).first()
 
     if not address:
@@ -189,7 +159,7 @@ def update_address(
 
     # 2. Xử lý Logic Default
     if payload.is_default is True:
-        _reset_default_address(db, current_user.CustomerID)
+        _reset_default_address(db, current_user.id)
         address.IsDefault = True
     
     # 3. Update các trường khác
@@ -207,12 +177,12 @@ def update_address(
 @users_router.delete("/addresses/{address_id}", response_model=APIResponse)
 def delete_address(
     address_id: int,
-    current_user: Customer = Depends(get_current_user),
+    current_user: CurrentCustomer = Depends(get_current_customer),
     db: Session = Depends(get_db)
 ):
     address = db.query(CustomerAdress).filter(
         CustomerAdress.AddressID == address_id,
-        CustomerAdress.CustomerID == current_user.CustomerID
+        CustomerAdress.CustomerID == current_user.id
     ).first()
 
     if not address:
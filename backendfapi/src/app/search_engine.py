@@ -0,0 +1,363 @@
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.models import Product, ProductSubcategory, FAQ
+
+# ==========================================
+# FULL-TEXT SEARCH ENGINE (Inverted index + BM25)
+# ==========================================
+# Thay cho ILIKE '%term%' (leading wildcard -> SQL Server phải scan cả bảng).
+# - Chuẩn hóa tiếng Việt: bỏ dấu (ả -> a, đ -> d), gộp dash "–"/"—" -> "-", casefold
+# - Prefix matching cho từ cuối của query (typeahead: "moun" -> "mountain")
+# - Chịu lỗi gõ 1 ký tự (thiếu/thừa/sai/đảo chỗ) cho từ >= 4 ký tự, theo kiểu SymSpell
+# - Xếp hạng BM25, trọng số theo field (Name > ProductNumber > ...)
+# Mỗi worker giữ index riêng -> reload toàn bộ sau SEARCH_INDEX_TTL giây (1 request reload, các request khác
+# dùng tạm index cũ).
+
+SEARCH_INDEX_TTL = int(os.getenv("SEARCH_INDEX_TTL", "600"))
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+PREFIX_WEIGHT = 0.8  # Điểm của từ khớp prefix so với khớp chính xác
+FUZZY_WEIGHT = 0.6   # Điểm của từ khớp sai 1 ký tự
+FUZZY_MIN_LENGTH = 4
+
+DASH_TRANSLATION = str.maketrans({"–": "-", "—": "-", "đ": "d", "Đ": "D"})
+TOKEN_PATTERN = re.compile(r"[0-9a-z]+")
+
+
+def fold_text(value: Optional[str]) -> str:
+    """'Xe Đạp Địa Hình – Đỏ' -> 'xe dap dia hinh - do'"""
+    if not value:
+        return ""
+    value = unicodedata.normalize("NFKD", str(value).translate(DASH_TRANSLATION))
+    return "".join(ch for ch in value if not unicodedata.combining(ch)).casefold()
+
+
+def tokenize(value: Optional[str]) -> List[str]:
+    return TOKEN_PATTERN.findall(fold_text(value))
+
+
+def deletes(term: str) -> Set[str]:
+    """Các biến thể xóa đúng 1 ký tự (SymSpell, khoảng cách 1)"""
+    return {term[:i] + term[i + 1:] for i in range(len(term))}
+
+
+def within_one_edit(a: str, b: str) -> bool:
+    """Damerau-Levenshtein(a, b) <= 1"""
+    if a == b:
+        return True
+    la, lb = len(a), len(b)
+    if abs(la - lb) > 1:
+        return False
+    if la == lb:
+        diff = [i for i in range(la) if a[i] != b[i]]
+        if len(diff) == 1:
+            return True
+        return len(diff) == 2 and diff[1] == diff[0] + 1 and a[diff[0]] == b[diff[1]] and a[diff[1]] == b[diff[0]]
+    if la > lb:
+        a, b = b, a
+    # b dài hơn a đúng 1 ký tự
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    return a[i:] == b[i + 1:]
+
+
+class InvertedIndex:
+    """
+    Index tổng quát: doc_id -> {field: text}.
+    tf của 1 term trong doc = tổng trọng số field chứa term (BM25F rút gọn).
+    """
+
+    def __init__(self, field_weights: Dict[str, float]):
+        self.field_weights = field_weights
+        self._postings: Dict[str, Dict[int, float]] = defaultdict(dict)
+        self._doc_terms: Dict[int, Set[str]] = {}
+        self._doc_len: Dict[int, float] = {}
+        self._total_len = 0.0
+        self._deletes: Dict[str, Set[str]] = defaultdict(set)
+        self._vocabulary: List[str] = []
+        self._vocabulary_dirty = False
+
+    def __len__(self):
+        return len(self._doc_len)
+
+    def copy(self) -> "InvertedIndex":
+        index = InvertedIndex(self.field_weights)
+        index._postings = defaultdict(dict, {term: dict(p) for term, p in self._postings.items()})
+        index._doc_terms = dict(self._doc_terms)  # Set của từng doc chỉ bị thay, không bị sửa tại chỗ
+        index._doc_len = dict(self._doc_len)
+        index._total_len = self._total_len
+        index._deletes = defaultdict(set, {variant: set(terms) for variant, terms in self._deletes.items()})
+        index._vocabulary = self._vocabulary
+        index._vocabulary_dirty = self._vocabulary_dirty
+        return index
+
+    # --- Write ---
+    def add(self, doc_id: int, fields: Dict[str, Optional[str]]):
+        self.remove(doc_id)
+        tf: Dict[str, float] = defaultdict(float)
+        length = 0.0
+        for field, text in fields.items():
+            weight = self.field_weights.get(field, 1.0)
+            for token in tokenize(text):
+                tf[token] += weight
+                length += weight
+        for term, freq in tf.items():
+            if term not in self._postings:
+                self._vocabulary_dirty = True
+                if len(term) >= FUZZY_MIN_LENGTH - 1:
+                    for variant in deletes(term):
+                        self._deletes[variant].add(term)
+            self._postings[term][doc_id] = freq
+        self._doc_terms[doc_id] = set(tf)
+        self._doc_len[doc_id] = length
+        self._total_len += length
+
+    def remove(self, doc_id: int):
+        terms = self._doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        self._total_len -= self._doc_len.pop(doc_id, 0.0)
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(doc_id, None)
+            if not postings:
+                del self._postings[term]
+                self._vocabulary_dirty = True
+                for variant in deletes(term):
+                    variants = self._deletes.get(variant)
+                    if variants is not None:
+                        variants.discard(term)
+                        if not variants:
+                            del self._deletes[variant]
+
+    # --- Term expansion ---
+    def _sorted_vocabulary(self) -> List[str]:
+        if self._vocabulary_dirty:
+            self._vocabulary = sorted(self._postings)
+            self._vocabulary_dirty = False
+        return self._vocabulary
+
+    def _prefix_terms(self, prefix: str) -> List[str]:
+        vocabulary = self._sorted_vocabulary()
+        result = []
+        for i in range(bisect_left(vocabulary, prefix), len(vocabulary)):
+            if not vocabulary[i].startswith(prefix):
+                break
+            if vocabulary[i] != prefix:
+                result.append(vocabulary[i])
+        return result
+
+    def _fuzzy_terms(self, term: str) -> List[str]:
+        if len(term) < FUZZY_MIN_LENGTH:
+            return []
+        candidates = set(self._deletes.get(term, ()))
+        for variant in deletes(term):
+            if variant in self._postings:
+                candidates.add(variant)
+            candidates |= self._deletes.get(variant, set())
+        candidates.discard(term)
+        return [c for c in candidates if within_one_edit(term, c)]
+
+    def expand(self, term: str, prefix: bool) -> Dict[str, float]:
+        """term của query -> {term trong index: trọng số}"""
+        expansions: Dict[str, float] = {}
+        if term in self._postings:
+            expansions[term] = 1.0
+        if prefix:
+            for candidate in self._prefix_terms(term):
+                expansions.setdefault(candidate, PREFIX_WEIGHT)
+        if not expansions:
+            # Chỉ sửa lỗi gõ khi không có từ nào khớp chính xác / prefix
+            for candidate in self._fuzzy_terms(term):
+                expansions[candidate] = FUZZY_WEIGHT
+        return expansions
+
+    # --- Query ---
+    def _idf(self, term: str) -> float:
+        n = len(self._doc_len)
+        df = len(self._postings.get(term, ()))
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, prefix: bool = True, limit: Optional[int] = None) -> List[Tuple[int, float]]:
+        """
+        Trả về [(doc_id, score)] giảm dần theo score.
+        Mọi từ của query đều phải khớp (AND); prefix chỉ áp dụng cho từ cuối.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or not self._doc_len:
+            return []
+        avg_len = self._total_len / len(self._doc_len) or 1.0
+
+        scores: Optional[Dict[int, float]] = None
+        for position, term in enumerate(terms):
+            expansions = self.expand(term, prefix=prefix and position == len(terms) - 1)
+            term_scores: Dict[int, float] = {}
+            for candidate, weight in expansions.items():
+                idf = self._idf(candidate) * weight
+                for doc_id, tf in self._postings[candidate].items():
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * self._doc_len[doc_id] / avg_len)
+                    score = idf * tf * (BM25_K1 + 1) / (tf + norm)
+                    # Nhiều từ mở rộng cùng khớp 1 doc -> lấy điểm cao nhất
+                    if score > term_scores.get(doc_id, 0.0):
+                        term_scores[doc_id] = score
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {doc_id: s + term_scores[doc_id] for doc_id, s in scores.items() if doc_id in term_scores}
+            if not scores:
+                return []
+
+        ranked = sorted(scores.items(), key=lambda x: (-x[1], x[0]))
+        return ranked[:limit] if limit else ranked
+
+
+class SearchIndex(ABC):
+    """
+    InvertedIndex + nạp từ DB, TTL và refresh từng document sau khi ghi.
+    Copy-on-write như CatalogIndex: phía đọc lấy self._index 1 lần rồi chấm điểm ngoài lock, phía ghi sửa bản sao
+    rồi gán lại. Document refresh / remove trong lúc load() đang chạy được ghi vào _pending và nạp lại vào index
+    mới trước khi công bố (dữ liệu load() đọc có thể cũ hơn lần commit đó).
+    """
+
+    field_weights: Dict[str, float] = {}
+
+    def __init__(self, ttl: int = SEARCH_INDEX_TTL):
+        self.ttl = ttl
+        self._index = InvertedIndex(self.field_weights)
+        self._loaded_at: Optional[float] = None
+        self._pending: Optional[Set[int]] = None  # doc_id đổi trong lúc load() (None: không có load nào đang chạy)
+        self._lock = threading.Lock()  # Chỉ cho phía ghi
+        self._reload_lock = threading.Lock()
+
+    @abstractmethod
+    def _fetch(self, db: Session, doc_id: Optional[int] = None) -> Iterable[Tuple[int, Dict[str, Optional[str]]]]:
+        """(doc_id, {field: text}) của mọi document, hoặc chỉ doc_id"""
+
+    @staticmethod
+    def _apply(index: InvertedIndex, doc_id: int, docs: List[Tuple[int, Dict[str, Optional[str]]]]):
+        index.remove(doc_id)
+        for found_id, fields in docs:
+            index.add(found_id, fields)
+        index._sorted_vocabulary()  # Dựng sẵn trước khi công bố -> phía đọc không ghi gì vào index
+
+    def load(self, db: Session) -> "SearchIndex":
+        with self._reload_lock:
+            return self._load(db)
+
+    def _load(self, db: Session) -> "SearchIndex":
+        """Gọi khi đang giữ _reload_lock (mỗi lúc chỉ 1 load)"""
+        with self._lock:
+            self._pending = set()
+        try:
+            index = InvertedIndex(self.field_weights)
+            for doc_id, fields in self._fetch(db):
+                index.add(doc_id, fields)
+            index._sorted_vocabulary()
+            while True:
+                with self._lock:
+                    pending, self._pending = self._pending, set()
+                    if not pending:
+                        self._index = index
+                        self._loaded_at = time.monotonic()
+                        return self
+                for doc_id in sorted(pending):
+                    self._apply(index, doc_id, list(self._fetch(db, doc_id)))
+        finally:
+            with self._lock:
+                self._pending = None
+
+    def _stale(self) -> bool:
+        loaded_at = self._loaded_at
+        return loaded_at is None or time.monotonic() - loaded_at > self.ttl
+
+    def ensure_loaded(self, db: Session) -> "SearchIndex":
+        if not self._stale():
+            return self
+        # Đã có index (chỉ hết hạn) -> request khác đang reload thì dùng tạm index cũ, không chờ
+        blocking = self._loaded_at is None
+        if not self._reload_lock.acquire(blocking=blocking):
+            return self
+        try:
+            if self._stale():
+                self._load(db)
+        finally:
+            self._reload_lock.release()
+        return self
+
+    def invalidate(self):
+        """Buộc reload ở lần đọc kế tiếp"""
+        self._loaded_at = None
+
+    def _update(self, doc_id: int, docs: List[Tuple[int, Dict[str, Optional[str]]]]):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.add(doc_id)
+            if self._loaded_at is None:
+                return  # Chưa load -> lần đọc đầu sẽ lấy dữ liệu mới
+            index = self._index.copy()
+            self._apply(index, doc_id, docs)
+            self._index = index
+
+    def refresh(self, db: Session, doc_id: int):
+        """Gọi sau khi commit create/update (document không còn -> bị xóa khỏi index)"""
+        if self._loaded_at is None and self._pending is None:
+            return
+        self._update(doc_id, list(self._fetch(db, doc_id)))
+
+    def remove(self, doc_id: int):
+        self._update(doc_id, [])
+
+    def search(self, query: str, prefix: bool = True, limit: Optional[int] = None) -> List[Tuple[int, float]]:
+        return self._index.search(query, prefix=prefix, limit=limit)
+
+    def scores(self, query: str, prefix: bool = True) -> Dict[int, float]:
+        return dict(self.search(query, prefix=prefix))
+
+
+class ProductSearchIndex(SearchIndex):
+    field_weights = {"name": 3.0, "product_number": 2.0, "subcategory": 1.5, "color": 1.0, "description": 0.5}
+
+    def _fetch(self, db: Session, doc_id: Optional[int] = None):
+        query = select(
+            Product.ProductID, Product.Name, Product.ProductNumber, Product.Color,
+            Product.Description, ProductSubcategory.Name.label("SubcategoryName")
+        ).outerjoin(ProductSubcategory, Product.ProductSubcategoryID == ProductSubcategory.ProductSubcategoryID)
+        if doc_id is not None:
+            query = query.where(Product.ProductID == doc_id)
+        for row in db.execute(query):
+            yield row.ProductID, {
+                "name": row.Name, "product_number": row.ProductNumber, "subcategory": row.SubcategoryName,
+                "color": row.Color, "description": row.Description,
+            }
+
+
+class FAQSearchIndex(SearchIndex):
+    field_weights = {"question": 2.0, "keywords": 2.0, "answer": 1.0}
+
+    def _fetch(self, db: Session, doc_id: Optional[int] = None):
+        query = select(FAQ.FAQID, FAQ.Question, FAQ.Answer, FAQ.Keywords)
+        if doc_id is not None:
+            query = query.where(FAQ.FAQID == doc_id)
+        for row in db.execute(query):
+            yield row.FAQID, {"question": row.Question, "keywords": row.Keywords, "answer": row.Answer}
+
+
+product_search = ProductSearchIndex()
+faq_search = FAQSearchIndex()
@@ -0,0 +1,85 @@
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import select, func, case, literal, union_all
+from sqlalchemy.orm import Session
+
+from app.models import ProductInventory, RentalDetail, RentalHeader
+
+# ==========================================
+# STOCK SUMMARY SERVICE
+# ==========================================
+# Tổng tồn kho / bảo trì / đang cho thuê cho nhiều sản phẩm trong 1 query:
+# UNION ALL (ProductInventory, RentalDetail đang thuê) rồi GROUP BY ProductID.
+# Dùng chung cho danh sách sản phẩm admin, chi tiết sản phẩm và widget tồn kho của dashboard.
+
+MAINTENANCE_LOCATION_ID = 60  # Location 60: Maintenance
+RENTAL_ACTIVE_STATUS = 1      # RentalHeader.Status = 1: đang thuê
+
+# SQL Server giới hạn 2100 tham số / câu lệnh, mỗi ID xuất hiện ở 2 nhánh UNION
+ID_CHUNK_SIZE = 1000
+
+
+@dataclass
+class StockSummary:
+    total: int = 0        # Tổng Quantity ở mọi Location
+    maintenance: int = 0  # Quantity ở Location bảo trì
+    renting: int = 0      # OrderQty của các đơn thuê đang active
+
+    @property
+    def in_house(self) -> int:
+        """Tồn kho ngoài khu bảo trì"""
+        return self.total - self.maintenance
+
+    @property
+    def available(self) -> int:
+        return max(0, self.total - self.maintenance - self.renting)
+
+
+EMPTY_STOCK = StockSummary()
+
+
+def _stock_rows(product_ids: Optional[list] = None):
+    """UNION ALL: (ProductID, total, maintenance, renting)"""
+    inventory = select(
+        ProductInventory.ProductID.label("ProductID"),
+        ProductInventory.Quantity.label("total"),
+        case((ProductInventory.LocationID == MAINTENANCE_LOCATION_ID, ProductInventory.Quantity), else_=0).label("maintenance"),
+        literal(0).label("renting"),
+    )
+    renting = select(
+        RentalDetail.ProductID.label("ProductID"),
+        literal(0).label("total"),
+        literal(0).label("maintenance"),
+        RentalDetail.OrderQty.label("renting"),
+    ).join(RentalHeader, RentalHeader.RentalID == RentalDetail.RentalID)\
+     .where(RentalHeader.Status == RENTAL_ACTIVE_STATUS)
+
+    if product_ids is not None:
+        inventory = inventory.where(ProductInventory.ProductID.in_(product_ids))
+        renting = renting.where(RentalDetail.ProductID.in_(product_ids))
+    return union_all(inventory, renting).subquery("stock_rows")
+
+
+def get_stock_summary(db: Session, product_ids: Iterable[int]) -> Dict[int, StockSummary]:
+    """ProductID -> StockSummary (sản phẩm không có dòng nào sẽ không có trong dict, dùng EMPTY_STOCK)"""
+    ids = list(dict.fromkeys(product_ids))
+    result: Dict[int, StockSummary] = {}
+    for start in range(0, len(ids), ID_CHUNK_SIZE):
+        rows = _stock_rows(ids[start:start + ID_CHUNK_SIZE])
+        query = select(
+            rows.c.ProductID,
+            func.sum(rows.c.total), func.sum(rows.c.maintenance), func.sum(rows.c.renting)
+        ).group_by(rows.c.ProductID)
+        for product_id, total, maintenance, renting in db.execute(query):
+            result[product_id] = StockSummary(int(total or 0), int(maintenance or 0), int(renting or 0))
+    return result
+
+
+def get_stock_totals(db: Session) -> StockSummary:
+    """Tổng toàn kho (widget Inventory Status của dashboard)"""
+    rows = _stock_rows()
+    total, maintenance, renting = db.execute(
+        select(func.sum(rows.c.total), func.sum(rows.c.maintenance), func.sum(rows.c.renting))
+    ).one()
+    return StockSummary(int(total or 0), int(maintenance or 0), int(renting or 0))
@@ -0,0 +1,137 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from fastapi import Depends, HTTPException, status
+from fastapi.security import OAuth2PasswordBearer
+from jose import JWTError, jwt
+from sqlalchemy.orm import Session
+
+from app.database import get_db
+from app.models import Customer
+from app.routes.auth.config import SECRET_KEY, ALGORITHM
+
+# ==========================================
+# AUTH DEPENDENCY + VERIFIED TOKEN CACHE
+# ==========================================
+# Dùng chung cho store / chatbot / users (trước đây mỗi router tự jwt.decode, users còn query Customer mỗi request):
+# - LRU token -> Principal (id, role, type, exp) đã verify, tối đa AUTH_TOKEN_CACHE_SIZE token
+# - Entry hết hạn đúng theo claim exp của token (token hết hạn -> decode lại -> 401)
+# - get_current_customer không query DB, dòng Customer chỉ được load khi handler gọi .load()
+# Token chỉ hết hiệu lực theo exp (chưa có thu hồi token), cache không thay đổi điều này.
+
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "4096"))
+
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token")  # Endpoint form OAuth2 (Swagger Authorize)
+
+
+@dataclass(frozen=True)
+class Principal:
+    id: int
+    role: Optional[str]
+    type: Optional[str]
+    expires_at: Optional[float]  # Unix timestamp (claim exp), None = không hết hạn
+
+    def expired(self, now: float) -> bool:
+        return self.expires_at is not None and self.expires_at <= now
+
+
+class TokenCache:
+    def __init__(self, max_size: int = AUTH_TOKEN_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, Principal]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[Principal]:
+        with self._lock:
+            principal = self._entries.get(token)
+            if principal is None:
+                return None
+            if principal.expired(time.time()):
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return principal
+
+    def put(self, token: str, principal: Principal):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[token] = principal
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache()
+
+
+def credentials_exception(detail: str = "Could not validate credentials") -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail=detail,
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+
+def verify_token(token: str) -> Principal:
+    """Token -> Principal (cache hit không decode lại), token sai / hết hạn -> 401"""
+    principal = token_cache.get(token)
+    if principal is not None:
+        return principal
+
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])  # jose tự kiểm tra exp
+    except JWTError:
+        raise credentials_exception()
+    user_id = payload.get("id")
+    if user_id is None:
+        raise credentials_exception()
+
+    exp = payload.get("exp")
+    principal = Principal(
+        id=user_id, role=payload.get("role"), type=payload.get("type"),
+        expires_at=float(exp) if exp is not None else None
+    )
+    token_cache.put(token, principal)
+    return principal
+
+
+# --- Dependencies ---
+def get_principal(token: str = Depends(oauth2_scheme)) -> Principal:
+    return verify_token(token)
+
+
+def get_current_user_id(principal: Principal = Depends(get_principal)) -> int:
+    """ID người dùng trong token (store / chatbot)"""
+    return principal.id
+
+
+class CurrentCustomer:
+    """Khách hàng của request: .id có sẵn từ token, dòng Customer chỉ query khi gọi .load()"""
+
+    def __init__(self, principal: Principal, db: Session):
+        self.principal = principal
+        self.id = principal.id
+        self._db = db
+        self._row: Optional[Customer] = None
+
+    def load(self) -> Customer:
+        if self._row is None:
+            self._row = self._db.get(Customer, self.id)
+            if self._row is None:
+                raise credentials_exception(f"User not found for ID: {self.id}")
+        return self._row
+
+
+def get_current_customer(principal: Principal = Depends(get_principal), db: Session = Depends(get_db)) -> CurrentCustomer:
+    if principal.role != "customer":
+        raise credentials_exception(f"Invalid token: invalid role (got role: {principal.role})")
+    return CurrentCustomer(principal, db)
@@ -0,0 +1,143 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+import pytest
+
+from app.catalog_index import CatalogEntry, CatalogFilter, CatalogIndex, CatalogSnapshot, iter_ordinals
+
+ENTRIES = [
+    CatalogEntry(1, "Mountain-100 Red", Decimal(500), subcategory_id=1, condition="New", size="42", color="Red"),
+    CatalogEntry(2, "Road-200 Black", Decimal(1500), subcategory_id=2, condition="New", size="44", color="Black"),
+    CatalogEntry(3, "Mountain-300 Black", Decimal(2500), subcategory_id=1, condition="Used", size="42", color="black "),
+    CatalogEntry(4, "Road-400 Blue", Decimal(3500), subcategory_id=2, condition="Used", size="46", color="Blue",
+                 rent_price=Decimal(40), is_rentable=True),
+]
+CATEGORIES = {1: "Mountain Bikes", 2: "Road Bikes"}
+
+
+def build_snapshot(entries=ENTRIES):
+    snapshot = CatalogSnapshot(CATEGORIES)
+    for entry in entries:
+        snapshot.add(entry)
+    return snapshot
+
+
+@pytest.fixture
+def index():
+    index = CatalogIndex()
+    index._snapshot = build_snapshot()
+    return index
+
+
+def product_ids(entries):
+    return [entry.product_id for entry in entries]
+
+
+def counts(facets, facet):
+    return {item["value"]: item["count"] for item in facets[facet]}
+
+
+@pytest.mark.parametrize("mask, ordinals", [
+    (0, []),
+    (0b1, [0]),
+    (0b1011, [0, 1, 3]),
+    (1 << 200 | 1 << 3, [3, 200]),
+])
+def test_iter_ordinals(mask, ordinals):
+    assert iter_ordinals(mask) == ordinals
+
+
+def test_snapshot_add_and_match():
+    snapshot = build_snapshot()
+    assert product_ids(snapshot.entries_of(snapshot.all)) == [1, 2, 3, 4]
+    # Giá trị facet được casefold + strip: "black " trùng "Black"
+    black = snapshot.match(CatalogFilter(colors=["BLACK"]))
+    assert product_ids(snapshot.entries_of(black)) == [2, 3]
+    assert snapshot.label("category", 1) == "Mountain Bikes"
+    assert snapshot.label("color", "black") == "Black"
+
+
+def test_snapshot_remove_leaves_tombstone():
+    snapshot = build_snapshot()
+    snapshot.remove(2)
+    snapshot.remove(99)  # Không có -> bỏ qua
+    assert 2 not in snapshot.ordinals
+    assert snapshot.entries[1] is None
+    assert product_ids(snapshot.entries_of(snapshot.match(CatalogFilter(colors=["black"])))) == [3]
+    assert snapshot.mask_of([1, 2, 3]) == 0b101
+
+
+def test_snapshot_copy_is_independent():
+    snapshot = build_snapshot()
+    copy = snapshot.copy()
+    copy.remove(1)
+    copy.add(CatalogEntry(5, "Mountain-500 Red", Decimal(900), subcategory_id=1, color="Red"))
+    red = CatalogFilter(colors=["red"])
+    assert product_ids(snapshot.entries_of(snapshot.match(red))) == [1]
+    assert product_ids(copy.entries_of(copy.match(red))) == [5]
+    assert len(snapshot.entries) == 4
+
+
+def test_facet_counts_are_disjunctive(index):
+    facets = index.facet_counts(CatalogFilter(sizes=["42"], condition="new"))
+    # Facet đang lọc không tự giới hạn chính nó: size vẫn đếm trong các sản phẩm New
+    assert counts(facets, "size") == {"42": 1, "44": 1}
+    assert counts(facets, "condition") == {"new": 1, "used": 1}
+    assert counts(facets, "color") == {"red": 1}
+    assert counts(facets, "category") == {1: 1}
+
+
+def test_facet_counts_within_ids(index):
+    facets = index.facet_counts(CatalogFilter(), within_ids=[3, 4, 99])
+    assert counts(facets, "condition") == {"used": 2}
+    assert counts(facets, "rentable") == {False: 1, True: 1}
+    assert counts(facets, "price_range") == {"2000-3000": 1, "above 3000": 1}
+
+
+def test_ensure_loaded_is_single_flight(monkeypatch):
+    index = CatalogIndex()
+    started = threading.Event()
+    release = threading.Event()
+    loads = []
+
+    def slow_load(db):
+        loads.append(db)
+        started.set()
+        release.wait(5)
+        index._snapshot = build_snapshot()
+        index._loaded_at = time.monotonic()
+        return index
+
+    monkeypatch.setattr(index, "load", slow_load)
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        first = pool.submit(index.ensure_loaded, None)
+        started.wait(5)
+        waiting = [pool.submit(index.ensure_loaded, None) for _ in range(3)]
+        time.sleep(0.05)  # Để các request sau kịp tới chỗ chờ _reload_lock
+        release.set()
+        for job in [first, *waiting]:
+            job.result()
+    assert len(loads) == 1
+
+
+def test_stale_snapshot_served_while_reloading(index, monkeypatch):
+    index._loaded_at = 0.0
+    index.ttl = 0
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_load(db):
+        started.set()
+        release.wait(5)
+        return index
+
+    monkeypatch.setattr(index, "load", slow_load)
+    reloader = threading.Thread(target=index.ensure_loaded, args=(None,))
+    reloader.start()
+    started.wait(5)
+    assert index.ensure_loaded(None) is index  # Không chờ reload, vẫn đọc snapshot cũ
+    assert product_ids(index.search(CatalogFilter(category_id=2))) == [2, 4]
+    release.set()
+    reloader.join()
@@ -0,0 +1,42 @@
+import pytest
+
+from app.chat_cache import ChatAnswerCache
+
+FINGERPRINT = "prompt-v1"
+
+
+@pytest.fixture
+def cache():
+    return ChatAnswerCache()
+
+
+def store_search(cache, message, sql):
+    cache.store(message, FINGERPRINT, False, {"intent": "product_search", "sql_query": sql})
+
+
+# Câu mua / đặt hàng gần giống câu tìm kiếm đã cache -> phải gọi AI (order_intent không bao giờ lấy từ cache)
+@pytest.mark.parametrize("cached, message", [
+    ("cho mình xem xe đạp địa hình Trek Marlin 5 Gen 2", "cho mình mua xe đạp địa hình Trek Marlin 5 Gen 2"),
+    ("tìm xe đạp địa hình Giant Talon 29 màu đen", "đặt xe đạp địa hình Giant Talon 29 màu đen"),
+    ("tìm xe đạp địa hình màu đỏ", "tìm xe đạp địa hình màu đen"),
+])
+def test_product_search_needs_exact_match(cache, cached, message):
+    store_search(cache, cached, "SELECT 1")
+    assert cache.lookup(message, FINGERPRINT, False) is None
+
+
+def test_product_search_exact_match_after_normalize(cache):
+    store_search(cache, "Tìm xe đạp địa hình màu đỏ", "SELECT 1")
+    entry = cache.lookup("tim xe dap dia hinh mau do!!", FINGERPRINT, False)
+    assert entry is not None and entry.answer == {"sql_query": "SELECT 1"}
+
+
+def test_near_duplicate_policy_question(cache):
+    cache.store("Chính sách đổi trả thế nào?", FINGERPRINT, False, {"intent": "policy", "reply_message": "7 ngày"})
+    entry = cache.lookup("chinh sach doi tra the naoo", FINGERPRINT, True)  # Gõ sai, có lịch sử chat
+    assert entry is not None and entry.answer == {"reply_message": "7 ngày"}
+
+
+def test_order_intent_is_never_cached(cache):
+    cache.store("mua mã 2", FINGERPRINT, False, {"intent": "order_intent", "order_details": {"product_id": 2}})
+    assert cache.lookup("mua mã 2", FINGERPRINT, False) is None
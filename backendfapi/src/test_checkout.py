@@ -0,0 +1,152 @@
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import create_engine, func, select, update
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.schema import ColumnDefault
+
+from app import checkout
+from app.database import Base
+from app.models import (
+    Cart, CartItem, Customer, CustomerAdress, Product, ProductInventory, SalesOrderDetail, SalesOrderHeader,
+    SalesOrderStockReservation, Voucher, VoucherUsage,
+)
+from app.stock import MAINTENANCE_LOCATION_ID
+
+PRODUCT_ID = 1
+STOCK = {1: 7, 2: 5}  # LocationID -> Quantity (ngoài kho bảo trì)
+VOUCHER_CODE = "TEST-CHECKOUT"
+VOUCHER_QUANTITY = 3
+CUSTOMERS = 20
+
+
+@pytest.fixture
+def session_factory(tmp_path, monkeypatch):
+    """DB SQLite tạm (file, để các thread dùng connection riêng) với 1 sản phẩm, 1 voucher, CUSTOMERS giỏ hàng"""
+    # SQLite không có IDENTITY cho khóa chính ghép -> cấp SalesOrderDetailID phía Python
+    detail_ids = itertools.count(1)
+    detail_id = SalesOrderDetail.__table__.c.SalesOrderDetailID
+    monkeypatch.setattr(detail_id, "autoincrement", False)
+    monkeypatch.setattr(detail_id, "default", ColumnDefault(lambda ctx: next(detail_ids)))
+    monkeypatch.setattr(checkout, "CHECKOUT_RETRY_BACKOFF", 0)
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'checkout.db'}", connect_args={"check_same_thread": False, "timeout": 30})
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine, autoflush=False)
+    now = datetime.now()
+    with factory() as db:
+        db.add(Product(
+            ProductID=PRODUCT_ID, Name="Test bike", ProductNumber="BK-TEST", FinishedGoodsFlag=True, ReorderPoint=1,
+            SafetyStockLevel=1, StandardCost=1, ListPrice=100, DaysToManufacture=0, SellStartDate=now, ModifiedDate=now,
+        ))
+        for location_id, quantity in STOCK.items():
+            db.add(ProductInventory(ProductID=PRODUCT_ID, LocationID=location_id, Quantity=quantity, ModifiedDate=now))
+        db.add(ProductInventory(ProductID=PRODUCT_ID, LocationID=MAINTENANCE_LOCATION_ID, Quantity=50, ModifiedDate=now))
+        db.add(Voucher(
+            Code=VOUCHER_CODE, Scope="all", DiscountAmount=1, StartDate=now - timedelta(days=1),
+            EndDate=now + timedelta(days=1), MinOrderAmount=0, Quantity=VOUCHER_QUANTITY, Status=True,
+        ))
+        for customer_id in range(1, CUSTOMERS + 1):
+            db.add(Customer(CustomerID=customer_id, FirstName="Test", Status=1))
+            db.add(CustomerAdress(AddressID=customer_id, CustomerID=customer_id, AddressLine1="Test", ModifiedDate=now))
+            db.add(Cart(CartID=customer_id, CustomerID=customer_id, Status="Active", IsCheckedOut=False))
+            db.add(CartItem(
+                CartID=customer_id, ProductID=PRODUCT_ID, Quantity=1, UnitPrice=100, Subtotal=100, TransactionType="buy",
+            ))
+        db.commit()
+    yield factory
+    engine.dispose()
+
+
+def checkout_customer(factory, customer_id):
+    with factory() as db:
+        try:
+            try:
+                checkout.place_order(db, customer_id, customer_id, voucher_code=VOUCHER_CODE)
+                return "ok (voucher)"
+            except HTTPException as e:
+                if "voucher" not in e.detail.lower():
+                    raise
+            checkout.place_order(db, customer_id, customer_id)  # Hết voucher -> checkout lại không dùng voucher
+            return "ok"
+        except HTTPException as e:
+            return e.status_code
+
+
+def test_concurrent_checkout_never_oversells(session_factory):
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        outcomes = list(pool.map(lambda cid: checkout_customer(session_factory, cid), range(1, CUSTOMERS + 1)))
+
+    total_stock = sum(STOCK.values())
+    with session_factory() as db:
+        sold = db.scalar(select(func.coalesce(func.sum(SalesOrderDetail.OrderQty), 0)))
+        stock = dict(db.execute(
+            select(ProductInventory.LocationID, ProductInventory.Quantity).where(ProductInventory.ProductID == PRODUCT_ID)
+        ).all())
+        reserved = db.scalar(select(func.coalesce(func.sum(SalesOrderStockReservation.Quantity), 0)))
+        voucher = db.execute(select(Voucher).where(Voucher.Code == VOUCHER_CODE)).scalar_one()
+        used = db.scalar(select(func.count()).select_from(VoucherUsage))
+
+    assert sold == total_stock
+    assert outcomes.count(409) == CUSTOMERS - total_stock
+    assert reserved == sold
+    assert stock == {**{location_id: 0 for location_id in STOCK}, MAINTENANCE_LOCATION_ID: 50}
+    assert used == VOUCHER_QUANTITY and voucher.Quantity == 0
+    assert outcomes.count("ok (voucher)") == VOUCHER_QUANTITY
+
+
+def test_release_stock_restores_debited_locations(session_factory):
+    with session_factory() as db:
+        db.execute(CartItem.__table__.update().where(CartItem.CartID == 1).values(Quantity=9, Subtotal=900))
+        db.commit()
+        order = checkout.place_order(db, 1, 1)
+        assert dict(db.execute(
+            select(SalesOrderStockReservation.LocationID, SalesOrderStockReservation.Quantity)
+        ).all()) == {1: 7, 2: 2}
+
+        assert checkout.release_stock(db, order.buy_order_id)
+        db.commit()
+        assert not checkout.release_stock(db, order.buy_order_id)  # Hủy lần 2 không cộng kho nữa
+        stock = dict(db.execute(
+            select(ProductInventory.LocationID, ProductInventory.Quantity)
+            .where(ProductInventory.LocationID != MAINTENANCE_LOCATION_ID)
+        ).all())
+        assert stock == STOCK
+        assert db.get(SalesOrderHeader, order.buy_order_id).StockReservedAt is None
+
+
+def test_deadlock_victim_is_retried(session_factory, monkeypatch):
+    place_order = checkout._place_order
+    calls = []
+
+    def deadlock_once(db, *args):
+        calls.append(args)
+        if len(calls) == 1:
+            db.execute(update(Voucher).values(Quantity=Voucher.Quantity - 1))  # Phải được rollback trước khi chạy lại
+            raise DBAPIError("UPDATE ProductInventory", {}, Exception("(1205) Transaction was deadlocked"))
+        return place_order(db, *args)
+
+    monkeypatch.setattr(checkout, "_place_order", deadlock_once)
+    with session_factory() as db:
+        result = checkout.place_order(db, 1, 1, voucher_code=VOUCHER_CODE)
+        assert len(calls) == 2
+        assert result.buy_order_id is not None
+        assert db.scalar(select(func.count()).select_from(VoucherUsage)) == 1
+        assert db.scalar(select(Voucher.Quantity)) == VOUCHER_QUANTITY - 1
+
+
+def test_other_db_errors_are_not_retried(session_factory, monkeypatch):
+    calls = []
+
+    def fail(db, *args):
+        calls.append(args)
+        raise DBAPIError("INSERT SalesOrderHeader", {}, Exception("(2627) Violation of PRIMARY KEY constraint"))
+
+    monkeypatch.setattr(checkout, "_place_order", fail)
+    with session_factory() as db, pytest.raises(DBAPIError):
+        checkout.place_order(db, 1, 1)
+    assert len(calls) == 1
@@ -0,0 +1,105 @@
+import pytest
+from sqlalchemy import Column, Integer, String, create_engine, insert, update
+from sqlalchemy.orm import declarative_base, sessionmaker
+
+from app.count_cache import count_cache
+
+Base = declarative_base()
+
+
+class Ticket(Base):
+    __tablename__ = "CountCacheTicket"
+
+    TicketID = Column(Integer, primary_key=True)
+    Status = Column(String(10), nullable=False)
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(Ticket), [{"TicketID": i, "Status": "open"} for i in range(1, 4)])
+    count_cache.invalidate(None)
+    yield engine
+    count_cache.invalidate(None)
+    engine.dispose()
+
+
+@pytest.fixture
+def session_factory(engine):
+    return sessionmaker(bind=engine)
+
+
+def insert_behind_cache(engine, ticket_id):
+    """Ghi thẳng qua Core connection (không qua Session) -> count cache không biết, giá trị cache thành cũ"""
+    with engine.begin() as conn:
+        conn.execute(insert(Ticket), {"TicketID": ticket_id, "Status": "open"})
+
+
+def count_open(db):
+    return count_cache.count(db.query(Ticket).filter(Ticket.Status == "open"))
+
+
+def test_count_survives_read_only_request(engine, session_factory):
+    with session_factory() as db:
+        assert count_open(db) == 3
+    insert_behind_cache(engine, 10)
+    with session_factory() as db:
+        db.query(Ticket).all()
+        db.commit()  # Commit không ghi gì
+        assert count_open(db) == 3  # Vẫn lấy từ cache
+
+
+def test_cache_key_includes_params(session_factory):
+    with session_factory() as db:
+        assert count_open(db) == 3
+        assert count_cache.count(db.query(Ticket).filter(Ticket.Status == "closed")) == 0
+
+
+def test_commit_on_table_invalidates(engine, session_factory):
+    with session_factory() as db:
+        assert count_open(db) == 3
+        db.add(Ticket(TicketID=4, Status="open"))
+        db.commit()
+        assert count_open(db) == 4
+
+
+def test_bulk_update_commit_invalidates(session_factory):
+    with session_factory() as db:
+        assert count_open(db) == 3
+        db.execute(update(Ticket).where(Ticket.TicketID == 1).values(Status="closed"))
+        db.commit()
+        assert count_open(db) == 2
+
+
+def test_rolled_back_flush_does_not_invalidate(engine, session_factory):
+    with session_factory() as db:
+        assert count_open(db) == 3
+        insert_behind_cache(engine, 10)
+        db.add(Ticket(TicketID=4, Status="open"))
+        db.flush()
+        db.rollback()
+        db.query(Ticket).all()
+        db.commit()  # Commit sau rollback không được invalidate theo flush đã bị hủy
+        assert count_open(db) == 3
+
+
+def test_rolled_back_savepoint_keeps_outer_writes(session_factory):
+    with session_factory() as db:
+        assert count_open(db) == 3
+        db.add(Ticket(TicketID=4, Status="open"))
+        savepoint = db.begin_nested()
+        db.add(Ticket(TicketID=5, Status="open"))
+        db.flush()
+        savepoint.rollback()
+        db.commit()
+        assert count_open(db) == 4
+
+
+def test_invalidate_all(engine, session_factory):
+    with session_factory() as db:
+        assert count_open(db) == 3
+        insert_behind_cache(engine, 10)
+        count_cache.invalidate(None)
+        assert count_open(db) == 4
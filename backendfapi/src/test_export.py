@@ -0,0 +1,40 @@
+import csv
+import io
+from decimal import Decimal
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+from app.export import encode_csv, schema_columns
+
+
+class Prices(BaseModel):
+    list_price: Decimal
+    sale_price: Optional[Decimal] = None
+
+
+class Row(BaseModel):
+    id: int
+    star_5: int = Field(0, alias="5_star")
+    prices: Optional[Prices] = None
+    tags: list = []
+
+
+def read_csv(items):
+    text = b"".join(encode_csv(items, Row)).decode("utf-8")
+    assert text.startswith("\ufeff")
+    return list(csv.reader(io.StringIO(text[1:])))
+
+
+def test_schema_columns_are_flattened_with_aliases():
+    assert schema_columns(Row) == ["id", "5_star", "prices.list_price", "prices.sale_price", "tags"]
+
+
+def test_empty_export_still_has_header():
+    assert read_csv([]) == [["id", "5_star", "prices.list_price", "prices.sale_price", "tags"]]
+
+
+def test_header_does_not_depend_on_first_row():
+    rows = read_csv([Row(id=1), Row(id=2, prices=Prices(list_price=Decimal("9.5")))])
+    assert rows[1] == ["1", "0", "", "", "[]"]  # prices=None -> cột con để trống
+    assert rows[2] == ["2", "0", "9.5", "", "[]"]
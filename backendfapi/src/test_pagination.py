@@ -0,0 +1,118 @@
+import base64
+import json
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import Column, DateTime, Integer, Numeric, String, create_engine
+from sqlalchemy.orm import declarative_base, sessionmaker
+
+from app.helper import CursorParams, decode_cursor, encode_cursor, keyset_paginate
+
+Base = declarative_base()
+START = datetime(2025, 1, 1, 8, 0)
+
+
+class Item(Base):
+    __tablename__ = "PaginationItem"
+
+    ItemID = Column(Integer, primary_key=True)
+    CreatedAt = Column(DateTime, nullable=False)
+    Price = Column(Numeric(10, 2), nullable=False)
+    Name = Column(String(20), nullable=False)
+
+
+SORT_KEY = [Item.CreatedAt, Item.ItemID]
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    # 10 dòng, cứ 2 dòng trùng CreatedAt -> phải phân biệt bằng ItemID
+    session.add_all(
+        Item(ItemID=i, CreatedAt=START + timedelta(hours=i // 2), Price=Decimal(i * 10), Name=f"item {i}")
+        for i in range(1, 11)
+    )
+    session.commit()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def ids(rows):
+    return [row.ItemID for row in rows]
+
+
+def page(db, page=1, limit=3, **params):
+    return keyset_paginate(db.query(Item), SORT_KEY, page, limit, CursorParams(**params))
+
+
+def raw_cursor(values) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+
+def test_forward_cursor_walks_every_row_once(db):
+    rows, meta = page(db, paging="cursor", total="deferred")
+    seen = ids(rows)
+    assert meta.prev_cursor is None and meta.total_items is None and meta.current_page is None
+    while meta.next_cursor:
+        rows, meta = page(db, cursor=meta.next_cursor, total="deferred")
+        seen += ids(rows)
+    assert seen == [10, 9, 8, 7, 6, 5, 4, 3, 2, 1]
+
+
+def test_prev_cursor_returns_previous_page(db):
+    _, first = page(db, paging="cursor")
+    second_rows, second = page(db, cursor=first.next_cursor)
+    third_rows, third = page(db, cursor=second.next_cursor)
+    back_rows, back = page(db, cursor=third.prev_cursor)
+    assert ids(back_rows) == ids(second_rows) == [7, 6, 5]
+    assert back.next_cursor is not None and back.prev_cursor is not None
+    first_rows, top = page(db, cursor=second.prev_cursor)
+    assert ids(first_rows) == [10, 9, 8]
+    assert top.prev_cursor is None  # Không còn dòng nào phía trước
+
+
+def test_page_mode_cursor_continues_from_offset_page(db):
+    rows, meta = page(db, page=2)
+    assert ids(rows) == [7, 6, 5]
+    assert meta.current_page == 2 and meta.total_items == 10 and meta.total_pages == 4
+    next_rows, _ = page(db, cursor=meta.next_cursor)
+    assert ids(next_rows) == ids(page(db, page=3)[0]) == [4, 3, 2]
+    prev_rows, _ = page(db, cursor=meta.prev_cursor)
+    assert ids(prev_rows) == ids(page(db, page=1)[0])
+
+
+def test_cursor_round_trip_keeps_types():
+    values = ["next", START, Decimal("12.50"), "x", 3]
+    assert decode_cursor(encode_cursor(values), [Item.CreatedAt, Item.Price, Item.Name, Item.ItemID]) == (
+        "next", values[1:]
+    )
+
+
+@pytest.mark.parametrize("cursor", [
+    "***",                                       # Không phải base64
+    raw_cursor({"next": 1}),                     # Không phải mảng
+    raw_cursor(["next", 1]),                     # Thiếu cột
+    raw_cursor(["sideways", {"$dt": START.isoformat()}, 1]),
+    raw_cursor(["next", "abc", 1]),              # CreatedAt phải là datetime
+    raw_cursor(["next", {"$dt": START.isoformat()}, "abc"]),
+    raw_cursor(["next", {"$dt": START.isoformat()}, [1]]),
+    raw_cursor(["next", {"$dt": START.isoformat()}, None]),
+    raw_cursor(["next", {"$dt": START.isoformat()}, True]),
+    raw_cursor(["next", {"$dt": "yesterday"}, 1]),
+])
+def test_invalid_cursor_is_rejected(db, cursor):
+    with pytest.raises(HTTPException) as error:
+        page(db, cursor=cursor)
+    assert error.value.status_code == 400
+
+
+@pytest.mark.parametrize("value", [{"$dec": "abc"}, {"$dec": "NaN"}, "12.5"])
+def test_invalid_decimal_cursor_is_rejected(value):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(raw_cursor(["next", value, 1]), [Item.Price, Item.ItemID])
+    assert error.value.status_code == 400
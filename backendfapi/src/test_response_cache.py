@@ -0,0 +1,161 @@
+from datetime import datetime
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import app.response_cache as cache_module
+from app.database import get_db
+from app.models import Product, ProductImage, ProductInventory
+from app.response_cache import MemoryBackend, ResponseCache, cached_response, product_tag
+from app.routes.admin.apis import admin_router
+from app.routes.store.apis import store_router
+
+
+class FlakyBackend(MemoryBackend):
+    """Backend dùng chung mất kết nối khi tăng version tag; ghi lại TTL của mỗi lần set"""
+
+    def __init__(self):
+        super().__init__()
+        self.fail_incr = False
+        self.ttls = []
+
+    def incr(self, key):
+        if self.fail_incr:
+            raise ConnectionError("backend down")
+        return super().incr(key)
+
+    def set(self, key, value, ttl):
+        self.ttls.append(ttl)
+        super().set(key, value, ttl)
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = ResponseCache(FlakyBackend(), ttl=60, fallback_ttl=5)
+    monkeypatch.setattr(cache_module, "response_cache", cache)
+    return cache
+
+
+@pytest.fixture
+def calls():
+    return []
+
+
+@pytest.fixture
+def client(cache, calls):
+    api = FastAPI()
+
+    @api.get("/sync/{item_id}")
+    @cached_response(tags=lambda params, result: [product_tag(params["item_id"])])
+    def read_sync(item_id: int, q: str = ""):
+        calls.append(("sync", item_id))
+        return {"item_id": item_id, "q": q, "version": len(calls)}
+
+    @api.get("/async/{item_id}")
+    @cached_response(tags=lambda params, result: [product_tag(params["item_id"])])
+    async def read_async(item_id: int):
+        calls.append(("async", item_id))
+        return {"item_id": item_id, "version": len(calls)}
+
+    return TestClient(api)
+
+
+@pytest.mark.parametrize("path", ["/sync/1", "/async/1"])
+def test_second_request_is_served_from_cache(client, calls, path):
+    first = client.get(path)
+    second = client.get(path)
+    assert first.status_code == second.status_code == 200
+    assert first.content == second.content
+    assert first.headers["etag"] == second.headers["etag"]
+    assert first.headers["cache-control"] == "no-cache"
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize("if_none_match", ["{etag}", "W/{etag}", '"other", {etag}', "*"])
+def test_matching_etag_returns_304(client, if_none_match):
+    etag = client.get("/sync/1").headers["etag"]
+    response = client.get("/sync/1", headers={"If-None-Match": if_none_match.format(etag=etag)})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+
+
+def test_stale_etag_gets_full_body(client):
+    response = client.get("/sync/1", headers={"If-None-Match": '"stale"'})
+    assert response.status_code == 200 and response.json()["item_id"] == 1
+
+
+def test_query_string_is_part_of_key(client, calls):
+    assert client.get("/sync/1?q=a").json()["q"] == "a"
+    assert client.get("/sync/1?q=b").json()["q"] == "b"
+    assert len(calls) == 2
+
+
+@pytest.mark.parametrize("path", ["/sync/1", "/async/1"])
+def test_tag_invalidation_evicts_only_tagged_entries(client, cache, calls, path):
+    etag = client.get(path).headers["etag"]
+    client.get(path.replace("/1", "/2"))
+    cache.invalidate(product_tag(1))
+    response = client.get(path, headers={"If-None-Match": etag})
+    assert response.status_code == 200 and response.headers["etag"] != etag
+    client.get(path.replace("/1", "/2"))
+    assert len(calls) == 3  # Entry của item 2 vẫn còn
+
+
+def test_invalidate_fails_soft(client, cache, calls):
+    client.get("/sync/1")
+    cache.backend.fail_incr = True
+    cache.invalidate(product_tag(1))  # Không raise
+    cache.backend.fail_incr = False
+    client.get("/sync/2")
+    assert cache.backend.ttls == [60, 5]  # Entry ghi sau khi invalidate lỗi chỉ sống fallback_ttl
+
+
+# --- Storefront detail bị evict sau khi admin PATCH sản phẩm ---
+@pytest.fixture
+def store_client(cache):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    tables = [Product.__table__, ProductImage.__table__, ProductInventory.__table__]
+    Product.metadata.create_all(engine, tables=tables)
+    factory = sessionmaker(bind=engine, autoflush=False)
+    now = datetime.now()
+    with factory() as db:
+        db.add(Product(
+            ProductID=1, Name="Trek Marlin 5", ProductNumber="BK-M5", FinishedGoodsFlag=True, ReorderPoint=1,
+            SafetyStockLevel=1, StandardCost=100, ListPrice=500, DaysToManufacture=0, SellStartDate=now,
+            ModifiedDate=now, Condition="New",
+        ))
+        db.commit()
+
+    def session():
+        with factory() as db:
+            yield db
+
+    api = FastAPI()
+    api.include_router(store_router)
+    api.include_router(admin_router)
+    api.dependency_overrides[get_db] = session
+    yield TestClient(api)
+    engine.dispose()
+
+
+def test_product_patch_evicts_store_detail(store_client):
+    first = store_client.get("/store/products/1/detail")
+    assert first.status_code == 200 and first.json()["data"]["name"] == "Trek Marlin 5"
+    assert store_client.get("/store/products/1/detail", headers={"If-None-Match": first.headers["etag"]}).status_code == 304
+
+    response = store_client.patch("/admin/products/1", json={
+        "name": "Trek Marlin 7", "product_number": "BK-M7", "subcategory_id": 1, "standard_cost": 100,
+        "list_price": 650, "attributes": {"color": "Black"}, "safety_stock_level": 1, "reorder_point": 1,
+        "stock_details": {"total_stock": 5}, "rental_config": {"is_rentable": False}, "images": [],
+    })
+    assert response.status_code == 200
+
+    detail = store_client.get("/store/products/1/detail", headers={"If-None-Match": first.headers["etag"]})
+    assert detail.status_code == 200
+    assert detail.json()["data"]["name"] == "Trek Marlin 7"
+    assert detail.headers["etag"] != first.headers["etag"]
@@ -0,0 +1,94 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.search_engine import SearchIndex
+
+
+class MemorySearchIndex(SearchIndex):
+    """Document lấy từ dict thay cho DB; before_fetch_all chạy giữa lúc load() đang đọc"""
+    field_weights = {"name": 1.0}
+
+    def __init__(self, docs, ttl=600):
+        super().__init__(ttl)
+        self.docs = dict(docs)
+        self.full_loads = 0
+        self.before_fetch_all = None
+
+    def _fetch(self, db, doc_id=None):
+        if doc_id is not None:
+            return [(doc_id, self.docs[doc_id])] if doc_id in self.docs else []
+        self.full_loads += 1
+        snapshot = list(self.docs.items())
+        if self.before_fetch_all:
+            self.before_fetch_all()
+        return snapshot
+
+
+def ids(index, query):
+    return [doc_id for doc_id, _ in index.search(query)]
+
+
+def test_refresh_and_remove_copy_on_write():
+    index = MemorySearchIndex({1: {"name": "mountain bike"}, 2: {"name": "road bike"}}).load(None)
+    before = index._index
+    index.docs[3] = {"name": "mountain helmet"}
+    index.refresh(None, 3)
+    index.remove(1)
+    assert ids(index, "mountain") == [3]
+    assert sorted(doc_id for doc_id, _ in before.search("mountain")) == [1]  # Reader đang giữ index cũ không đổi
+
+
+def test_refresh_during_load_is_not_lost():
+    index = MemorySearchIndex({1: {"name": "mountain bike"}})
+
+    def commit_during_load():
+        index.docs[1] = {"name": "gravel bike"}
+        index.refresh(None, 1)
+
+    index.before_fetch_all = commit_during_load
+    index.load(None)
+    assert ids(index, "gravel") == [1]
+    assert ids(index, "mountain") == []
+
+
+def test_ensure_loaded_is_single_flight():
+    index = MemorySearchIndex({1: {"name": "mountain bike"}})
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_fetch():
+        started.set()
+        release.wait(5)
+
+    index.before_fetch_all = slow_fetch
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        first = pool.submit(index.ensure_loaded, None)
+        started.wait(5)
+        waiting = [pool.submit(index.ensure_loaded, None) for _ in range(3)]
+        time.sleep(0.05)  # Để các request sau kịp tới chỗ chờ _reload_lock
+        release.set()
+        for job in [first, *waiting]:
+            job.result()
+    assert index.full_loads == 1
+    assert ids(index, "mountain") == [1]
+
+
+def test_stale_index_served_while_reloading():
+    index = MemorySearchIndex({1: {"name": "mountain bike"}}, ttl=0).load(None)
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_fetch():
+        started.set()
+        release.wait(5)
+
+    index.before_fetch_all = slow_fetch
+    index.docs[1] = {"name": "gravel bike"}
+    reloader = threading.Thread(target=index.ensure_loaded, args=(None,))
+    reloader.start()
+    started.wait(5)
+    assert ids(index.ensure_loaded(None), "mountain") == [1]  # Không chờ reload
+    release.set()
+    reloader.join()
+    assert ids(index, "gravel") == [1]
@@ -0,0 +1,84 @@
+import time
+
+import pytest
+from fastapi import Depends, FastAPI, HTTPException
+from fastapi.testclient import TestClient
+from jose import jwt
+
+from app.routes.auth.config import ALGORITHM, SECRET_KEY  # Import routes trước token_cache như app/__init__
+import app.token_cache as token_module
+from app.token_cache import Principal, TokenCache, get_current_user_id, token_cache, verify_token
+
+
+def make_token(user_id=7, role="customer", expires_in=3600):
+    return jwt.encode({"id": user_id, "role": role, "exp": int(time.time()) + expires_in}, SECRET_KEY, algorithm=ALGORITHM)
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    token_cache.clear()
+    yield
+    token_cache.clear()
+
+
+def test_entry_expires_at_exp_claim(monkeypatch):
+    cache = TokenCache()
+    cache.put("token", Principal(id=1, role="customer", type=None, expires_at=1000.0))
+    monkeypatch.setattr(token_module.time, "time", lambda: 999.0)
+    assert cache.get("token").id == 1
+    monkeypatch.setattr(token_module.time, "time", lambda: 1000.0)
+    assert cache.get("token") is None
+    assert "token" not in cache._entries
+
+
+def test_lru_eviction():
+    cache = TokenCache(max_size=2)
+    for name in ("a", "b"):
+        cache.put(name, Principal(id=ord(name), role="customer", type=None, expires_at=None))
+    assert cache.get("a") is not None  # "a" thành mới dùng nhất
+    cache.put("c", Principal(id=3, role="customer", type=None, expires_at=None))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+
+
+def test_cache_disabled_when_size_is_zero():
+    cache = TokenCache(max_size=0)
+    cache.put("a", Principal(id=1, role="customer", type=None, expires_at=None))
+    assert cache.get("a") is None
+
+
+def test_verified_token_is_not_decoded_again(monkeypatch):
+    token = make_token()
+    assert verify_token(token).id == 7
+    decode_calls = []
+    monkeypatch.setattr(token_module.jwt, "decode", lambda *args, **kwargs: decode_calls.append(args))
+    assert verify_token(token).id == 7
+    assert decode_calls == []
+
+
+@pytest.mark.parametrize("token", [
+    "not-a-jwt",
+    make_token(expires_in=-60),                                                   # Hết hạn
+    jwt.encode({"id": 7, "exp": int(time.time()) + 60}, "wrong-secret", algorithm=ALGORITHM),
+    jwt.encode({"role": "customer", "exp": int(time.time()) + 60}, SECRET_KEY, algorithm=ALGORITHM),  # Thiếu id
+])
+def test_invalid_token_is_401(token):
+    with pytest.raises(HTTPException) as error:
+        verify_token(token)
+    assert error.value.status_code == 401
+    assert error.value.headers == {"WWW-Authenticate": "Bearer"}
+    assert token_cache.get(token) is None
+
+
+def test_dependency_over_http():
+    api = FastAPI()
+
+    @api.get("/me")
+    def me(user_id: int = Depends(get_current_user_id)):
+        return {"id": user_id}
+
+    client = TestClient(api)
+    assert client.get("/me").status_code == 401
+    assert client.get("/me", headers={"Authorization": "Bearer not-a-jwt"}).status_code == 401
+    response = client.get("/me", headers={"Authorization": f"Bearer {make_token(user_id=42)}"})
+    assert response.status_code == 200 and response.json() == {"id": 42}
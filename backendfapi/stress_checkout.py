@@ -0,0 +1,178 @@
+"""
+Kiểm tra checkout đồng thời (app/checkout.py) trên DB thật: N khách cùng checkout 1 sản phẩm / 1 voucher có hạn,
+sau đó kiểm tra không bán quá tồn kho và không dùng quá số lượng voucher.
+
+    python stress_checkout.py --product-id 680 --stock 100 --orders 300 --quantity 2 --voucher-quantity 40
+
+Script tạo khách / địa chỉ / giỏ hàng / voucher tạm (tên "Stress"), đặt tồn kho sản phẩm = --stock ở 1 kho,
+chạy --orders checkout song song (--concurrency thread, mỗi thread 1 session) rồi dọn sạch dữ liệu tạm,
+khôi phục tồn kho và tính lại DailyRevenue hôm nay (--keep để giữ lại xem).
+Chỉ chạy trên DB dev. Nên đặt DB_POOL_SIZE / DB_MAX_OVERFLOW >= --concurrency.
+"""
+
+import argparse
+import os
+import sys
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
+
+# Fix encoding cho Windows console
+if sys.platform == 'win32':
+    import io
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+
+from fastapi import HTTPException
+from sqlalchemy import delete, func, select
+
+from app.database import SessionLocal
+from app.models import (
+    Cart, CartItem, Customer, CustomerAdress, Product, ProductInventory, RentalDetail, RentalHeader,
+    SalesOrderDetail, SalesOrderHeader, SalesOrderStockReservation, Voucher, VoucherUsage,
+)
+from app.checkout import place_order
+from app.revenue import rebuild_daily_revenue
+from app.stock import MAINTENANCE_LOCATION_ID
+
+
+def setup(db, args, code):
+    """Trả về (danh sách CustomerID tạm, tồn kho gốc [(LocationID, Quantity)])"""
+    product = db.get(Product, args.product_id)
+    if not product:
+        sys.exit(f"Product {args.product_id} not found")
+
+    inventory = db.execute(
+        select(ProductInventory).where(ProductInventory.ProductID == args.product_id)
+    ).scalars().all()
+    original = [(inv.LocationID, inv.Quantity) for inv in inventory]
+    stocked = [inv for inv in inventory if inv.LocationID != MAINTENANCE_LOCATION_ID]
+    if not stocked:
+        sys.exit(f"Product {args.product_id} has no inventory row outside maintenance")
+    for i, inv in enumerate(stocked):
+        inv.Quantity = args.stock if i == 0 else 0
+
+    now = datetime.now()
+    db.add(Voucher(
+        Code=code, Name="Stress", Scope="all", DiscountAmount=1, StartDate=now - timedelta(days=1),
+        EndDate=now + timedelta(days=1), MinOrderAmount=0, Quantity=args.voucher_quantity, Status=True
+    ))
+    customers = [Customer(FirstName="Stress", LastName=code, Status=1) for _ in range(args.orders)]
+    db.add_all(customers)
+    db.flush()
+    for customer in customers:
+        db.add(CustomerAdress(CustomerID=customer.CustomerID, AddressLine1="Stress", ModifiedDate=now))
+        cart = Cart(CustomerID=customer.CustomerID, CreatedDate=now, ModifiedDate=now, Status="Active", IsCheckedOut=False)
+        db.add(cart)
+        db.flush()
+        db.add(CartItem(
+            CartID=cart.CartID, ProductID=args.product_id, Quantity=args.quantity,
+            UnitPrice=product.ListPrice, DateAdded=now, TransactionType="buy"
+        ))
+    db.commit()
+    return [c.CustomerID for c in customers], original
+
+
+def checkout(customer_id: int, code: str):
+    with SessionLocal() as db:
+        address_id = db.scalar(select(CustomerAdress.AddressID).where(CustomerAdress.CustomerID == customer_id))
+        try:
+            try:
+                place_order(db, customer_id, address_id, voucher_code=code)
+                return "ok (voucher)"
+            except HTTPException as e:
+                if "voucher" not in e.detail.lower():
+                    raise
+            # Hết voucher -> khách checkout lại không dùng voucher
+            place_order(db, customer_id, address_id)
+            return "ok"
+        except HTTPException as e:
+            return f"{e.status_code} {e.detail}"
+        except Exception as e:
+            return f"error {type(e).__name__}: {e}"
+
+
+def verify(db, args, code, customer_ids) -> bool:
+    sold = db.scalar(
+        select(func.coalesce(func.sum(SalesOrderDetail.OrderQty), 0))
+        .join(SalesOrderHeader, SalesOrderHeader.SalesOrderID == SalesOrderDetail.SalesOrderID)
+        .where(SalesOrderHeader.CustomerID.in_(customer_ids))
+    )
+    stock = db.execute(
+        select(ProductInventory.LocationID, ProductInventory.Quantity).where(
+            ProductInventory.ProductID == args.product_id, ProductInventory.LocationID != MAINTENANCE_LOCATION_ID)
+    ).all()
+    voucher = db.execute(select(Voucher).where(Voucher.Code == code)).scalar_one()
+    used = db.scalar(select(func.count()).select_from(VoucherUsage).where(VoucherUsage.VoucherID == voucher.VoucherID))
+
+    expected_sold = min(args.orders, args.stock // args.quantity) * args.quantity
+    checks = {
+        f"bán {sold} / tồn kho {args.stock} (kỳ vọng {expected_sold})": sold == expected_sold,
+        f"tồn kho còn lại {sum(q for _, q in stock)} = {args.stock} - {sold}": sum(q for _, q in stock) == args.stock - sold,
+        f"không kho nào âm {stock}": all(q >= 0 for _, q in stock),
+        f"voucher dùng {used} / {args.voucher_quantity}, còn {voucher.Quantity}":
+            used <= args.voucher_quantity and voucher.Quantity == args.voucher_quantity - used,
+    }
+    for label, passed in checks.items():
+        print(f"  [{'PASS' if passed else 'FAIL'}] {label}")
+    return all(checks.values())
+
+
+def cleanup(db, args, code, customer_ids, original):
+    sales_ids = select(SalesOrderHeader.SalesOrderID).where(SalesOrderHeader.CustomerID.in_(customer_ids))
+    rental_ids = select(RentalHeader.RentalID).where(RentalHeader.CustomerID.in_(customer_ids))
+    cart_ids = select(Cart.CartID).where(Cart.CustomerID.in_(customer_ids))
+    db.execute(delete(VoucherUsage).where(VoucherUsage.CustomerID.in_(customer_ids)))
+    db.execute(delete(SalesOrderDetail).where(SalesOrderDetail.SalesOrderID.in_(sales_ids)))
+    db.execute(delete(SalesOrderStockReservation).where(SalesOrderStockReservation.SalesOrderID.in_(sales_ids)))
+    db.execute(delete(SalesOrderHeader).where(SalesOrderHeader.CustomerID.in_(customer_ids)))
+    db.execute(delete(RentalDetail).where(RentalDetail.RentalID.in_(rental_ids)))
+    db.execute(delete(RentalHeader).where(RentalHeader.CustomerID.in_(customer_ids)))
+    db.execute(delete(CartItem).where(CartItem.CartID.in_(cart_ids)))
+    db.execute(delete(Cart).where(Cart.CustomerID.in_(customer_ids)))
+    db.execute(delete(CustomerAdress).where(CustomerAdress.CustomerID.in_(customer_ids)))
+    db.execute(delete(Customer).where(Customer.CustomerID.in_(customer_ids)))
+    db.execute(delete(Voucher).where(Voucher.Code == code))
+    for location_id, quantity in original:
+        inv = db.get(ProductInventory, (args.product_id, location_id))
+        inv.Quantity = quantity
+    rebuild_daily_revenue(db, date.today(), date.today())
+    db.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stress test checkout đồng thời")
+    parser.add_argument("--product-id", type=int, required=True)
+    parser.add_argument("--stock", type=int, default=100)
+    parser.add_argument("--orders", type=int, default=300, help="Số khách checkout cùng lúc")
+    parser.add_argument("--quantity", type=int, default=1, help="Số lượng mỗi đơn")
+    parser.add_argument("--voucher-quantity", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--keep", action="store_true", help="Không xóa dữ liệu tạm")
+    args = parser.parse_args()
+
+    code = f"STRESS-{uuid.uuid4().hex[:8].upper()}"
+    with SessionLocal() as db:
+        customer_ids, original = setup(db, args, code)
+    print(f"{args.orders} checkout, {args.concurrency} thread, tồn kho {args.stock}, voucher {code} x{args.voucher_quantity}")
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        outcomes = Counter(pool.map(lambda cid: checkout(cid, code), customer_ids))
+    elapsed = time.perf_counter() - started
+    print(f"Xong trong {elapsed:.2f}s ({args.orders / elapsed:.1f} checkout/s)")
+    for outcome, count in outcomes.most_common():
+        print(f"  {count:5} x {outcome}")
+
+    with SessionLocal() as db:
+        passed = verify(db, args, code, customer_ids)
+        if not args.keep:
+            cleanup(db, args, code, customer_ids, original)
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,42 +1,432 @@
+"""
+Gộp các file dump (Table_YYYYMMDDhhmm.json, dạng {"Table": [ {...}, ... ]}) thành db.json cho json-server,
+và (tùy chọn) nạp thẳng vào SQL Server theo schema backendfapi/src/app/models.py.
+
+- Đọc từng file theo kiểu stream (không json.load cả file), mỗi file chạy trong 1 worker process.
+- Mỗi bảng ghi ra 1 file tạm dạng compact rồi nối lại thành db.json -> bộ nhớ không phụ thuộc kích thước dump.
+- --to-db: insert theo lô --batch-size dòng, mỗi lô 1 transaction. Bảng được chạy theo tầng khóa ngoại
+  (bảng cha xong mới tới bảng con), các bảng cùng tầng chạy song song. Cột DB tự tính (CartItem.Subtotal)
+  bị bỏ qua; mỗi lô CartItem tính lại tổng quan các giỏ liên quan (app/cart_summary.py).
+
+    python merge_json.py                      # chỉ tạo db.json
+    python merge_json.py --to-db --no-json    # chỉ nạp DB
+    python merge_json.py --workers 4 --to-db
+"""
+
+import argparse
+import glob
 import json
 import os
-import glob
+import re
+import shutil
+import sys
+import tempfile
+import time
+import types
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from decimal import Decimal
 
-def merge_json_files():
-    # Directory containing the json files
-    source_dir = os.path.dirname(os.path.abspath(__file__))
-    output_file = os.path.join(source_dir, 'db.json')
-    
-    merged_data = {}
-    
-    # Pattern to match json files
-    json_files = glob.glob(os.path.join(source_dir, '*.json'))
-    
-    print(f"Found {len(json_files)} JSON files.")
-    
-    for file_path in json_files:
-        # Skip the output file if it already exists and is in the list
-        if os.path.basename(file_path) == 'db.json':
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_SRC = os.path.join(SOURCE_DIR, '..', '..', 'backendfapi', 'src')
+sys.path.insert(0, BACKEND_SRC)
+
+# Fix encoding cho Windows console
+if sys.platform == 'win32':
+    import io
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+
+READ_CHUNK = 64 * 1024
+CART_REBUILD_CHUNK = 1000  # Số CartID mỗi lần rebuild (SQL Server giới hạn 2100 tham số / câu lệnh)
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+# ==========================================
+# STREAMING JSON READER
+# ==========================================
+class JsonStream:
+    """Đọc object JSON cấp ngoài cùng theo từng phần: các key lần lượt, value là mảng thì trả từng phần tử"""
+
+    def __init__(self, f):
+        self.f = f
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        chunk = self.f.read(READ_CHUNK)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Ký tự kế tiếp (bỏ khoảng trắng), "" khi hết file"""
+        while True:
+            self.pos = WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char: str):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected {char!r} but found {found!r}")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # Số nằm sát cuối buffer có thể bị cắt dở (12|3) -> đọc thêm rồi decode lại
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+    def items(self):
+        """Yield (key, value); value là iterator phần tử nếu là mảng (phải đọc hết trước khi sang key kế)"""
+        self.expect("{")
+        if self.peek() == "}":
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            if self.peek() == "[":
+                self.pos += 1
+                yield key, self._array()
+            else:
+                yield key, self.value()
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.expect("}")
+            return
+
+    def _array(self):
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.expect("]")
+            return
+
+
+def is_array(value) -> bool:
+    return isinstance(value, types.GeneratorType)
+
+
+def drain(value):
+    """Đọc bỏ phần còn lại của mảng để stream tới được key kế tiếp"""
+    if is_array(value):
+        for _ in value:
+            pass
+
+
+# ==========================================
+# DB (lazy import để chế độ chỉ tạo db.json không cần pyodbc)
+# ==========================================
+def model_tables() -> dict:
+    from app.models import Base
+    return {table.name: table for table in Base.metadata.sorted_tables}
+
+
+def table_layers(names, tables) -> dict:
+    """Tầng khóa ngoại của từng bảng trong dump: 0 = không phụ thuộc bảng nào khác trong dump"""
+    layers = {}
+
+    def layer(name):
+        if name not in layers:
+            layers[name] = 0  # chặn vòng lặp
+            deps = {fk.column.table.name for fk in tables[name].foreign_keys} & set(names) - {name}
+            layers[name] = 1 + max((layer(dep) for dep in deps), default=-1)
+        return layers[name]
+
+    for name in names:
+        if name in tables:
+            layer(name)
+    return layers
+
+
+def is_db_generated(column) -> bool:
+    """Cột do DB tự tính (Computed / server_default=FetchedValue(), VD CartItem.Subtotal) -> không INSERT được"""
+    from sqlalchemy import FetchedValue
+    return column.computed is not None or type(column.server_default) is FetchedValue
+
+
+def column_converters(table) -> dict:
+    """
+    Chuyển giá trị trong dump (chuỗi ISO / "450.0000" / 0-1) sang kiểu Python của cột.
+    Cột do DB tự tính không có trong dict -> TableLoader bỏ qua và báo trong ignored columns.
+    """
+    from sqlalchemy import Boolean, Date, DateTime, Numeric
+
+    def to_datetime(value):
+        if not isinstance(value, str):
+            return value
+        # "2013-11-12T17:00:00.000Z": giữ nguyên giờ như trong DB nguồn, cột DATETIME không có timezone
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).replace(tzinfo=None)
+
+    def to_date(value):
+        return date.fromisoformat(value[:10]) if isinstance(value, str) else value
+
+    def to_decimal(value):
+        return Decimal(str(value)) if value is not None and value != "" else None
+
+    def to_bool(value):
+        return bool(int(value)) if isinstance(value, (int, str)) and value != "" else value
+
+    converters = {}
+    for column in table.columns:
+        if is_db_generated(column):
             continue
-            
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                # Assuming each file contains a dictionary with one or more keys
-                # We merge them into the main dictionary
-                if isinstance(data, dict):
-                    merged_data.update(data)
+        if isinstance(column.type, DateTime):
+            converters[column.name] = to_datetime
+        elif isinstance(column.type, Date):
+            converters[column.name] = to_date
+        elif isinstance(column.type, Boolean):
+            converters[column.name] = to_bool
+        elif isinstance(column.type, Numeric):
+            converters[column.name] = to_decimal
+        else:
+            converters[column.name] = None
+    return converters
+
+
+def rebuild_loaded_carts(conn, rows: list):
+    """
+    CartItem nạp thẳng bằng INSERT không đi qua record_cart_change -> tính lại snapshot tổng quan
+    (LineCount, ItemCount, ...) của các giỏ vừa nạp, nếu không badge giỏ hàng hiện 0
+    """
+    from sqlalchemy.orm import Session
+    from app.cart_summary import rebuild_cart_summary
+
+    cart_ids = sorted({row["CartID"] for row in rows if row.get("CartID") is not None})
+    with Session(bind=conn) as db:
+        for start in range(0, len(cart_ids), CART_REBUILD_CHUNK):
+            rebuild_cart_summary(db, cart_ids[start:start + CART_REBUILD_CHUNK])
+
+
+AFTER_INSERT = {"CartItem": rebuild_loaded_carts}  # Bảng -> hàm chạy trong transaction của mỗi lô
+
+
+class TableLoader:
+    """Insert từng lô batch_size dòng, mỗi lô 1 transaction (engine bật fast_executemany)"""
+
+    def __init__(self, name: str, batch_size: int):
+        from app.database import engine
+        engine.dispose(close=False)  # Không dùng lại connection kế thừa từ process cha
+        self.engine = engine
+        self.table = model_tables()[name]
+        self.converters = column_converters(self.table)
+        self.batch_size = batch_size
+        self.batch = []
+        self.inserted = 0
+        self.ignored_columns = set()
+        self.after_insert = AFTER_INSERT.get(name)
+
+    def add(self, row: dict):
+        record = {}
+        for key, value in row.items():
+            if key not in self.converters:
+                self.ignored_columns.add(key)
+                continue
+            convert = self.converters[key]
+            record[key] = convert(value) if convert else value
+        self.batch.append(record)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.batch:
+            return
+        # Dialect mssql tự bật IDENTITY_INSERT khi dữ liệu có giá trị cho cột identity
+        with self.engine.begin() as conn:
+            conn.execute(self.table.insert(), self.batch)
+            if self.after_insert:
+                self.after_insert(conn, self.batch)
+        self.inserted += len(self.batch)
+        self.batch = []
+
+
+# ==========================================
+# WORKER
+# ==========================================
+def process_file(path: str, parts_dir: str, write_json: bool, to_db: bool, batch_size: int, only=None) -> list:
+    """
+    Đọc 1 file dump. Trả về thống kê từng bảng:
+    {table, file, rows, part (file tạm '"Table":[...]'), inserted, seconds, error}
+    """
+    stats = []
+    with open(path, "r", encoding="utf-8-sig") as f:
+        for table, value in JsonStream(f).items():
+            if only is not None and table not in only:
+                drain(value)  # Bảng thuộc tầng khác
+                continue
+            started = time.perf_counter()
+            stat = {"table": table, "file": os.path.basename(path), "rows": 0, "part": None,
+                    "inserted": None, "seconds": 0.0, "error": None}
+            out = None
+            loader = None
+
+            def load(method, *args):
+                """Lỗi insert DB chỉ dừng nạp bảng này, part JSON vẫn ghi tới hết bảng"""
+                nonlocal loader
+                try:
+                    method(*args)
+                except Exception as e:
+                    stat["error"] = f"{type(e).__name__}: {str(e).splitlines()[0] if str(e) else ''}"
+                    stat["inserted"] = loader.inserted
+                    loader = None
+
+            try:
+                loader = TableLoader(table, batch_size) if to_db and table in model_tables() else None
+                if write_json:
+                    fd, stat["part"] = tempfile.mkstemp(suffix=".part", dir=parts_dir)
+                    out = os.fdopen(fd, "w", encoding="utf-8")
+                    out.write(json.dumps(table, ensure_ascii=False) + ":")
+                if not is_array(value):
+                    if out:
+                        out.write(json.dumps(value, ensure_ascii=False, separators=(",", ":")))
                 else:
-                    print(f"Warning: {file_path} does not contain a JSON object (dict). Skipped.")
-        except Exception as e:
-            print(f"Error reading {file_path}: {e}")
-            
-    try:
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(merged_data, f, indent=4, ensure_ascii=False)
+                    if out:
+                        out.write("[")
+                    for row in value:
+                        if out:
+                            if stat["rows"]:
+                                out.write(",")
+                            out.write(json.dumps(row, ensure_ascii=False, separators=(",", ":")))
+                        if loader:
+                            load(loader.add, row)
+                        stat["rows"] += 1
+                    if out:
+                        out.write("]")
+                if loader:
+                    load(loader.flush)
+                if loader:
+                    stat["inserted"] = loader.inserted
+                    if loader.ignored_columns:
+                        stat["error"] = f"ignored columns: {', '.join(sorted(loader.ignored_columns))}"
+            except Exception as e:
+                # Lỗi đọc / ghi JSON giữa chừng -> part dở dang, bỏ hẳn bảng này khỏi db.json
+                stat["error"] = f"{type(e).__name__}: {str(e).splitlines()[0] if str(e) else ''}"
+                if loader:
+                    stat["inserted"] = loader.inserted
+                if out:
+                    out.close()
+                    out = None
+                if stat["part"]:
+                    os.remove(stat["part"])
+                    stat["part"] = None
+                drain(value)
+            finally:
+                if out:
+                    out.close()
+            stat["seconds"] = round(time.perf_counter() - started, 3)
+            stats.append(stat)
+    return stats
+
+
+def scan_tables(path: str) -> list:
+    """Tên các bảng (key cấp ngoài) trong 1 file, đọc lướt không giữ dữ liệu"""
+    names = []
+    with open(path, "r", encoding="utf-8-sig") as f:
+        for table, value in JsonStream(f).items():
+            names.append(table)
+            drain(value)
+    return names
+
+
+# ==========================================
+# MAIN
+# ==========================================
+def write_output(stats: list, output_file: str):
+    """Nối các part thành db.json; bảng trùng tên giữa các file: file sau (theo tên) ghi đè như dict.update"""
+    parts = {}
+    for stat in stats:
+        if stat["part"]:
+            if stat["table"] in parts:
+                print(f"Warning: table {stat['table']} appears in several files, keeping {stat['file']}")
+                os.remove(parts[stat["table"]])
+            parts[stat["table"]] = stat["part"]
+
+    fd, tmp_path = tempfile.mkstemp(suffix=".json", dir=os.path.dirname(output_file))
+    with os.fdopen(fd, "w", encoding="utf-8") as out:
+        out.write("{")
+        for index, part in enumerate(parts.values()):
+            if index:
+                out.write(",")
+            with open(part, "r", encoding="utf-8") as f:
+                shutil.copyfileobj(f, out)
+            os.remove(part)
+        out.write("}")
+    os.chmod(tmp_path, 0o644)  # mkstemp tạo file 0600
+    os.replace(tmp_path, output_file)
+
+
+def merge_json_files(workers: int, write_json: bool, to_db: bool, batch_size: int, output_file: str):
+    json_files = sorted(
+        path for path in glob.glob(os.path.join(SOURCE_DIR, '*.json'))
+        if os.path.abspath(path) != os.path.abspath(output_file)
+    )
+    print(f"Found {len(json_files)} JSON files.")
+    started = time.perf_counter()
+    stats = []
+
+    with tempfile.TemporaryDirectory(dir=SOURCE_DIR) as parts_dir, ProcessPoolExecutor(max_workers=workers) as pool:
+        if to_db:
+            # Chạy theo tầng khóa ngoại: mọi bảng tầng n xong mới sang tầng n + 1
+            tables = model_tables()
+            file_tables = dict(zip(json_files, pool.map(scan_tables, json_files)))
+            layers = table_layers([name for names in file_tables.values() for name in names], tables)
+            unknown = sorted({name for names in file_tables.values() for name in names} - set(layers))
+            if unknown:
+                print(f"Not in app/models.py (only written to db.json): {', '.join(unknown)}")
+            for level in sorted(set(layers.values()) | ({-1} if unknown else set())):
+                wanted = {name for name, lvl in layers.items() if lvl == level} if level >= 0 else set(unknown)
+                jobs = [
+                    pool.submit(process_file, path, parts_dir, write_json, True, batch_size, wanted & set(names))
+                    for path, names in file_tables.items() if wanted & set(names)
+                ]
+                for job in jobs:
+                    stats.extend(job.result())
+        else:
+            jobs = [pool.submit(process_file, path, parts_dir, write_json, False, batch_size) for path in json_files]
+            for job in jobs:
+                stats.extend(job.result())
+
+        if write_json:
+            write_output(stats, output_file)
+
+    print(f"{'table':24} {'rows':>8} {'inserted':>9} {'seconds':>8}  note")
+    for stat in sorted(stats, key=lambda s: s["table"]):
+        inserted = "" if stat["inserted"] is None else stat["inserted"]
+        print(f"{stat['table']:24} {stat['rows']:>8} {inserted:>9} {stat['seconds']:>8}  {stat['error'] or ''}")
+    print(f"Total: {sum(s['rows'] for s in stats)} rows in {time.perf_counter() - started:.2f} s")
+    if write_json:
         print(f"Successfully merged files into {output_file}")
-    except Exception as e:
-        print(f"Error writing to {output_file}: {e}")
+    return stats
+
 
 if __name__ == "__main__":
-    merge_json_files()
+    parser = argparse.ArgumentParser(description="Merge json_dbs dumps into db.json and/or load them into SQL Server")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--output", default=os.path.join(SOURCE_DIR, 'db.json'))
+    parser.add_argument("--no-json", action="store_true", help="Không ghi db.json")
+    parser.add_argument("--to-db", action="store_true", help="Insert vào SQL Server (app.database)")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Số dòng mỗi transaction khi --to-db")
+    args = parser.parse_args()
+
+    merge_json_files(args.workers, not args.no_json, args.to_db, args.batch_size, args.output)
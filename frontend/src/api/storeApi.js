@@ -85,6 +85,7 @@ export const getSimilarProducts = (productId) => {
  * @param {Object} params - Optional parameters
  * @param {string} params.buy_voucher_code - Voucher code for buy items
  * @param {string} params.rent_voucher_code - Voucher code for rent items
+ * @param {boolean} params.include_items - false: only totals (total_lines, total_items), items = []
  * @returns {Promise} Cart summary with items, totals for buy and rent, and discounted amounts
  */
 export const getCart = (params = {}) => {
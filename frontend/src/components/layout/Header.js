@@ -32,14 +32,12 @@ function Header() {
             return;
         }
         try {
-            const response = await getCart();
+            // Badge chỉ cần tổng quan giỏ, không lấy chi tiết item
+            const response = await getCart({ include_items: false });
             const data = response.data?.data || response.data;
             
             // Count unique items (not total quantity)
-            // If items array exists, count the number of distinct items
-            const count = Array.isArray(data?.items) 
-                ? data.items.length  // Number of unique items
-                : 0;
+            const count = data?.total_lines || 0;
             
             setCartItemCount(count);
         } catch (error) {